@@ -0,0 +1,97 @@
+"""
+Benchmark batched inserts and query latency of the database layer
+
+Usage:
+    python benchmarks/bench_database.py [rows] [writer_threads]
+"""
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.database.batcher import WriteBehindBatcher
+from modules.database.pool import ConnectionPool
+from modules.database.repositories import ReceiptResultRepository, UploadHistoryRepository
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        "p50": samples[len(samples) // 2] * 1000,
+        "p99": samples[int(len(samples) * 0.99)] * 1000,
+        "mean": statistics.mean(samples) * 1000,
+    }
+
+
+def timed_queries(func, args):
+    samples = []
+    for arg in args:
+        started = time.perf_counter()
+        func(*arg)
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    users = max(1, rows // 1000)
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pool = ConnectionPool(f"sqlite:///{temp_dir}/bench.sqlite3", pool_size=writers + 2)
+        batcher = WriteBehindBatcher(pool)
+        receipts = ReceiptResultRepository(pool, batcher)
+        history = UploadHistoryRepository(pool, batcher)
+        result = {"status": "success", "confidence": 0.9, "tier": "fast",
+                  "extracted_data": {"store_name": "店舗", "date": "2024-05-01", "total_amount": 1080.0}}
+
+        def write(worker):
+            rng = random.Random(worker)
+            for i in range(worker, rows, writers):
+                day = f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+                data = dict(result["extracted_data"], date=day)
+                receipts.add(f"user{i % users}", f"sha{i}", dict(result, extracted_data=data))
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=write, args=(w,)) for w in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        batcher.flush()
+        elapsed = time.perf_counter() - started
+        stats = batcher.stats()
+        print(f"{rows} receipt rows from {writers} threads: {elapsed:.1f} s, {rows / elapsed:,.0f} inserts/s "
+              f"({stats['batches']} transactions, avg batch {stats['avg_batch_size']})")
+
+        started = time.perf_counter()
+        for i in range(10000):
+            history.add(f"user{i % users}", f"file{i}.jpg", folder_path="u/2024-05", size=1000, kind="image")
+        batcher.flush()
+        print(f"10000 upload history rows: {10000 / (time.perf_counter() - started):,.0f} inserts/s")
+
+        rng = random.Random(0)
+        print("Query latency (ms) at", rows, "rows:")
+        for name, func, args in (
+            ("receipt by image", receipts.get, [(f"user{i % users}", f"sha{i}")
+                                                for i in rng.sample(range(rows), 2000)]),
+            ("receipts in a month", receipts.between, [(f"user{rng.randrange(users)}", "2024-05-01", "2024-05-31")
+                                                       for _ in range(2000)]),
+            ("recent uploads", history.recent, [(f"user{rng.randrange(users)}",) for _ in range(2000)]),
+        ):
+            result_ms = timed_queries(func, args)
+            print(f"  {name:22s} p50 {result_ms['p50']:.3f}  p99 {result_ms['p99']:.3f}  mean {result_ms['mean']:.3f}")
+
+        batcher.stop()
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark the columnar sales aggregation against summarize_sales_data and calculate_commission
+
+Usage:
+    python benchmarks/bench_sales_aggregation.py [receipts] [contractors]
+"""
+import logging
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.ai.assistant import AIAssistant
+from modules.ai.sales_aggregation import NUMPY_AVAILABLE, SalesColumns, aggregate_sales
+
+
+def make_receipts(count, contractors, seed=1):
+    rng = random.Random(seed)
+    receipts = []
+    for _ in range(count):
+        contractor = f"contractor-{rng.randrange(contractors)}"
+        if rng.random() < 0.02:
+            receipts.append((contractor, {"status": "error"}))
+            continue
+        receipts.append((contractor, {
+            "status": "success",
+            "extracted_data": {
+                "date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                "total_amount": float(rng.randint(100, 50000)),
+                "items": [{"name": "item"}] * rng.randint(1, 5),
+            },
+        }))
+    return receipts
+
+
+def legacy(assistant, receipts, rate):
+    """The current path: group in Python, then one summarize and commission call per group"""
+    groups = defaultdict(list)
+    for contractor, receipt in receipts:
+        data = receipt.get("extracted_data") or {}
+        period = str(data.get("date"))[:7] if data.get("date") else "unknown"
+        groups[(contractor, period)].append(receipt)
+    results = {}
+    for key, group in groups.items():
+        summary = assistant.summarize_sales_data(group)
+        summary.update(assistant.calculate_commission(summary["total_amount"], rate))
+        results[key] = summary
+    return results
+
+
+def timed(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    contractors = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rate = 0.3
+    logging.disable(logging.INFO)
+
+    receipts = make_receipts(count, contractors)
+    assistant = AIAssistant.__new__(AIAssistant)
+    assistant.logger = logging.getLogger("bench")
+
+    legacy_time, legacy_result = timed(lambda: legacy(assistant, receipts, rate))
+    build_time, columns = timed(lambda: SalesColumns.from_receipts(receipts))
+    python_time, python_result = timed(lambda: aggregate_sales(columns, rate, use_numpy=False))
+    print(f"{count} receipts, {contractors} contractors, {len(python_result)} groups")
+    print(f"  legacy (summarize + commission per group): {legacy_time * 1000:9.1f} ms")
+    print(f"  build columns:                             {build_time * 1000:9.1f} ms")
+    print(f"  columnar, array fallback:                  {python_time * 1000:9.1f} ms")
+    if NUMPY_AVAILABLE:
+        numpy_time, numpy_result = timed(lambda: aggregate_sales(columns, rate, use_numpy=True))
+        print(f"  columnar, numpy:                           {numpy_time * 1000:9.1f} ms")
+        assert numpy_result == python_result
+
+    mismatches = sum(
+        1 for key, summary in python_result.items()
+        if summary["total_amount"] != legacy_result[key]["total_amount"]
+        or summary["commission_amount"] != int(legacy_result[key]["commission_amount"])
+    )
+    print(f"  groups where legacy float results differ from exact yen: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -21,9 +21,11 @@ class Config:
     BASE_DIR = Path(__file__).parent
     LOGS_DIR = BASE_DIR / "logs"
     MODULES_DIR = BASE_DIR / "modules"
+    DATA_DIR = Path(os.getenv("DATA_DIR", str(BASE_DIR / "data")))
     
     # Ensure directories exist
     LOGS_DIR.mkdir(exist_ok=True)
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
     
     # LINE Bot Configuration
     LINE_CHANNEL_ACCESS_TOKEN: str = os.getenv("LINE_CHANNEL_ACCESS_TOKEN", "")
@@ -36,9 +38,70 @@ class Config:
     
     # OpenAI API
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
+    OPENAI_VISION_MODEL: str = os.getenv("OPENAI_VISION_MODEL", "gpt-4o")
+    # USD per 1M input and output tokens, for cost reporting
+    OPENAI_VISION_MODEL_COST: list = [float(v) for v in os.getenv("OPENAI_VISION_MODEL_COST", "2.50,10.00").split(",")]
+    RECEIPT_PROMPT_VERSION: str = os.getenv("RECEIPT_PROMPT_VERSION", "1")  # Bump to invalidate cached analyses
+    OPENAI_TIMEOUT: float = float(os.getenv("OPENAI_TIMEOUT", "120"))
+    OPENAI_MAX_RETRIES: int = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+    OPENAI_BACKOFF_BASE: float = float(os.getenv("OPENAI_BACKOFF_BASE", "1"))
+    OPENAI_BACKOFF_MAX: float = float(os.getenv("OPENAI_BACKOFF_MAX", "60"))
+    OPENAI_CONCURRENCY_INITIAL: int = int(os.getenv("OPENAI_CONCURRENCY_INITIAL", "4"))
+    OPENAI_CONCURRENCY_MAX: int = int(os.getenv("OPENAI_CONCURRENCY_MAX", "16"))
+    OPENAI_LATENCY_TARGET_MS: float = float(os.getenv("OPENAI_LATENCY_TARGET_MS", "30000"))
+    OPENAI_RECEIPT_MAX_TOKENS: int = int(os.getenv("OPENAI_RECEIPT_MAX_TOKENS", "1000"))  # Per receipt in a request
     
-    # Database Configuration
+    # Bulk receipt analysis
+    RECEIPT_BULK_IMAGES_PER_REQUEST: int = int(os.getenv("RECEIPT_BULK_IMAGES_PER_REQUEST", "4"))
+    RECEIPT_BULK_PACK_MAX_BYTES: int = int(os.getenv("RECEIPT_BULK_PACK_MAX_BYTES", "1048576"))  # Larger images go alone
+    RECEIPT_BULK_WORKERS: int = int(os.getenv("RECEIPT_BULK_WORKERS", "8"))
+    RECEIPT_BATCH_WINDOW: float = float(os.getenv("RECEIPT_BATCH_WINDOW", "5.0"))  # Quiet seconds that end a photo set
+    RECEIPT_BATCH_MAX: int = int(os.getenv("RECEIPT_BATCH_MAX", "100"))  # Receipts analyzed together at most
+    
+    # Tiered receipt extraction (cheap model first, OPENAI_VISION_MODEL for doubtful results)
+    RECEIPT_TIERED_ENABLED: bool = os.getenv("RECEIPT_TIERED_ENABLED", "True").lower() == "true"
+    RECEIPT_FAST_MODEL: str = os.getenv("RECEIPT_FAST_MODEL", "gpt-4o-mini")
+    RECEIPT_FAST_MODEL_COST: list = [float(v) for v in os.getenv("RECEIPT_FAST_MODEL_COST", "0.15,0.60").split(",")]
+    RECEIPT_CONFIDENCE_THRESHOLD: float = float(os.getenv("RECEIPT_CONFIDENCE_THRESHOLD", "0.8"))
+    RECEIPT_AMOUNT_TOLERANCE: float = float(os.getenv("RECEIPT_AMOUNT_TOLERANCE", "1"))  # Yen
+    
+    # Invoice templates (generated once per contractor and layout)
+    INVOICE_TEMPLATE_MODEL: str = os.getenv("INVOICE_TEMPLATE_MODEL", "gpt-4o-mini")
+    INVOICE_TEMPLATE_VERSION: str = os.getenv("INVOICE_TEMPLATE_VERSION", "1")  # Bump to regenerate all templates
+    INVOICE_TEMPLATE_DB_PATH: str = os.getenv("INVOICE_TEMPLATE_DB_PATH", str(DATA_DIR / "invoice_templates.sqlite3"))
+    INVOICE_TEMPLATE_RETRY_SECONDS: float = float(os.getenv("INVOICE_TEMPLATE_RETRY_SECONDS", "300"))  # Retry after a failed generation
+    
+    # Sales aggregation
+    COMMISSION_ROUNDING: str = os.getenv("COMMISSION_ROUNDING", "down")  # down or half_up, applied once per yen total
+    
+    # File classification (nearest past filing decisions, LLM only when unsure)
+    CLASSIFIER_ENABLED: bool = os.getenv("CLASSIFIER_ENABLED", "True").lower() == "true"
+    CLASSIFIER_DB_PATH: str = os.getenv("CLASSIFIER_DB_PATH", str(DATA_DIR / "file_decisions.sqlite3"))
+    CLASSIFIER_DIMENSIONS: int = int(os.getenv("CLASSIFIER_DIMENSIONS", "512"))
+    CLASSIFIER_TOP_K: int = int(os.getenv("CLASSIFIER_TOP_K", "5"))
+    CLASSIFIER_MIN_CONFIDENCE: float = float(os.getenv("CLASSIFIER_MIN_CONFIDENCE", "0.6"))
+    CLASSIFIER_FALLBACK_MODEL: str = os.getenv("CLASSIFIER_FALLBACK_MODEL", "gpt-4o-mini")
+    
+    # Database Configuration (sqlite:///path?pool_size=8&timeout=30; empty uses data/app.sqlite3)
     DATABASE_URL: str = os.getenv("DATABASE_URL", "")
+    DATABASE_POOL_SIZE: int = int(os.getenv("DATABASE_POOL_SIZE", "8"))
+    DATABASE_BATCH_SIZE: int = int(os.getenv("DATABASE_BATCH_SIZE", "500"))  # Statements per transaction
+    DATABASE_FLUSH_INTERVAL: float = float(os.getenv("DATABASE_FLUSH_INTERVAL", "0.05"))  # Seconds
+    DATABASE_MAX_PENDING: int = int(os.getenv("DATABASE_MAX_PENDING", "100000"))
+    
+    # CSV export (LIFF admin screen); an empty token disables the endpoints
+    EXPORT_API_TOKEN: str = os.getenv("EXPORT_API_TOKEN", "")
+    EXPORT_FETCH_SIZE: int = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))  # Rows per cursor step
+    EXPORT_CHUNK_SIZE: int = int(os.getenv("EXPORT_CHUNK_SIZE", "65536"))  # Bytes per response chunk
+    
+    # Search (questions are translated into structured queries once and cached)
+    SEARCH_QUERY_MODEL: str = os.getenv("SEARCH_QUERY_MODEL", "gpt-4o-mini")
+    SEARCH_QUERY_VERSION: str = os.getenv("SEARCH_QUERY_VERSION", "1")  # Bump to retranslate cached questions
+    SEARCH_QUERY_CACHE_DB_PATH: str = os.getenv("SEARCH_QUERY_CACHE_DB_PATH", str(DATA_DIR / "search_queries.sqlite3"))
+    
+    # Naming rules (edited on the LIFF admin screen; workers pick up changes within the check interval)
+    NAMING_RULES_ADMIN_TOKEN: str = os.getenv("NAMING_RULES_ADMIN_TOKEN", "")  # Empty disables rule editing
+    NAMING_RULES_CHECK_INTERVAL: float = float(os.getenv("NAMING_RULES_CHECK_INTERVAL", "2.0"))  # Seconds
     
     # Application Settings
     DEBUG: bool = os.getenv("DEBUG", "False").lower() == "true"
@@ -49,9 +112,88 @@ class Config:
     # File Upload Settings
     MAX_FILE_SIZE: int = int(os.getenv("MAX_FILE_SIZE", "10485760"))  # 10MB
     ALLOWED_EXTENSIONS: list = os.getenv("ALLOWED_EXTENSIONS", "jpg,jpeg,png,pdf,txt,docx,xlsx").split(",")
+    STREAM_CHUNK_SIZE: int = int(os.getenv("STREAM_CHUNK_SIZE", "65536"))  # 64KB
     
     # OneDrive Settings
     ONEDRIVE_ROOT_FOLDER: str = os.getenv("ONEDRIVE_ROOT_FOLDER", "LineBot_Uploads")
+    FOLDER_CACHE_TTL: int = int(os.getenv("FOLDER_CACHE_TTL", "3600"))  # Folder path -> item ID cache
+    
+    # Local drive index (delta query sync)
+    DRIVE_INDEX_DB_PATH: str = os.getenv("DRIVE_INDEX_DB_PATH", str(DATA_DIR / "drive_index.sqlite3"))
+    DRIVE_INDEX_SYNC_INTERVAL: int = int(os.getenv("DRIVE_INDEX_SYNC_INTERVAL", "300"))  # 0 disables
+    DRIVE_INDEX_MAX_AGE: int = int(os.getenv("DRIVE_INDEX_MAX_AGE", "900"))  # Listings fall back to Graph after this
+    DRIVE_INDEX_SYNC_LEASE: float = float(os.getenv("DRIVE_INDEX_SYNC_LEASE", "900"))  # One worker process syncs; others take over after this
+    
+    # Microsoft Graph HTTP Settings
+    GRAPH_BASE_URL: str = os.getenv("GRAPH_BASE_URL", "https://graph.microsoft.com/v1.0")
+    GRAPH_POOL_CONNECTIONS: int = int(os.getenv("GRAPH_POOL_CONNECTIONS", "4"))
+    GRAPH_POOL_MAXSIZE: int = int(os.getenv("GRAPH_POOL_MAXSIZE", "16"))
+    GRAPH_CONNECT_TIMEOUT: float = float(os.getenv("GRAPH_CONNECT_TIMEOUT", "5"))
+    GRAPH_READ_TIMEOUT: float = float(os.getenv("GRAPH_READ_TIMEOUT", "60"))
+    GRAPH_MAX_RETRIES: int = int(os.getenv("GRAPH_MAX_RETRIES", "4"))
+    GRAPH_BACKOFF_BASE: float = float(os.getenv("GRAPH_BACKOFF_BASE", "0.5"))
+    GRAPH_BACKOFF_MAX: float = float(os.getenv("GRAPH_BACKOFF_MAX", "60"))
+    
+    # Adaptive (AIMD) concurrency limit for Graph calls
+    GRAPH_CONCURRENCY_INITIAL: int = int(os.getenv("GRAPH_CONCURRENCY_INITIAL", "4"))
+    GRAPH_CONCURRENCY_MIN: int = int(os.getenv("GRAPH_CONCURRENCY_MIN", "1"))
+    GRAPH_CONCURRENCY_MAX: int = int(os.getenv("GRAPH_CONCURRENCY_MAX", "16"))  # Keep <= GRAPH_POOL_MAXSIZE
+    GRAPH_LATENCY_TARGET_MS: float = float(os.getenv("GRAPH_LATENCY_TARGET_MS", "3000"))
+    
+    # Microsoft Graph Token Cache ("file", "sqlite" or "memory")
+    GRAPH_TOKEN_CACHE: str = os.getenv("GRAPH_TOKEN_CACHE", "file")
+    GRAPH_TOKEN_CACHE_PATH: str = os.getenv("GRAPH_TOKEN_CACHE_PATH", str(DATA_DIR / "graph_token.json"))
+    GRAPH_TOKEN_REFRESH_MARGIN: int = int(os.getenv("GRAPH_TOKEN_REFRESH_MARGIN", "300"))  # 5 minutes
+    
+    # Resumable Upload Sessions (used above the threshold; Graph simple upload is limited to 4MB)
+    UPLOAD_SESSION_THRESHOLD: int = int(os.getenv("UPLOAD_SESSION_THRESHOLD", "4194304"))  # 4MB
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", "3276800"))  # 3.125MB (multiple of 320KB)
+    UPLOAD_SESSION_DB_PATH: str = os.getenv("UPLOAD_SESSION_DB_PATH", str(DATA_DIR / "upload_sessions.sqlite3"))
+    ONEDRIVE_MAX_CONCURRENCY: int = int(os.getenv("ONEDRIVE_MAX_CONCURRENCY", "8"))  # Transfers in flight per user (outbox) or per AsyncOneDriveClient
+    
+    # Content-hash deduplication of uploads
+    UPLOAD_DEDUP_ENABLED: bool = os.getenv("UPLOAD_DEDUP_ENABLED", "True").lower() == "true"
+    UPLOAD_HASH_DB_PATH: str = os.getenv("UPLOAD_HASH_DB_PATH", str(DATA_DIR / "upload_hashes.sqlite3"))
+    UPLOAD_COPY_TIMEOUT: float = float(os.getenv("UPLOAD_COPY_TIMEOUT", "30"))  # Seconds to wait for a server-side copy
+    
+    # Durable upload outbox (received files waiting for upload)
+    OUTBOX_DIR = Path(os.getenv("OUTBOX_DIR", str(DATA_DIR / "outbox")))
+    OUTBOX_DB_PATH: str = os.getenv("OUTBOX_DB_PATH", str(DATA_DIR / "outbox.sqlite3"))
+    OUTBOX_WORKERS: int = int(os.getenv("OUTBOX_WORKERS", "8"))
+    OUTBOX_PER_USER: int = int(os.getenv("OUTBOX_PER_USER", "1"))  # Above 1 uploads a user's files out of order
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20"))  # 0 retries forever
+    OUTBOX_BACKOFF_BASE: float = float(os.getenv("OUTBOX_BACKOFF_BASE", "5"))
+    OUTBOX_BACKOFF_MAX: float = float(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))
+    OUTBOX_LEASE_SECONDS: float = float(os.getenv("OUTBOX_LEASE_SECONDS", "900"))
+    
+    # Image preprocessing before upload and analysis
+    IMAGE_PREPROCESS_ENABLED: bool = os.getenv("IMAGE_PREPROCESS_ENABLED", "True").lower() == "true"
+    IMAGE_MAX_LONG_EDGE: int = int(os.getenv("IMAGE_MAX_LONG_EDGE", "2048"))  # Vision models downscale larger images
+    IMAGE_JPEG_QUALITY: int = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+    IMAGE_GRAYSCALE: str = os.getenv("IMAGE_GRAYSCALE", "auto")  # auto, always or never
+    IMAGE_PREPROCESS_WORKERS: int = int(os.getenv("IMAGE_PREPROCESS_WORKERS", "2"))  # 0 processes inline
+    IMAGE_ARCHIVE_ORIGINAL: bool = os.getenv("IMAGE_ARCHIVE_ORIGINAL", "False").lower() == "true"
+    IMAGE_ARCHIVE_FOLDER: str = os.getenv("IMAGE_ARCHIVE_FOLDER", "originals")
+    
+    # Receipt analysis cache (keyed by image content hash and model/prompt version)
+    ANALYSIS_CACHE_ENABLED: bool = os.getenv("ANALYSIS_CACHE_ENABLED", "True").lower() == "true"
+    ANALYSIS_CACHE_DB_PATH: str = os.getenv("ANALYSIS_CACHE_DB_PATH", str(DATA_DIR / "analysis_cache.sqlite3"))
+    ANALYSIS_CACHE_TTL: float = float(os.getenv("ANALYSIS_CACHE_TTL", "7776000"))  # 90 days, 0 never expires
+    ANALYSIS_CACHE_MAX_ENTRIES: int = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "50000"))
+    ANALYSIS_CACHE_MEMORY_ENTRIES: int = int(os.getenv("ANALYSIS_CACHE_MEMORY_ENTRIES", "1024"))
+    # Match re-encoded copies by perceptual hash within this many bits (0-3, -1 disables);
+    # off by default because different receipts from one store can look alike
+    ANALYSIS_CACHE_PERCEPTUAL_DISTANCE: int = int(os.getenv("ANALYSIS_CACHE_PERCEPTUAL_DISTANCE", "-1"))
+    
+    # Webhook Event Processing
+    WEBHOOK_WORKERS: int = int(os.getenv("WEBHOOK_WORKERS", "4"))
+    WEBHOOK_QUEUE_SIZE: int = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))
+    
+    # Webhook Event Deduplication ("memory" or "sqlite")
+    DEDUP_BACKEND: str = os.getenv("DEDUP_BACKEND", "sqlite")
+    DEDUP_TTL_SECONDS: int = int(os.getenv("DEDUP_TTL_SECONDS", "86400"))  # 24 hours
+    DEDUP_MAX_ENTRIES: int = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+    DEDUP_DB_PATH: str = os.getenv("DEDUP_DB_PATH", str(DATA_DIR / "webhook_events.sqlite3"))
     
     @classmethod
     def validate_config(cls) -> bool:
@@ -51,18 +51,22 @@ class LineOneDriveAIApp:
     def initialize_components(self):
         """Initialize all system components"""
         try:
-            # Initialize LINE Bot Handler
-            self.logger.info("Initializing LINE Bot Handler...")
-            self.line_bot_handler = LineBotHandler()
-            
             # Initialize OneDrive Client
             self.logger.info("Initializing OneDrive Client...")
             self.onedrive_client = OneDriveClient()
+            self.onedrive_client.start_index_sync()
             
             # Initialize AI Assistant
             self.logger.info("Initializing AI Assistant...")
             self.ai_assistant = AIAssistant()
             
+            # Initialize LINE Bot Handler
+            self.logger.info("Initializing LINE Bot Handler...")
+            self.line_bot_handler = LineBotHandler(
+                onedrive_client=self.onedrive_client,
+                ai_assistant=self.ai_assistant
+            )
+            
             self.logger.info("All components initialized successfully")
             
         except Exception as e:
@@ -114,6 +118,9 @@ class LineOneDriveAIApp:
             self.logger.info("Shutting down application...")
             
             # Cleanup components
+            if self.line_bot_handler:
+                self.line_bot_handler.cleanup()
+            
             if self.onedrive_client:
                 self.onedrive_client.cleanup()
             
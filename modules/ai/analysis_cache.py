@@ -0,0 +1,326 @@
+"""
+Content-addressed cache of receipt analysis results
+"""
+import hashlib
+import io
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.utils.sqlite import connect_sqlite
+
+
+# dHash bits are split into this many bands for near-duplicate lookups: two
+# hashes within PERCEPTUAL_BANDS - 1 bits share at least one band exactly
+PERCEPTUAL_BANDS = 4
+BAND_BITS = 64 // PERCEPTUAL_BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def content_hash(data: bytes) -> str:
+    """SHA-256 hex digest identifying exact image content"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(data: bytes) -> Optional[int]:
+    """
+    64-bit difference hash (dHash) that survives re-encoding and resizing
+
+    Args:
+        data: Encoded image
+
+    Returns:
+        Hash as an unsigned integer, or None if the image cannot be decoded
+    """
+    if not PIL_AVAILABLE:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # draft() lets JPEG decoding skip most of the pixels
+            image.draft("L", (64, 64))
+            pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    except Exception:
+        return None
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _bands(phash: int):
+    return [(phash >> (i * BAND_BITS)) & BAND_MASK for i in range(PERCEPTUAL_BANDS)]
+
+
+class AnalysisCache:
+    """
+    SQLite cache of analysis results keyed by image SHA-256
+
+    Each entry records the model/prompt version it was produced with; entries
+    from another version are misses and are pruned. Recent hits are served
+    from an in-process LRU, so repeated lookups do not touch SQLite. On an
+    exact miss, a perceptual hash finds re-encoded or resized copies of an
+    already analyzed image.
+    """
+
+    # Expired, outdated and excess rows are pruned once every this many inserts
+    PRUNE_INTERVAL = 100
+
+    def __init__(self,
+                 version: str,
+                 db_path: Union[str, Path, None] = None,
+                 ttl_seconds: Optional[float] = None,
+                 max_entries: Optional[int] = None,
+                 memory_entries: Optional[int] = None,
+                 perceptual_distance: Optional[int] = None):
+        """
+        Initialize the cache
+
+        Args:
+            version: Model and prompt version of the results being cached
+            db_path: Database file (defaults to ANALYSIS_CACHE_DB_PATH)
+            ttl_seconds: Result lifetime, 0 keeps results until evicted
+                         (defaults to ANALYSIS_CACHE_TTL)
+            max_entries: Maximum stored results (defaults to ANALYSIS_CACHE_MAX_ENTRIES)
+            memory_entries: Results kept in the in-process LRU (defaults to ANALYSIS_CACHE_MEMORY_ENTRIES)
+            perceptual_distance: Largest dHash distance treated as the same image,
+                                 negative disables perceptual matching
+                                 (defaults to ANALYSIS_CACHE_PERCEPTUAL_DISTANCE)
+        """
+        self.logger = StructuredLogger(__name__)
+        self.version = version
+        self.ttl_seconds = config.ANALYSIS_CACHE_TTL if ttl_seconds is None else ttl_seconds
+        self.max_entries = max(1, config.ANALYSIS_CACHE_MAX_ENTRIES if max_entries is None else max_entries)
+        self.memory_entries = config.ANALYSIS_CACHE_MEMORY_ENTRIES if memory_entries is None else memory_entries
+        distance = config.ANALYSIS_CACHE_PERCEPTUAL_DISTANCE if perceptual_distance is None else perceptual_distance
+        # Banding only guarantees matches below the number of bands
+        self.perceptual_distance = min(distance, PERCEPTUAL_BANDS - 1)
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inserts = 0
+        self._hits = 0
+        self._perceptual_hits = 0
+        self._misses = 0
+
+        self._conn = connect_sqlite(db_path or config.ANALYSIS_CACHE_DB_PATH)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis_cache ("
+            " sha256 TEXT PRIMARY KEY,"
+            " version TEXT NOT NULL,"
+            " phash INTEGER,"
+            + "".join(f" band{i} INTEGER," for i in range(PERCEPTUAL_BANDS)) +
+            " extracted_data TEXT NOT NULL,"
+            " confidence REAL,"
+            " created_at REAL NOT NULL,"
+            " expires_at REAL,"
+            " last_used_at REAL NOT NULL)"
+        )
+        for i in range(PERCEPTUAL_BANDS):
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_analysis_cache_band{i} ON analysis_cache (band{i})"
+            )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_used ON analysis_cache (last_used_at)"
+        )
+
+    def get(self, image_content: bytes, sha256: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Look up the analysis of an image
+
+        Args:
+            image_content: Encoded image
+            sha256: Precomputed content_hash(image_content)
+
+        Returns:
+            Dict with extracted_data, confidence and cache ('exact' or
+            'perceptual'), or None on a miss
+        """
+        sha256 = sha256 or content_hash(image_content)
+        now = time.time()
+
+        with self._lock:
+            cached = self._memory.get(sha256)
+            if cached is not None and (cached[2] is None or cached[2] > now):
+                self._memory.move_to_end(sha256)
+                self._hits += 1
+                return self._result(cached, "exact")
+
+            row = self._conn.execute(
+                "SELECT extracted_data, confidence, expires_at FROM analysis_cache"
+                " WHERE sha256 = ? AND version = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (sha256, self.version, now)
+            ).fetchone()
+            if row is not None:
+                self._touch(sha256, now)
+                entry = self._remember(sha256, row)
+                self._hits += 1
+                return self._result(entry, "exact")
+
+        if self.perceptual_distance >= 0:
+            match = self._find_similar(perceptual_hash(image_content), now)
+            if match is not None:
+                with self._lock:
+                    self._perceptual_hits += 1
+                return match
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def _find_similar(self, phash: Optional[int], now: float) -> Optional[Dict[str, Any]]:
+        """Find a stored image whose dHash is within perceptual_distance"""
+        if phash is None:
+            return None
+        bands = _bands(phash)
+        where = " OR ".join(f"band{i} = ?" for i in range(PERCEPTUAL_BANDS))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT sha256, phash, extracted_data, confidence, expires_at FROM analysis_cache"
+                f" WHERE ({where}) AND version = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (*bands, self.version, now)
+            ).fetchall()
+            best = None
+            for row in rows:
+                distance = hamming_distance(phash, row["phash"] & 0xFFFFFFFFFFFFFFFF)
+                if distance <= self.perceptual_distance and (best is None or distance < best[0]):
+                    best = (distance, row)
+            if best is None:
+                return None
+            self._touch(best[1]["sha256"], now)
+        entry = (json.loads(best[1]["extracted_data"]), best[1]["confidence"], best[1]["expires_at"])
+        return self._result(entry, "perceptual")
+
+    def put(self, image_content: bytes, extracted_data: Dict[str, Any], confidence: Optional[float],
+            sha256: Optional[str] = None):
+        """
+        Store the analysis of an image
+
+        Args:
+            image_content: Encoded image
+            extracted_data: Structured receipt data
+            confidence: Model confidence
+            sha256: Precomputed content_hash(image_content)
+        """
+        sha256 = sha256 or content_hash(image_content)
+        phash = perceptual_hash(image_content) if self.perceptual_distance >= 0 else None
+        bands = _bands(phash) if phash is not None else [None] * PERCEPTUAL_BANDS
+        now = time.time()
+        expires_at = now + self.ttl_seconds if self.ttl_seconds else None
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache"
+                " (sha256, version, phash, "
+                + ", ".join(f"band{i}" for i in range(PERCEPTUAL_BANDS)) +
+                ", extracted_data, confidence, created_at, expires_at, last_used_at)"
+                " VALUES (?, ?, ?, " + ", ".join("?" * PERCEPTUAL_BANDS) + ", ?, ?, ?, ?, ?)",
+                (sha256, self.version,
+                 # SQLite integers are signed 64-bit
+                 phash - (1 << 64) if phash is not None and phash >= (1 << 63) else phash,
+                 *bands, json.dumps(extracted_data, ensure_ascii=False), confidence,
+                 now, expires_at, now)
+            )
+            self._memory.pop(sha256, None)
+            self._remember(sha256, (json.dumps(extracted_data, ensure_ascii=False), confidence, expires_at))
+            self._inserts += 1
+            if self._inserts % self.PRUNE_INTERVAL == 0:
+                self._prune(now)
+
+    def _remember(self, sha256: str, row) -> tuple:
+        """Add a row to the in-process LRU (caller holds the lock)"""
+        entry = (json.loads(row[0]), row[1], row[2])
+        if self.memory_entries > 0:
+            self._memory[sha256] = entry
+            self._memory.move_to_end(sha256)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+        return entry
+
+    def _touch(self, sha256: str, now: float):
+        """Mark a row as recently used for LRU eviction (caller holds the lock)"""
+        self._conn.execute("UPDATE analysis_cache SET last_used_at = ? WHERE sha256 = ?", (now, sha256))
+
+    @staticmethod
+    def _result(entry: tuple, match: str) -> Dict[str, Any]:
+        extracted_data, confidence, _ = entry
+        return {
+            "status": "success",
+            # Callers may modify the result, the cached copy must not change
+            "extracted_data": json.loads(json.dumps(extracted_data)),
+            "confidence": confidence,
+            "cache": match,
+        }
+
+    def _prune(self, now: float):
+        """Delete expired and outdated rows, then the least recently used beyond max_entries"""
+        self._conn.execute(
+            "DELETE FROM analysis_cache WHERE expires_at <= ? OR version != ?", (now, self.version)
+        )
+        self._conn.execute(
+            "DELETE FROM analysis_cache WHERE sha256 IN ("
+            " SELECT sha256 FROM analysis_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def prune(self):
+        """Apply TTL, version and size limits now"""
+        with self._lock:
+            self._prune(time.time())
+            self._memory.clear()
+
+    def invalidate(self, image_content: bytes = None, sha256: Optional[str] = None):
+        """
+        Drop the cached analysis of one image
+
+        Args:
+            image_content: Encoded image
+            sha256: content_hash of the image, if already known
+        """
+        sha256 = sha256 or content_hash(image_content)
+        with self._lock:
+            self._memory.pop(sha256, None)
+            self._conn.execute("DELETE FROM analysis_cache WHERE sha256 = ?", (sha256,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM analysis_cache WHERE version = ?", (self.version,)
+            ).fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get hit/miss counters
+
+        Returns:
+            Dictionary with hits, perceptual_hits, misses, hit_rate and entries
+        """
+        entries = len(self)
+        with self._lock:
+            total = self._hits + self._perceptual_hits + self._misses
+            return {
+                "version": self.version,
+                "hits": self._hits,
+                "perceptual_hits": self._perceptual_hits,
+                "misses": self._misses,
+                "hit_rate": round((self._hits + self._perceptual_hits) / total, 4) if total else 0.0,
+                "entries": entries,
+                "memory_entries": len(self._memory),
+                "max_entries": self.max_entries,
+            }
@@ -1,8 +1,9 @@
 """
 AI Assistant for receipt reading and invoice generation
 """
+import json
 import logging
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, Callable, Iterable, Iterator, List, Sequence, Tuple
 
 try:
     import openai
@@ -12,6 +13,16 @@ except ImportError:
 
 from config import config
 from modules.utils.logger import log_error_with_traceback, StructuredLogger
+from modules.ai.analysis_cache import AnalysisCache, content_hash
+from modules.ai.bulk_analysis import ReceiptBulkAnalyzer
+from modules.ai.file_classifier import FileClassifier
+from modules.ai.invoice_templates import InvoiceEngine
+from modules.ai.receipt_vision import ReceiptVisionClient
+from modules.ai.search_query import SEARCH_TRANSLATION_PROMPT, QueryTranslator
+from modules.database.search_index import PERIODS
+from modules.ai.sales_aggregation import SalesColumns, aggregate_sales
+from modules.ai.tiered_extraction import TieredReceiptExtractor, default_tiers
+from modules.utils.image_preprocess import ImagePreprocessor
 
 
 class AIAssistant:
@@ -21,6 +32,27 @@ class AIAssistant:
         """Initialize AI Assistant"""
         self.logger = StructuredLogger(__name__)
         
+        # Results are reused for images that were already analyzed
+        self.analysis_cache = None
+        if config.ANALYSIS_CACHE_ENABLED:
+            self.analysis_cache = AnalysisCache(self.analysis_version)
+        
+        # Folder and name suggestions from past decisions, asking ChatGPT only when unsure
+        self.file_classifier = None
+        if config.CLASSIFIER_ENABLED:
+            self.file_classifier = FileClassifier(fallback=self._suggest_file_placement_with_llm)
+        
+        # Receipts are shrunk before they are sent to the vision model
+        self.image_preprocessor = None
+        if config.IMAGE_PREPROCESS_ENABLED:
+            self.image_preprocessor = ImagePreprocessor()
+        
+        self.vision = None
+        self.extractor = None
+        self.bulk_analyzer = None
+        self.invoice_engine = None
+        self.search_translator = None
+        
         if not OPENAI_AVAILABLE:
             self.logger.warning("OpenAI library not available. Install requirements.txt to enable AI functionality.")
             return
@@ -31,18 +63,63 @@ class AIAssistant:
         else:
             openai.api_key = config.OPENAI_API_KEY
         
+        # Vision requests share one rate-limit-aware client
+        self.vision = ReceiptVisionClient()
+        self.extractor = TieredReceiptExtractor(self.vision)
+        self.bulk_analyzer = ReceiptBulkAnalyzer(self.vision, extractor=self.extractor, cache=self.analysis_cache,
+                                                 preprocess=self.prepare_receipt_image)
+        
+        # Invoice layouts are written once per contractor, amounts are filled in locally
+        self.invoice_engine = InvoiceEngine(self._generate_invoice_template)
+        
+        # Search questions are translated once per phrasing
+        self.search_translator = QueryTranslator(self._translate_search_query)
+        
         self.logger.info("AI Assistant initialized")
     
-    def analyze_receipt_image(self, image_content: bytes) -> Optional[Dict[str, Any]]:
+    @property
+    def analysis_version(self) -> str:
+        """Model and prompt version that receipt analyses are produced with"""
+        models = "+".join(tier["model"] for tier in default_tiers())
+        return f"{models}:{config.RECEIPT_PROMPT_VERSION}"
+    
+    def prepare_receipt_image(self, image_content: bytes) -> bytes:
+        """
+        Shrink a receipt image for the vision model (EXIF rotation, resize, re-encode)
+        
+        Args:
+            image_content: Receipt image content as bytes
+            
+        Returns:
+            Image to send; the input when preprocessing is disabled or does not help
+        """
+        if self.image_preprocessor is None:
+            return image_content
+        return self.image_preprocessor.process(image_content)["content"]
+    
+    def analyze_receipt_image(self, image_content: bytes, preprocessed: bool = False) -> Optional[Dict[str, Any]]:
         """
         Analyze receipt image using OpenAI Vision API
         
+        Images analyzed before with the same model and prompt version are
+        answered from the analysis cache without calling the API. Others are
+        preprocessed once, before any model tier sees them.
+        
         Args:
             image_content: Receipt image content as bytes
+            preprocessed: The image was already preprocessed (e.g. when it was stored)
             
         Returns:
             Analysis result with extracted information
         """
+        sha256 = None
+        if self.analysis_cache is not None:
+            sha256 = content_hash(image_content)
+            cached = self.analysis_cache.get(image_content, sha256=sha256)
+            if cached is not None:
+                self.logger.debug("Receipt analysis served from cache", match=cached['cache'])
+                return cached
+        
         if not OPENAI_AVAILABLE:
             self.logger.warning("Cannot analyze receipt: OpenAI library not available")
             return None
@@ -52,23 +129,20 @@ class AIAssistant:
                 self.logger.error("OpenAI API key not configured")
                 return None
             
-            # TODO: Implement OpenAI Vision API call for receipt analysis
-            # This is a placeholder implementation
-            
             self.logger.info("Analyzing receipt image")
             
-            # Simulated analysis result
-            analysis_result = {
-                "status": "success",
-                "extracted_data": {
-                    "total_amount": 0.0,
-                    "date": None,
-                    "store_name": None,
-                    "items": [],
-                    "tax": 0.0
-                },
-                "confidence": 0.0
-            }
+            image = image_content if preprocessed else self.prepare_receipt_image(image_content)
+            
+            # The fast model answers first; doubtful results go to the large model
+            analysis_result = self.extractor.analyze([image])[0]
+            
+            if self.analysis_cache is not None and analysis_result.get("status") == "success":
+                self.analysis_cache.put(
+                    image_content,
+                    analysis_result["extracted_data"],
+                    analysis_result.get("confidence"),
+                    sha256=sha256
+                )
             
             return analysis_result
             
@@ -80,6 +154,74 @@ class AIAssistant:
             )
             return None
     
+    def analyze_receipts_bulk(self, images: Sequence[bytes],
+                              on_progress: Optional[Callable[[int, int], None]] = None,
+                              preprocessed: bool = False) -> Iterator[Tuple[int, Optional[Dict[str, Any]]]]:
+        """
+        Analyze many receipts, e.g. a contractor's month of uploads
+        
+        Several small receipts are sent per vision request and requests run
+        concurrently under the shared rate limiter. Results are yielded as
+        they complete, in no particular order; collect them into a list by
+        index for summarize_sales_data.
+        
+        Args:
+            images: Receipt images as bytes
+            on_progress: Called with (done, total) after each result
+            preprocessed: The images were already preprocessed
+            
+        Yields:
+            (index into images, analysis result or None if it failed)
+        """
+        if not self.bulk_analyzer or not config.OPENAI_API_KEY:
+            self.logger.warning("Cannot analyze receipts: OpenAI not available or not configured")
+            for index in range(len(images)):
+                yield index, None
+            return
+        
+        yield from self.bulk_analyzer.analyze(images, on_progress=on_progress, preprocessed=preprocessed)
+    
+    def submit_receipt_batch(self, images: Sequence[bytes], preprocessed: bool = False) -> Optional[str]:
+        """
+        Queue receipts as an offline OpenAI batch job for non-urgent runs
+        
+        Args:
+            images: Receipt images as bytes
+            preprocessed: The images were already preprocessed
+            
+        Returns:
+            Batch ID for collect_receipt_batch, or None if nothing was submitted
+        """
+        if not self.bulk_analyzer or not config.OPENAI_API_KEY:
+            self.logger.warning("Cannot submit receipt batch: OpenAI not available or not configured")
+            return None
+        
+        try:
+            return self.bulk_analyzer.submit_batch(images, preprocessed=preprocessed)
+        except Exception as e:
+            log_error_with_traceback(
+                logging.getLogger(__name__), 
+                "Receipt batch submission error", 
+                e
+            )
+            return None
+    
+    def collect_receipt_batch(self, batch_id: Optional[str],
+                              images: Optional[Sequence[bytes]] = None) -> Optional[Dict[int, Optional[Dict[str, Any]]]]:
+        """
+        Get the results of a receipt batch job
+        
+        Args:
+            batch_id: ID returned by submit_receipt_batch
+            images: The submitted images, to cache the results and fill in cached ones
+            
+        Returns:
+            Analysis results by image index, or None while the job is still running
+        """
+        if not self.bulk_analyzer:
+            return None
+        return self.bulk_analyzer.collect_batch(batch_id, images)
+    
     def calculate_commission(self, sales_amount: float, commission_rate: float) -> Dict[str, float]:
         """
         Calculate commission based on sales amount and rate
@@ -118,13 +260,19 @@ class AIAssistant:
                 "remaining_amount": 0.0
             }
     
-    def generate_invoice_content(self, sales_data: Dict[str, Any], contractor_info: Dict[str, Any]) -> Optional[str]:
+    def generate_invoice_content(self, sales_data: Dict[str, Any], contractor_info: Dict[str, Any],
+                                 layout: str = "default") -> Optional[str]:
         """
         Generate invoice content using ChatGPT
         
+        ChatGPT writes a template once per contractor and layout; the amounts
+        are filled in locally, so monthly invoices do not call the API again
+        until the contractor details or INVOICE_TEMPLATE_VERSION change.
+        
         Args:
             sales_data: Sales information
             contractor_info: Contractor information
+            layout: Invoice layout name
             
         Returns:
             Generated invoice content or None if failed
@@ -138,27 +286,9 @@ class AIAssistant:
                 self.logger.error("OpenAI API key not configured")
                 return None
             
-            prompt = self._create_invoice_prompt(sales_data, contractor_info)
-            
-            # TODO: Implement actual OpenAI API call
-            # This is a placeholder implementation
-            
             self.logger.info("Generating invoice content")
             
-            # Simulated invoice content
-            invoice_content = f"""
-請求書
-
-請求先: {contractor_info.get('name', 'N/A')}
-期間: {sales_data.get('period', 'N/A')}
-売上合計: ¥{sales_data.get('total_sales', 0):,}
-歩合率: {sales_data.get('commission_rate', 0)*100}%
-請求金額: ¥{sales_data.get('commission_amount', 0):,}
-
-詳細は添付の売上明細をご参照ください。
-"""
-            
-            return invoice_content
+            return self.invoice_engine.render(sales_data, contractor_info, layout)
             
         except Exception as e:
             log_error_with_traceback(
@@ -168,35 +298,162 @@ class AIAssistant:
             )
             return None
     
-    def _create_invoice_prompt(self, sales_data: Dict[str, Any], contractor_info: Dict[str, Any]) -> str:
+    def _generate_invoice_template(self, contractor_info: Dict[str, Any], layout: str) -> Optional[str]:
         """
-        Create prompt for invoice generation
+        Ask ChatGPT for a reusable invoice template
+        
+        Args:
+            contractor_info: Contractor information
+            layout: Invoice layout name
+            
+        Returns:
+            Template text with {{field}} placeholders
+        """
+        response = self.vision.client.chat.completions.create(
+            model=config.INVOICE_TEMPLATE_MODEL,
+            messages=[{"role": "user", "content": self._create_invoice_prompt(contractor_info, layout)}],
+            temperature=0
+        )
+        return response.choices[0].message.content
+    
+    def _create_invoice_prompt(self, contractor_info: Dict[str, Any], layout: str = "default") -> str:
+        """
+        Create prompt for invoice template generation
         
         Args:
-            sales_data: Sales information
             contractor_info: Contractor information
+            layout: Invoice layout name
             
         Returns:
             Generated prompt
         """
         prompt = f"""
-以下の情報に基づいて、業務委託者向けの請求書を日本語で作成してください。
+以下の情報に基づいて、業務委託者向けの請求書のテンプレートを日本語で作成してください。
 
 業務委託者情報:
 - 名前: {contractor_info.get('name', 'N/A')}
 - 住所: {contractor_info.get('address', 'N/A')}
 - 連絡先: {contractor_info.get('contact', 'N/A')}
 
-売上情報:
-- 期間: {sales_data.get('period', 'N/A')}
-- 総売上: {sales_data.get('total_sales', 0):,}円
-- 歩合率: {sales_data.get('commission_rate', 0)*100}%
-- 請求金額: {sales_data.get('commission_amount', 0):,}円
+レイアウト: {layout}
 
-フォーマル且つ分かりやすい請求書を作成してください。
+毎月変わる値は次のプレースホルダーをそのまま書いてください（金額にはカンマ区切りの数値、歩合率には「30%」の形式の値が入ります）。
+- 期間: {{{{period}}}}
+- 総売上: {{{{total_sales}}}}
+- 歩合率: {{{{commission_rate}}}}
+- 請求金額: {{{{commission_amount}}}}
+
+フォーマル且つ分かりやすい請求書にしてください。テンプレート本文のみを出力してください。
 """
         return prompt
     
+    def suggest_file_placement(self, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Suggest a folder and file name for a received file
+        
+        Answered locally from similar past decisions in milliseconds; ChatGPT
+        is only asked when the nearest decisions are not similar enough.
+        
+        Args:
+            fields: file_name (as received), store_name, text, date, amount
+            
+        Returns:
+            Dict with folder, file_name, confidence and source, or None
+        """
+        if self.file_classifier is None:
+            return None
+        return self.file_classifier.suggest(fields)
+    
+    def record_file_placement(self, fields: Dict[str, Any], folder: str, file_name: str):
+        """
+        Remember where a file was filed so similar files get the same suggestion
+        
+        Args:
+            fields: file_name (as received), store_name, text, date, amount
+            folder: Folder the file was put in
+            file_name: Final file name
+        """
+        if self.file_classifier is not None:
+            self.file_classifier.learn(fields, folder, file_name)
+    
+    def _suggest_file_placement_with_llm(self, fields: Dict[str, Any],
+                                         neighbours: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Ask ChatGPT for a folder and file name, showing the closest past decisions
+        
+        Args:
+            fields: Description of the file
+            neighbours: Most similar past decisions
+            
+        Returns:
+            Dict with folder and file_name, or None
+        """
+        if not self.vision or not config.OPENAI_API_KEY:
+            return None
+        
+        examples = "\n".join(
+            f"- {n['file_name']} → フォルダ: {n['folder']}（類似度 {n['similarity']:.2f}）" for n in neighbours
+        ) or "（なし）"
+        prompt = f"""
+次のファイルの保存先フォルダとファイル名を提案してください。
+
+ファイル名: {fields.get('file_name', 'N/A')}
+店舗名: {fields.get('store_name') or 'N/A'}
+日付: {fields.get('date') or 'N/A'}
+金額: {fields.get('amount') or 'N/A'}
+内容: {str(fields.get('text') or 'N/A')[:500]}
+
+過去に似たファイルを保存した例:
+{examples}
+
+既存のフォルダと命名の仕方にできるだけ合わせ、次のJSON形式のみで回答してください。
+{{"folder": "フォルダ", "file_name": "ファイル名"}}
+"""
+        response = self.vision.client.chat.completions.create(
+            model=config.CLASSIFIER_FALLBACK_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "json_object"},
+            temperature=0
+        )
+        return json.loads(response.choices[0].message.content)
+    
+    def translate_search_query(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Turn a natural-language question into a structured search query
+        
+        Repeated phrasings are answered from the translation cache.
+        
+        Args:
+            question: Question such as '先月の○○店のレシート'
+            
+        Returns:
+            Structured query for SearchIndex.search, or None if unavailable
+        """
+        if self.search_translator is None or not config.OPENAI_API_KEY:
+            return None
+        return self.search_translator(question)
+    
+    def _translate_search_query(self, question: str) -> Dict[str, Any]:
+        """
+        Ask ChatGPT for the structured query of a question
+        
+        Args:
+            question: Natural-language question
+            
+        Returns:
+            Query dict as answered
+        """
+        prompt = SEARCH_TRANSLATION_PROMPT.format(
+            question=question, periods=", ".join(f'"{period}"' for period in PERIODS)
+        )
+        response = self.vision.client.chat.completions.create(
+            model=config.SEARCH_QUERY_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "json_object"},
+            temperature=0
+        )
+        return json.loads(response.choices[0].message.content)
+    
     def summarize_sales_data(self, receipts_data: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
         Summarize multiple receipt data
@@ -253,6 +510,51 @@ class AIAssistant:
                 "average_amount": 0.0
             }
     
+    def aggregate_sales(self,
+                        receipts: Iterable[Tuple[str, Dict[str, Any]]],
+                        commission_rates: Any = 0) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """
+        Summarize receipts and commissions for many contractors and months at once
+        
+        Unlike summarize_sales_data and calculate_commission, amounts are whole
+        yen and commissions are rounded once per total (COMMISSION_ROUNDING).
+        
+        Args:
+            receipts: Pairs of contractor and receipt analysis result
+            commission_rates: Rate per contractor, or one rate for everyone
+            
+        Returns:
+            Summary per (contractor, period YYYY-MM)
+        """
+        columns = SalesColumns.from_receipts(receipts)
+        summaries = aggregate_sales(columns, commission_rates)
+        self.logger.info("Sales aggregated", receipts=len(columns), groups=len(summaries))
+        return summaries
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get AI assistant statistics
+        
+        Returns:
+            Dictionary with analysis cache statistics
+        """
+        stats = {}
+        if self.analysis_cache is not None:
+            stats["analysis_cache"] = self.analysis_cache.stats()
+        if self.vision:
+            stats["vision"] = self.vision.stats()
+        if self.extractor:
+            stats["extraction_tiers"] = self.extractor.stats()
+        if self.invoice_engine:
+            stats["invoice_templates"] = self.invoice_engine.stats()
+        if self.file_classifier is not None:
+            stats["file_classifier"] = self.file_classifier.stats()
+        if self.search_translator is not None:
+            stats["search_translations"] = self.search_translator.stats()
+        return stats
+    
     def cleanup(self):
         """Cleanup resources"""
+        if self.image_preprocessor is not None:
+            self.image_preprocessor.shutdown()
         self.logger.info("AI Assistant cleaned up")
\ No newline at end of file
@@ -0,0 +1,269 @@
+"""
+Bulk receipt analysis: packed, concurrent vision requests and offline batch jobs
+"""
+import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.ai.analysis_cache import AnalysisCache
+from modules.ai.receipt_vision import ReceiptParseError, ReceiptVisionClient, parse_receipt_response
+
+
+# OpenAI batch statuses that mean the job has not finished yet
+BATCH_RUNNING_STATUSES = frozenset(["validating", "in_progress", "finalizing", "cancelling"])
+
+CUSTOM_ID_PREFIX = "receipts:"
+
+
+class ReceiptBulkAnalyzer:
+    """
+    Analyzes many receipts at once
+
+    Small images are packed several to a request, which saves the fixed
+    prompt tokens per call; large images, whose detail the model needs, are
+    sent alone. A packed request whose answer does not line up with its
+    images is retried one image per request. Requests run on a thread pool
+    behind the vision client's adaptive limiter, and results are yielded as
+    soon as each request finishes.
+    """
+
+    def __init__(self,
+                 vision: ReceiptVisionClient,
+                 extractor=None,
+                 cache: Optional[AnalysisCache] = None,
+                 images_per_request: Optional[int] = None,
+                 pack_max_bytes: Optional[int] = None,
+                 workers: Optional[int] = None,
+                 preprocess: Optional[Callable[[bytes], bytes]] = None):
+        """
+        Initialize the analyzer
+
+        Args:
+            vision: Client used for the requests
+            extractor: Object whose analyze(images) produces the results, e.g. a
+                       TieredReceiptExtractor (defaults to vision)
+            cache: Analysis cache consulted before and filled after requests
+            images_per_request: Most receipts per request (defaults to RECEIPT_BULK_IMAGES_PER_REQUEST)
+            pack_max_bytes: Larger images get a request of their own (defaults to RECEIPT_BULK_PACK_MAX_BYTES)
+            workers: Requests in flight (defaults to RECEIPT_BULK_WORKERS; the limiter may allow fewer)
+            preprocess: Shrinks an image once before it is packed into requests
+                        (e.g. AIAssistant.prepare_receipt_image)
+        """
+        self.logger = StructuredLogger(__name__)
+        self.vision = vision
+        self.extractor = extractor or vision
+        self.cache = cache
+        self.images_per_request = max(1, images_per_request or config.RECEIPT_BULK_IMAGES_PER_REQUEST)
+        self.pack_max_bytes = config.RECEIPT_BULK_PACK_MAX_BYTES if pack_max_bytes is None else pack_max_bytes
+        self.workers = workers or config.RECEIPT_BULK_WORKERS
+        self.preprocess = preprocess
+
+    def plan_requests(self, images: Sequence[Tuple[int, bytes]]) -> List[List[Tuple[int, bytes]]]:
+        """
+        Group images into requests
+
+        Args:
+            images: (index, image) pairs
+
+        Returns:
+            Lists of (index, image) pairs, one list per request
+        """
+        groups = []
+        packed = []
+        for index, data in images:
+            if len(data) > self.pack_max_bytes:
+                groups.append([(index, data)])
+                continue
+            packed.append((index, data))
+            if len(packed) == self.images_per_request:
+                groups.append(packed)
+                packed = []
+        if packed:
+            groups.append(packed)
+        return groups
+
+    def _cached(self, images: Sequence[bytes]) -> Tuple[Dict[int, Dict[str, Any]], List[Tuple[int, bytes]]]:
+        """Split images into cached results and (index, image) pairs still to analyze"""
+        results = {}
+        pending = []
+        for index, data in enumerate(images):
+            cached = self.cache.get(data) if self.cache is not None else None
+            if cached is not None:
+                results[index] = cached
+            else:
+                pending.append((index, data))
+        return results, pending
+
+    def _prepare(self, pending: List[Tuple[int, bytes]], preprocessed: bool) -> List[Tuple[int, bytes]]:
+        """Preprocess the images still to analyze, once each and concurrently"""
+        if self.preprocess is None or preprocessed or not pending:
+            return pending
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(pending)),
+                                thread_name_prefix="receipt-prepare") as executor:
+            prepared = list(executor.map(self.preprocess, [data for _, data in pending]))
+        return [(index, data) for (index, _), data in zip(pending, prepared)]
+
+    def _store(self, data: bytes, result: Optional[Dict[str, Any]]):
+        if self.cache is not None and result and result.get("status") == "success":
+            self.cache.put(data, result["extracted_data"], result.get("confidence"))
+
+    def _analyze_group(self, group: List[Tuple[int, bytes]]) -> List[Tuple[int, Optional[Dict[str, Any]]]]:
+        """Run one request, falling back to single-image requests if a packed answer is unusable"""
+        try:
+            results = self.extractor.analyze([data for _, data in group])
+        except ReceiptParseError as e:
+            if len(group) == 1:
+                self.logger.warning("Receipt answer could not be parsed", index=group[0][0], error=str(e))
+                return [(group[0][0], None)]
+            self.logger.warning("Packed receipt answer did not match, analyzing one by one",
+                                images=len(group), error=str(e))
+            return [pair for single in group for pair in self._analyze_group([single])]
+        except Exception as e:
+            self.logger.warning("Receipt request failed", images=len(group), error=str(e))
+            return [(index, None) for index, _ in group]
+        return [(index, result) for (index, _), result in zip(group, results)]
+
+    def analyze(self, images: Sequence[bytes],
+                on_progress: Optional[Callable[[int, int], None]] = None,
+                preprocessed: bool = False) -> Iterator[Tuple[int, Optional[Dict[str, Any]]]]:
+        """
+        Analyze receipts, yielding each result as soon as it is available
+
+        Cached results come first. Closing the iterator early cancels the
+        requests that have not started.
+
+        Args:
+            images: Encoded receipt images
+            on_progress: Called with (done, total) after each yielded result
+            preprocessed: The images were already preprocessed (e.g. when they were stored)
+
+        Yields:
+            (index into images, analysis result or None if it failed)
+        """
+        total = len(images)
+        done = 0
+        cached, pending = self._cached(images)
+        for index, result in cached.items():
+            done += 1
+            yield index, result
+            if on_progress:
+                on_progress(done, total)
+
+        groups = self.plan_requests(self._prepare(pending, preprocessed))
+        if not groups:
+            return
+        self.logger.info("Bulk receipt analysis started",
+                         images=total, cached=len(cached), requests=len(groups))
+
+        executor = ThreadPoolExecutor(max_workers=min(self.workers, len(groups)),
+                                      thread_name_prefix="receipt-bulk")
+        try:
+            futures = {executor.submit(self._analyze_group, group) for group in groups}
+            while futures:
+                finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    for index, result in future.result():
+                        # Cached under the image as given, which is what later lookups see
+                        self._store(images[index], result)
+                        done += 1
+                        yield index, result
+                        if on_progress:
+                            on_progress(done, total)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit_batch(self, images: Sequence[bytes], preprocessed: bool = False) -> Optional[str]:
+        """
+        Queue receipts as an OpenAI batch job (about half the price, done within 24 hours)
+
+        Images that are already cached are not sent.
+
+        Args:
+            images: Encoded receipt images
+            preprocessed: The images were already preprocessed
+
+        Returns:
+            Batch ID to pass to collect_batch, or None if everything was cached
+        """
+        _, pending = self._cached(images)
+        groups = self.plan_requests(self._prepare(pending, preprocessed))
+        if not groups:
+            return None
+
+        lines = []
+        for group in groups:
+            lines.append(json.dumps({
+                "custom_id": CUSTOM_ID_PREFIX + ",".join(str(index) for index, _ in group),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self.vision.request_body([data for _, data in group]),
+            }, ensure_ascii=False))
+
+        client = self.vision.client
+        input_file = client.files.create(
+            file=("receipts.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = client.post("/batches", cast_to=object, body={
+            "input_file_id": input_file.id,
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+        })
+        self.logger.info("Receipt batch submitted",
+                         batch_id=batch["id"], images=len(pending), requests=len(groups))
+        return batch["id"]
+
+    def collect_batch(self, batch_id: Optional[str],
+                      images: Optional[Sequence[bytes]] = None) -> Optional[Dict[int, Optional[Dict[str, Any]]]]:
+        """
+        Fetch the results of a batch job
+
+        Args:
+            batch_id: ID returned by submit_batch
+            images: The images that were submitted; when given, results are
+                    cached and images skipped at submission are answered from the cache
+
+        Returns:
+            Analysis result (or None) by image index, or None while the job is running
+        """
+        results: Dict[int, Optional[Dict[str, Any]]] = {}
+        if batch_id:
+            client = self.vision.client
+            batch = client.get(f"/batches/{batch_id}", cast_to=object)
+            if batch.get("status") in BATCH_RUNNING_STATUSES:
+                return None
+
+            for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+                if not file_id:
+                    continue
+                for line in client.files.content(file_id).text.splitlines():
+                    if line.strip():
+                        results.update(self._parse_batch_line(json.loads(line)))
+            self.logger.info("Receipt batch collected", batch_id=batch_id,
+                             status=batch.get("status"), results=len(results))
+
+        if images is not None:
+            for index, data in enumerate(images):
+                if index in results:
+                    self._store(data, results[index])
+                else:
+                    results[index] = self.cache.get(data) if self.cache is not None else None
+        return results
+
+    def _parse_batch_line(self, line: Dict[str, Any]) -> Dict[int, Optional[Dict[str, Any]]]:
+        """Map one batch output line to results by image index"""
+        custom_id = line.get("custom_id") or ""
+        if not custom_id.startswith(CUSTOM_ID_PREFIX):
+            return {}
+        indices = [int(index) for index in custom_id[len(CUSTOM_ID_PREFIX):].split(",")]
+
+        response = line.get("response") or {}
+        if response.get("status_code") == 200:
+            try:
+                content = response["body"]["choices"][0]["message"]["content"]
+                return dict(zip(indices, parse_receipt_response(content, len(indices))))
+            except (KeyError, IndexError, TypeError, ReceiptParseError) as e:
+                self.logger.warning("Batch receipt answer could not be parsed", custom_id=custom_id, error=str(e))
+        return {index: None for index in indices}
@@ -0,0 +1,331 @@
+"""
+Local file classification: suggests a folder and file name from similar past decisions
+"""
+import json
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from array import array
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.utils.sqlite import connect_sqlite
+
+
+# Embedded fields and their weights; date and amount are only used for naming
+EMBEDDED_FIELDS = {"file_name": 1.0, "store_name": 2.0, "text": 0.5}
+
+TOKEN_RE = re.compile(r"\w+")
+DIGITS_RE = re.compile(r"\d")
+PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+
+def _stem(file_name: str) -> str:
+    return file_name.rsplit(".", 1)[0] if "." in file_name else file_name
+
+
+def _extension(file_name: str) -> str:
+    return file_name.rsplit(".", 1)[1].lower() if "." in file_name else ""
+
+
+def embed(fields: Dict[str, Any], dimensions: int) -> Dict[int, float]:
+    """
+    Embed a file description as a sparse, L2-normalized hashed n-gram vector
+
+    Character 2- and 3-grams of every token are hashed (signed) into a fixed
+    number of dimensions. Digits are folded so dates and amounts do not make
+    otherwise identical files look different. Works for Japanese text
+    without a tokenizer.
+
+    Args:
+        fields: file_name, store_name and text (missing fields are skipped)
+        dimensions: Vector size
+
+    Returns:
+        Non-zero components by dimension
+    """
+    vector: Dict[int, float] = {}
+    for field, weight in EMBEDDED_FIELDS.items():
+        value = fields.get(field)
+        if not value:
+            continue
+        if field == "file_name":
+            value = _stem(str(value))
+        text = DIGITS_RE.sub("0", unicodedata.normalize("NFKC", str(value)).lower())
+        for token in TOKEN_RE.findall(text):
+            token = f"^{token}$"
+            for n in (2, 3):
+                for i in range(len(token) - n + 1):
+                    h = zlib.crc32(f"{field}:{token[i:i + n]}".encode("utf-8"))
+                    index = h % dimensions
+                    vector[index] = vector.get(index, 0.0) + (weight if h & 0x80000000 else -weight)
+
+    norm = sum(v * v for v in vector.values()) ** 0.5
+    if not norm:
+        return {}
+    return {i: v / norm for i, v in vector.items() if v}
+
+
+def name_template(file_name: str, fields: Dict[str, Any]) -> str:
+    """
+    Turn a chosen file name into a template by replacing the file's own values
+
+    Example: '2024-05-01_セブン_1100.jpg' for a receipt from セブン over 1100 yen
+    dated 2024-05-01 becomes '{date}_{store_name}_{amount}'.
+
+    Args:
+        file_name: Final file name
+        fields: Fields of the file it was chosen for
+
+    Returns:
+        Template without extension
+    """
+    template = _stem(file_name)
+    values = _name_values(fields)
+    # Longer values first so a date is not split by an amount inside it
+    for field, value in sorted(values.items(), key=lambda item: -len(item[1])):
+        if value and value in template:
+            template = template.replace(value, "{" + field + "}")
+    return template
+
+
+def _name_values(fields: Dict[str, Any]) -> Dict[str, str]:
+    amount = fields.get("amount")
+    return {
+        "store_name": str(fields.get("store_name") or ""),
+        "date": str(fields.get("date") or ""),
+        "amount": f"{amount:.0f}" if isinstance(amount, (int, float)) else str(amount or ""),
+        "original": _stem(str(fields.get("file_name") or "")),
+    }
+
+
+def fill_template(template: str, fields: Dict[str, Any]) -> Optional[str]:
+    """
+    Fill a name template with a file's values
+
+    Returns:
+        File name without extension, or None if a value is missing
+    """
+    values = _name_values(fields)
+    if any(not values.get(field) for field in PLACEHOLDER_RE.findall(template)):
+        return None
+    return PLACEHOLDER_RE.sub(lambda m: values[m.group(1)], template)
+
+
+class FileClassifier:
+    """
+    Nearest-neighbour index of past filing decisions
+
+    Each decision (the folder a file was put in and its final name) is kept
+    with the embedding of the file's description. A new file gets the folder
+    with the most similarity-weighted votes among its top-k neighbours, and a
+    name built from the best matching neighbour's naming pattern. When the
+    neighbours are not similar or do not agree, the fallback (normally the
+    LLM) is asked instead.
+    """
+
+    def __init__(self,
+                 fallback: Optional[Callable[[Dict[str, Any], List[Dict[str, Any]]], Optional[Dict[str, Any]]]] = None,
+                 db_path: Union[str, Path, None] = None,
+                 dimensions: Optional[int] = None,
+                 top_k: Optional[int] = None,
+                 min_confidence: Optional[float] = None):
+        """
+        Initialize the classifier and load past decisions
+
+        Args:
+            fallback: Called with (fields, neighbours) when confidence is low;
+                      returns a dict with folder and file_name, or None
+            db_path: Database file (defaults to CLASSIFIER_DB_PATH)
+            dimensions: Embedding size (defaults to CLASSIFIER_DIMENSIONS)
+            top_k: Neighbours that vote (defaults to CLASSIFIER_TOP_K)
+            min_confidence: Lowest confidence answered locally (defaults to CLASSIFIER_MIN_CONFIDENCE)
+        """
+        self.logger = StructuredLogger(__name__)
+        self.fallback = fallback
+        self.dimensions = dimensions or config.CLASSIFIER_DIMENSIONS
+        self.top_k = top_k or config.CLASSIFIER_TOP_K
+        self.min_confidence = config.CLASSIFIER_MIN_CONFIDENCE if min_confidence is None else min_confidence
+
+        self._lock = threading.Lock()
+        self._decisions: List[Dict[str, Any]] = []
+        # Row-major float32 vectors, one row per decision
+        self._vectors = array("f")
+        self._matrix = None
+        self._stats = {"suggestions": 0, "local": 0, "fallback": 0, "unanswered": 0, "search_time": 0.0}
+
+        self._conn = connect_sqlite(db_path or config.CLASSIFIER_DB_PATH)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_decisions ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " folder TEXT NOT NULL,"
+            " file_name TEXT NOT NULL,"
+            " fields TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._load()
+
+    def _load(self):
+        """Embed the stored decisions (vectors are cheap to recompute, so only fields are stored)"""
+        rows = self._conn.execute("SELECT folder, file_name, fields FROM file_decisions ORDER BY id").fetchall()
+        for row in rows:
+            self._append(row["folder"], row["file_name"], json.loads(row["fields"]))
+        if rows:
+            self.logger.info("File classifier loaded", decisions=len(rows))
+
+    def _append(self, folder: str, file_name: str, fields: Dict[str, Any]):
+        row = array("f", bytes(4 * self.dimensions))
+        for index, value in embed(fields, self.dimensions).items():
+            row[index] = value
+        # The NumPy view pins the buffer, so drop it before the array grows
+        self._matrix = None
+        self._vectors.extend(row)
+        self._decisions.append({"folder": folder, "file_name": file_name,
+                                "template": name_template(file_name, fields)})
+
+    def learn(self, fields: Dict[str, Any], folder: str, file_name: str):
+        """
+        Remember where a file was filed and under which name
+
+        Args:
+            fields: file_name (as received), store_name, text, date, amount
+            folder: Folder the file was put in
+            file_name: Final file name
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO file_decisions (folder, file_name, fields, created_at) VALUES (?, ?, ?, ?)",
+                (folder, file_name, json.dumps(fields, ensure_ascii=False, default=str), time.time())
+            )
+            self._append(folder, file_name, fields)
+
+    def neighbours(self, fields: Dict[str, Any], k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Find the most similar past decisions
+
+        Args:
+            fields: Description of the file
+            k: Number of neighbours (defaults to top_k)
+
+        Returns:
+            Decisions with a similarity key, most similar first
+        """
+        k = k or self.top_k
+        query = embed(fields, self.dimensions)
+        with self._lock:
+            count = len(self._decisions)
+            if not query or not count:
+                return []
+            if NUMPY_AVAILABLE:
+                if self._matrix is None:
+                    self._matrix = np.frombuffer(self._vectors, dtype=np.float32).reshape(count, self.dimensions)
+                indices = np.fromiter(query.keys(), dtype=np.int64)
+                weights = np.fromiter(query.values(), dtype=np.float32)
+                scores = self._matrix[:, indices] @ weights
+                top = np.argpartition(-scores, min(k, count) - 1)[:k] if count > k else np.arange(count)
+                ranked = sorted(((float(scores[i]), int(i)) for i in top), reverse=True)
+            else:
+                vectors, dimensions = self._vectors, self.dimensions
+                scores = [
+                    sum(vectors[offset + index] * weight for index, weight in query.items())
+                    for offset in range(0, count * dimensions, dimensions)
+                ]
+                ranked = sorted(((score, i) for i, score in enumerate(scores)), reverse=True)[:k]
+            return [dict(self._decisions[i], similarity=round(score, 4)) for score, i in ranked if score > 0]
+
+    def suggest(self, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Suggest a folder and file name
+
+        Args:
+            fields: file_name (as received), store_name, text, date, amount
+
+        Returns:
+            Dict with folder, file_name, confidence and source ('index' or
+            'fallback'), or None if there is no suggestion
+        """
+        started = time.perf_counter()
+        neighbours = self.neighbours(fields)
+        suggestion = self._vote(fields, neighbours)
+        with self._lock:
+            self._stats["suggestions"] += 1
+            self._stats["search_time"] += time.perf_counter() - started
+
+        if suggestion and suggestion["confidence"] >= self.min_confidence:
+            with self._lock:
+                self._stats["local"] += 1
+            return suggestion
+
+        if self.fallback is not None:
+            try:
+                answer = self.fallback(fields, neighbours)
+            except Exception as e:
+                self.logger.warning("File classification fallback failed", error=str(e))
+                answer = None
+            if answer and answer.get("folder"):
+                with self._lock:
+                    self._stats["fallback"] += 1
+                extension = _extension(str(fields.get("file_name") or ""))
+                file_name = answer.get("file_name") or fields.get("file_name")
+                if extension and not str(file_name).lower().endswith(f".{extension}"):
+                    file_name = f"{file_name}.{extension}"
+                return {"folder": answer["folder"], "file_name": file_name,
+                        "confidence": suggestion["confidence"] if suggestion else 0.0, "source": "fallback"}
+
+        with self._lock:
+            self._stats["unanswered"] += 1
+        return suggestion
+
+    def _vote(self, fields: Dict[str, Any], neighbours: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Pick the folder with the most similarity-weighted votes"""
+        if not neighbours:
+            return None
+        votes: Dict[str, float] = {}
+        best: Dict[str, Dict[str, Any]] = {}
+        for neighbour in neighbours:
+            folder = neighbour["folder"]
+            votes[folder] = votes.get(folder, 0.0) + neighbour["similarity"]
+            best.setdefault(folder, neighbour)
+        folder = max(votes, key=votes.get)
+        # Similar and unanimous neighbours give a confidence near 1
+        confidence = best[folder]["similarity"] * votes[folder] / sum(votes.values())
+
+        file_name = str(fields.get("file_name") or "")
+        for neighbour in neighbours:
+            if neighbour["folder"] != folder:
+                continue
+            name = fill_template(neighbour["template"], fields)
+            if name:
+                extension = _extension(file_name) or _extension(neighbour["file_name"])
+                file_name = f"{name}.{extension}" if extension else name
+                break
+        return {"folder": folder, "file_name": file_name, "confidence": round(confidence, 4), "source": "index"}
+
+    def __len__(self) -> int:
+        return len(self._decisions)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get suggestion counters
+
+        Returns:
+            Dictionary with decisions, suggestions answered locally or by the
+            fallback, and the average search time
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["decisions"] = len(self._decisions)
+            stats["avg_search_ms"] = (round(stats.pop("search_time") / stats["suggestions"] * 1000, 3)
+                                      if stats["suggestions"] else 0.0)
+            stats["backend"] = "numpy" if NUMPY_AVAILABLE else "array"
+            return stats
@@ -0,0 +1,289 @@
+"""
+Cached invoice templates: the LLM writes a layout once, amounts are filled in locally
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.utils.sqlite import connect_sqlite
+
+
+# Values that change from invoice to invoice; everything else is part of the template
+INVOICE_FIELDS = ("period", "total_sales", "commission_rate", "commission_amount")
+
+PLACEHOLDER_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+DEFAULT_INVOICE_TEMPLATE = """
+請求書
+
+請求先: {name}
+期間: {{period}}
+売上合計: ¥{{total_sales}}
+歩合率: {{commission_rate}}
+請求金額: ¥{{commission_amount}}
+
+詳細は添付の売上明細をご参照ください。
+"""
+
+
+def contractor_fingerprint(contractor_info: Dict[str, Any]) -> str:
+    """Hash of the contractor details a template was written for"""
+    canonical = json.dumps(contractor_info, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def format_invoice_values(sales_data: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Format the per-invoice values for a template
+
+    Args:
+        sales_data: Sales information (period, total_sales, commission_rate, commission_amount)
+
+    Returns:
+        Display strings by field name
+    """
+    return {
+        "period": str(sales_data.get("period", "N/A")),
+        "total_sales": f"{sales_data.get('total_sales', 0):,.0f}",
+        "commission_rate": f"{sales_data.get('commission_rate', 0) * 100:g}%",
+        "commission_amount": f"{sales_data.get('commission_amount', 0):,.0f}",
+    }
+
+
+class CompiledTemplate:
+    """Template split once into literal text and field names, so rendering is a join"""
+
+    __slots__ = ("literals", "fields")
+
+    def __init__(self, text: str):
+        """
+        Compile a template
+
+        Args:
+            text: Template with {{field}} placeholders
+
+        Raises:
+            ValueError: If a placeholder is unknown or a field is missing
+        """
+        parts = PLACEHOLDER_RE.split(text)
+        self.literals: List[str] = parts[0::2]
+        self.fields: List[str] = parts[1::2]
+        unknown = set(self.fields) - set(INVOICE_FIELDS)
+        missing = set(INVOICE_FIELDS) - set(self.fields)
+        if unknown or missing:
+            raise ValueError(f"Invalid invoice template (unknown: {sorted(unknown)}, missing: {sorted(missing)})")
+
+    def render(self, values: Dict[str, str]) -> str:
+        literals = self.literals
+        out = [literals[0]]
+        for field, literal in zip(self.fields, literals[1:]):
+            out.append(values[field])
+            out.append(literal)
+        return "".join(out)
+
+
+class InvoiceTemplateStore:
+    """SQLite store of invoice templates per contractor and layout"""
+
+    def __init__(self, db_path: Union[str, Path, None] = None):
+        """
+        Initialize the store
+
+        Args:
+            db_path: Database file (defaults to INVOICE_TEMPLATE_DB_PATH)
+        """
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(db_path or config.INVOICE_TEMPLATE_DB_PATH)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS invoice_templates ("
+            " contractor TEXT NOT NULL,"
+            " layout TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " version TEXT NOT NULL,"
+            " template TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (contractor, layout))"
+        )
+
+    def get(self, contractor: str, layout: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the stored template for a contractor and layout
+
+        Returns:
+            Dict with fingerprint, version, template and source, or None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, version, template, source FROM invoice_templates"
+                " WHERE contractor = ? AND layout = ?",
+                (contractor, layout)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def put(self, contractor: str, layout: str, fingerprint: str, version: str, template: str, source: str):
+        """Store a template, replacing the previous one for the contractor and layout"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO invoice_templates"
+                " (contractor, layout, fingerprint, version, template, source, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (contractor, layout, fingerprint, version, template, source, time.time())
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM invoice_templates").fetchone()[0]
+
+
+class InvoiceEngine:
+    """
+    Renders invoices from per-contractor templates
+
+    A template is generated (normally by the LLM) the first time a contractor
+    and layout are seen, and again only when the contractor details or
+    INVOICE_TEMPLATE_VERSION change. Compiled templates are kept in memory,
+    so rendering a month's invoice only formats the numbers. When generation
+    fails the default template is used from memory only, and generation is
+    retried after INVOICE_TEMPLATE_RETRY_SECONDS.
+    """
+
+    def __init__(self,
+                 generate_template: Callable[[Dict[str, Any], str], Optional[str]],
+                 store: Optional[InvoiceTemplateStore] = None,
+                 version: Optional[str] = None,
+                 retry_seconds: Optional[float] = None):
+        """
+        Initialize the engine
+
+        Args:
+            generate_template: Called with (contractor_info, layout); returns
+                               template text with {{field}} placeholders, or None
+            store: Template store (defaults to a new InvoiceTemplateStore)
+            version: Template version (defaults to INVOICE_TEMPLATE_VERSION)
+            retry_seconds: Seconds before a failed generation is retried
+                           (defaults to INVOICE_TEMPLATE_RETRY_SECONDS)
+        """
+        self.logger = StructuredLogger(__name__)
+        self.generate_template = generate_template
+        self.store = store if store is not None else InvoiceTemplateStore()
+        self.version = version or config.INVOICE_TEMPLATE_VERSION
+        self.retry_seconds = retry_seconds if retry_seconds is not None else config.INVOICE_TEMPLATE_RETRY_SECONDS
+        # Held while a template is generated; renders of cached templates do not wait for it
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # (contractor, layout) -> (fingerprint, template, retry deadline or None)
+        self._compiled: Dict[Tuple[str, str], Tuple[str, CompiledTemplate, Optional[float]]] = {}
+        self._renders = 0
+        self._generated = 0
+        self._fallbacks = 0
+
+    @staticmethod
+    def contractor_key(contractor_info: Dict[str, Any]) -> str:
+        return str(contractor_info.get("id") or contractor_info.get("name") or "")
+
+    def render(self, sales_data: Dict[str, Any], contractor_info: Dict[str, Any], layout: str = "default") -> str:
+        """
+        Render an invoice
+
+        Args:
+            sales_data: Sales information
+            contractor_info: Contractor information
+            layout: Invoice layout name
+
+        Returns:
+            Invoice text
+        """
+        template = self.template_for(contractor_info, layout)
+        text = template.render(format_invoice_values(sales_data))
+        with self._stats_lock:
+            self._renders += 1
+        return text
+
+    def template_for(self, contractor_info: Dict[str, Any], layout: str = "default") -> CompiledTemplate:
+        """
+        Get the compiled template for a contractor, generating it if needed
+
+        Args:
+            contractor_info: Contractor information
+            layout: Invoice layout name
+
+        Returns:
+            Compiled template
+        """
+        contractor = self.contractor_key(contractor_info)
+        fingerprint = contractor_fingerprint(contractor_info)
+        key = (contractor, layout)
+
+        cached = self._compiled.get(key)
+        if self._is_current(cached, fingerprint):
+            return cached[1]
+
+        with self._lock:
+            cached = self._compiled.get(key)
+            if self._is_current(cached, fingerprint):
+                return cached[1]
+
+            stored = self.store.get(contractor, layout)
+            if stored and stored["fingerprint"] == fingerprint and stored["version"] == self.version:
+                self._compiled[key] = (fingerprint, CompiledTemplate(stored["template"]), None)
+            else:
+                self._compiled[key] = self._generate(contractor, layout, fingerprint, contractor_info)
+            return self._compiled[key][1]
+
+    @staticmethod
+    def _is_current(cached: Optional[Tuple[str, CompiledTemplate, Optional[float]]], fingerprint: str) -> bool:
+        return (cached is not None and cached[0] == fingerprint
+                and (cached[2] is None or time.monotonic() < cached[2]))
+
+    def _generate(self, contractor: str, layout: str, fingerprint: str,
+                  contractor_info: Dict[str, Any]) -> Tuple[str, CompiledTemplate, Optional[float]]:
+        """
+        Generate and validate a template (caller holds the lock)
+
+        Only a valid generated template is stored. On failure the default
+        template is returned with a retry deadline and is not persisted.
+
+        Returns:
+            Cache entry of (fingerprint, compiled template, retry deadline or None)
+        """
+        try:
+            text = self.generate_template(contractor_info, layout)
+            compiled = CompiledTemplate(text or "")
+        except Exception as e:
+            self.logger.warning("Invoice template generation failed, using default template",
+                                contractor=contractor, layout=layout, error=str(e),
+                                retry_seconds=self.retry_seconds)
+            text = DEFAULT_INVOICE_TEMPLATE.replace("{name}", str(contractor_info.get("name", "N/A")))
+            with self._stats_lock:
+                self._fallbacks += 1
+            return fingerprint, CompiledTemplate(text), time.monotonic() + self.retry_seconds
+
+        self.store.put(contractor, layout, fingerprint, self.version, text, "llm")
+        with self._stats_lock:
+            self._generated += 1
+        self.logger.info("Invoice template generated",
+                         contractor=contractor, layout=layout, version=self.version)
+        return fingerprint, compiled, None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get render and generation counters
+
+        Returns:
+            Dictionary with renders, templates generated, fallbacks and stored templates
+        """
+        with self._stats_lock:
+            return {
+                "version": self.version,
+                "renders": self._renders,
+                "generated": self._generated,
+                "fallbacks": self._fallbacks,
+                "stored": len(self.store),
+            }
@@ -0,0 +1,342 @@
+"""
+OpenAI vision requests for receipt extraction
+"""
+import base64
+import json
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import openai
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.onedrive.http_session import parse_retry_after
+from modules.onedrive.rate_limiter import ERROR, SUCCESS, THROTTLED, AdaptiveConcurrencyLimiter
+
+
+RECEIPT_ANALYSIS_PROMPT = """
+あなたはレシート読み取りアシスタントです。添付されたレシート画像を、添付された順番どおりに1枚ずつ読み取ってください。
+画像ごとに次の形式のオブジェクトを作成し、{"receipts": [...]} として画像と同じ数だけ返してください。
+
+{"total_amount": 税込合計金額（数値）,
+ "date": "YYYY-MM-DD" 形式の日付,
+ "store_name": 店名,
+ "items": [{"name": 品名, "price": 金額（数値）, "quantity": 数量（数値）}],
+ "tax": 消費税額（数値）,
+ "confidence": 読み取り結果の確からしさ（0から1の数値）}
+
+読み取れない項目は null にしてください。金額は通貨記号やカンマを含めない数値にしてください。
+"""
+
+
+class ReceiptParseError(ValueError):
+    """The model response does not contain one receipt per image"""
+
+    # Token usage of the request whose answer could not be parsed
+    usage: Optional[Dict[str, int]] = None
+
+
+def image_data_url(data: bytes) -> str:
+    """Encode an image as a data: URL for the vision API"""
+    if data.startswith(b"\x89PNG"):
+        content_type = "image/png"
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        content_type = "image/webp"
+    else:
+        content_type = "image/jpeg"
+    return f"data:{content_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def build_receipt_messages(images: List[bytes]) -> List[Dict[str, Any]]:
+    """
+    Build chat messages asking for the receipts in several images at once
+
+    Args:
+        images: Encoded receipt images
+
+    Returns:
+        Messages for the chat completions API
+    """
+    content = [{"type": "text", "text": f"レシート画像 {len(images)} 枚"}]
+    for data in images:
+        content.append({"type": "image_url", "image_url": {"url": image_data_url(data), "detail": "high"}})
+    return [
+        {"role": "system", "content": RECEIPT_ANALYSIS_PROMPT.strip()},
+        {"role": "user", "content": content},
+    ]
+
+
+def _number(value: Any) -> Optional[float]:
+    """Read a model-provided amount, tolerating '1,280' or '¥1280'"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(",", "").replace("¥", "").replace("円", "").strip())
+    except ValueError:
+        return None
+
+
+def normalize_receipt(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert one receipt object from the model into an analysis result
+
+    Args:
+        raw: Receipt object as returned by the model
+
+    Returns:
+        Analysis result with status, extracted_data and confidence
+    """
+    items = []
+    for item in raw.get("items") or []:
+        if not isinstance(item, dict):
+            continue
+        items.append({
+            "name": item.get("name"),
+            "price": _number(item.get("price")),
+            "quantity": _number(item.get("quantity")) or 1.0,
+        })
+    confidence = _number(raw.get("confidence"))
+    return {
+        "status": "success",
+        "extracted_data": {
+            "total_amount": _number(raw.get("total_amount")) or 0.0,
+            "date": raw.get("date") or None,
+            "store_name": raw.get("store_name") or None,
+            "items": items,
+            "tax": _number(raw.get("tax")) or 0.0,
+        },
+        "confidence": min(1.0, max(0.0, confidence)) if confidence is not None else 0.0,
+    }
+
+
+def parse_receipt_response(text: str, expected: int) -> List[Dict[str, Any]]:
+    """
+    Parse the JSON answer to build_receipt_messages
+
+    Args:
+        text: Message content returned by the model
+        expected: Number of images that were sent
+
+    Returns:
+        One analysis result per image, in order
+
+    Raises:
+        ReceiptParseError: If the answer is not JSON or has the wrong number of receipts
+    """
+    try:
+        data = json.loads(text or "")
+    except ValueError as e:
+        raise ReceiptParseError(f"Response is not JSON: {e}")
+
+    receipts = data.get("receipts") if isinstance(data, dict) else data
+    if isinstance(receipts, dict):
+        receipts = [receipts]
+    if not isinstance(receipts, list) or len(receipts) != expected:
+        raise ReceiptParseError(
+            f"Expected {expected} receipts, got {len(receipts) if isinstance(receipts, list) else 'none'}"
+        )
+    if not all(isinstance(receipt, dict) for receipt in receipts):
+        raise ReceiptParseError("Receipt entries must be objects")
+    return [normalize_receipt(receipt) for receipt in receipts]
+
+
+class ReceiptVisionClient:
+    """
+    Sends receipt images to the OpenAI vision model
+
+    All requests share one adaptive concurrency limiter, so bulk runs back
+    off together when OpenAI returns 429, and calls honour its Retry-After.
+    """
+
+    def __init__(self,
+                 client=None,
+                 limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+                 model: Optional[str] = None,
+                 max_retries: Optional[int] = None,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        Initialize the vision client
+
+        Args:
+            client: openai.OpenAI instance (created on first use by default)
+            limiter: Concurrency limiter (defaults to one using the OPENAI_CONCURRENCY_* settings)
+            model: Default model (defaults to OPENAI_VISION_MODEL)
+            max_retries: Retries for throttled and transient failures (defaults to OPENAI_MAX_RETRIES)
+            sleep: Sleep function (mainly for tests)
+        """
+        self.logger = StructuredLogger(__name__)
+        self._client = client
+        self.limiter = limiter or AdaptiveConcurrencyLimiter(
+            initial_limit=config.OPENAI_CONCURRENCY_INITIAL,
+            min_limit=1,
+            max_limit=config.OPENAI_CONCURRENCY_MAX,
+            latency_target_ms=config.OPENAI_LATENCY_TARGET_MS
+        )
+        self.model = model or config.OPENAI_VISION_MODEL
+        self.max_retries = config.OPENAI_MAX_RETRIES if max_retries is None else max_retries
+        self._sleep = sleep
+        self._client_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._images = 0
+        self._retries = 0
+        self._failures = 0
+        self._prompt_tokens = 0
+        self._completion_tokens = 0
+
+    @property
+    def client(self):
+        """OpenAI client, created on first use"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    # Retries are handled here so the limiter sees every 429
+                    self._client = openai.OpenAI(
+                        api_key=config.OPENAI_API_KEY,
+                        timeout=config.OPENAI_TIMEOUT,
+                        max_retries=0
+                    )
+        return self._client
+
+    def request_body(self, images: List[bytes], model: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Chat completion parameters for a receipt request
+
+        Images are sent as given; callers preprocess them once beforehand.
+
+        Args:
+            images: Encoded receipt images, analyzed together
+            model: Model to use (defaults to the client's model)
+
+        Returns:
+            Keyword arguments for chat.completions.create (also the batch request body)
+        """
+        return {
+            "model": model or self.model,
+            "messages": build_receipt_messages(images),
+            "response_format": {"type": "json_object"},
+            "temperature": 0,
+            "max_tokens": config.OPENAI_RECEIPT_MAX_TOKENS * len(images),
+        }
+
+    def analyze(self, images: List[bytes], model: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Extract several receipts with one request
+
+        Args:
+            images: Encoded receipt images
+            model: Model to use (defaults to the client's model)
+
+        Returns:
+            One analysis result per image, in order
+
+        Raises:
+            ReceiptParseError: If the answer does not match the images
+            openai.OpenAIError: If the request fails after retries
+        """
+        return self.analyze_with_usage(images, model)[0]
+
+    def analyze_with_usage(self, images: List[bytes],
+                           model: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """
+        Extract several receipts with one request and report its token usage
+
+        Args:
+            images: Encoded receipt images
+            model: Model to use (defaults to the client's model)
+
+        Returns:
+            (one analysis result per image, {"prompt_tokens", "completion_tokens"})
+
+        Raises:
+            ReceiptParseError: If the answer does not match the images (its usage attribute is set)
+            openai.OpenAIError: If the request fails after retries
+        """
+        body = self.request_body(images, model)
+        retries = 0
+        delay = 0.0
+
+        while True:
+            wait = max(delay, self.limiter.pause_remaining())
+            if wait > 0:
+                self._sleep(wait)
+
+            started_at = self.limiter.acquire()
+            try:
+                response = self.client.chat.completions.create(**body)
+            except openai.RateLimitError as e:
+                headers = e.response.headers if e.response is not None else {}
+                retry_after = parse_retry_after(headers.get("retry-after"))
+                self.limiter.release(started_at, THROTTLED, retry_after)
+                delay = retry_after if retry_after is not None else self.backoff_delay(retries)
+                error = e
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                self.limiter.release(started_at, ERROR)
+                delay = self.backoff_delay(retries)
+                error = e
+            except Exception:
+                self.limiter.release(started_at, ERROR)
+                self._count(len(images), retries, failed=True)
+                raise
+            else:
+                self.limiter.release(started_at, SUCCESS)
+                break
+
+            if retries >= self.max_retries:
+                self._count(len(images), retries, failed=True)
+                raise error
+            self.logger.warning("Vision request failed, retrying",
+                                attempt=retries + 1, delay=round(delay, 3), error=str(error))
+            retries += 1
+
+        response_usage = getattr(response, "usage", None)
+        usage = {
+            "prompt_tokens": getattr(response_usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(response_usage, "completion_tokens", 0) or 0,
+        }
+        self._count(len(images), retries, failed=False, **usage)
+        try:
+            return parse_receipt_response(response.choices[0].message.content, len(images)), usage
+        except ReceiptParseError as e:
+            e.usage = usage
+            raise
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(config.OPENAI_BACKOFF_MAX, config.OPENAI_BACKOFF_BASE * (2 ** attempt)))
+
+    def _count(self, images: int, retries: int, failed: bool,
+               prompt_tokens: int = 0, completion_tokens: int = 0):
+        with self._stats_lock:
+            self._requests += 1
+            self._images += images
+            self._retries += retries
+            self._failures += failed
+            self._prompt_tokens += prompt_tokens
+            self._completion_tokens += completion_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get request, token and concurrency counters
+
+        Returns:
+            Dictionary of vision request statistics
+        """
+        with self._stats_lock:
+            return {
+                "requests": self._requests,
+                "images": self._images,
+                "retries": self._retries,
+                "failures": self._failures,
+                "prompt_tokens": self._prompt_tokens,
+                "completion_tokens": self._completion_tokens,
+                "concurrency": self.limiter.stats(),
+            }
@@ -0,0 +1,249 @@
+"""
+Columnar sales aggregation: per-contractor, per-period totals and commissions in one pass
+"""
+from array import array
+from datetime import date
+from decimal import ROUND_DOWN, ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from config import config
+
+
+# Period used for receipts without a readable date
+UNKNOWN_PERIOD = "unknown"
+
+# Date column value for receipts without a readable date
+NO_DATE = -1
+
+ROUNDING_MODES = {"down": ROUND_DOWN, "half_up": ROUND_HALF_UP}
+
+
+def to_yen(amount: Any) -> int:
+    """
+    Convert an amount to whole yen, rounding half up
+
+    Amounts go through their decimal string so 0.1 + 0.2 style float error
+    never shifts a yen.
+
+    Args:
+        amount: int, float, Decimal or numeric string
+
+    Returns:
+        Amount in yen
+    """
+    if amount is None:
+        return 0
+    if isinstance(amount, int):
+        return amount
+    if isinstance(amount, float) and amount.is_integer():
+        return int(amount)
+    try:
+        return int(Decimal(str(amount)).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError):
+        return 0
+
+
+def apply_rate(amount: int, rate: Any, rounding: Optional[str] = None) -> int:
+    """
+    Multiply a yen amount by a rate exactly and round to whole yen
+
+    Args:
+        amount: Amount in yen
+        rate: Rate such as 0.3 or "0.3"
+        rounding: 'down' (truncate) or 'half_up' (defaults to COMMISSION_ROUNDING)
+
+    Returns:
+        Rounded amount in yen
+    """
+    mode = ROUNDING_MODES[(rounding or config.COMMISSION_ROUNDING).lower()]
+    return int((Decimal(amount) * Decimal(str(rate))).quantize(Decimal(1), rounding=mode))
+
+
+def _date_ordinal(value: Any) -> int:
+    try:
+        return date.fromisoformat(str(value)[:10]).toordinal()
+    except ValueError:
+        return NO_DATE
+
+
+class SalesColumns:
+    """
+    Receipts stored column-wise in typed arrays
+
+    Contractors and periods are stored as integer codes into lookup lists,
+    amounts as integer yen and dates as proleptic ordinals, so one
+    pass over the columns can aggregate any number of contractors.
+    """
+
+    def __init__(self):
+        self.contractors: List[str] = []
+        self.periods: List[str] = []
+        self._contractor_codes: Dict[str, int] = {}
+        self._period_codes: Dict[str, int] = {}
+        # Receipts share few distinct dates, so each is parsed once
+        self._days: Dict[Any, int] = {}
+        self.contractor = array("q")
+        self.period = array("q")
+        self.amount = array("q")
+        self.items = array("q")
+        self.day = array("q")
+
+    def __len__(self) -> int:
+        return len(self.amount)
+
+    def _code(self, codes: Dict[str, int], names: List[str], name: str) -> int:
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(names)
+            names.append(name)
+        return code
+
+    def append(self, contractor: str, receipt: Optional[Mapping[str, Any]], period: Optional[str] = None):
+        """
+        Add one receipt analysis result
+
+        Failed analyses count as receipts with no amount, like summarize_sales_data.
+
+        Args:
+            contractor: Contractor the receipt belongs to
+            receipt: Analysis result (status, extracted_data)
+            period: Period label (defaults to the receipt date's YYYY-MM)
+        """
+        data = (receipt.get("extracted_data") or {}) if receipt and receipt.get("status") == "success" else {}
+        receipt_date = data.get("date")
+        day = NO_DATE
+        if receipt_date:
+            day = self._days.get(receipt_date)
+            if day is None:
+                day = self._days[receipt_date] = _date_ordinal(receipt_date)
+        if period is None:
+            period = str(receipt_date)[:7] if day != NO_DATE else UNKNOWN_PERIOD
+
+        self.contractor.append(self._code(self._contractor_codes, self.contractors, str(contractor)))
+        self.period.append(self._code(self._period_codes, self.periods, period))
+        self.amount.append(to_yen(data.get("total_amount")))
+        self.items.append(len(data.get("items") or []))
+        self.day.append(day)
+
+    @classmethod
+    def from_receipts(cls, records: Iterable[Tuple[str, Mapping[str, Any]]]) -> "SalesColumns":
+        """
+        Build columns from (contractor, analysis result) pairs
+
+        Args:
+            records: Pairs of contractor and receipt analysis result
+
+        Returns:
+            Filled columns
+        """
+        columns = cls()
+        for contractor, receipt in records:
+            columns.append(contractor, receipt)
+        return columns
+
+
+def _group_totals_numpy(columns: SalesColumns):
+    """Per-group count, amount, items and date range with sorted segment reductions"""
+    n_periods = max(1, len(columns.periods))
+    keys = np.frombuffer(columns.contractor, dtype=np.int64) * n_periods + np.frombuffer(columns.period, dtype=np.int64)
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+
+    # int64 sums are exact for any realistic yen total
+    amount = np.frombuffer(columns.amount, dtype=np.int64)[order]
+    items = np.frombuffer(columns.items, dtype=np.int64)[order]
+    day = np.frombuffer(columns.day, dtype=np.int64)[order]
+    no_first = np.iinfo(np.int64).max
+    first = np.minimum.reduceat(np.where(day == NO_DATE, no_first, day), starts)
+    last = np.maximum.reduceat(day, starts)
+
+    group_keys = keys[starts]
+    return zip(
+        (group_keys // n_periods).tolist(),
+        (group_keys % n_periods).tolist(),
+        counts.tolist(),
+        np.add.reduceat(amount, starts).tolist(),
+        np.add.reduceat(items, starts).tolist(),
+        [None if d == no_first else d for d in first.tolist()],
+        [None if d == NO_DATE else d for d in last.tolist()],
+    )
+
+
+def _group_totals_python(columns: SalesColumns):
+    """Per-group count, amount, items and date range in one loop over the columns"""
+    groups: Dict[Tuple[int, int], List[Any]] = {}
+    for contractor, period, amount, items, day in zip(
+            columns.contractor, columns.period, columns.amount, columns.items, columns.day):
+        group = groups.get((contractor, period))
+        if group is None:
+            group = groups[(contractor, period)] = [0, 0, 0, None, None]
+        group[0] += 1
+        group[1] += amount
+        group[2] += items
+        if day != NO_DATE:
+            if group[3] is None or day < group[3]:
+                group[3] = day
+            if group[4] is None or day > group[4]:
+                group[4] = day
+    for (contractor, period), (count, amount, items, first, last) in sorted(groups.items()):
+        yield contractor, period, count, amount, items, first, last
+
+
+def aggregate_sales(columns: SalesColumns,
+                    commission_rates: Union[Mapping[str, Any], Any] = 0,
+                    rounding: Optional[str] = None,
+                    use_numpy: Optional[bool] = None) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """
+    Total every contractor's receipts per period and apply commission rates
+
+    All money values are integer yen. Commissions are computed exactly from
+    the yen total and rounded once, per contractor and period.
+
+    Args:
+        columns: Receipt columns
+        commission_rates: Rate per contractor, or one rate for everyone
+        rounding: 'down' or 'half_up' for commissions (defaults to COMMISSION_ROUNDING)
+        use_numpy: Force or disable the NumPy path (defaults to using it when installed)
+
+    Returns:
+        Summary per (contractor, period) with the keys of summarize_sales_data
+        and calculate_commission
+    """
+    if not len(columns):
+        return {}
+    if use_numpy is None:
+        use_numpy = NUMPY_AVAILABLE
+    groups = _group_totals_numpy(columns) if use_numpy else _group_totals_python(columns)
+
+    summaries = {}
+    for contractor_code, period_code, count, total, items, first, last in groups:
+        contractor = columns.contractors[contractor_code]
+        period = columns.periods[period_code]
+        rate = commission_rates.get(contractor, 0) if isinstance(commission_rates, Mapping) else commission_rates
+        commission = apply_rate(total, rate, rounding)
+        # Average rounded half up in integer arithmetic
+        average = (2 * total + count) // (2 * count)
+        summaries[(contractor, period)] = {
+            "contractor": contractor,
+            "period": period,
+            "total_receipts": count,
+            "total_amount": total,
+            "total_items": items,
+            "date_range": {
+                "start": date.fromordinal(first).isoformat() if first is not None else None,
+                "end": date.fromordinal(last).isoformat() if last is not None else None,
+            },
+            "average_amount": average,
+            "commission_rate": float(rate),
+            "commission_amount": commission,
+            "remaining_amount": total - commission,
+        }
+    return summaries
@@ -0,0 +1,216 @@
+"""
+Natural-language search questions translated once into structured queries, then cached
+"""
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Union
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.utils.sqlite import connect_sqlite
+from modules.database.search_index import KINDS, PERIODS
+
+
+SEARCH_TRANSLATION_PROMPT = """
+次の検索依頼を、ファイルとレシートの検索条件に変換してください。
+
+検索依頼: {question}
+
+次のJSON形式のみで回答してください。該当しない項目は null にしてください。
+{{
+  "kind": "file" または "receipt" または null,
+  "keywords": ["店舗名・品目・ファイル名などの語句"],
+  "period": {periods} のいずれか、または null,
+  "date_from": "YYYY-MM-DD" または null,
+  "date_to": "YYYY-MM-DD" または null,
+  "amount_min": 数値 または null,
+  "amount_max": 数値 または null
+}}
+
+「先月」「今週」のような相対的な期間は date_from/date_to ではなく period で表してください。
+keywords には「レシート」「ファイル」「先月」などの条件語は含めないでください。
+"""
+
+# Polite request endings that do not change what is searched for
+REQUEST_SUFFIXES = ("を教えてください", "を見せてください", "を探してください", "をください",
+                    "を教えて", "を見せて", "を探して", "ください", "ありますか")
+
+PUNCTUATION_RE = re.compile(r"[\s、。,.!?！？「」『』\"']+")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Canonical form of a question, so rephrasings that only differ in width,
+    spacing, punctuation or politeness share one cache entry
+
+    Args:
+        question: Question as typed
+
+    Returns:
+        Normalized question
+    """
+    text = PUNCTUATION_RE.sub("", unicodedata.normalize("NFKC", question).lower())
+    stripped = True
+    while stripped:
+        stripped = False
+        for suffix in REQUEST_SUFFIXES:
+            if text.endswith(suffix) and len(text) > len(suffix):
+                text = text[:-len(suffix)]
+                stripped = True
+    return text
+
+
+def validate_query(raw: Any) -> Dict[str, Any]:
+    """
+    Keep only well-formed fields of a translated query
+
+    Args:
+        raw: Query as returned by the translator
+
+    Returns:
+        Structured query for SearchIndex.search
+    """
+    raw = raw if isinstance(raw, dict) else {}
+    query: Dict[str, Any] = {}
+    if raw.get("kind") in KINDS:
+        query["kind"] = raw["kind"]
+    keywords = raw.get("keywords") or []
+    if isinstance(keywords, str):
+        keywords = [keywords]
+    query["keywords"] = [str(k).strip() for k in keywords if str(k).strip()][:5]
+    if raw.get("period") in PERIODS:
+        query["period"] = raw["period"]
+    for field in ("date_from", "date_to"):
+        value = str(raw.get(field) or "")
+        if re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+            query[field] = value
+    for field in ("amount_min", "amount_max"):
+        if isinstance(raw.get(field), (int, float)):
+            query[field] = raw[field]
+    return query
+
+
+class QueryTranslator:
+    """
+    Translates search questions with the LLM, once per normalized question
+
+    Translations keep relative periods ('last_month') unresolved, so a cached
+    answer stays correct on later days. Entries live in SQLite with an
+    in-process LRU in front.
+    """
+
+    def __init__(self,
+                 translate: Callable[[str], Any],
+                 db_path: Union[str, Path, None] = None,
+                 version: Optional[str] = None,
+                 memory_entries: int = 1024):
+        """
+        Initialize the translator
+
+        Args:
+            translate: Called with the question; returns the query as a dict
+            db_path: Cache database (defaults to SEARCH_QUERY_CACHE_DB_PATH)
+            version: Translation version; bump to discard cached translations
+                     (defaults to SEARCH_QUERY_VERSION)
+            memory_entries: Translations kept in memory
+        """
+        self.logger = StructuredLogger(__name__)
+        self.translate = translate
+        self.version = version or config.SEARCH_QUERY_VERSION
+        self.memory_entries = memory_entries
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._conn = connect_sqlite(db_path or config.SEARCH_QUERY_CACHE_DB_PATH)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_translations ("
+            " question TEXT NOT NULL,"
+            " version TEXT NOT NULL,"
+            " query TEXT NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (question, version))"
+        )
+
+    def __call__(self, question: str) -> Dict[str, Any]:
+        """
+        Get the structured query for a question
+
+        Args:
+            question: Natural-language question
+
+        Returns:
+            Structured query (falls back to searching the question's words
+            if the translation fails)
+        """
+        key = normalize_question(question)
+        with self._lock:
+            query = self._memory.get(key)
+            if query is not None:
+                self._memory.move_to_end(key)
+                self._hits += 1
+                return dict(query)
+            row = self._conn.execute(
+                "SELECT query FROM search_translations WHERE question = ? AND version = ?",
+                (key, self.version)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE search_translations SET hits = hits + 1 WHERE question = ? AND version = ?",
+                    (key, self.version)
+                )
+                query = json.loads(row["query"])
+                self._remember(key, query)
+                self._hits += 1
+                return dict(query)
+            self._misses += 1
+
+        started = time.monotonic()
+        try:
+            query = validate_query(self.translate(question))
+        except Exception as e:
+            self.logger.warning("Search query translation failed, searching the words", error=str(e))
+            return {"keywords": [w for w in PUNCTUATION_RE.split(question) if w]}
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_translations (question, version, query, created_at)"
+                " VALUES (?, ?, ?, ?)",
+                (key, self.version, json.dumps(query, ensure_ascii=False), time.time())
+            )
+            self._remember(key, query)
+        self.logger.info("Search query translated", question=key, query=query,
+                         duration_ms=round((time.monotonic() - started) * 1000, 1))
+        return dict(query)
+
+    def _remember(self, key: str, query: Dict[str, Any]):
+        self._memory[key] = query
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache counters
+
+        Returns:
+            Dictionary with hits, misses (LLM calls) and cached translations
+        """
+        with self._lock:
+            cached = self._conn.execute(
+                "SELECT COUNT(*) FROM search_translations WHERE version = ?", (self.version,)
+            ).fetchone()[0]
+            total = self._hits + self._misses
+            return {
+                "version": self.version,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 4) if total else 0.0,
+                "cached": cached,
+            }
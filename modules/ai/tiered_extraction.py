@@ -0,0 +1,238 @@
+"""
+Confidence-tiered receipt extraction: a cheap model first, the large model only when needed
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.ai.receipt_vision import ReceiptParseError, ReceiptVisionClient
+
+
+def default_tiers() -> List[Dict[str, Any]]:
+    """
+    Tiers from the configuration, cheapest first
+
+    Returns:
+        List of dicts with name, model and cost (USD per 1M input and output tokens)
+    """
+    accurate = {"name": "accurate", "model": config.OPENAI_VISION_MODEL, "cost": config.OPENAI_VISION_MODEL_COST}
+    if not config.RECEIPT_TIERED_ENABLED or config.RECEIPT_FAST_MODEL == config.OPENAI_VISION_MODEL:
+        return [accurate]
+    return [{"name": "fast", "model": config.RECEIPT_FAST_MODEL, "cost": config.RECEIPT_FAST_MODEL_COST}, accurate]
+
+
+def receipt_issues(result: Optional[Dict[str, Any]],
+                   confidence_threshold: float,
+                   tolerance: float) -> List[str]:
+    """
+    Check an analysis result for signs that it was misread
+
+    Args:
+        result: Analysis result (None for a failed analysis)
+        confidence_threshold: Lowest acceptable model confidence
+        tolerance: Allowed difference in yen between the items and the total
+
+    Returns:
+        Reasons to distrust the result; empty if it looks consistent
+    """
+    if not result or result.get("status") != "success":
+        return ["failed"]
+
+    issues = []
+    data = result.get("extracted_data") or {}
+    if (result.get("confidence") or 0.0) < confidence_threshold:
+        issues.append("low_confidence")
+
+    try:
+        datetime.strptime(str(data.get("date")), "%Y-%m-%d")
+    except ValueError:
+        issues.append("missing_date")
+
+    total = data.get("total_amount") or 0.0
+    tax = data.get("tax") or 0.0
+    if total <= 0:
+        issues.append("missing_total")
+
+    items = data.get("items") or []
+    if items and all(item.get("price") is not None for item in items):
+        items_total = sum(item["price"] * (item.get("quantity") or 1) for item in items)
+        # Item prices may be shown with or without consumption tax
+        if abs(items_total - total) > tolerance and abs(items_total + tax - total) > tolerance:
+            issues.append("items_mismatch")
+
+    # Consumption tax is at most 10% of the pre-tax amount
+    if tax < 0 or (total > 0 and tax > total * 0.1 + tolerance):
+        issues.append("tax_out_of_range")
+    return issues
+
+
+class TieredReceiptExtractor:
+    """
+    Runs receipts through increasingly capable models until they look right
+
+    Every receipt goes to the first (cheapest) tier. Results with a low
+    confidence or inconsistent fields (no date, items not adding up to the
+    total) are sent again to the next tier. Results of the last tier are kept
+    even if they still fail a check, marked with needs_review.
+    """
+
+    def __init__(self,
+                 vision: ReceiptVisionClient,
+                 tiers: Optional[List[Dict[str, Any]]] = None,
+                 confidence_threshold: Optional[float] = None,
+                 tolerance: Optional[float] = None):
+        """
+        Initialize the extractor
+
+        Args:
+            vision: Client used for the requests
+            tiers: Tier dicts with name, model and cost, cheapest first (defaults to default_tiers())
+            confidence_threshold: Lowest accepted confidence (defaults to RECEIPT_CONFIDENCE_THRESHOLD)
+            tolerance: Allowed yen difference between items and total (defaults to RECEIPT_AMOUNT_TOLERANCE)
+        """
+        self.logger = StructuredLogger(__name__)
+        self.vision = vision
+        self.tiers = tiers or default_tiers()
+        self.confidence_threshold = (config.RECEIPT_CONFIDENCE_THRESHOLD
+                                     if confidence_threshold is None else confidence_threshold)
+        self.tolerance = config.RECEIPT_AMOUNT_TOLERANCE if tolerance is None else tolerance
+
+        self._lock = threading.Lock()
+        self._stats = {
+            tier["name"]: {
+                "model": tier["model"], "requests": 0, "images": 0, "accepted": 0, "escalated": 0,
+                "failures": 0, "latency": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0,
+            }
+            for tier in self.tiers
+        }
+
+    def analyze(self, images: List[bytes]) -> List[Dict[str, Any]]:
+        """
+        Extract receipts, escalating doubtful ones
+
+        Args:
+            images: Encoded receipt images, sent together per tier
+
+        Returns:
+            One analysis result per image, with tier and, where they apply,
+            escalation_reasons and needs_review
+
+        Raises:
+            ReceiptParseError: If a packed answer does not match its images
+                               (callers retry the images separately)
+            openai.OpenAIError: If the first tier fails
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(images)
+        reasons: Dict[int, List[str]] = {}
+        pending = list(range(len(images)))
+
+        for level, tier in enumerate(self.tiers):
+            last = level == len(self.tiers) - 1
+            started = time.monotonic()
+            try:
+                tier_results, usage = self.vision.analyze_with_usage([images[i] for i in pending], tier["model"])
+            except ReceiptParseError as e:
+                self._record(tier, len(pending), started, e.usage, failed=True)
+                if len(pending) > 1 or last:
+                    raise
+                # A single unreadable answer is escalated like a low-confidence one
+                tier_results = [None]
+            except Exception as e:
+                self._record(tier, len(pending), started, None, failed=True)
+                if level == 0:
+                    raise
+                self.logger.warning("Receipt escalation failed, keeping earlier results",
+                                    tier=tier["name"], images=len(pending), error=str(e))
+                break
+            else:
+                self._record(tier, len(pending), started, usage)
+
+            escalate = []
+            for index, result in zip(pending, tier_results):
+                issues = receipt_issues(result, self.confidence_threshold, self.tolerance)
+                if issues and not last:
+                    reasons[index] = issues
+                    if result is not None:
+                        results[index] = self._annotate(result, tier, reasons.get(index), None)
+                    escalate.append(index)
+                    continue
+                results[index] = self._annotate(result, tier, reasons.get(index), issues) if result else None
+                with self._lock:
+                    self._stats[tier["name"]]["accepted"] += 1
+
+            with self._lock:
+                self._stats[tier["name"]]["escalated"] += len(escalate)
+            if escalate:
+                self.logger.info("Escalating receipts to next tier",
+                                 tier=tier["name"], images=len(escalate),
+                                 reasons=sorted({r for i in escalate for r in reasons[i]}))
+            pending = escalate
+            if not pending:
+                break
+
+        # Receipts whose escalation failed keep the earlier tier's result
+        for index in pending:
+            if results[index] is not None:
+                results[index]["needs_review"] = reasons[index]
+        if any(result is None for result in results):
+            raise ReceiptParseError("No tier produced a usable answer")
+        return results
+
+    @staticmethod
+    def _annotate(result: Dict[str, Any], tier: Dict[str, Any],
+                  reasons: Optional[List[str]], issues: Optional[List[str]]) -> Dict[str, Any]:
+        result["tier"] = tier["name"]
+        if reasons:
+            result["escalation_reasons"] = reasons
+        if issues:
+            result["needs_review"] = issues
+        else:
+            result.pop("needs_review", None)
+        return result
+
+    def _record(self, tier: Dict[str, Any], images: int, started: float,
+                usage: Optional[Dict[str, int]], failed: bool = False):
+        """Add one request to the tier's counters"""
+        prompt_tokens = (usage or {}).get("prompt_tokens", 0)
+        completion_tokens = (usage or {}).get("completion_tokens", 0)
+        input_cost, output_cost = tier["cost"]
+        with self._lock:
+            stats = self._stats[tier["name"]]
+            stats["requests"] += 1
+            stats["images"] += images
+            stats["failures"] += failed
+            stats["latency"] += time.monotonic() - started
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["cost_usd"] += (prompt_tokens * input_cost + completion_tokens * output_cost) / 1_000_000
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get hit rate, latency and cost per tier
+
+        Returns:
+            Dictionary of per-tier statistics keyed by tier name
+        """
+        with self._lock:
+            result = {}
+            for name, stats in self._stats.items():
+                result[name] = {
+                    "model": stats["model"],
+                    "requests": stats["requests"],
+                    "images": stats["images"],
+                    "accepted": stats["accepted"],
+                    "escalated": stats["escalated"],
+                    "failures": stats["failures"],
+                    "hit_rate": round(stats["accepted"] / stats["images"], 4) if stats["images"] else 0.0,
+                    "avg_latency_ms": (round(stats["latency"] / stats["requests"] * 1000, 1)
+                                       if stats["requests"] else 0.0),
+                    "prompt_tokens": stats["prompt_tokens"],
+                    "completion_tokens": stats["completion_tokens"],
+                    "cost_usd": round(stats["cost_usd"], 6),
+                    "cost_per_image_usd": (round(stats["cost_usd"] / stats["images"], 6)
+                                           if stats["images"] else 0.0),
+                }
+            return result
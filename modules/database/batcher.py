@@ -0,0 +1,222 @@
+"""
+Write-behind batching: many small inserts committed together in one transaction
+"""
+import itertools
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Sequence, Tuple
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.database.pool import ConnectionPool, PoolTimeoutError
+
+
+# Seconds the writer waits before retrying requeued statements
+RETRY_DELAY = 0.5
+
+# Attempts before a statement failing with an unexpected error is dropped
+MAX_ATTEMPTS = 5
+
+
+def _is_transient(error: Exception) -> bool:
+    """Whether a write failed only because the database or the pool was busy"""
+    if isinstance(error, PoolTimeoutError):
+        return True
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+class WriteBehindBatcher:
+    """
+    Queues write statements and commits them from a background thread
+
+    Callers return as soon as their statement is queued. The writer takes up
+    to max_batch statements at a time, runs consecutive statements with the
+    same SQL as one executemany and commits the whole batch in a single
+    transaction, so a burst of inserts costs one fsync instead of one each.
+    If a batch fails, its statements are retried one by one so a single bad
+    row does not lose the others. A statement that violates a constraint is
+    dropped; one that hit a locked database or a busy pool is put back at the
+    front of the queue and retried after RETRY_DELAY, as is one failing with
+    any other error, up to MAX_ATTEMPTS.
+    """
+
+    def __init__(self,
+                 pool: ConnectionPool,
+                 max_batch: Optional[int] = None,
+                 flush_interval: Optional[float] = None,
+                 max_pending: Optional[int] = None):
+        """
+        Initialize the batcher and start its writer thread
+
+        Args:
+            pool: Connection pool to write through
+            max_batch: Statements per transaction (defaults to DATABASE_BATCH_SIZE)
+            flush_interval: Seconds a statement may wait for more to arrive (defaults to DATABASE_FLUSH_INTERVAL)
+            max_pending: Queued statements before submit() blocks (defaults to DATABASE_MAX_PENDING)
+        """
+        self.logger = StructuredLogger(__name__)
+        self.pool = pool
+        self.max_batch = max_batch or config.DATABASE_BATCH_SIZE
+        self.flush_interval = config.DATABASE_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.max_pending = max(max_pending or config.DATABASE_MAX_PENDING, self.max_batch)
+
+        # (sql, params, failed attempts)
+        self._pending: Deque[Tuple[str, Sequence[Any], int]] = deque()
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._flushing = 0
+        self._stop = False
+        self._retry_at = 0.0
+        self._stats = {"submitted": 0, "written": 0, "batches": 0, "failed": 0, "requeued": 0, "write_time": 0.0}
+
+        self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, sql: str, params: Sequence[Any] = ()):
+        """
+        Queue a write statement
+
+        Blocks while max_pending statements are already queued.
+
+        Args:
+            sql: INSERT/UPDATE/DELETE statement
+            params: Statement parameters
+        """
+        with self._cond:
+            if self._stop:
+                raise RuntimeError("Write-behind batcher is stopped")
+            while len(self._pending) >= self.max_pending:
+                self._cond.wait()
+            self._pending.append((sql, params, 0))
+            self._stats["submitted"] += 1
+            self._cond.notify_all()
+
+    def pending(self) -> int:
+        """Number of statements not yet committed"""
+        with self._cond:
+            return len(self._pending) + self._in_flight
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued statement is committed
+
+        Args:
+            timeout: Seconds to wait (None waits indefinitely)
+
+        Returns:
+            True if everything was written
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                while self._pending or self._in_flight:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flushing -= 1
+        return True
+
+    def stop(self, timeout: float = 30.0):
+        """Write what is queued and stop the writer thread"""
+        self.flush(timeout)
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stop:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # Requeued statements wait a moment for the lock holder to finish
+                while time.monotonic() < self._retry_at:
+                    self._cond.wait(self._retry_at - time.monotonic())
+                # Give a burst a moment to fill the batch, unless someone is waiting on flush()
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < self.max_batch and not self._stop and not self._flushing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                count = min(len(self._pending), self.max_batch)
+                batch = [self._pending.popleft() for _ in range(count)]
+                self._in_flight = count
+                self._cond.notify_all()
+
+            self._write(batch)
+
+            with self._cond:
+                self._in_flight = 0
+                self._cond.notify_all()
+
+    def _write(self, batch):
+        started = time.monotonic()
+        try:
+            with self.pool.transaction() as conn:
+                for sql, group in itertools.groupby(batch, key=lambda statement: statement[0]):
+                    conn.executemany(sql, [params for _, params, _ in group])
+            written, failed, retry = len(batch), 0, []
+        except Exception as e:
+            self.logger.warning("Write batch failed, retrying statements one by one",
+                                statements=len(batch), error=str(e))
+            written, failed, retry = self._write_each(batch)
+
+        with self._cond:
+            if retry:
+                # Back at the front, in order, so later writes still land after them
+                self._pending.extendleft(reversed(retry))
+                self._retry_at = time.monotonic() + RETRY_DELAY
+            self._stats["written"] += written
+            self._stats["failed"] += failed
+            self._stats["requeued"] += len(retry)
+            self._stats["batches"] += 1
+            self._stats["write_time"] += time.monotonic() - started
+
+    def _write_each(self, batch) -> Tuple[int, int, list]:
+        """Write statements one at a time; returns written and dropped counts and statements to retry"""
+        written = failed = 0
+        for index, (sql, params, attempts) in enumerate(batch):
+            try:
+                with self.pool.transaction() as conn:
+                    conn.execute(sql, params)
+                written += 1
+            except Exception as e:
+                statement = sql.split("(")[0].strip()
+                if _is_transient(e):
+                    # The rest would wait for the same lock; retry them all later
+                    self.logger.warning("Database busy, requeueing writes",
+                                        statements=len(batch) - index, error=str(e))
+                    return written, failed, batch[index:]
+                if isinstance(e, sqlite3.IntegrityError) or attempts + 1 >= MAX_ATTEMPTS:
+                    failed += 1
+                    self.logger.error("Dropping failed write", sql=statement, attempts=attempts + 1, error=str(e))
+                    continue
+                self.logger.warning("Write failed, requeueing it", sql=statement, attempts=attempts + 1, error=str(e))
+                return written, failed, [(sql, params, attempts + 1)] + batch[index + 1:]
+        return written, failed, []
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get write counters
+
+        Returns:
+            Dictionary with submitted, written and failed statements, batches,
+            average batch size and pending statements
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending) + self._in_flight
+        batches = stats["batches"]
+        stats["avg_batch_size"] = round(stats["written"] / batches, 1) if batches else 0.0
+        stats["avg_batch_ms"] = round(stats.pop("write_time") / batches * 1000, 2) if batches else 0.0
+        return stats
@@ -0,0 +1,198 @@
+"""
+Thread-safe SQLite connection pool configured from DATABASE_URL
+"""
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.utils.sqlite import connect_sqlite
+
+
+class PoolTimeoutError(RuntimeError):
+    """Raised when no connection becomes free within the pool timeout"""
+
+
+def parse_database_url(url: Optional[str]) -> Dict[str, Any]:
+    """
+    Parse a DATABASE_URL
+
+    Supported forms are 'sqlite:///relative/path.sqlite3',
+    'sqlite:////absolute/path.sqlite3' and 'sqlite:///:memory:', with
+    optional pool_size, timeout (seconds to wait for a lock or a free
+    connection) and cached_statements query parameters. An empty URL uses
+    data/app.sqlite3.
+
+    Args:
+        url: Database URL
+
+    Returns:
+        Dict with path, pool_size, timeout and cached_statements
+
+    Raises:
+        ValueError: If the URL is not a SQLite URL
+    """
+    settings = {
+        "path": str(config.DATA_DIR / "app.sqlite3"),
+        "pool_size": config.DATABASE_POOL_SIZE,
+        "timeout": 30.0,
+        "cached_statements": 256,
+    }
+    if not url:
+        return settings
+
+    parts = urlsplit(url)
+    if parts.scheme != "sqlite":
+        raise ValueError(f"Unsupported DATABASE_URL scheme '{parts.scheme}' (only sqlite:/// is supported)")
+    # sqlite:///relative and sqlite:////absolute, as in SQLAlchemy
+    path = parts.path[1:] if parts.path.startswith("/") else parts.path
+    if path:
+        settings["path"] = path
+
+    params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+    if "pool_size" in params:
+        settings["pool_size"] = int(params["pool_size"])
+    if "timeout" in params:
+        settings["timeout"] = float(params["timeout"])
+    if "cached_statements" in params:
+        settings["cached_statements"] = int(params["cached_statements"])
+    return settings
+
+
+class ConnectionPool:
+    """
+    Bounded pool of WAL-mode SQLite connections
+
+    Connections are created on demand up to pool_size and reused, so their
+    prepared statement caches stay warm. Several processes (e.g. gunicorn
+    workers) can each hold a pool on the same file; WAL lets readers run
+    while one writer commits, and busy_timeout makes writers queue.
+    """
+
+    def __init__(self, url: Optional[str] = None, pool_size: Optional[int] = None):
+        """
+        Initialize the pool
+
+        Args:
+            url: Database URL (defaults to DATABASE_URL)
+            pool_size: Maximum connections (defaults to the URL's pool_size or DATABASE_POOL_SIZE)
+        """
+        self.logger = StructuredLogger(__name__)
+        settings = parse_database_url(config.DATABASE_URL if url is None else url)
+        self.path = settings["path"]
+        self.timeout = settings["timeout"]
+        self.cached_statements = settings["cached_statements"]
+        # Every connection to :memory: is a separate database
+        self.size = 1 if self.path == ":memory:" else max(1, pool_size or settings["pool_size"])
+
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._connections = []
+        self._waits = 0
+        self._closed = False
+
+    def _acquire(self) -> sqlite3.Connection:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._waits += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                raise PoolTimeoutError(f"No database connection free after {self.timeout}s")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            conn = connect_sqlite(self.path, timeout=self.timeout, cached_statements=self.cached_statements)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection (autocommit; use transaction() to group writes)
+
+        Raises:
+            PoolTimeoutError: If every connection stays busy for the timeout
+        """
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def dedicated_connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Open a connection outside the pool, closed when done
+
+        For long reads such as streamed exports, which would otherwise hold a
+        pooled connection for as long as a client takes to download. An
+        in-memory database exists only in the pooled connection, so that one
+        is borrowed instead.
+        """
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        if self.path == ":memory:":
+            with self.connection() as conn:
+                yield conn
+            return
+        conn = connect_sqlite(self.path, timeout=self.timeout)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection inside a write transaction that commits on success"""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        """Close every connection"""
+        self._closed = True
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get pool usage
+
+        Returns:
+            Dictionary with size, open and idle connections and waits for a free one
+        """
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": len(self._connections),
+                "idle": self._idle.qsize(),
+                "waits": self._waits,
+            }
@@ -0,0 +1,574 @@
+"""
+Repositories for upload history, receipt results and sales totals, commission rates,
+per-user state and naming rules
+
+The sales totals can be recomputed from the stored receipt results with:
+
+    python -m modules.database.repositories rebuild-sales
+"""
+import argparse
+import json
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from modules.utils.logger import StructuredLogger
+
+from modules.ai.sales_aggregation import to_yen
+from modules.database.batcher import WriteBehindBatcher
+from modules.database.pool import ConnectionPool
+
+
+SALES_GRAINS = ("day", "week", "month", "total")
+
+# Contractor value of the sales totals over all of a user's receipts
+ALL_CONTRACTORS = "*"
+
+TOTAL_PERIOD = "all"
+
+
+def period_keys(day: date) -> Dict[str, str]:
+    """
+    Period labels a date falls into
+
+    Args:
+        day: Sale date
+
+    Returns:
+        Period label per grain (ISO week for 'week')
+    """
+    year, week, _ = day.isocalendar()
+    return {
+        "day": day.isoformat(),
+        "week": f"{year}-W{week:02d}",
+        "month": day.strftime("%Y-%m"),
+        "total": TOTAL_PERIOD,
+    }
+
+
+def _sale_date(data: Dict[str, Any], received_at: datetime) -> date:
+    """Receipt date, or the day it was received when the date is unreadable"""
+    try:
+        return date.fromisoformat(str(data.get("date"))[:10])
+    except ValueError:
+        return received_at.date()
+
+
+def _empty_summary(grain: str, period: str) -> Dict[str, Any]:
+    return {"grain": grain, "period": period, "receipts": 0, "total_amount": 0,
+            "total_items": 0, "first_date": None, "last_date": None}
+
+
+class Repository:
+    """Base class: creates its tables and sends inserts through the batcher when one is given"""
+
+    SCHEMA = ""
+
+    def __init__(self, pool: ConnectionPool, batcher: Optional[WriteBehindBatcher] = None):
+        """
+        Initialize the repository
+
+        Args:
+            pool: Connection pool
+            batcher: Write-behind batcher for inserts (None writes immediately)
+        """
+        self.pool = pool
+        self.batcher = batcher
+        with pool.connection() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _write(self, sql: str, params: tuple):
+        if self.batcher is not None:
+            self.batcher.submit(sql, params)
+        else:
+            with self.pool.connection() as conn:
+                conn.execute(sql, params)
+
+    def _rows(self, sql: str, params: tuple) -> List[Dict[str, Any]]:
+        # Reads see this process's queued writes
+        if self.batcher is not None and self.batcher.pending():
+            self.batcher.flush()
+        with self.pool.connection() as conn:
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+    def _row(self, sql: str, params: tuple) -> Optional[Dict[str, Any]]:
+        rows = self._rows(sql, params)
+        return rows[0] if rows else None
+
+
+class UploadHistoryRepository(Repository):
+    """Files stored in OneDrive, per user"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS upload_history ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " user_id TEXT NOT NULL,"
+        " file_name TEXT NOT NULL,"
+        " folder_path TEXT,"
+        " item_id TEXT,"
+        " size INTEGER,"
+        " kind TEXT,"
+        " deduplicated INTEGER NOT NULL DEFAULT 0,"
+        " created_at REAL NOT NULL);"
+        "CREATE INDEX IF NOT EXISTS upload_history_user ON upload_history (user_id, created_at);"
+        "CREATE INDEX IF NOT EXISTS upload_history_created ON upload_history (created_at);"
+    )
+
+    def add(self, user_id: str, file_name: str, folder_path: Optional[str] = None,
+            item_id: Optional[str] = None, size: Optional[int] = None,
+            kind: Optional[str] = None, deduplicated: bool = False):
+        """Record an upload"""
+        self._write(
+            "INSERT INTO upload_history"
+            " (user_id, file_name, folder_path, item_id, size, kind, deduplicated, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, file_name, folder_path, item_id, size, kind, int(deduplicated), time.time())
+        )
+
+    def recent(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Get a user's latest uploads, newest first"""
+        return self._rows(
+            "SELECT * FROM upload_history WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+            (user_id, limit)
+        )
+
+
+class ReceiptResultRepository(Repository):
+    """Receipt analysis results, one per user and image"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS receipt_results ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " user_id TEXT NOT NULL,"
+        " sha256 TEXT NOT NULL,"
+        " status TEXT NOT NULL,"
+        " store_name TEXT,"
+        " receipt_date TEXT,"
+        " total_amount INTEGER,"
+        " confidence REAL,"
+        " tier TEXT,"
+        " data TEXT,"
+        " contractor TEXT,"
+        " sale_date TEXT,"
+        " items INTEGER,"
+        " created_at REAL NOT NULL,"
+        " UNIQUE (user_id, sha256));"
+        "CREATE INDEX IF NOT EXISTS receipt_results_date ON receipt_results (user_id, receipt_date);"
+        "CREATE INDEX IF NOT EXISTS receipt_results_all_dates ON receipt_results (receipt_date);"
+    )
+
+    def add(self, user_id: str, sha256: str, result: Dict[str, Any]):
+        """
+        Record an analysis result, replacing an earlier one for the same image
+
+        Args:
+            user_id: LINE user ID
+            sha256: Image content hash
+            result: Analysis result
+        """
+        data = result.get("extracted_data") or {}
+        self._write(
+            "INSERT OR REPLACE INTO receipt_results"
+            " (user_id, sha256, status, store_name, receipt_date, total_amount, confidence, tier, data, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, sha256, result.get("status", "error"), data.get("store_name"), data.get("date"),
+             to_yen(data.get("total_amount")), result.get("confidence"), result.get("tier"),
+             json.dumps(data, ensure_ascii=False), time.time())
+        )
+
+    def get(self, user_id: str, sha256: str) -> Optional[Dict[str, Any]]:
+        """Get the result for an image"""
+        row = self._row("SELECT * FROM receipt_results WHERE user_id = ? AND sha256 = ?", (user_id, sha256))
+        if row is not None:
+            row["data"] = json.loads(row["data"] or "{}")
+        return row
+
+    def between(self, user_id: str, start: str, end: str) -> List[Dict[str, Any]]:
+        """Get a user's receipts dated from start to end (YYYY-MM-DD, inclusive)"""
+        return self._rows(
+            "SELECT user_id, sha256, status, store_name, receipt_date, total_amount, confidence, tier"
+            " FROM receipt_results WHERE user_id = ? AND receipt_date BETWEEN ? AND ? ORDER BY receipt_date",
+            (user_id, start, end)
+        )
+
+
+class SalesLedgerRepository(Repository):
+    """
+    Running sales totals per user (and per contractor) for each day, ISO week, month and all time
+
+    A successful receipt is stored in receipt_results (with its contractor,
+    sale date and item count) and added to the totals in the same
+    transaction, so status replies and weekly reports are primary-key reads
+    however long the history is. Each image is counted once.
+    """
+
+    SCHEMA = ReceiptResultRepository.SCHEMA + (
+        "CREATE TABLE IF NOT EXISTS sales_aggregates ("
+        " user_id TEXT NOT NULL,"
+        " contractor TEXT NOT NULL,"
+        " grain TEXT NOT NULL,"
+        " period TEXT NOT NULL,"
+        " receipts INTEGER NOT NULL,"
+        " total_amount INTEGER NOT NULL,"
+        " total_items INTEGER NOT NULL,"
+        " first_date TEXT NOT NULL,"
+        " last_date TEXT NOT NULL,"
+        " PRIMARY KEY (user_id, contractor, grain, period));"
+    )
+
+    UPSERT = (
+        "INSERT INTO sales_aggregates"
+        " (user_id, contractor, grain, period, receipts, total_amount, total_items, first_date, last_date)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        " ON CONFLICT (user_id, contractor, grain, period) DO UPDATE SET"
+        " receipts = receipts + excluded.receipts,"
+        " total_amount = total_amount + excluded.total_amount,"
+        " total_items = total_items + excluded.total_items,"
+        " first_date = MIN(first_date, excluded.first_date),"
+        " last_date = MAX(last_date, excluded.last_date)"
+    )
+
+    def __init__(self, pool: ConnectionPool, batcher: Optional[WriteBehindBatcher] = None):
+        super().__init__(pool, batcher)
+        self.logger = StructuredLogger(__name__)
+
+    def record(self, user_id: str, sha256: str, result: Dict[str, Any],
+               contractor: Optional[str] = None,
+               received_at: Optional[datetime] = None) -> bool:
+        """
+        Store a successful receipt analysis and add it to the totals; written immediately
+
+        Args:
+            user_id: LINE user ID that sent the receipt
+            sha256: Image content hash, so the receipt is counted once
+            result: Analysis result (status, extracted_data)
+            contractor: Contractor the receipt is billed to, if known
+            received_at: When the receipt was received (defaults to now)
+
+        Returns:
+            True if the receipt was added, False if it failed or was already counted
+        """
+        if not result or result.get("status") != "success":
+            return False
+        data = result.get("extracted_data") or {}
+        periods = period_keys(_sale_date(data, received_at or datetime.now()))
+        amount = to_yen(data.get("total_amount"))
+        items = len(data.get("items") or [])
+
+        # Queued results for the same image must not land after this one
+        if self.batcher is not None and self.batcher.pending():
+            self.batcher.flush()
+        with self.pool.transaction() as conn:
+            counted = conn.execute(
+                "SELECT 1 FROM receipt_results WHERE user_id = ? AND sha256 = ? AND sale_date IS NOT NULL",
+                (user_id, sha256)
+            ).fetchone()
+            if counted:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO receipt_results"
+                " (user_id, sha256, status, store_name, receipt_date, total_amount, confidence, tier, data,"
+                "  contractor, sale_date, items, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, sha256, "success", data.get("store_name"), data.get("date"), amount,
+                 result.get("confidence"), result.get("tier"), json.dumps(data, ensure_ascii=False),
+                 contractor, periods["day"], items, time.time())
+            )
+            scopes = [ALL_CONTRACTORS] if contractor is None else [ALL_CONTRACTORS, contractor]
+            conn.executemany(
+                self.UPSERT,
+                [(user_id, scope, grain, periods[grain], 1, amount, items, periods["day"], periods["day"])
+                 for scope in scopes for grain in SALES_GRAINS]
+            )
+        return True
+
+    def summary(self, user_id: str, grain: str = "month", period: Optional[str] = None,
+                contractor: str = ALL_CONTRACTORS) -> Dict[str, Any]:
+        """
+        Get the totals of one period
+
+        Args:
+            user_id: LINE user ID
+            grain: 'day', 'week', 'month' or 'total'
+            period: Period label (defaults to the current one)
+            contractor: Contractor, or ALL_CONTRACTORS for all of the user's receipts
+
+        Returns:
+            Dict with grain, period, receipts, total_amount, total_items, first_date and last_date
+        """
+        if period is None:
+            period = period_keys(date.today())[grain]
+        row = self._row(
+            "SELECT grain, period, receipts, total_amount, total_items, first_date, last_date"
+            " FROM sales_aggregates WHERE user_id = ? AND contractor = ? AND grain = ? AND period = ?",
+            (user_id, contractor, grain, period)
+        )
+        return row if row is not None else _empty_summary(grain, period)
+
+    def status(self, user_id: str, today: Optional[date] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Get today's, this week's, this month's and all-time totals
+
+        Args:
+            user_id: LINE user ID
+            today: Reference date (defaults to today)
+
+        Returns:
+            Summary per grain
+        """
+        periods = period_keys(today or date.today())
+        return {grain: self.summary(user_id, grain, periods[grain]) for grain in SALES_GRAINS}
+
+    def contractor_summaries(self, user_id: str, grain: str = "week",
+                             period: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Get the totals of one period per contractor, e.g. for a weekly report
+
+        Args:
+            user_id: LINE user ID
+            grain: 'day', 'week', 'month' or 'total'
+            period: Period label (defaults to the current one)
+
+        Returns:
+            Summaries with a contractor key, largest total first
+        """
+        if period is None:
+            period = period_keys(date.today())[grain]
+        return self._rows(
+            "SELECT contractor, grain, period, receipts, total_amount, total_items, first_date, last_date"
+            " FROM sales_aggregates WHERE user_id = ? AND grain = ? AND period = ? AND contractor != ?"
+            " ORDER BY total_amount DESC",
+            (user_id, grain, period, ALL_CONTRACTORS)
+        )
+
+    def rebuild(self) -> int:
+        """
+        Recompute every total from the counted receipt results
+
+        Returns:
+            Number of aggregate rows written
+        """
+        started = time.monotonic()
+        if self.batcher is not None and self.batcher.pending():
+            self.batcher.flush()
+        with self.pool.transaction() as conn:
+            conn.execute("DELETE FROM sales_aggregates")
+            receipts = conn.execute(
+                "SELECT user_id, contractor, sale_date, total_amount, items FROM receipt_results"
+                " WHERE sale_date IS NOT NULL"
+            )
+            for user_id, contractor, sale_date, amount, items in receipts.fetchall():
+                periods = period_keys(date.fromisoformat(sale_date))
+                scopes = [ALL_CONTRACTORS] if contractor is None else [ALL_CONTRACTORS, contractor]
+                conn.executemany(
+                    self.UPSERT,
+                    [(user_id, scope, grain, periods[grain], 1, amount, items, sale_date, sale_date)
+                     for scope in scopes for grain in SALES_GRAINS]
+                )
+            rows = conn.execute("SELECT COUNT(*) FROM sales_aggregates").fetchone()[0]
+        self.logger.info("Sales aggregates rebuilt",
+                         rows=rows, duration_ms=round((time.monotonic() - started) * 1000, 1))
+        return rows
+
+
+class CommissionRateRepository(Repository):
+    """Commission rate per contractor, kept as exact decimal strings"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS commission_rates ("
+        " contractor TEXT PRIMARY KEY,"
+        " rate TEXT NOT NULL,"
+        " updated_at REAL NOT NULL);"
+    )
+
+    def set(self, contractor: str, rate: Any):
+        """
+        Set a contractor's rate (e.g. '0.3'); written immediately
+
+        Raises:
+            ValueError: If the rate is not between 0 and 1
+        """
+        value = Decimal(str(rate))
+        if not Decimal(0) <= value <= Decimal(1):
+            raise ValueError(f"Commission rate must be between 0 and 1, got {rate}")
+        with self.pool.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO commission_rates (contractor, rate, updated_at) VALUES (?, ?, ?)",
+                (contractor, str(value), time.time())
+            )
+
+    def get(self, contractor: str, default: Optional[Decimal] = None) -> Optional[Decimal]:
+        """Get a contractor's rate"""
+        row = self._row("SELECT rate FROM commission_rates WHERE contractor = ?", (contractor,))
+        return Decimal(row["rate"]) if row else default
+
+    def all(self) -> Dict[str, Decimal]:
+        """Get every contractor's rate, e.g. for aggregate_sales"""
+        return {row["contractor"]: Decimal(row["rate"])
+                for row in self._rows("SELECT contractor, rate FROM commission_rates", ())}
+
+
+class UserStateRepository(Repository):
+    """Small JSON values per user and key (conversation state, preferences)"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS user_state ("
+        " user_id TEXT NOT NULL,"
+        " key TEXT NOT NULL,"
+        " value TEXT NOT NULL,"
+        " updated_at REAL NOT NULL,"
+        " PRIMARY KEY (user_id, key));"
+    )
+
+    def set(self, user_id: str, key: str, value: Any):
+        """Store a JSON-serializable value"""
+        self._write(
+            "INSERT OR REPLACE INTO user_state (user_id, key, value, updated_at) VALUES (?, ?, ?, ?)",
+            (user_id, key, json.dumps(value, ensure_ascii=False), time.time())
+        )
+
+    def get(self, user_id: str, key: str, default: Any = None) -> Any:
+        """Get a value"""
+        row = self._row("SELECT value FROM user_state WHERE user_id = ? AND key = ?", (user_id, key))
+        return json.loads(row["value"]) if row else default
+
+    def delete(self, user_id: str, key: str):
+        """Remove a value"""
+        self._write("DELETE FROM user_state WHERE user_id = ? AND key = ?", (user_id, key))
+
+    def all_for(self, user_id: str) -> Dict[str, Any]:
+        """Get all of a user's values"""
+        return {row["key"]: json.loads(row["value"])
+                for row in self._rows("SELECT key, value FROM user_state WHERE user_id = ?", (user_id,))}
+
+
+class NamingRuleRepository(Repository):
+    """
+    Naming rules edited by admins, with a version stamp and sequence counters
+
+    Every change bumps the version in the same transaction, so processes
+    holding compiled rules only need to compare one integer to notice edits.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS naming_rules ("
+        " name TEXT PRIMARY KEY,"
+        " priority INTEGER NOT NULL DEFAULT 100,"
+        " kind TEXT,"
+        " extensions TEXT,"
+        " folder_template TEXT NOT NULL,"
+        " file_template TEXT NOT NULL,"
+        " enabled INTEGER NOT NULL DEFAULT 1,"
+        " updated_at REAL NOT NULL);"
+        "CREATE TABLE IF NOT EXISTS naming_rules_version ("
+        " id INTEGER PRIMARY KEY CHECK (id = 1),"
+        " version INTEGER NOT NULL);"
+        "INSERT OR IGNORE INTO naming_rules_version (id, version) VALUES (1, 0);"
+        "CREATE TABLE IF NOT EXISTS naming_sequences ("
+        " rule TEXT NOT NULL,"
+        " scope TEXT NOT NULL,"
+        " value INTEGER NOT NULL,"
+        " PRIMARY KEY (rule, scope));"
+    )
+
+    RULE_FIELDS = ("name", "priority", "kind", "extensions", "folder_template", "file_template", "enabled")
+
+    def save(self, rule: Dict[str, Any]) -> int:
+        """
+        Insert or replace a rule; written immediately
+
+        Args:
+            rule: Dict with name, folder_template, file_template and optional
+                  priority, kind, extensions (comma-separated) and enabled
+
+        Returns:
+            New version stamp
+        """
+        values = (rule["name"], int(rule.get("priority", 100)), rule.get("kind") or None,
+                  rule.get("extensions") or None, rule["folder_template"], rule["file_template"],
+                  int(bool(rule.get("enabled", True))), time.time())
+        with self.pool.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO naming_rules"
+                " (name, priority, kind, extensions, folder_template, file_template, enabled, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                values
+            )
+            return self._bump(conn)
+
+    def delete(self, name: str) -> int:
+        """Remove a rule; returns the new version stamp"""
+        with self.pool.transaction() as conn:
+            conn.execute("DELETE FROM naming_rules WHERE name = ?", (name,))
+            return self._bump(conn)
+
+    def _bump(self, conn) -> int:
+        conn.execute("UPDATE naming_rules_version SET version = version + 1 WHERE id = 1")
+        return conn.execute("SELECT version FROM naming_rules_version WHERE id = 1").fetchone()[0]
+
+    def version(self) -> int:
+        """Get the current version stamp"""
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT version FROM naming_rules_version WHERE id = 1").fetchone()[0]
+
+    def load(self) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Get the version stamp and every rule, read consistently
+
+        Returns:
+            Version and rules ordered by priority, then name
+        """
+        with self.pool.connection() as conn:
+            # A read transaction, so the rules match the version
+            conn.execute("BEGIN")
+            try:
+                version = conn.execute("SELECT version FROM naming_rules_version WHERE id = 1").fetchone()[0]
+                rows = conn.execute(
+                    f"SELECT {', '.join(self.RULE_FIELDS)} FROM naming_rules ORDER BY priority, name"
+                ).fetchall()
+            finally:
+                conn.execute("COMMIT")
+        return version, [dict(row) for row in rows]
+
+    def next_sequence(self, rule: str, scope: str) -> int:
+        """
+        Take the next number of a sequence (starting at 1)
+
+        A single upsert statement, so numbers are unique across threads and
+        processes sharing the database.
+
+        Args:
+            rule: Rule name
+            scope: Sequence scope, e.g. the name being numbered
+
+        Returns:
+            Sequence number
+        """
+        with self.pool.connection() as conn:
+            return conn.execute(
+                "INSERT INTO naming_sequences (rule, scope, value) VALUES (?, ?, 1)"
+                " ON CONFLICT (rule, scope) DO UPDATE SET value = value + 1 RETURNING value",
+                (rule, scope)
+            ).fetchall()[0][0]
+
+
+def main(argv: Optional[List[str]] = None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    parser.add_argument("command", choices=["rebuild-sales"],
+                        help="rebuild-sales: recompute the sales totals from the receipt results")
+    parser.add_argument("--url", default=None, help="Database URL (defaults to DATABASE_URL)")
+    args = parser.parse_args(argv)
+
+    if args.command == "rebuild-sales":
+        pool = ConnectionPool(args.url)
+        try:
+            rows = SalesLedgerRepository(pool).rebuild()
+        finally:
+            pool.close()
+        print(f"Rebuilt {rows} sales aggregate rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Full-text search over stored files and receipts (SQLite FTS5 with character bigrams)
+"""
+import json
+import re
+import time
+import unicodedata
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from modules.ai.sales_aggregation import to_yen
+from modules.database.repositories import Repository
+
+
+KINDS = ("file", "receipt")
+
+# Relative periods a structured query may use; resolved against today's date when searching
+PERIODS = ("today", "yesterday", "this_week", "last_week", "this_month", "last_month", "this_year", "last_year")
+
+# Runs of CJK characters (kanji, kana, full-width forms) versus everything else
+CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿ｦ-ﾟ]+")
+WORD_RE = re.compile(r"\w+")
+
+
+def ngram_runs(text: Optional[str], run_ends: bool = False) -> List[List[str]]:
+    """
+    Split text into search tokens, grouped by run
+
+    Japanese has no spaces between words, so CJK runs become overlapping
+    character bigrams ('新宿店' -> '新宿', '宿店'); other text is split into
+    words, one group each. Any substring of two or more characters of an
+    indexed CJK run is then a phrase of consecutive bigrams.
+
+    Args:
+        text: Text to tokenize
+        run_ends: Also emit the last character of each CJK run, so a single
+                  character matches as a prefix query wherever it appears
+                  ('緑茶' -> '緑茶', '茶'); used when indexing, not for queries
+
+    Returns:
+        Token groups in order
+    """
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    runs = []
+    position = 0
+    for match in CJK_RE.finditer(text):
+        runs.extend([word] for word in WORD_RE.findall(text[position:match.start()]))
+        run = match.group()
+        tokens = [run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)]
+        if run_ends and len(run) > 1:
+            tokens.append(run[-1])
+        runs.append(tokens)
+        position = match.end()
+    runs.extend([word] for word in WORD_RE.findall(text[position:]))
+    return runs
+
+
+def ngram_tokens(text: Optional[str], run_ends: bool = False) -> List[str]:
+    """
+    Split text into search tokens (see ngram_runs)
+
+    Args:
+        text: Text to tokenize
+        run_ends: Also emit the last character of each CJK run
+
+    Returns:
+        Tokens in order
+    """
+    return [token for run in ngram_runs(text, run_ends) for token in run]
+
+
+def match_expression(keywords: List[str]) -> Optional[str]:
+    """
+    Build an FTS5 MATCH expression requiring every keyword
+
+    Each run of a keyword is its own phrase ('ローソン100' -> "ロー ーソ ソン"
+    AND "100"): the index has a run-end token after every CJK run, so a
+    phrase spanning two runs would never match.
+
+    Args:
+        keywords: Search terms
+
+    Returns:
+        MATCH expression, or None if no keyword has searchable text
+    """
+    phrases = []
+    for keyword in keywords:
+        for tokens in ngram_runs(keyword):
+            phrase = '"' + " ".join(token.replace('"', '""') for token in tokens) + '"'
+            # A single CJK character is the start of a bigram or the indexed end of a run
+            if len(tokens) == 1 and len(tokens[0]) == 1:
+                phrase += "*"
+            phrases.append(phrase)
+    return " AND ".join(phrases) if phrases else None
+
+
+def _indexed(text: Optional[str]) -> str:
+    return " ".join(ngram_tokens(text, run_ends=True))
+
+
+def resolve_period(period: Optional[str], today: Optional[date] = None) -> Tuple[Optional[date], Optional[date]]:
+    """
+    Turn a relative period into a date range
+
+    Args:
+        period: One of PERIODS
+        today: Reference date (defaults to today)
+
+    Returns:
+        First and last date (inclusive), or (None, None) for an unknown period
+    """
+    today = today or date.today()
+    if period == "today":
+        return today, today
+    if period == "yesterday":
+        yesterday = today - timedelta(days=1)
+        return yesterday, yesterday
+    if period in ("this_week", "last_week"):
+        monday = today - timedelta(days=today.weekday())
+        if period == "last_week":
+            monday -= timedelta(days=7)
+        return monday, monday + timedelta(days=6)
+    if period in ("this_month", "last_month"):
+        first = today.replace(day=1)
+        if period == "last_month":
+            first = (first - timedelta(days=1)).replace(day=1)
+        next_month = (first + timedelta(days=32)).replace(day=1)
+        return first, next_month - timedelta(days=1)
+    if period in ("this_year", "last_year"):
+        year = today.year - (period == "last_year")
+        return date(year, 1, 1), date(year, 12, 31)
+    return None, None
+
+
+class SearchIndex(Repository):
+    """
+    Searchable documents for files and receipts
+
+    Each document keeps its plain fields in search_documents and its
+    bigram-tokenized text (file name, folder path, store name and line items)
+    in the search_fts FTS5 table, joined on the document id.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS search_documents ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " kind TEXT NOT NULL,"
+        " ref TEXT NOT NULL,"
+        " user_id TEXT NOT NULL,"
+        " title TEXT,"
+        " folder_path TEXT,"
+        " store_name TEXT,"
+        " items TEXT,"
+        " doc_date TEXT,"
+        " amount INTEGER,"
+        " created_at REAL NOT NULL,"
+        " UNIQUE (kind, ref));"
+        "CREATE INDEX IF NOT EXISTS search_documents_user ON search_documents (user_id, doc_date);"
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+        " title, folder_path, store_name, items, tokenize='unicode61 remove_diacritics 0');"
+    )
+
+    def _index(self, kind: str, ref: str, user_id: str, title: Optional[str], folder_path: Optional[str],
+               store_name: Optional[str], items: List[str], doc_date: Optional[str], amount: Optional[int]):
+        """Insert or replace a document; three statements so they can go through the batcher"""
+        select_id = "(SELECT id FROM search_documents WHERE kind = ? AND ref = ?)"
+        self._write(f"DELETE FROM search_fts WHERE rowid = {select_id}", (kind, ref))
+        self._write(
+            "INSERT INTO search_documents"
+            " (kind, ref, user_id, title, folder_path, store_name, items, doc_date, amount, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (kind, ref) DO UPDATE SET user_id = excluded.user_id, title = excluded.title,"
+            " folder_path = excluded.folder_path, store_name = excluded.store_name, items = excluded.items,"
+            " doc_date = excluded.doc_date, amount = excluded.amount",
+            (kind, ref, user_id, title, folder_path, store_name, json.dumps(items, ensure_ascii=False),
+             doc_date, amount, time.time())
+        )
+        self._write(
+            "INSERT INTO search_fts (rowid, title, folder_path, store_name, items)"
+            " SELECT id, ?, ?, ?, ? FROM search_documents WHERE kind = ? AND ref = ?",
+            (_indexed(title), _indexed(folder_path), _indexed(store_name),
+             " ".join(_indexed(item) for item in items), kind, ref)
+        )
+
+    def index_file(self, user_id: str, ref: str, file_name: str, folder_path: Optional[str] = None,
+                   uploaded_at: Optional[float] = None):
+        """
+        Add or update a stored file
+
+        Args:
+            user_id: LINE user ID
+            ref: OneDrive item ID (or another unique reference)
+            file_name: File name
+            folder_path: Folder the file is in
+            uploaded_at: Upload time (defaults to now)
+        """
+        doc_date = date.fromtimestamp(uploaded_at or time.time()).isoformat()
+        self._index("file", ref, user_id, file_name, folder_path, None, [], doc_date, None)
+
+    def index_receipt(self, user_id: str, ref: str, result: Dict[str, Any], file_name: Optional[str] = None):
+        """
+        Add or update an analyzed receipt
+
+        Args:
+            user_id: LINE user ID
+            ref: Image content hash
+            result: Receipt analysis result
+            file_name: Name of the stored image, if known
+        """
+        data = result.get("extracted_data") or {}
+        items = [str(item.get("name")) for item in data.get("items") or [] if item.get("name")]
+        doc_date = str(data.get("date"))[:10] if data.get("date") else None
+        self._index("receipt", ref, user_id, file_name, None, data.get("store_name"), items,
+                    doc_date, to_yen(data.get("total_amount")))
+
+    def search(self, user_id: Optional[str], query: Dict[str, Any],
+               today: Optional[date] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Find documents matching a structured query
+
+        Args:
+            user_id: Only this user's documents (None searches everyone's)
+            query: Dict with optional kind ('file'/'receipt'), keywords, period
+                   (one of PERIODS), date_from, date_to (YYYY-MM-DD), amount_min and amount_max
+            today: Reference date for relative periods
+            limit: Maximum results
+
+        Returns:
+            Documents, best matches first (newest first without keywords)
+        """
+        conditions, params = [], []
+        match = match_expression([str(k) for k in query.get("keywords") or [] if k])
+        if match:
+            conditions.append("search_fts MATCH ?")
+            params.append(match)
+        if user_id is not None:
+            conditions.append("d.user_id = ?")
+            params.append(user_id)
+        if query.get("kind") in KINDS:
+            conditions.append("d.kind = ?")
+            params.append(query["kind"])
+
+        start, end = resolve_period(query.get("period"), today)
+        start = query.get("date_from") or (start.isoformat() if start else None)
+        end = query.get("date_to") or (end.isoformat() if end else None)
+        if start:
+            conditions.append("d.doc_date >= ?")
+            params.append(str(start))
+        if end:
+            conditions.append("d.doc_date <= ?")
+            params.append(str(end))
+        if query.get("amount_min") is not None:
+            conditions.append("d.amount >= ?")
+            params.append(to_yen(query["amount_min"]))
+        if query.get("amount_max") is not None:
+            conditions.append("d.amount <= ?")
+            params.append(to_yen(query["amount_max"]))
+
+        if match:
+            sql = "SELECT d.* FROM search_fts JOIN search_documents d ON d.id = search_fts.rowid"
+            order = "search_fts.rank, d.doc_date DESC"
+        else:
+            sql = "SELECT d.* FROM search_documents d"
+            order = "d.doc_date DESC, d.id DESC"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY {order} LIMIT ?"
+        params.append(limit)
+
+        rows = self._rows(sql, tuple(params))
+        for row in rows:
+            row["items"] = json.loads(row["items"] or "[]")
+        return rows
@@ -0,0 +1,318 @@
+"""
+Streaming CSV export of upload and receipt history for the LIFF admin screen
+"""
+import codecs
+import csv
+import hmac
+import io
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    from flask import Blueprint, Response, abort, request
+    FLASK_AVAILABLE = True
+except ImportError:
+    FLASK_AVAILABLE = False
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.database.pool import ConnectionPool
+
+
+# Columns per export: (SQL expression, CSV header)
+EXPORTS: Dict[str, Dict[str, Any]] = {
+    "uploads": {
+        "table": "upload_history",
+        "columns": [
+            ("created_at", "日時"),
+            ("user_id", "ユーザーID"),
+            ("folder_path", "フォルダ"),
+            ("file_name", "ファイル名"),
+            ("size", "サイズ"),
+            ("kind", "種別"),
+            ("deduplicated", "重複"),
+            ("item_id", "OneDrive ID"),
+        ],
+        # Uploads are filtered on their epoch timestamp
+        "date_column": "created_at",
+        "epoch_dates": True,
+        "folder_column": "folder_path",
+    },
+    "receipts": {
+        "table": "receipt_results",
+        "columns": [
+            ("receipt_date", "日付"),
+            ("user_id", "ユーザーID"),
+            ("store_name", "店舗名"),
+            ("total_amount", "金額"),
+            ("status", "状態"),
+            ("confidence", "信頼度"),
+            ("tier", "モデル"),
+            ("sha256", "画像ハッシュ"),
+        ],
+        "date_column": "receipt_date",
+        "epoch_dates": False,
+        "folder_column": None,
+    },
+}
+
+# Leading characters that make Excel evaluate a cell as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def build_export_query(kind: str,
+                       user_id: Optional[str] = None,
+                       start: Optional[date] = None,
+                       end: Optional[date] = None,
+                       folder: Optional[str] = None) -> Tuple[str, List[Any]]:
+    """
+    Build the SELECT for an export
+
+    Args:
+        kind: 'uploads' or 'receipts'
+        user_id: Only this user's rows
+        start: First date (inclusive)
+        end: Last date (inclusive)
+        folder: Only this folder and its subfolders (uploads only)
+
+    Returns:
+        SQL and parameters
+
+    Raises:
+        ValueError: If the export or a filter is not supported
+    """
+    export = EXPORTS.get(kind)
+    if export is None:
+        raise ValueError(f"Unknown export '{kind}'")
+
+    conditions, params = [], []
+    if user_id:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    date_column = export["date_column"]
+    if start:
+        conditions.append(f"{date_column} >= ?")
+        params.append(_date_bound(start, export["epoch_dates"]))
+    if end:
+        conditions.append(f"{date_column} < ?")
+        params.append(_date_bound(end + timedelta(days=1), export["epoch_dates"]))
+    if folder:
+        if not export["folder_column"]:
+            raise ValueError(f"The {kind} export cannot be filtered by folder")
+        folder = folder.strip("/")
+        conditions.append(f"({export['folder_column']} = ? OR {export['folder_column']} LIKE ? ESCAPE '\\')")
+        escaped = folder.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params.extend([folder, f"{escaped}/%"])
+
+    columns = ", ".join(column for column, _ in export["columns"])
+    sql = f"SELECT {columns} FROM {export['table']}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" ORDER BY {date_column}, id"
+    return sql, params
+
+
+def _date_bound(day: date, epoch: bool) -> Any:
+    return datetime(day.year, day.month, day.day).timestamp() if epoch else day.isoformat()
+
+
+def stream_rows(pool: ConnectionPool, sql: str, params: Sequence[Any],
+                fetch_size: Optional[int] = None) -> Iterator[Tuple[Any, ...]]:
+    """
+    Iterate over query results a page at a time
+
+    SQLite steps the statement as rows are fetched, so only fetch_size rows
+    are in memory. The query runs on a connection of its own, opened outside
+    the pool and held until the iterator is exhausted or closed, so slow
+    downloads do not take connections from request handlers and the writer.
+
+    Args:
+        pool: Connection pool of the database to read
+        sql: SELECT statement
+        params: Parameters
+        fetch_size: Rows fetched per step (defaults to EXPORT_FETCH_SIZE)
+
+    Yields:
+        Result rows
+    """
+    fetch_size = fetch_size or config.EXPORT_FETCH_SIZE
+    with pool.dedicated_connection() as conn:
+        cursor = conn.execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+
+def _cell(value: Any) -> Any:
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_csv(rows: Iterable[Sequence[Any]], header: Sequence[str],
+             formatters: Optional[Dict[int, Any]] = None,
+             chunk_size: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Encode rows as UTF-8 CSV with a BOM, in chunks of about chunk_size bytes
+
+    Args:
+        rows: Rows to write
+        header: Column names
+        formatters: Functions applied to the values of some columns, by index
+        chunk_size: Characters buffered before a chunk is yielded (defaults to EXPORT_CHUNK_SIZE)
+
+    Yields:
+        Encoded CSV data; the first chunk starts with the BOM Excel needs to read UTF-8
+    """
+    chunk_size = chunk_size or config.EXPORT_CHUNK_SIZE
+    formatters = formatters or {}
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\r\n")
+    writer.writerow(header)
+    prefix = codecs.BOM_UTF8
+
+    for row in rows:
+        values = [_cell(formatters[i](v) if i in formatters and v is not None else v) for i, v in enumerate(row)]
+        writer.writerow(values)
+        if buffer.tell() >= chunk_size:
+            yield prefix + buffer.getvalue().encode("utf-8")
+            prefix = b""
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield prefix + buffer.getvalue().encode("utf-8")
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """
+    Compress a byte stream into a gzip stream
+
+    Args:
+        chunks: Uncompressed data
+        level: Compression level
+
+    Yields:
+        gzip data
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _format_timestamp(value: float) -> str:
+    return datetime.fromtimestamp(value).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def export_csv(pool: ConnectionPool, kind: str, gzip: bool = False, **filters) -> Iterator[bytes]:
+    """
+    Stream an export as CSV (optionally gzip-compressed)
+
+    Args:
+        pool: Connection pool
+        kind: 'uploads' or 'receipts'
+        gzip: Compress the output
+        **filters: user_id, start, end and folder, as for build_export_query
+
+    Returns:
+        Iterator of encoded chunks
+
+    Raises:
+        ValueError: If the export or a filter is not supported
+    """
+    sql, params = build_export_query(kind, **filters)
+    export = EXPORTS[kind]
+    header = [name for _, name in export["columns"]]
+    formatters = {}
+    if export["epoch_dates"]:
+        formatters[0] = _format_timestamp
+    chunks = iter_csv(stream_rows(pool, sql, params), header, formatters)
+    return gzip_chunks(chunks) if gzip else chunks
+
+
+def _parse_date(value: Optional[str]) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid date '{value}' (expected YYYY-MM-DD)")
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    """
+    Check the request's 'Authorization: Bearer <token>' header
+
+    Args:
+        token: Expected token; empty rejects every request
+
+    Returns:
+        True if the header carries the token
+    """
+    supplied = request.headers.get("Authorization", "")
+    return bool(token) and hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {token}".encode("utf-8"))
+
+
+def create_export_blueprint(pool: ConnectionPool, token: Optional[str] = None):
+    """
+    Create the Flask blueprint with the export endpoints
+
+    GET /liff/export/uploads.csv and /liff/export/receipts.csv accept the
+    query parameters user_id, start, end (YYYY-MM-DD), folder (uploads only)
+    and gzip=1, and require 'Authorization: Bearer <EXPORT_API_TOKEN>'.
+
+    Args:
+        pool: Connection pool with the history tables
+        token: Bearer token (defaults to EXPORT_API_TOKEN; empty disables the endpoints)
+
+    Returns:
+        Blueprint, or None if Flask is not available
+    """
+    if not FLASK_AVAILABLE:
+        return None
+
+    logger = StructuredLogger(__name__)
+    token = config.EXPORT_API_TOKEN if token is None else token
+    blueprint = Blueprint("liff_export", __name__, url_prefix="/liff/export")
+
+    @blueprint.route("/<kind>.csv", methods=["GET"])
+    def export(kind: str):
+        """Stream an export as CSV"""
+        if not is_authorized(token):
+            abort(403)
+        if kind not in EXPORTS:
+            abort(404)
+
+        compress = request.args.get("gzip", "").lower() in ("1", "true")
+        try:
+            filters = {
+                "user_id": request.args.get("user_id") or None,
+                "start": _parse_date(request.args.get("start")),
+                "end": _parse_date(request.args.get("end")),
+                "folder": request.args.get("folder") or None,
+            }
+            chunks = export_csv(pool, kind, gzip=compress, **filters)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        logger.info("CSV export started", kind=kind, gzip=compress,
+                    **{key: str(value) for key, value in filters.items() if value})
+        file_name = f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        headers = {"X-Accel-Buffering": "no"}
+        if compress:
+            file_name += ".gz"
+            mimetype = "application/gzip"
+        else:
+            mimetype = "text/csv; charset=utf-8"
+        headers["Content-Disposition"] = f'attachment; filename="{file_name}"'
+        return Response(chunks, mimetype=mimetype, headers=headers, direct_passthrough=True)
+
+    return blueprint
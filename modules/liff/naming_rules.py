@@ -0,0 +1,80 @@
+"""
+Naming rule editing endpoints for the LIFF admin screen
+"""
+from typing import Optional
+
+try:
+    from flask import Blueprint, abort, request
+    FLASK_AVAILABLE = True
+except ImportError:
+    FLASK_AVAILABLE = False
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.database.repositories import NamingRuleRepository
+from modules.liff.export import is_authorized
+from modules.onedrive.naming import FIELDS, compile_rule
+
+
+def create_naming_rules_blueprint(repository: NamingRuleRepository, token: Optional[str] = None):
+    """
+    Create the Flask blueprint for editing naming rules
+
+    GET /liff/naming-rules lists the rules with the current version,
+    PUT /liff/naming-rules/<name> saves a rule (JSON with folder_template,
+    file_template and optional priority, kind, extensions and enabled) and
+    DELETE /liff/naming-rules/<name> removes one. Rules are compiled before
+    they are saved, so an invalid template is rejected with 400. Every
+    change bumps the version, which the workers' NamingRuleEngine picks up.
+    Rules decide where every upload is stored, so the endpoints take their
+    own admin token rather than the read-only export token.
+
+    Args:
+        repository: Naming rule repository
+        token: Admin bearer token (defaults to NAMING_RULES_ADMIN_TOKEN; empty disables the endpoints)
+
+    Returns:
+        Blueprint, or None if Flask is not available
+    """
+    if not FLASK_AVAILABLE:
+        return None
+
+    logger = StructuredLogger(__name__)
+    token = config.NAMING_RULES_ADMIN_TOKEN if token is None else token
+    blueprint = Blueprint("liff_naming_rules", __name__, url_prefix="/liff/naming-rules")
+
+    @blueprint.before_request
+    def authorize():
+        if not is_authorized(token):
+            abort(403)
+
+    @blueprint.route("", methods=["GET"])
+    def list_rules():
+        """List the rules"""
+        version, rules = repository.load()
+        return {"version": version, "rules": rules, "fields": list(FIELDS)}
+
+    @blueprint.route("/<name>", methods=["PUT"])
+    def save_rule(name: str):
+        """Create or replace a rule"""
+        rule = request.get_json(silent=True)
+        if not isinstance(rule, dict):
+            return {"error": "Expected a JSON object"}, 400
+        rule = {field: rule.get(field) for field in NamingRuleRepository.RULE_FIELDS if field in rule}
+        rule["name"] = name
+        try:
+            compile_rule(rule)
+        except (ValueError, TypeError) as e:
+            return {"error": str(e)}, 400
+        version = repository.save(rule)
+        logger.info("Naming rule saved", rule=name, version=version)
+        return {"version": version, "rule": rule}
+
+    @blueprint.route("/<name>", methods=["DELETE"])
+    def delete_rule(name: str):
+        """Remove a rule"""
+        version = repository.delete(name)
+        logger.info("Naming rule deleted", rule=name, version=version)
+        return {"version": version}
+
+    return blueprint
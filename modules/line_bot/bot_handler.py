@@ -2,7 +2,11 @@
 LINE Bot handler module
 """
 import logging
-from typing import Optional
+import re
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
 
 try:
     from flask import Flask, request, abort
@@ -19,14 +23,55 @@ except ImportError:
     
 from config import config
 from modules.utils.logger import log_error_with_traceback, StructuredLogger
+from modules.line_bot.event_queue import EventWorkerPool
+from modules.line_bot.dedup import create_dedup_store
+from modules.ai.analysis_cache import content_hash
+from modules.ai.sales_aggregation import to_yen
+from modules.database.batcher import WriteBehindBatcher
+from modules.database.pool import ConnectionPool
+from modules.database.repositories import (
+    NamingRuleRepository, ReceiptResultRepository, SalesLedgerRepository, UploadHistoryRepository
+)
+from modules.database.search_index import SearchIndex
+from modules.liff.export import create_export_blueprint
+from modules.liff.naming_rules import create_naming_rules_blueprint
+from modules.onedrive.naming import NamingRuleEngine, category_for
+from modules.onedrive.outbox import UploadOutbox
+from modules.utils.image_preprocess import ImagePreprocessor
+from modules.utils.file_stream import (
+    FileTooLargeError, UnsupportedFileTypeError,
+    extension_for_content_type, get_file_extension, validate_file_extension
+)
 
 
 class LineBotHandler:
     """LINE Bot message handler"""
     
-    def __init__(self):
-        """Initialize LINE Bot handler"""
+    def __init__(self, onedrive_client=None, ai_assistant=None):
+        """
+        Initialize LINE Bot handler
+        
+        Args:
+            onedrive_client: OneDriveClient used to store received media
+            ai_assistant: AIAssistant used to analyze received media
+        """
         self.logger = StructuredLogger(__name__)
+        self.onedrive_client = onedrive_client
+        self.ai_assistant = ai_assistant
+        self.sales_ledger = None
+        self.database_pool = None
+        self.write_batcher = None
+        self.upload_history = None
+        self.receipt_results = None
+        self.search_index = None
+        self.naming_rules = None
+        self.naming = None
+        self.user_names = {}
+        # Uploaded receipt images waiting for their completion callback, by outbox entry ID,
+        # and per-user photo sets waiting to be analyzed together
+        self.receipt_images = {}
+        self.receipt_batches = {}
+        self.receipt_images_lock = threading.Lock()
         
         if not DEPENDENCIES_AVAILABLE:
             self.logger.warning("LINE Bot dependencies not available. Install requirements.txt to enable full functionality.")
@@ -41,6 +86,44 @@ class LineBotHandler:
         self.line_bot_api = LineBotApi(config.LINE_CHANNEL_ACCESS_TOKEN)
         self.handler = WebhookHandler(config.LINE_CHANNEL_SECRET)
         
+        # Background workers run the message handlers so the webhook can
+        # acknowledge LINE immediately
+        self.event_pool = EventWorkerPool(
+            num_workers=config.WEBHOOK_WORKERS,
+            max_queue_size=config.WEBHOOK_QUEUE_SIZE
+        )
+        
+        # Remembers processed webhookEventIds so redeliveries are not handled twice
+        self.dedup_store = create_dedup_store()
+        
+        # Upload history and receipt results are written behind, in batches
+        self.database_pool = ConnectionPool()
+        self.write_batcher = WriteBehindBatcher(self.database_pool)
+        self.upload_history = UploadHistoryRepository(self.database_pool, self.write_batcher)
+        self.receipt_results = ReceiptResultRepository(self.database_pool, self.write_batcher)
+        
+        # Successful receipts with running totals for status replies
+        self.sales_ledger = SalesLedgerRepository(self.database_pool, self.write_batcher)
+        self.search_index = SearchIndex(self.database_pool, self.write_batcher)
+        
+        # Admin-edited naming rules, compiled once and reloaded when their version changes
+        self.naming_rules = NamingRuleRepository(self.database_pool)
+        self.naming = NamingRuleEngine(self.naming_rules)
+        
+        # Received files are kept on disk until OneDrive has them
+        self.outbox = None
+        self.image_preprocessor = None
+        if self.onedrive_client:
+            if config.IMAGE_PREPROCESS_ENABLED:
+                # Shares the assistant's process pool when it has one
+                self.image_preprocessor = getattr(self.ai_assistant, 'image_preprocessor', None) or ImagePreprocessor()
+            self.outbox = UploadOutbox(
+                self.upload_outbox_entry,
+                on_complete=self.on_upload_complete,
+                on_failure=self.on_upload_failed
+            )
+            self.outbox.start()
+        
         # Setup Flask app for webhook
         self.app = Flask(__name__)
         self.setup_routes()
@@ -66,111 +149,194 @@ class LineBotHandler:
                            signature=signature[:10] + "...",
                            body_length=len(body))
             
-            # Handle webhook body
+            # Verify signature and parse events, then hand them to the workers
             try:
-                self.handler.handle(body, signature)
+                events = self.handler.parser.parse(body, signature)
             except InvalidSignatureError:
                 self.logger.error("Invalid signature")
                 abort(400)
             except Exception as e:
                 log_error_with_traceback(
                     logging.getLogger(__name__), 
-                    "Webhook handling error", 
+                    "Webhook parsing error", 
                     e
                 )
                 abort(500)
             
+            for event in events:
+                if not self.enqueue_event(event):
+                    # Ask LINE to redeliver instead of blocking the request
+                    abort(503)
+            
             return 'OK'
         
         @self.app.route("/health", methods=['GET'])
         def health():
             """Health check endpoint"""
-            return {"status": "ok", "service": "LINE Bot OneDrive AI"}
+            health = {"status": "ok", "service": "LINE Bot OneDrive AI"}
+            if self.outbox:
+                health["outbox_pending"] = self.outbox.pending_count()
+            return health
+        
+        @self.app.route("/metrics", methods=['GET'])
+        def metrics():
+            """Runtime metrics endpoint"""
+            metrics = {
+                "event_queue": self.event_pool.stats(),
+                "event_dedup": self.dedup_store.stats()
+            }
+            if self.outbox:
+                metrics["upload_outbox"] = self.outbox.stats()
+            if self.image_preprocessor:
+                metrics["image_preprocess"] = self.image_preprocessor.stats()
+            if self.onedrive_client:
+                metrics["onedrive"] = self.onedrive_client.stats()
+            if self.ai_assistant:
+                metrics["ai"] = self.ai_assistant.stats()
+            if self.write_batcher is not None:
+                metrics["database"] = {"pool": self.database_pool.stats(), "writes": self.write_batcher.stats()}
+            if self.naming is not None:
+                metrics["naming_rules"] = self.naming.stats()
+            return metrics
+        
+        # History CSV downloads for the LIFF admin screen
+        export_blueprint = create_export_blueprint(self.database_pool)
+        if export_blueprint is not None:
+            self.app.register_blueprint(export_blueprint)
+        
+        # Naming rule editing for the LIFF admin screen
+        naming_blueprint = create_naming_rules_blueprint(self.naming_rules)
+        if naming_blueprint is not None:
+            self.app.register_blueprint(naming_blueprint)
     
     def setup_handlers(self):
         """Setup LINE Bot message handlers"""
         if not DEPENDENCIES_AVAILABLE:
             return
+        
+        self.message_handlers = {
+            TextMessage: self.handle_text_message,
+            ImageMessage: self.handle_image_message,
+            FileMessage: self.handle_file_message
+        }
+        
+        # Keep the SDK handler registrations for synchronous handler.handle() use
+        for message_type, func in self.message_handlers.items():
+            self.handler.add(MessageEvent, message=message_type)(func)
+    
+    def enqueue_event(self, event) -> bool:
+        """
+        Queue a webhook event for background processing
+        
+        Args:
+            event: Parsed LINE webhook event
             
-        @self.handler.add(MessageEvent, message=TextMessage)
-        def handle_text_message(event):
-            """Handle text messages"""
-            try:
-                user_id = event.source.user_id
-                message_text = event.message.text
-                
-                self.logger.info("Received text message", 
-                               user_id=user_id, 
-                               message=message_text)
-                
-                # Process text message
-                response = self.process_text_message(user_id, message_text)
-                
-                # Send response
-                if response:
-                    self.send_text_message(event.reply_token, response)
-                
-            except Exception as e:
-                log_error_with_traceback(
-                    logging.getLogger(__name__), 
-                    "Text message handling error", 
-                    e
-                )
-                self.send_error_message(event.reply_token)
+        Returns:
+            True if the event was queued or needs no processing, False if the queue is full
+        """
+        if not isinstance(event, MessageEvent):
+            self.logger.debug("Ignoring unsupported event", event_type=getattr(event, 'type', None))
+            return True
         
-        @self.handler.add(MessageEvent, message=ImageMessage)
-        def handle_image_message(event):
-            """Handle image messages"""
-            try:
-                user_id = event.source.user_id
-                message_id = event.message.id
-                
-                self.logger.info("Received image message", 
-                               user_id=user_id, 
-                               message_id=message_id)
-                
-                # Process image message
-                response = self.process_image_message(user_id, message_id)
-                
-                # Send response
-                if response:
-                    self.send_text_message(event.reply_token, response)
-                
-            except Exception as e:
-                log_error_with_traceback(
-                    logging.getLogger(__name__), 
-                    "Image message handling error", 
-                    e
-                )
-                self.send_error_message(event.reply_token)
+        func = self.message_handlers.get(type(event.message))
+        if func is None:
+            self.logger.debug("Ignoring unsupported message", message_type=getattr(event.message, 'type', None))
+            return True
         
-        @self.handler.add(MessageEvent, message=FileMessage)
-        def handle_file_message(event):
-            """Handle file messages"""
-            try:
-                user_id = event.source.user_id
-                message_id = event.message.id
-                file_name = event.message.fileName
-                
-                self.logger.info("Received file message", 
-                               user_id=user_id, 
-                               message_id=message_id,
-                               file_name=file_name)
-                
-                # Process file message
-                response = self.process_file_message(user_id, message_id, file_name)
-                
-                # Send response
-                if response:
-                    self.send_text_message(event.reply_token, response)
-                
-            except Exception as e:
-                log_error_with_traceback(
-                    logging.getLogger(__name__), 
-                    "File message handling error", 
-                    e
-                )
-                self.send_error_message(event.reply_token)
+        event_id = getattr(event, 'webhook_event_id', None)
+        if event_id and self.dedup_store.is_duplicate(event_id):
+            delivery_context = getattr(event, 'delivery_context', None)
+            self.logger.info("Skipping duplicate webhook event",
+                           event_id=event_id,
+                           is_redelivery=getattr(delivery_context, 'is_redelivery', None))
+            return True
+        
+        if not self.event_pool.submit(func, event):
+            # Let the redelivery of this event be processed
+            if event_id:
+                self.dedup_store.forget(event_id)
+            return False
+        
+        return True
+    
+    def handle_text_message(self, event):
+        """Handle text messages"""
+        try:
+            user_id = event.source.user_id
+            message_text = event.message.text
+            
+            self.logger.info("Received text message", 
+                           user_id=user_id, 
+                           text=message_text)
+            
+            # Process text message
+            response = self.process_text_message(user_id, message_text)
+            
+            # Send response
+            if response:
+                self.send_text_message(event.reply_token, response)
+            
+        except Exception as e:
+            log_error_with_traceback(
+                logging.getLogger(__name__), 
+                "Text message handling error", 
+                e
+            )
+            self.send_error_message(event.reply_token)
+    
+    def handle_image_message(self, event):
+        """Handle image messages"""
+        try:
+            user_id = event.source.user_id
+            message_id = event.message.id
+            
+            self.logger.info("Received image message", 
+                           user_id=user_id, 
+                           message_id=message_id)
+            
+            # Process image message
+            response = self.process_image_message(user_id, message_id)
+            
+            # Send response
+            if response:
+                self.send_text_message(event.reply_token, response)
+            
+        except Exception as e:
+            log_error_with_traceback(
+                logging.getLogger(__name__), 
+                "Image message handling error", 
+                e
+            )
+            self.send_error_message(event.reply_token)
+    
+    def handle_file_message(self, event):
+        """Handle file messages"""
+        try:
+            user_id = event.source.user_id
+            message_id = event.message.id
+            file_name = event.message.file_name
+            file_size = getattr(event.message, 'file_size', None)
+            
+            self.logger.info("Received file message", 
+                           user_id=user_id, 
+                           message_id=message_id,
+                           file_name=file_name,
+                           file_size=file_size)
+            
+            # Process file message
+            response = self.process_file_message(user_id, message_id, file_name, file_size)
+            
+            # Send response
+            if response:
+                self.send_text_message(event.reply_token, response)
+            
+        except Exception as e:
+            log_error_with_traceback(
+                logging.getLogger(__name__), 
+                "File message handling error", 
+                e
+            )
+            self.send_error_message(event.reply_token)
     
     def process_text_message(self, user_id: str, message: str) -> Optional[str]:
         """
@@ -192,8 +358,15 @@ class LineBotHandler:
         elif message_lower in ['help', 'ヘルプ']:
             return self.get_help_message()
         
-        elif message_lower in ['status', 'ステータス']:
-            return "システムは正常に動作しています。"
+        elif message_lower in ['status', 'ステータス', '売上確認']:
+            return self.get_sales_status_message(user_id)
+        
+        elif message_lower in ['weekly', '週報', '週間レポート']:
+            return self.get_weekly_report_message(user_id)
+        
+        elif message_lower.startswith(('検索', 'search ')):
+            question = re.sub(r'^(検索|search)[\s:：]*', '', message.strip(), flags=re.IGNORECASE)
+            return self.search_records(user_id, question)
         
         else:
             return "申し訳ございませんが、コマンドが認識できませんでした。'ヘルプ'と送信してください。"
@@ -209,10 +382,27 @@ class LineBotHandler:
         Returns:
             Response message or None
         """
-        # TODO: Implement image processing with OneDrive upload and AI analysis
-        return "画像を受信しました。処理中です..."
+        try:
+            content = self.line_bot_api.get_message_content(message_id)
+            extension = extension_for_content_type(content.content_type) or "jpg"
+            validate_file_extension(extension)
+            
+            file_name = self.build_file_name(message_id, extension)
+            entry_id = self.store_message_content(user_id, content, file_name, kind="image",
+                                                  message_id=message_id)
+            
+        except FileTooLargeError:
+            return self.get_file_too_large_message()
+        except UnsupportedFileTypeError as e:
+            return f"申し訳ございませんが、'{e.extension}' 形式の画像には対応していません。"
+        
+        if entry_id is None:
+            return "画像の保存に失敗しました。しばらく後に再度お試しください。"
+        
+        return "画像を受信しました。OneDriveへ保存します。"
     
-    def process_file_message(self, user_id: str, message_id: str, file_name: str) -> Optional[str]:
+    def process_file_message(self, user_id: str, message_id: str, file_name: str,
+                             file_size: Optional[int] = None) -> Optional[str]:
         """
         Process file message
         
@@ -220,12 +410,469 @@ class LineBotHandler:
             user_id: LINE user ID
             message_id: Message ID
             file_name: Original file name
+            file_size: File size in bytes reported by LINE (optional)
             
         Returns:
             Response message or None
         """
-        # TODO: Implement file processing with OneDrive upload
-        return f"ファイル '{file_name}' を受信しました。処理中です..."
+        extension = get_file_extension(file_name)
+        
+        # Reject before downloading anything when LINE already tells us enough
+        try:
+            validate_file_extension(extension)
+        except UnsupportedFileTypeError:
+            return f"申し訳ございませんが、'{extension or file_name}' 形式のファイルには対応していません。"
+        
+        if file_size is not None and file_size > config.MAX_FILE_SIZE:
+            return self.get_file_too_large_message()
+        
+        try:
+            content = self.line_bot_api.get_message_content(message_id)
+            entry_id = self.store_message_content(user_id, content, file_name, kind="file",
+                                                  message_id=message_id)
+        except FileTooLargeError:
+            return self.get_file_too_large_message()
+        
+        if entry_id is None:
+            return f"ファイル '{file_name}' の保存に失敗しました。しばらく後に再度お試しください。"
+        
+        return f"ファイル '{file_name}' を受信しました。OneDriveへ保存します。"
+    
+    def store_message_content(self, user_id: str, content, file_name: str, kind: str,
+                              message_id: Optional[str] = None) -> Optional[int]:
+        """
+        Stream LINE message content into the upload outbox
+        
+        LINE only keeps message content for a limited time, so it is written
+        to disk right away (enforcing MAX_FILE_SIZE while downloading); the
+        outbox drainers upload it to OneDrive and retry until Graph accepts it.
+        
+        Args:
+            user_id: LINE user ID
+            content: Message content returned by LineBotApi.get_message_content
+            file_name: Received (or generated) file name; the naming rules choose the stored name
+            kind: 'image' or 'file'
+            message_id: LINE message ID
+            
+        Returns:
+            Outbox entry ID or None if the file cannot be stored
+            
+        Raises:
+            FileTooLargeError: If the content exceeds MAX_FILE_SIZE
+        """
+        if not self.outbox:
+            self.logger.warning("OneDrive client not available, cannot store file", file_name=file_name)
+            return None
+        
+        original = file_name
+        folder_path, file_name, category = self.name_upload(user_id, file_name, kind, message_id)
+        metadata = {"kind": kind}
+        if category is not None:
+            # Learned once the upload completes (see on_upload_complete)
+            metadata.update(original=original, category=category)
+        return self.outbox.enqueue(
+            user_id,
+            content.iter_content(chunk_size=config.STREAM_CHUNK_SIZE),
+            file_name,
+            folder_path=folder_path,
+            metadata=metadata
+        )
+    
+    def upload_outbox_entry(self, entry: dict, spool) -> Optional[dict]:
+        """
+        Upload a spooled outbox entry to OneDrive
+        
+        Images are rotated, shrunk and re-encoded first; with
+        IMAGE_ARCHIVE_ORIGINAL the untouched original is stored as well.
+        
+        Args:
+            entry: Outbox entry
+            spool: Spooled file content
+            
+        Returns:
+            Upload response or None to retry later
+        """
+        content = spool
+        file_name = entry['file_name']
+        processed = None
+        
+        if self.image_preprocessor and entry['metadata'].get('kind') == 'image':
+            original = spool.read()
+            processed = self.image_preprocessor.process(original)
+            content = processed['content']
+            if processed['changed']:
+                file_name = f"{file_name.rsplit('.', 1)[0]}.{processed['extension']}"
+                if config.IMAGE_ARCHIVE_ORIGINAL:
+                    archived = self.onedrive_client.upload_file(
+                        original,
+                        entry['file_name'],
+                        folder_path=f"{entry['folder_path']}/{config.IMAGE_ARCHIVE_FOLDER}",
+                        resume_key=f"outbox:{entry['id']}:original"
+                    )
+                    if archived is None:
+                        return None
+        
+        result = self.onedrive_client.upload_file(
+            content,
+            file_name,
+            folder_path=entry['folder_path'],
+            resume_key=f"outbox:{entry['id']}"
+        )
+        if result is not None and processed is not None:
+            result['preprocess'] = {
+                "original_size": processed['original_size'],
+                "size": processed['size'],
+                "bytes_saved": processed['bytes_saved']
+            }
+        
+        # Stored images are analyzed as receipts once the upload is complete
+        if result is not None and self.ai_assistant and entry['metadata'].get('kind') == 'image':
+            if processed is not None:
+                image = processed['content']
+            else:
+                spool.seek(0)
+                image = spool.read()
+            with self.receipt_images_lock:
+                self.receipt_images[entry['id']] = image
+        return result
+    
+    def on_upload_complete(self, entry: dict, result: dict):
+        """Follow up on an uploaded outbox entry"""
+        if self.upload_history is not None:
+            self.upload_history.add(
+                entry['user_id'],
+                result.get('name') or entry['file_name'],
+                folder_path=entry['folder_path'],
+                item_id=result.get('id'),
+                size=result.get('size'),
+                kind=entry['metadata'].get('kind'),
+                deduplicated=bool(result.get('deduplicated'))
+            )
+        
+        if self.search_index is not None and not result.get('deduplicated'):
+            self.search_index.index_file(
+                entry['user_id'],
+                result.get('id') or f"outbox:{entry['id']}",
+                result.get('name') or entry['file_name'],
+                folder_path=entry['folder_path']
+            )
+        
+        if result.get('deduplicated'):
+            self.send_push_message(
+                entry['user_id'],
+                f"'{entry['file_name']}' と同じ内容のファイルが既に保存されています（{result.get('name')}）。"
+                "重複のため保存を省略しました。"
+            )
+        
+        with self.receipt_images_lock:
+            image = self.receipt_images.pop(entry['id'], None)
+        if image is not None:
+            # Receipts without a readable date are dated by when the photo was sent
+            self.queue_receipt_analysis(entry['user_id'], image, result.get('name') or entry['file_name'],
+                                        datetime.fromtimestamp(entry['created_at']))
+        
+        category = entry['metadata'].get('category')
+        if category is not None and self.ai_assistant is not None:
+            # Similar files get the same category without another classification
+            self.ai_assistant.record_file_placement(
+                {'file_name': entry['metadata'].get('original')},
+                category,
+                result.get('name') or entry['file_name']
+            )
+    
+    def queue_receipt_analysis(self, user_id: str, image: bytes, file_name: Optional[str] = None,
+                               received_at: Optional[datetime] = None):
+        """
+        Add an uploaded receipt to the user's current photo set
+        
+        The set is analyzed once no new receipt arrived for RECEIPT_BATCH_WINDOW
+        seconds (or RECEIPT_BATCH_MAX receipts are waiting), so a month-end
+        upload of many receipts becomes one bulk run with progress messages.
+        
+        Args:
+            user_id: LINE user ID
+            image: Image content as stored
+            file_name: Name of the stored file
+            received_at: When the user sent the image
+        """
+        with self.receipt_images_lock:
+            batch = self.receipt_batches.get(user_id)
+            if batch is None:
+                batch = self.receipt_batches[user_id] = {"images": [], "file_names": [], "received_at": [],
+                                                            "timer": None}
+                self._schedule_receipt_batch(user_id, batch, config.RECEIPT_BATCH_WINDOW)
+            batch["images"].append(image)
+            batch["file_names"].append(file_name)
+            batch["received_at"].append(received_at)
+            batch["updated_at"] = time.monotonic()
+            full = len(batch["images"]) >= config.RECEIPT_BATCH_MAX
+        if full:
+            self.flush_receipt_batch(user_id)
+    
+    def _schedule_receipt_batch(self, user_id: str, batch: dict, delay: float):
+        timer = threading.Timer(delay, self._on_receipt_batch_timer, args=(user_id, batch))
+        timer.daemon = True
+        batch["timer"] = timer
+        timer.start()
+    
+    def _on_receipt_batch_timer(self, user_id: str, batch: dict):
+        with self.receipt_images_lock:
+            if self.receipt_batches.get(user_id) is not batch:
+                return
+            quiet = time.monotonic() - batch["updated_at"]
+            if quiet < config.RECEIPT_BATCH_WINDOW:
+                self._schedule_receipt_batch(user_id, batch, config.RECEIPT_BATCH_WINDOW - quiet)
+                return
+        self.flush_receipt_batch(user_id)
+    
+    def flush_receipt_batch(self, user_id: str):
+        """Analyze the user's waiting receipts now, on a worker"""
+        with self.receipt_images_lock:
+            batch = self.receipt_batches.pop(user_id, None)
+        if batch is None:
+            return
+        batch["timer"].cancel()
+        
+        images, file_names, received_at = batch["images"], batch["file_names"], batch["received_at"]
+        if len(images) == 1:
+            job = (self.analyze_stored_receipt, user_id, images[0], file_names[0], received_at[0])
+        else:
+            job = (self.analyze_receipts_for_user, user_id, images, file_names, received_at)
+        # Analysis takes seconds, so it runs on a worker; inline only if the queue is full
+        if not self.event_pool.submit(*job):
+            job[0](*job[1:])
+    
+    def analyze_stored_receipt(self, user_id: str, image: bytes, file_name: Optional[str] = None,
+                               received_at: Optional[datetime] = None):
+        """
+        Analyze an uploaded receipt image, store the result and tell the user
+        
+        Args:
+            user_id: LINE user ID
+            image: Image content as stored
+            file_name: Name of the stored file
+            received_at: When the user sent the image
+        """
+        # Stored images already went through the preprocessor, when there is one
+        result = self.ai_assistant.analyze_receipt_image(image, preprocessed=self.image_preprocessor is not None)
+        if result is None or result.get('status') != 'success':
+            self.logger.info("Stored image was not read as a receipt", user_id=user_id, file_name=file_name)
+            return
+        
+        self.record_receipt_analysis(user_id, content_hash(image), result, file_name, received_at)
+        data = result.get('extracted_data') or {}
+        amount = "金額不明" if data.get('total_amount') is None else f"¥{to_yen(data['total_amount']):,}"
+        self.send_push_message(
+            user_id,
+            f"レシートを読み取りました: {data.get('store_name') or '店舗不明'} "
+            f"{data.get('date') or '日付不明'} {amount}"
+        )
+    
+    def record_receipt_analysis(self, user_id: str, receipt_key: str, result: dict,
+                                file_name: Optional[str] = None, received_at: Optional[datetime] = None):
+        """
+        Store a receipt analysis in the results table (through the sales ledger when
+        it succeeded) and the search index
+        
+        Args:
+            user_id: LINE user ID
+            receipt_key: Image content hash
+            result: Analysis result
+            file_name: Name of the stored image, if known
+            received_at: When the image was received; dates the sale if the receipt has no date
+        """
+        if self.sales_ledger is not None and result.get('status') == 'success':
+            self.sales_ledger.record(user_id, receipt_key, result, received_at=received_at)
+        elif self.receipt_results is not None:
+            self.receipt_results.add(user_id, receipt_key, result)
+        if self.search_index is not None:
+            self.search_index.index_receipt(user_id, receipt_key, result, file_name)
+    
+    def analyze_receipts_for_user(self, user_id: str, images: List[bytes],
+                                  file_names: Optional[List[Optional[str]]] = None,
+                                  received_at: Optional[List[Optional[datetime]]] = None) -> List[Optional[dict]]:
+        """
+        Analyze a batch of receipts, pushing progress to the user
+        
+        Args:
+            user_id: LINE user ID to notify
+            images: Receipt images as bytes
+            file_names: Names of the stored images, in the same order
+            received_at: When each image was received, in the same order
+            
+        Returns:
+            Analysis results in the order of images (None for failures)
+        """
+        total = len(images)
+        results: List[Optional[dict]] = [None] * total
+        if not self.ai_assistant or not total:
+            return results
+        
+        # A progress message about every quarter keeps push message usage low
+        step = max(1, -(-total // 4))
+        
+        def on_progress(done: int, total: int):
+            if done % step == 0 and done < total:
+                self.send_push_message(user_id, f"レシートを解析しています... ({done}/{total})")
+        
+        self.send_push_message(user_id, f"{total}件のレシートの解析を開始します。")
+        for index, result in self.ai_assistant.analyze_receipts_bulk(
+                images, on_progress=on_progress, preprocessed=self.image_preprocessor is not None):
+            results[index] = result
+            if result is None:
+                continue
+            self.record_receipt_analysis(user_id, content_hash(images[index]), result,
+                                         file_names[index] if file_names else None,
+                                         received_at[index] if received_at else None)
+        
+        failed = sum(1 for result in results if result is None)
+        message = f"{total}件のレシートの解析が完了しました。"
+        if failed:
+            message += f"（{failed}件は読み取れませんでした）"
+        self.send_push_message(user_id, message)
+        return results
+    
+    def on_upload_failed(self, entry: dict):
+        """Tell the user that a file could not be stored"""
+        self.send_push_message(
+            entry['user_id'],
+            f"'{entry['file_name']}' をOneDriveに保存できませんでした。管理者にお問い合わせください。"
+        )
+    
+    def get_sales_status_message(self, user_id: str) -> str:
+        """Get the reply with the user's sales today, this week, this month and in total"""
+        if self.sales_ledger is None:
+            return "システムは正常に動作しています。"
+        
+        status = self.sales_ledger.status(user_id)
+        if not status["total"]["receipts"]:
+            return "まだ売上データがありません。レシート画像を送信してください。"
+        
+        lines = ["【売上状況】"]
+        for grain, label in (("day", "本日"), ("week", "今週"), ("month", "今月"), ("total", "累計")):
+            summary = status[grain]
+            lines.append(f"{label}: ¥{summary['total_amount']:,}（{summary['receipts']}件）")
+        return "\n".join(lines)
+    
+    def get_weekly_report_message(self, user_id: str) -> str:
+        """Get the reply with this week's sales, per contractor where known"""
+        if self.sales_ledger is None:
+            return "売上データを利用できません。"
+        
+        week = self.sales_ledger.summary(user_id, "week")
+        if not week["receipts"]:
+            return "今週の売上データはまだありません。"
+        
+        lines = [
+            f"【週間レポート {week['period']}】",
+            f"売上合計: ¥{week['total_amount']:,}",
+            f"レシート: {week['receipts']}件 / 品目: {week['total_items']}点",
+            f"期間: {week['first_date']} 〜 {week['last_date']}",
+        ]
+        for summary in self.sales_ledger.contractor_summaries(user_id, "week", week["period"]):
+            lines.append(f"・{summary['contractor']}: ¥{summary['total_amount']:,}（{summary['receipts']}件）")
+        return "\n".join(lines)
+    
+    def search_records(self, user_id: str, question: str) -> str:
+        """
+        Answer a natural-language search over the user's files and receipts
+        
+        The question is translated into a structured query once per phrasing
+        (cached); the search itself runs on the local full-text index.
+        
+        Args:
+            user_id: LINE user ID
+            question: Question such as '先月のセブンイレブンのレシート'
+            
+        Returns:
+            Reply listing the matches
+        """
+        if self.search_index is None:
+            return "検索を利用できません。"
+        if not question:
+            return "検索したい内容を続けて送信してください。（例：検索 先月のセブンイレブンのレシート）"
+        
+        query = self.ai_assistant.translate_search_query(question) if self.ai_assistant else None
+        if query is None:
+            query = {"keywords": question.split()}
+        results = self.search_index.search(user_id, query, limit=10)
+        if not results:
+            return f"「{question}」に一致するファイル・レシートは見つかりませんでした。"
+        
+        lines = [f"【検索結果】{len(results)}件"]
+        for doc in results:
+            if doc['kind'] == 'receipt':
+                amount = f" ¥{doc['amount']:,}" if doc['amount'] is not None else ""
+                lines.append(f"🧾 {doc['doc_date'] or '日付不明'} {doc['store_name'] or '店舗不明'}{amount}")
+            else:
+                lines.append(f"📁 {doc['doc_date']} {doc['folder_path']}/{doc['title']}")
+        return "\n".join(lines)
+    
+    def name_upload(self, user_id: str, file_name: str, kind: str,
+                    message_id: Optional[str] = None) -> Tuple[str, str, Optional[str]]:
+        """
+        Choose the OneDrive folder and file name of an upload with the naming rules
+        
+        A rule's {category} is the folder the file classifier suggests from
+        similar past uploads, or the extension's category when it has none.
+        
+        Args:
+            user_id: LINE user ID
+            file_name: Received (or generated) file name
+            kind: 'image' or 'file'
+            message_id: LINE message ID
+            
+        Returns:
+            Folder path (relative to ONEDRIVE_ROOT_FOLDER), file name, and the
+            category if the chosen rule used it (None otherwise)
+        """
+        if self.naming is None:
+            return self.get_user_folder(user_id), file_name, None
+        
+        used = {}
+        
+        def category() -> str:
+            # Only looked up when the rule uses {category}; may ask ChatGPT on a cold index
+            suggestion = None
+            if self.ai_assistant is not None:
+                suggestion = self.ai_assistant.suggest_file_placement({'file_name': file_name})
+            used['category'] = (suggestion or {}).get('folder') or category_for(file_name.rpartition('.')[2])
+            return used['category']
+        
+        decision = self.naming.decide({
+            'user_id': user_id,
+            'kind': kind,
+            'original': file_name,
+            'message_id': message_id,
+            'user_name': lambda: self.get_user_name(user_id),
+            'category': category
+        })
+        self.logger.debug("Naming rule applied", rule=decision['rule'],
+                          folder_path=decision['folder_path'], file_name=decision['file_name'])
+        return decision['folder_path'], decision['file_name'], used.get('category')
+    
+    def get_user_name(self, user_id: str) -> Optional[str]:
+        """Get a user's LINE display name (looked up once per process)"""
+        if user_id not in self.user_names:
+            try:
+                self.user_names[user_id] = self.line_bot_api.get_profile(user_id).display_name
+            except Exception as e:
+                self.logger.warning("Could not get LINE profile", user_id=user_id, error=str(e))
+                return None
+        return self.user_names[user_id]
+    
+    def get_user_folder(self, user_id: str) -> str:
+        """Get the OneDrive folder for a user's uploads this month"""
+        return f"{user_id}/{datetime.now().strftime('%Y-%m')}"
+    
+    def build_file_name(self, message_id: str, extension: str) -> str:
+        """Build a unique file name for media without an original name"""
+        return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{message_id}.{extension}"
+    
+    def get_file_too_large_message(self) -> str:
+        """Get the reply for files over MAX_FILE_SIZE"""
+        max_mb = config.MAX_FILE_SIZE / (1024 * 1024)
+        return f"申し訳ございませんが、ファイルサイズが上限（{max_mb:.0f}MB）を超えています。"
     
     def send_text_message(self, reply_token: str, message: str):
         """Send text message"""
@@ -244,6 +891,23 @@ class LineBotHandler:
                 e
             )
     
+    def send_push_message(self, user_id: str, message: str):
+        """Send a text message outside of a reply (e.g. after a background upload)"""
+        if not DEPENDENCIES_AVAILABLE:
+            self.logger.info(f"Would push message: {message}")
+            return
+            
+        try:
+            from linebot.models import TextSendMessage
+            self.line_bot_api.push_message(user_id, TextSendMessage(text=message))
+            
+        except Exception as e:
+            log_error_with_traceback(
+                logging.getLogger(__name__), 
+                "Failed to push message", 
+                e
+            )
+    
     def send_error_message(self, reply_token: str):
         """Send error message"""
         error_msg = "申し訳ございません。処理中にエラーが発生しました。しばらく後に再度お試しください。"
@@ -255,6 +919,8 @@ class LineBotHandler:
 📁 ファイルアップロード: ファイルを送信
 📸 レシート読取: レシート画像を送信
 💰 売上確認: 'ステータス'と送信
+📊 週間レポート: '週報'と送信
+🔍 検索: '検索 先月のレシート'のように送信
 ❓ ヘルプ: 'ヘルプ'と送信
 
 何かご不明な点がございましたら、管理者にお問い合わせください。"""
@@ -266,4 +932,20 @@ class LineBotHandler:
             return
             
         self.logger.info(f"Starting LINE Bot server on port {port}")
-        self.app.run(host='0.0.0.0', port=port, debug=config.DEBUG)
\ No newline at end of file
+        self.app.run(host='0.0.0.0', port=port, debug=config.DEBUG)
+    
+    def cleanup(self):
+        """Cleanup resources"""
+        # Waiting photo sets are analyzed before the workers stop
+        for user_id in list(getattr(self, 'receipt_batches', {})):
+            self.flush_receipt_batch(user_id)
+        if getattr(self, 'event_pool', None):
+            self.event_pool.shutdown(timeout=30)
+        if getattr(self, 'outbox', None):
+            self.outbox.stop()
+        if getattr(self, 'image_preprocessor', None):
+            self.image_preprocessor.shutdown()
+        if self.write_batcher is not None:
+            self.write_batcher.stop()
+            self.database_pool.close()
+        self.logger.info("LINE Bot handler cleaned up")
\ No newline at end of file
@@ -0,0 +1,201 @@
+"""
+Deduplication of redelivered LINE webhook events
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.utils.sqlite import connect_sqlite
+
+
+class EventDedupStore(ABC):
+    """Base class for bounded TTL stores of processed webhookEventIds"""
+
+    backend = "base"
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        """
+        Initialize counters shared by all stores
+
+        Args:
+            ttl_seconds: How long an event ID is remembered
+            max_entries: Maximum number of remembered event IDs
+        """
+        self.logger = StructuredLogger(__name__)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._counter_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def is_duplicate(self, event_id: str) -> bool:
+        """
+        Check an event ID and mark it as seen in one step
+
+        Args:
+            event_id: LINE webhookEventId
+
+        Returns:
+            True if the event was already seen within the TTL
+        """
+        duplicate = self._check_and_mark(event_id, time.time())
+        with self._counter_lock:
+            if duplicate:
+                self._hits += 1
+            else:
+                self._misses += 1
+        return duplicate
+
+    @abstractmethod
+    def forget(self, event_id: str):
+        """
+        Remove an event ID so a redelivery is processed again
+
+        Args:
+            event_id: LINE webhookEventId
+        """
+
+    @abstractmethod
+    def _check_and_mark(self, event_id: str, now: float) -> bool:
+        """Check an event ID and mark it as seen; True if it was already seen"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Number of remembered event IDs"""
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get hit/miss counters
+
+        Returns:
+            Dictionary with hits, misses and current size
+        """
+        with self._counter_lock:
+            total = self._hits + self._misses
+            return {
+                "backend": self.backend,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 4) if total else 0.0,
+                "entries": len(self),
+                "max_entries": self.max_entries,
+            }
+
+
+class MemoryDedupStore(EventDedupStore):
+    """Per-process LRU store with TTL"""
+
+    backend = "memory"
+
+    def __init__(self, ttl_seconds: float = 3600, max_entries: int = 10000):
+        super().__init__(ttl_seconds, max_entries)
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_and_mark(self, event_id: str, now: float) -> bool:
+        with self._lock:
+            expires_at = self._entries.get(event_id)
+            if expires_at is not None and expires_at > now:
+                self._entries.move_to_end(event_id)
+                return True
+
+            self._entries[event_id] = now + self.ttl_seconds
+            self._entries.move_to_end(event_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return False
+
+    def forget(self, event_id: str):
+        with self._lock:
+            self._entries.pop(event_id, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteDedupStore(EventDedupStore):
+    """SQLite-backed store shared by all gunicorn workers on the host"""
+
+    backend = "sqlite"
+
+    # Expired and excess rows are pruned once every this many inserts
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, db_path: Union[str, Path], ttl_seconds: float = 3600, max_entries: int = 10000):
+        super().__init__(ttl_seconds, max_entries)
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._conn = connect_sqlite(db_path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed_events ("
+            " event_id TEXT PRIMARY KEY,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_processed_events_expires"
+            " ON processed_events (expires_at)"
+        )
+
+    def _check_and_mark(self, event_id: str, now: float) -> bool:
+        with self._lock:
+            # A single upsert is atomic across processes: it inserts a new ID or
+            # revives an expired one, and changes nothing for a live duplicate
+            cursor = self._conn.execute(
+                "INSERT INTO processed_events (event_id, expires_at) VALUES (?, ?)"
+                " ON CONFLICT(event_id) DO UPDATE SET expires_at = excluded.expires_at"
+                " WHERE processed_events.expires_at <= ?",
+                (event_id, now + self.ttl_seconds, now)
+            )
+            duplicate = cursor.rowcount == 0
+
+            if not duplicate:
+                self._inserts += 1
+                if self._inserts % self.PRUNE_INTERVAL == 0:
+                    self._prune(now)
+            return duplicate
+
+    def _prune(self, now: float):
+        """Delete expired rows and trim the table to max_entries"""
+        self._conn.execute("DELETE FROM processed_events WHERE expires_at <= ?", (now,))
+        self._conn.execute(
+            "DELETE FROM processed_events WHERE event_id IN ("
+            " SELECT event_id FROM processed_events ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def forget(self, event_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM processed_events WHERE event_id = ?", (event_id,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM processed_events").fetchone()[0]
+
+
+def create_dedup_store(backend: Optional[str] = None) -> EventDedupStore:
+    """
+    Create the dedup store selected in the configuration
+
+    Args:
+        backend: 'memory' or 'sqlite' (defaults to config.DEDUP_BACKEND)
+
+    Returns:
+        Dedup store instance
+    """
+    backend = (backend or config.DEDUP_BACKEND).lower()
+    if backend == "sqlite":
+        return SQLiteDedupStore(
+            config.DEDUP_DB_PATH,
+            ttl_seconds=config.DEDUP_TTL_SECONDS,
+            max_entries=config.DEDUP_MAX_ENTRIES
+        )
+    return MemoryDedupStore(
+        ttl_seconds=config.DEDUP_TTL_SECONDS,
+        max_entries=config.DEDUP_MAX_ENTRIES
+    )
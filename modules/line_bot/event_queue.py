@@ -0,0 +1,170 @@
+"""
+Bounded background worker pool for LINE webhook events
+"""
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from modules.utils.logger import log_error_with_traceback, StructuredLogger
+
+
+class EventWorkerPool:
+    """Run webhook event jobs on a fixed pool of background threads"""
+
+    def __init__(self, num_workers: int = 4, max_queue_size: int = 100, name: str = "line-event"):
+        """
+        Initialize the worker pool and start the worker threads
+
+        Args:
+            num_workers: Number of worker threads
+            max_queue_size: Maximum number of jobs waiting in the queue
+            name: Thread name prefix
+        """
+        self.logger = StructuredLogger(__name__)
+        self.num_workers = max(1, num_workers)
+        self.max_queue_size = max(1, max_queue_size)
+        self.name = name
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=self.max_queue_size)
+        self._lock = threading.Lock()
+        self._busy_workers = 0
+        self._submitted = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._total_run = 0.0
+        self._started_at = time.monotonic()
+        self._busy_time = 0.0
+        self._stopping = False
+
+        self._threads = []
+        for index in range(self.num_workers):
+            thread = threading.Thread(
+                target=self._worker_loop,
+                name=f"{self.name}-{index}",
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+        self.logger.info("Event worker pool started",
+                         workers=self.num_workers,
+                         max_queue_size=self.max_queue_size)
+
+    def submit(self, func: Callable[..., Any], *args, **kwargs) -> bool:
+        """
+        Enqueue a job without blocking
+
+        Args:
+            func: Callable to run on a worker thread
+            *args: Positional arguments for the callable
+            **kwargs: Keyword arguments for the callable
+
+        Returns:
+            True if the job was queued, False if the queue is full or stopping
+        """
+        if self._stopping:
+            return False
+
+        try:
+            self._queue.put_nowait((time.monotonic(), func, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            self.logger.warning("Event queue is full, job rejected",
+                                queue_depth=self._queue.qsize())
+            return False
+
+        with self._lock:
+            self._submitted += 1
+        return True
+
+    def _worker_loop(self):
+        """Take jobs from the queue until a stop sentinel is received"""
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+
+            enqueued_at, func, args, kwargs = job
+            started_at = time.monotonic()
+            wait_time = started_at - enqueued_at
+
+            with self._lock:
+                self._busy_workers += 1
+                self._total_wait += wait_time
+                self._max_wait = max(self._max_wait, wait_time)
+
+            failed = False
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                failed = True
+                log_error_with_traceback(
+                    logging.getLogger(__name__),
+                    "Event job failed",
+                    e
+                )
+            finally:
+                run_time = time.monotonic() - started_at
+                with self._lock:
+                    self._busy_workers -= 1
+                    self._busy_time += run_time
+                    self._total_run += run_time
+                    if failed:
+                        self._failed += 1
+                    else:
+                        self._processed += 1
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get queue and worker statistics for pool sizing
+
+        Returns:
+            Dictionary with queue depth, wait times and worker usage
+        """
+        with self._lock:
+            finished = self._processed + self._failed
+            elapsed = max(time.monotonic() - self._started_at, 1e-9)
+            return {
+                "workers": self.num_workers,
+                "busy_workers": self._busy_workers,
+                "worker_utilization": round(self._busy_time / (elapsed * self.num_workers), 4),
+                "queue_depth": self._queue.qsize(),
+                "max_queue_size": self.max_queue_size,
+                "submitted": self._submitted,
+                "processed": self._processed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._total_wait / finished * 1000, 3) if finished else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 3),
+                "avg_run_ms": round(self._total_run / finished * 1000, 3) if finished else 0.0,
+            }
+
+    def shutdown(self, wait: bool = True, timeout: Optional[float] = None):
+        """
+        Stop accepting jobs and stop the workers after the queued jobs finish
+
+        Args:
+            wait: Wait for worker threads to exit
+            timeout: Maximum seconds to wait per worker thread
+        """
+        if self._stopping:
+            return
+        self._stopping = True
+
+        for _ in self._threads:
+            # Sentinels are queued behind pending jobs, so those still run
+            self._queue.put(None)
+
+        if wait:
+            for thread in self._threads:
+                thread.join(timeout)
+
+        self.logger.info("Event worker pool stopped", **self.stats())
@@ -0,0 +1,162 @@
+"""
+asyncio interface to the OneDrive client with bounded parallel transfers
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.onedrive.client import OneDriveClient
+
+
+class AsyncOneDriveClient:
+    """
+    Awaitable OneDriveClient operations, at most `max_concurrency` at a time
+
+    Calls run the synchronous client (pooled session, retries, token refresh,
+    resumable uploads) on a dedicated thread pool, so an event loop can start
+    many transfers without blocking. Cancelling a task that is waiting for a
+    slot means the transfer never starts; cancelling a running upload stops
+    it before its next chunk, leaving the upload session resumable.
+    """
+
+    def __init__(self, client: Optional[OneDriveClient] = None, max_concurrency: Optional[int] = None):
+        """
+        Initialize the async client
+
+        Args:
+            client: Synchronous client to run calls on (defaults to a new OneDriveClient)
+            max_concurrency: Transfers in flight at once (defaults to ONEDRIVE_MAX_CONCURRENCY)
+        """
+        self.logger = StructuredLogger(__name__)
+        self.client = client or OneDriveClient()
+        self.max_concurrency = max_concurrency or config.ONEDRIVE_MAX_CONCURRENCY
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                            thread_name_prefix="onedrive-async")
+        self._semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._cancelled = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        """Semaphore for the running event loop (asyncio primitives are per loop)"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                self._semaphores = {
+                    other: value for other, value in self._semaphores.items() if not other.is_closed()
+                }
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+            return semaphore
+
+    async def _run(self, func: Callable[..., Any], *args,
+                   cancel_event: Optional[threading.Event] = None, **kwargs) -> Any:
+        """Run a blocking client call once a concurrency slot is free; cancel_event is passed on"""
+        if cancel_event is not None:
+            kwargs['cancel_event'] = cancel_event
+        async with self._semaphore():
+            with self._lock:
+                self._in_flight += 1
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, functools.partial(func, *args, **kwargs)
+                )
+                with self._lock:
+                    self._completed += 1
+                return result
+            except asyncio.CancelledError:
+                if cancel_event is not None:
+                    cancel_event.set()
+                with self._lock:
+                    self._cancelled += 1
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+
+    async def upload_file(self, file_content: Union[bytes, BinaryIO], file_name: str,
+                          folder_path: str = None, resume_key: Optional[str] = None,
+                          deduplicate: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Upload file to OneDrive (see OneDriveClient.upload_file)
+
+        Args:
+            file_content: File content as bytes, or a seekable file object
+            file_name: Name of the file
+            folder_path: Optional folder path (defaults to root folder)
+            resume_key: Stable key to resume an interrupted chunked upload
+            deduplicate: Skip the upload if identical content is already stored in the folder
+
+        Returns:
+            Upload response or None if failed
+        """
+        cancel_event = threading.Event()
+        return await self._run(
+            self.client.upload_file, file_content, file_name,
+            folder_path=folder_path, resume_key=resume_key, deduplicate=deduplicate,
+            cancel_event=cancel_event
+        )
+
+    async def upload_many(self, files: Iterable[Tuple[Union[bytes, BinaryIO], str]],
+                          folder_path: str = None) -> List[Optional[Dict[str, Any]]]:
+        """
+        Upload several files concurrently (e.g. a LINE image set)
+
+        Cancelling the returned awaitable cancels every upload that has not finished.
+
+        Args:
+            files: (content, file name) pairs
+            folder_path: Folder to upload into
+
+        Returns:
+            Upload responses in input order (None for failed uploads)
+        """
+        # Resolve the folder once instead of racing to create it from every upload
+        await self.ensure_folder(folder_path)
+        tasks = [
+            asyncio.ensure_future(self.upload_file(content, file_name, folder_path=folder_path))
+            for content, file_name in files
+        ]
+        try:
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def create_folder(self, folder_name: str, parent_path: str = None) -> Optional[Dict[str, Any]]:
+        """Create folder in OneDrive (see OneDriveClient.create_folder)"""
+        return await self._run(self.client.create_folder, folder_name, parent_path)
+
+    async def ensure_folder(self, folder_path: Optional[str] = None) -> Optional[str]:
+        """Get or create a folder's item ID (see OneDriveClient.ensure_folder)"""
+        return await self._run(self.client.ensure_folder, folder_path)
+
+    async def list_files(self, folder_path: str = None, use_index: bool = True) -> Optional[list]:
+        """List files in OneDrive folder (see OneDriveClient.list_files)"""
+        return await self._run(self.client.list_files, folder_path, use_index)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get concurrency statistics"""
+        with self._lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "cancelled": self._cancelled,
+            }
+
+    async def aclose(self):
+        """Wait for running calls and release the thread pool"""
+        await asyncio.get_running_loop().run_in_executor(None, functools.partial(self._executor.shutdown, wait=True))
+
+    async def __aenter__(self) -> "AsyncOneDriveClient":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
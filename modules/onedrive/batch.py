@@ -0,0 +1,268 @@
+"""
+Microsoft Graph JSON $batch support
+"""
+import itertools
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+
+from modules.utils.logger import StructuredLogger
+from modules.onedrive.http_session import parse_retry_after
+
+
+# Graph accepts at most 20 sub-requests per $batch call
+MAX_BATCH_SIZE = 20
+
+# Rounds of resending throttled (429) sub-requests before giving up
+MAX_THROTTLE_ROUNDS = 3
+
+
+class BatchResponse:
+    """Result of one sub-request, shaped like the parts of a response callers use"""
+
+    def __init__(self, status_code: int, headers: Optional[Dict[str, str]], body: Any):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+
+    def json(self) -> Any:
+        return self.body
+
+    @property
+    def text(self) -> str:
+        return str(self.body)
+
+
+class BatchRequest:
+    """A queued sub-request and the future that receives its response"""
+
+    def __init__(self, request_id: str, method: str, url: str, body: Any = None,
+                 headers: Optional[Dict[str, str]] = None, depends_on: Optional[List["BatchRequest"]] = None):
+        self.id = request_id
+        self.method = method.upper()
+        self.url = url
+        self.body = body
+        self.headers = headers
+        self.depends_on = depends_on or []
+        self.future: Future = Future()
+
+    def to_json(self) -> Dict[str, Any]:
+        data = {"id": self.id, "method": self.method, "url": self.url}
+        if self.body is not None:
+            data["body"] = self.body
+            data["headers"] = {"Content-Type": "application/json", **(self.headers or {})}
+        elif self.headers:
+            data["headers"] = self.headers
+        if self.depends_on:
+            data["dependsOn"] = [dependency.id for dependency in self.depends_on]
+        return data
+
+
+class GraphBatch:
+    """Collects sub-requests and sends them in $batch calls of up to 20"""
+
+    def __init__(self, client):
+        """
+        Initialize an empty batch
+
+        Args:
+            client: OneDriveClient used to send the $batch calls
+        """
+        self.logger = StructuredLogger(__name__)
+        self.client = client
+        self._requests: List[BatchRequest] = []
+        self._ids = itertools.count(1)
+
+    def add(self, method: str, url: str, body: Any = None, headers: Optional[Dict[str, str]] = None,
+            depends_on: Optional[List[BatchRequest]] = None) -> BatchRequest:
+        """
+        Queue a sub-request
+
+        Args:
+            method: HTTP method
+            url: URL relative to the API version, e.g. '/me/drive/root/children'
+            body: JSON body
+            headers: Sub-request headers
+            depends_on: Sub-requests that must succeed before this one runs
+
+        Returns:
+            Queued request; its `future` resolves to a BatchResponse
+        """
+        request = BatchRequest(str(next(self._ids)), method, url, body, headers, depends_on)
+        self._requests.append(request)
+        return request
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def __enter__(self) -> "GraphBatch":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.execute()
+
+    def execute(self):
+        """Send all queued sub-requests and resolve their futures"""
+        pending, self._requests = self._requests, []
+        for group in self._pack(pending):
+            self._send_group(group)
+
+    @staticmethod
+    def _pack(requests: List[BatchRequest]) -> List[List[BatchRequest]]:
+        """
+        Split requests into $batch groups, keeping dependency chains together
+
+        dependsOn may only reference requests in the same $batch call, so
+        connected requests are packed into one group where they fit. A chain
+        longer than 20 is cut in dependency order; the later groups are sent
+        after the earlier ones have completed.
+        """
+        index = {id(request): position for position, request in enumerate(requests)}
+        parent = list(range(len(requests)))
+
+        def find(position):
+            while parent[position] != position:
+                parent[position] = parent[parent[position]]
+                position = parent[position]
+            return position
+
+        for position, request in enumerate(requests):
+            for dependency in request.depends_on:
+                if id(dependency) not in index:
+                    raise ValueError("dependsOn must reference a request in the same batch")
+                parent[find(position)] = find(index[id(dependency)])
+
+        components: Dict[int, List[BatchRequest]] = {}
+        for request in GraphBatch._dependency_order(requests):
+            components.setdefault(find(index[id(request)]), []).append(request)
+
+        groups: List[List[BatchRequest]] = []
+        for component in components.values():
+            if len(component) > MAX_BATCH_SIZE:
+                for start in range(0, len(component), MAX_BATCH_SIZE):
+                    groups.append(component[start:start + MAX_BATCH_SIZE])
+                continue
+            for group in groups:
+                if len(group) + len(component) <= MAX_BATCH_SIZE:
+                    group.extend(component)
+                    break
+            else:
+                groups.append(list(component))
+        return groups
+
+    @staticmethod
+    def _dependency_order(requests: List[BatchRequest]) -> List[BatchRequest]:
+        """Order requests so every request follows its dependencies"""
+        ordered: List[BatchRequest] = []
+        visited = set()
+        visiting = set()
+
+        def visit(request):
+            if id(request) in visited:
+                return
+            if id(request) in visiting:
+                raise ValueError("dependsOn contains a cycle")
+            visiting.add(id(request))
+            for dependency in request.depends_on:
+                visit(dependency)
+            visiting.discard(id(request))
+            visited.add(id(request))
+            ordered.append(request)
+
+        for request in requests:
+            visit(request)
+        return ordered
+
+    def _send_group(self, group: List[BatchRequest]):
+        """Send one $batch call, resending throttled sub-requests"""
+        group_ids = {request.id for request in group}
+        remaining = []
+        for request in group:
+            # Dependencies in earlier groups have completed; fail like Graph would (424)
+            outside = [d for d in request.depends_on if d.id not in group_ids]
+            if any(self._failed(dependency) for dependency in outside):
+                request.future.set_result(BatchResponse(424, {}, {"error": {"code": "failedDependency"}}))
+                group_ids.discard(request.id)
+                continue
+            request.depends_on = [d for d in request.depends_on if d.id in group_ids]
+            remaining.append(request)
+        if not remaining:
+            return
+        for attempt in range(MAX_THROTTLE_ROUNDS + 1):
+            sent_at = time.monotonic()
+            try:
+                response = self.client._graph_request(
+                    'POST',
+                    f"{self.client.base_url}/$batch",
+                    json={"requests": [request.to_json() for request in remaining]}
+                )
+            except Exception as e:
+                for request in remaining:
+                    request.future.set_exception(e)
+                return
+
+            if response is None or response.status_code != 200:
+                error = RuntimeError(
+                    f"$batch request failed: {getattr(response, 'status_code', 'no access token')}"
+                )
+                self.logger.error("Batch request failed",
+                                status_code=getattr(response, 'status_code', None),
+                                requests=len(remaining))
+                for request in remaining:
+                    request.future.set_exception(error)
+                return
+
+            results = {item["id"]: item for item in response.json().get("responses", [])}
+            can_retry = attempt < MAX_THROTTLE_ROUNDS
+
+            # Throttled requests, and dependents that failed (424) because of them, are resent
+            retry_ids = set()
+            retry_after = 0.0
+            changed = True
+            while changed:
+                changed = False
+                for request in remaining:
+                    item = results.get(request.id) or {}
+                    status = item.get("status")
+                    if request.id in retry_ids or not can_retry:
+                        continue
+                    if status == 429 or (status == 424 and any(
+                            dependency.id in retry_ids for dependency in request.depends_on)):
+                        retry_ids.add(request.id)
+                        changed = True
+                        if status == 429:
+                            delay = parse_retry_after((item.get("headers") or {}).get("Retry-After"))
+                            retry_after = max(retry_after, 1.0 if delay is None else delay)
+
+            for request in remaining:
+                if request.id in retry_ids:
+                    continue
+                item = results.get(request.id)
+                if item is None:
+                    request.future.set_exception(RuntimeError(f"No response for batch request {request.id}"))
+                else:
+                    request.future.set_result(
+                        BatchResponse(item.get("status", 0), item.get("headers"), item.get("body"))
+                    )
+
+            if not retry_ids:
+                return
+
+            self.logger.warning("Batch sub-requests throttled, retrying",
+                                count=len(retry_ids), delay=round(retry_after, 3))
+            retry_after = min(retry_after, self.client.session.backoff_max)
+            # Throttled sub-requests count against the shared concurrency limit too
+            self.client.session.limiter.record_throttle(sent_at, retry_after)
+            time.sleep(retry_after)
+            remaining = [request for request in remaining if request.id in retry_ids]
+            for request in remaining:
+                # Dependencies that already completed are no longer in this call
+                request.depends_on = [d for d in request.depends_on if d.id in retry_ids]
+
+    @staticmethod
+    def _failed(request: BatchRequest) -> bool:
+        """True if a completed request raised or returned an error status"""
+        if request.future.exception() is not None:
+            return True
+        return request.future.result().status_code >= 400
@@ -1,24 +1,42 @@
 """
 OneDrive client for Microsoft Graph API integration
 """
+import importlib.util
+import io
 import logging
-from typing import Optional, Dict, Any
+import threading
+import time
+from typing import Optional, Dict, Any, BinaryIO, Iterable, List, Union
+from urllib.parse import quote
 
-try:
-    import requests
-    REQUESTS_AVAILABLE = True
-except ImportError:
-    REQUESTS_AVAILABLE = False
+# Requests are sent through the shared GraphSession, which is built on requests
+REQUESTS_AVAILABLE = importlib.util.find_spec("requests") is not None
 
 from config import config
 from modules.utils.logger import log_error_with_traceback, StructuredLogger
+from modules.onedrive.http_session import get_graph_session
+from modules.onedrive.token_manager import TokenManager
+from modules.onedrive.upload_session import ResumableUploader
+from modules.onedrive.batch import GraphBatch
+from modules.onedrive.folder_cache import FolderCache
+from modules.onedrive.delta_index import DeltaSync, DriveIndex
+from modules.onedrive.hashing import hash_content
+from modules.onedrive.upload_index import UploadHashIndex
 
 
 class OneDriveClient:
     """OneDrive client for file operations via Microsoft Graph API"""
     
-    def __init__(self):
-        """Initialize OneDrive client"""
+    def __init__(self, token_manager: Optional[TokenManager] = None, session=None,
+                 drive_index: Optional[DriveIndex] = None):
+        """
+        Initialize OneDrive client
+        
+        Args:
+            token_manager: Access token source (defaults to the shared token cache)
+            session: GraphSession to send requests with (defaults to the shared session)
+            drive_index: Local metadata index (defaults to DRIVE_INDEX_DB_PATH)
+        """
         self.logger = StructuredLogger(__name__)
         
         if not REQUESTS_AVAILABLE:
@@ -33,11 +51,36 @@ class OneDriveClient:
         ]):
             self.logger.warning("Microsoft Graph configuration is incomplete")
         
-        self.access_token: Optional[str] = None
-        self.base_url = "https://graph.microsoft.com/v1.0"
+        self.base_url = config.GRAPH_BASE_URL.rstrip('/')
+        
+        # Shared keep-alive session with timeouts and retries
+        self.session = session or get_graph_session()
+        
+        # Access token shared with the other workers and refreshed before expiry
+        self.token_manager = token_manager or TokenManager()
+        
+        # Chunked upload sessions for files above UPLOAD_SESSION_THRESHOLD
+        self.resumable_uploader = ResumableUploader(self._graph_request, self.session)
+        
+        # Drive paths (including ONEDRIVE_ROOT_FOLDER) to folder item IDs
+        self.folder_cache = FolderCache(ttl_seconds=config.FOLDER_CACHE_TTL)
+        
+        # Local copy of the upload tree, kept current by delta queries
+        self.drive_index = drive_index or DriveIndex()
+        self.delta_sync = DeltaSync(self, self.drive_index)
+        
+        # Content hashes of uploaded files, to skip uploading identical content again
+        self.upload_index = UploadHashIndex()
         
         self.logger.info("OneDrive client initialized")
     
+    @property
+    def access_token(self) -> Optional[str]:
+        """Current access token, refreshed if it is about to expire"""
+        if not REQUESTS_AVAILABLE:
+            return None
+        return self.token_manager.get_token()
+    
     def authenticate(self) -> bool:
         """
         Authenticate with Microsoft Graph API
@@ -48,82 +91,164 @@ class OneDriveClient:
         if not REQUESTS_AVAILABLE:
             self.logger.warning("Cannot authenticate: requests library not available")
             return False
+        
+        if self.token_manager.get_token():
+            self.logger.info("Successfully authenticated with Microsoft Graph")
+            return True
+        return False
+    
+    def _graph_request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None, **kwargs):
+        """
+        Send an authenticated Graph request
+        
+        A 401 response drops the token and the request is sent once more with
+        a fresh one.
+        
+        Args:
+            method: HTTP method
+            url: Request URL
+            headers: Additional request headers
+            **kwargs: Arguments passed to GraphSession.request
             
-        try:
-            # TODO: Implement proper OAuth2 flow for production
-            # For now, this is a placeholder for client credentials flow
+        Returns:
+            Response, or None if no access token could be obtained
+        """
+        body = kwargs.get('data')
+        body_position = body.tell() if hasattr(body, 'seek') else None
+        
+        for attempt in range(2):
+            access_token = self.token_manager.get_token()
+            if not access_token:
+                return None
             
-            auth_url = f"https://login.microsoftonline.com/{config.MICROSOFT_TENANT_ID}/oauth2/v2.0/token"
+            request_headers = dict(headers or {})
+            request_headers['Authorization'] = f'Bearer {access_token}'
+            response = self.session.request(method, url, headers=request_headers, **kwargs)
             
-            data = {
-                'client_id': config.MICROSOFT_CLIENT_ID,
-                'client_secret': config.MICROSOFT_CLIENT_SECRET,
-                'scope': 'https://graph.microsoft.com/.default',
-                'grant_type': 'client_credentials'
-            }
-            
-            response = requests.post(auth_url, data=data)
+            if response.status_code != 401 or attempt == 1:
+                return response
             
-            if response.status_code == 200:
-                token_data = response.json()
-                self.access_token = token_data.get('access_token')
-                self.logger.info("Successfully authenticated with Microsoft Graph")
-                return True
-            else:
-                self.logger.error("Authentication failed", 
-                                status_code=response.status_code,
-                                response=response.text)
-                return False
-                
-        except Exception as e:
-            log_error_with_traceback(
-                logging.getLogger(__name__), 
-                "Authentication error", 
-                e
-            )
-            return False
+            if body_position is not None:
+                body.seek(body_position)
+            self.logger.warning("Access token rejected, refreshing", url=url)
+            self.token_manager.invalidate(access_token)
     
-    def upload_file(self, file_content: bytes, file_name: str, folder_path: str = None) -> Optional[Dict[str, Any]]:
+    def upload_file(self, file_content: Union[bytes, BinaryIO], file_name: str, folder_path: str = None,
+                    resume_key: Optional[str] = None, deduplicate: bool = True,
+                    cancel_event: Optional[threading.Event] = None) -> Optional[Dict[str, Any]]:
         """
         Upload file to OneDrive
         
+        Files larger than UPLOAD_SESSION_THRESHOLD are sent in chunks through an
+        upload session that can be resumed after a failure. With deduplication,
+        content that was uploaded before is not sent again; the existing item
+        is returned with 'deduplicated': True and any cached 'analysis'.
+        Content already stored in another folder is copied there on the server
+        instead of being sent again.
+        
         Args:
-            file_content: File content as bytes
+            file_content: File content as bytes, or a seekable file object that is streamed
             file_name: Name of the file
             folder_path: Optional folder path (defaults to root folder)
+            resume_key: Stable key to resume an interrupted chunked upload
+                        (defaults to the target path and size)
+            deduplicate: Skip the upload if identical content is already stored in
+                         the folder, copy it if stored elsewhere (only when UPLOAD_DEDUP_ENABLED)
+            cancel_event: Abandons the transfer (between chunks for upload sessions) when set
             
         Returns:
-            Upload response or None if failed
+            Upload response (with the content's 'contentHashes' when deduplicating) or None if failed
         """
         if not REQUESTS_AVAILABLE:
             self.logger.warning(f"Cannot upload file '{file_name}': requests library not available")
             return None
             
         try:
-            if not self.access_token:
-                if not self.authenticate():
-                    return None
+            # Address the file through the cached parent folder ID; the path form
+            # is the fallback and lets Graph create missing folders itself
+            parent_path = self._drive_path(folder_path)
+            parent_id = self.ensure_folder(folder_path)
             
-            # Determine upload path
-            if folder_path:
-                upload_path = f"/me/drive/root:/{config.ONEDRIVE_ROOT_FOLDER}/{folder_path}/{file_name}:/content"
+            hashes = None
+            if deduplicate and config.UPLOAD_DEDUP_ENABLED:
+                hashes = hash_content(file_content)
+                # Without the folder ID a duplicate cannot be scoped to the folder
+                existing = self._find_uploaded(hashes, parent_id) if parent_id else None
+                if existing and existing['deduplicated']:
+                    self.logger.info("Identical content already uploaded, skipping transfer",
+                                   file_name=file_name,
+                                   existing_item=existing.get('name'),
+                                   size=hashes['size'])
+                    return existing
+                if existing:
+                    copied = self._copy_item(existing['id'], parent_id, file_name)
+                    if copied:
+                        self.logger.info("Identical content stored in another folder, copied",
+                                       file_name=file_name,
+                                       folder_path=folder_path,
+                                       size=hashes['size'])
+                        self._index_items([copied])
+                        self._record_upload(hashes, copied)
+                        copied['analysis'] = existing['analysis']
+                        return copied
+            if parent_id:
+                item_url = f"{self.base_url}/me/drive/items/{parent_id}:/{quote(file_name, safe='')}"
             else:
-                upload_path = f"/me/drive/root:/{config.ONEDRIVE_ROOT_FOLDER}/{file_name}:/content"
+                item_url = f"{self.base_url}/me/drive/root:/{parent_path}/{file_name}"
             
-            url = f"{self.base_url}{upload_path}"
+            size = self._content_size(file_content)
+            if size is not None and size > config.UPLOAD_SESSION_THRESHOLD:
+                stream = io.BytesIO(file_content) if isinstance(file_content, bytes) else file_content
+                result = self.resumable_uploader.upload(
+                    stream,
+                    size,
+                    f"{item_url}:/createUploadSession",
+                    resume_key or f"{parent_path}/{file_name}:{size}",
+                    cancel_event=cancel_event
+                )
+                if result:
+                    self.logger.info("File uploaded successfully", 
+                                   file_name=file_name,
+                                   folder_path=folder_path,
+                                   size=size)
+                    self._index_items([result])
+                    self._record_upload(hashes, result)
+                elif parent_id:
+                    # The folder may have been moved or deleted; re-resolve next time
+                    self.folder_cache.invalidate(parent_path)
+                return result
+            
+            if cancel_event is not None and cancel_event.is_set():
+                self.logger.info("Upload cancelled", file_name=file_name)
+                return None
             
             headers = {
-                'Authorization': f'Bearer {self.access_token}',
                 'Content-Type': 'application/octet-stream'
             }
             
-            response = requests.put(url, headers=headers, data=file_content)
+            response = self._graph_request('PUT', f"{item_url}:/content", headers=headers, data=file_content)
+            if response is not None and response.status_code == 404 and parent_id:
+                self.logger.warning("Cached folder not found, retrying by path", folder_path=folder_path)
+                self.folder_cache.invalidate(parent_path)
+                if hasattr(file_content, 'seek'):
+                    file_content.seek(0)
+                response = self._graph_request(
+                    'PUT',
+                    f"{self.base_url}/me/drive/root:/{parent_path}/{file_name}:/content",
+                    headers=headers,
+                    data=file_content
+                )
+            if response is None:
+                return None
             
             if response.status_code in [200, 201]:
                 self.logger.info("File uploaded successfully", 
                                file_name=file_name,
                                folder_path=folder_path)
-                return response.json()
+                result = response.json()
+                self._index_items([result])
+                self._record_upload(hashes, result)
+                return result
             else:
                 self.logger.error("File upload failed",
                                 file_name=file_name,
@@ -139,6 +264,284 @@ class OneDriveClient:
             )
             return None
     
+    def _find_uploaded(self, hashes: Dict[str, Any], parent_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Find a stored item with the same content, preferring the target folder
+        
+        Checks the upload hash index, then the drive index's quickXorHash
+        column (files that reached OneDrive some other way), first in the
+        target folder and then anywhere. Candidates are confirmed with Graph
+        so deleted or moved items are not taken for the folder's own.
+        
+        Args:
+            hashes: Result of hash_content
+            parent_id: Item ID of the folder the content is uploaded to
+            
+        Returns:
+            Existing driveItem annotated with 'deduplicated' (True only if it is
+            in the target folder), 'analysis' and 'contentHashes', or None
+        """
+        sha256 = hashes['sha256Hash']
+        known = {}
+        for entry in (self.upload_index.get(sha256, parent_id), self.upload_index.get(sha256)):
+            if entry:
+                known.setdefault(entry['item_id'], entry)
+        analysis = next((entry['analysis'] for entry in known.values() if entry['analysis']), None)
+        
+        candidates = list(known)
+        for scope in (parent_id, None):
+            candidates += [
+                item['id'] for item in self.drive_index.find_by_hash(hashes['quickXorHash'], scope)
+                if item.get('size') == hashes['size'] and item['id'] not in candidates
+            ]
+        
+        for item_id in candidates:
+            response = self._graph_request('GET', f"{self.base_url}/me/drive/items/{item_id}")
+            if response is None:
+                break
+            if response.status_code == 200:
+                item = response.json()
+                same_folder = (item.get('parentReference') or {}).get('id') == parent_id
+                if same_folder or item_id not in known:
+                    self.upload_index.add(hashes, item)
+                self.upload_index.record_hit(hashes['size'])
+                return {
+                    **item,
+                    'deduplicated': same_folder,
+                    'analysis': analysis,
+                    'contentHashes': hashes
+                }
+            if response.status_code == 404:
+                if item_id in known:
+                    self.upload_index.forget(sha256, item_id)
+                continue
+            break
+        
+        self.upload_index.record_miss()
+        return None
+    
+    def _copy_item(self, item_id: str, parent_id: str, file_name: str) -> Optional[Dict[str, Any]]:
+        """
+        Copy a stored item into a folder on the server
+        
+        Graph copies asynchronously; the monitor URL is polled for up to
+        UPLOAD_COPY_TIMEOUT seconds.
+        
+        Args:
+            item_id: Item to copy
+            parent_id: Destination folder item ID
+            file_name: Name of the copy (renamed if taken)
+            
+        Returns:
+            driveItem of the copy, or None if the copy failed or did not finish in time
+        """
+        response = self._graph_request(
+            'POST',
+            f"{self.base_url}/me/drive/items/{item_id}/copy",
+            params={'@microsoft.graph.conflictBehavior': 'rename'},
+            json={'parentReference': {'id': parent_id}, 'name': file_name}
+        )
+        if response is None or response.status_code != 202 or not response.headers.get('Location'):
+            self.logger.warning("Copy request failed, uploading instead",
+                              file_name=file_name,
+                              status_code=response.status_code if response is not None else None)
+            return None
+        
+        monitor_url = response.headers['Location']
+        deadline = time.monotonic() + config.UPLOAD_COPY_TIMEOUT
+        delay = 0.2
+        while True:
+            # The monitor URL is pre-authenticated and rejects a bearer token
+            status = self.session.request('GET', monitor_url)
+            progress = status.json() if status.status_code in (200, 202) else {}
+            if progress.get('status') == 'completed' and progress.get('resourceId'):
+                item = self._graph_request('GET', f"{self.base_url}/me/drive/items/{progress['resourceId']}")
+                return item.json() if item is not None and item.status_code == 200 else None
+            if progress.get('status') not in ('notStarted', 'inProgress', 'waiting') or time.monotonic() >= deadline:
+                self.logger.warning("Copy did not complete, uploading instead",
+                                  file_name=file_name,
+                                  status=progress.get('status'))
+                return None
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+    
+    def _record_upload(self, hashes: Optional[Dict[str, Any]], result: Dict[str, Any]):
+        """Remember the hashes of uploaded content and attach them to the result"""
+        if not hashes:
+            return
+        result['contentHashes'] = hashes
+        try:
+            self.upload_index.add(hashes, result)
+        except Exception as e:
+            log_error_with_traceback(logging.getLogger(__name__), "Upload hash index update error", e)
+    
+    def record_analysis(self, content_hashes: Dict[str, Any], analysis: Dict[str, Any]) -> bool:
+        """
+        Cache an analysis result for uploaded content, returned again for duplicates
+        
+        Args:
+            content_hashes: 'contentHashes' from an upload_file result
+            analysis: Analysis result
+            
+        Returns:
+            True if the content was known
+        """
+        if not REQUESTS_AVAILABLE or not content_hashes:
+            return False
+        return self.upload_index.set_analysis(content_hashes['sha256Hash'], analysis)
+    
+    @staticmethod
+    def _drive_path(folder_path: Optional[str] = None) -> str:
+        """Drive path of a folder under ONEDRIVE_ROOT_FOLDER"""
+        return FolderCache.normalize(f"{config.ONEDRIVE_ROOT_FOLDER}/{folder_path or ''}")
+    
+    def ensure_folder(self, folder_path: Optional[str] = None) -> Optional[str]:
+        """
+        Get the item ID of a folder, creating only the segments that are missing
+        
+        Resolved IDs are cached for FOLDER_CACHE_TTL seconds. Existing folders
+        are never duplicated, unlike create_folder's 'rename' behaviour.
+        
+        Args:
+            folder_path: Folder path under the root folder (defaults to the root folder)
+            
+        Returns:
+            Folder item ID or None if it could not be resolved
+        """
+        if not REQUESTS_AVAILABLE:
+            return None
+        
+        drive_path = self._drive_path(folder_path)
+        cached = self.folder_cache.get(drive_path)
+        if cached:
+            return cached
+        
+        try:
+            for _ in range(2):
+                item_id, stale = self._resolve_folder(drive_path)
+                if not stale:
+                    return item_id
+            return None
+        except Exception as e:
+            log_error_with_traceback(
+                logging.getLogger(__name__), 
+                f"Folder resolution error for {folder_path}", 
+                e
+            )
+            return None
+    
+    def _resolve_folder(self, drive_path: str):
+        """
+        Look up a folder by path, creating missing segments below the deepest existing ancestor
+        
+        Uncached ancestors are looked up together in one $batch call, and the
+        missing segments are created in another, each POST depending on its
+        parent's through dependsOn.
+        
+        Returns:
+            (item ID or None, True if a cached ancestor turned out to be stale
+            or a segment was created concurrently, so resolving again may succeed)
+        """
+        # Common case: the folder exists, one request
+        response = self._graph_request('GET', f"{self.base_url}/me/drive/root:/{drive_path}")
+        if response is None:
+            return None, False
+        if response.status_code == 200:
+            item_id = response.json()['id']
+            self.folder_cache.set(drive_path, item_id)
+            return item_id, False
+        if response.status_code != 404:
+            self.logger.error("Folder lookup failed",
+                            folder_path=drive_path,
+                            status_code=response.status_code,
+                            response=response.text)
+            return None, False
+        
+        prefix, parent_id = self.folder_cache.deepest_ancestor(drive_path)
+        parts = drive_path.split('/')
+        depth = len(prefix.split('/')) if prefix else 0
+        
+        # Find the deepest ancestor that exists but is not cached
+        if len(parts) - depth > 1:
+            with self.batch() as batch:
+                lookups = [
+                    batch.add('GET', quote(f"/me/drive/root:/{'/'.join(parts[:end])}", safe="/:"))
+                    for end in range(depth + 1, len(parts))
+                ]
+            for request in lookups:
+                response = request.future.result() if request.future.exception() is None else None
+                if response is None or response.status_code != 200:
+                    break
+                item = response.json()
+                depth += 1
+                prefix, parent_id = '/'.join(parts[:depth]), item['id']
+                self.folder_cache.set(prefix, parent_id)
+                self._index_items([item])
+        
+        creates = []
+        with self.batch() as batch:
+            for end in range(depth, len(parts)):
+                if creates:
+                    children_url = quote(f"/me/drive/root:/{'/'.join(parts[:end])}", safe="/:") + ":/children"
+                elif parent_id:
+                    children_url = f"/me/drive/items/{parent_id}/children"
+                else:
+                    children_url = "/me/drive/root/children"
+                creates.append(batch.add(
+                    'POST',
+                    children_url,
+                    body={
+                        'name': parts[end],
+                        'folder': {},
+                        '@microsoft.graph.conflictBehavior': 'fail'
+                    },
+                    depends_on=creates[-1:]
+                ))
+        
+        for end, request in enumerate(creates, start=depth + 1):
+            try:
+                response = request.future.result()
+            except Exception as e:
+                self.logger.error("Folder creation failed", folder_path='/'.join(parts[:end]), error=str(e))
+                return None, False
+            
+            if response.status_code == 409:
+                # Created concurrently by another worker; it is found by the next lookup
+                return None, True
+            
+            if response.status_code == 404 and end == depth + 1 and parent_id:
+                self.folder_cache.invalidate(prefix)
+                return None, True
+            
+            if response.status_code not in (200, 201):
+                self.logger.error("Folder creation failed",
+                                folder_name=parts[end - 1],
+                                parent_path='/'.join(parts[:end - 1]),
+                                status_code=response.status_code,
+                                response=response.text)
+                return None, False
+            
+            item = response.json()
+            parent_id = item['id']
+            self.folder_cache.set('/'.join(parts[:end]), parent_id)
+            self._index_items([item])
+        
+        self.logger.info("Folder ensured", folder_path=drive_path, created=len(creates))
+        return parent_id, False
+    
+    @staticmethod
+    def _content_size(file_content: Union[bytes, BinaryIO]) -> Optional[int]:
+        """Get the remaining size of bytes or a seekable file object"""
+        if isinstance(file_content, (bytes, bytearray)):
+            return len(file_content)
+        try:
+            position = file_content.tell()
+            size = file_content.seek(0, io.SEEK_END) - position
+            file_content.seek(position)
+            return size
+        except (AttributeError, OSError, ValueError):
+            return None
+    
     def create_folder(self, folder_name: str, parent_path: str = None) -> Optional[Dict[str, Any]]:
         """
         Create folder in OneDrive
@@ -155,28 +558,21 @@ class OneDriveClient:
             return None
             
         try:
-            if not self.access_token:
-                if not self.authenticate():
-                    return None
-            
             # Determine parent path
             if parent_path:
                 url = f"{self.base_url}/me/drive/root:/{config.ONEDRIVE_ROOT_FOLDER}/{parent_path}:/children"
             else:
                 url = f"{self.base_url}/me/drive/root:/{config.ONEDRIVE_ROOT_FOLDER}:/children"
             
-            headers = {
-                'Authorization': f'Bearer {self.access_token}',
-                'Content-Type': 'application/json'
-            }
-            
             data = {
                 'name': folder_name,
                 'folder': {},
                 '@microsoft.graph.conflictBehavior': 'rename'
             }
             
-            response = requests.post(url, headers=headers, json=data)
+            response = self._graph_request('POST', url, json=data)
+            if response is None:
+                return None
             
             if response.status_code in [200, 201]:
                 self.logger.info("Folder created successfully", 
@@ -198,12 +594,16 @@ class OneDriveClient:
             )
             return None
     
-    def list_files(self, folder_path: str = None) -> Optional[list]:
+    def list_files(self, folder_path: str = None, use_index: bool = True) -> Optional[list]:
         """
         List files in OneDrive folder
         
+        Answered from the drive index when it has synced recently, otherwise
+        from Graph (following @odata.nextLink pages).
+        
         Args:
             folder_path: Folder path (defaults to root)
+            use_index: Allow answering from the local drive index
             
         Returns:
             List of files or None if failed
@@ -213,9 +613,11 @@ class OneDriveClient:
             return None
             
         try:
-            if not self.access_token:
-                if not self.authenticate():
-                    return None
+            drive_path = self._drive_path(folder_path)
+            if use_index and self.drive_index.is_fresh(config.DRIVE_INDEX_MAX_AGE):
+                children = self.drive_index.list_children(drive_path)
+                if children is not None:
+                    return children
             
             # Determine folder path
             if folder_path:
@@ -223,15 +625,20 @@ class OneDriveClient:
             else:
                 url = f"{self.base_url}/me/drive/root:/{config.ONEDRIVE_ROOT_FOLDER}:/children"
             
-            headers = {
-                'Authorization': f'Bearer {self.access_token}'
-            }
-            
-            response = requests.get(url, headers=headers)
+            # Prefer the cached folder ID over re-resolving the path
+            folder_id = self.folder_cache.get(drive_path)
+            if folder_id:
+                response = self._graph_request('GET', f"{self.base_url}/me/drive/items/{folder_id}/children")
+                if response is not None and response.status_code == 404:
+                    self.folder_cache.invalidate(drive_path)
+                    response = self._graph_request('GET', url)
+            else:
+                response = self._graph_request('GET', url)
+            if response is None:
+                return None
             
             if response.status_code == 200:
-                data = response.json()
-                return data.get('value', [])
+                return self._collect_pages(response.json(), folder_path)
             else:
                 self.logger.error("File listing failed",
                                 folder_path=folder_path,
@@ -247,7 +654,218 @@ class OneDriveClient:
             )
             return None
     
+    def _collect_pages(self, data: Dict[str, Any], folder_path: Optional[str] = None) -> Optional[list]:
+        """
+        Gather a collection response and the pages behind its @odata.nextLink
+        
+        Args:
+            data: First page of the collection
+            folder_path: Folder being listed (for logging)
+            
+        Returns:
+            All items, or None if a later page failed
+        """
+        items = list(data.get('value', []))
+        next_link = data.get('@odata.nextLink')
+        while next_link:
+            response = self._graph_request('GET', next_link)
+            if response is None or response.status_code != 200:
+                self.logger.error("File listing page failed",
+                                folder_path=folder_path,
+                                status_code=getattr(response, 'status_code', None))
+                return None
+            data = response.json()
+            items.extend(data.get('value', []))
+            next_link = data.get('@odata.nextLink')
+        return items
+    
+    def _index_items(self, items: List[Dict[str, Any]]):
+        """Write API results through to the drive index without failing the caller"""
+        try:
+            self.drive_index.apply(items)
+        except Exception as e:
+            log_error_with_traceback(logging.getLogger(__name__), "Drive index update error", e)
+    
+    def recent_files(self, folder_path: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Get recently modified files from the local drive index
+        
+        Args:
+            folder_path: Folder path under the root folder (defaults to the root folder)
+            limit: Maximum number of files
+            
+        Returns:
+            driveItems, newest first (empty until the index has synced)
+        """
+        if not REQUESTS_AVAILABLE:
+            return []
+        return self.drive_index.recent_files(self._drive_path(folder_path), limit)
+    
+    def start_index_sync(self):
+        """Start keeping the drive index current in the background (in one worker process at a time)"""
+        if REQUESTS_AVAILABLE:
+            self.delta_sync.start()
+    
+    def batch(self) -> GraphBatch:
+        """
+        Start a $batch request collection
+        
+        Usage:
+            with client.batch() as batch:
+                request = batch.add('GET', '/me/drive/root/children')
+            response = request.future.result()
+        
+        Returns:
+            GraphBatch that sends its requests when the block exits
+        """
+        return GraphBatch(self)
+    
+    @staticmethod
+    def _batch_item_url(folder_path: Optional[str] = None) -> str:
+        """Percent-encoded item URL under the root folder for use inside $batch"""
+        path = f"{config.ONEDRIVE_ROOT_FOLDER}/{folder_path}" if folder_path else config.ONEDRIVE_ROOT_FOLDER
+        return quote(f"/me/drive/root:/{path}", safe="/:")
+    
+    def create_folder_tree(self, folder_paths: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Create folder paths (and their parents) with as few $batch calls as possible
+        
+        Each folder depends on its parent through dependsOn. Existing folders
+        are kept (no "Folder 1" duplicates) and returned as they are.
+        
+        Args:
+            folder_paths: Folder paths relative to the root folder, e.g. ['2024-05/contractor_a']
+            
+        Returns:
+            Mapping of every folder path (including parents) to its driveItem, or None if failed
+        """
+        if not REQUESTS_AVAILABLE:
+            self.logger.warning("Cannot create folders: requests library not available")
+            return {}
+        
+        segments = []
+        for folder_path in folder_paths:
+            parts = [part for part in folder_path.strip('/').split('/') if part]
+            for depth in range(1, len(parts) + 1):
+                segment = '/'.join(parts[:depth])
+                if segment not in segments:
+                    segments.append(segment)
+        
+        results: Dict[str, Optional[Dict[str, Any]]] = {}
+        existing = []
+        todo = segments
+        
+        # A child of an existing folder fails with 424 (its parent's create got 409);
+        # it is resent in the next round, when the parent is known to exist
+        while todo:
+            requests_by_path = {}
+            with self.batch() as batch:
+                for segment in todo:
+                    parent, _, name = segment.rpartition('/')
+                    requests_by_path[segment] = batch.add(
+                        'POST',
+                        f"{self._batch_item_url(parent or None)}:/children",
+                        body={
+                            'name': name,
+                            'folder': {},
+                            '@microsoft.graph.conflictBehavior': 'fail'
+                        },
+                        depends_on=[requests_by_path[parent]] if parent in requests_by_path else None
+                    )
+            
+            retry = []
+            for segment, request in requests_by_path.items():
+                try:
+                    response = request.future.result()
+                except Exception as e:
+                    self.logger.error("Folder creation failed", folder_path=segment, error=str(e))
+                    results[segment] = None
+                    continue
+                
+                if response.status_code in (200, 201):
+                    results[segment] = response.json()
+                    self.folder_cache.set(self._drive_path(segment), results[segment]['id'])
+                elif response.status_code == 409:
+                    existing.append(segment)
+                elif response.status_code == 424:
+                    retry.append(segment)
+                else:
+                    self.logger.error("Folder creation failed",
+                                    folder_path=segment,
+                                    status_code=response.status_code,
+                                    response=response.text)
+                    results[segment] = None
+            
+            if len(retry) == len(todo):
+                # No progress; should not happen since the first folder has no dependency
+                results.update({segment: None for segment in retry})
+                break
+            todo = retry
+        
+        if existing:
+            with self.batch() as batch:
+                lookups = {segment: batch.add('GET', self._batch_item_url(segment)) for segment in existing}
+            for segment, request in lookups.items():
+                response = request.future.result() if request.future.exception() is None else None
+                results[segment] = response.json() if response and response.status_code == 200 else None
+                if results[segment]:
+                    self.folder_cache.set(self._drive_path(segment), results[segment]['id'])
+        
+        self.logger.info("Folder tree ensured",
+                       folders=len(segments),
+                       created=len(segments) - len(existing))
+        return results
+    
+    def list_files_many(self, folder_paths: Iterable[str]) -> Dict[str, Optional[list]]:
+        """
+        List several folders using $batch calls of up to 20 folders each
+        
+        Args:
+            folder_paths: Folder paths relative to the root folder
+            
+        Returns:
+            Mapping of folder path to its children, or None if the listing failed
+        """
+        if not REQUESTS_AVAILABLE:
+            self.logger.warning("Cannot list files: requests library not available")
+            return {}
+        
+        with self.batch() as batch:
+            requests_by_path = {
+                folder_path: batch.add('GET', f"{self._batch_item_url(folder_path)}:/children")
+                for folder_path in dict.fromkeys(folder_paths)
+            }
+        
+        results: Dict[str, Optional[list]] = {}
+        for folder_path, request in requests_by_path.items():
+            if request.future.exception() is not None:
+                results[folder_path] = None
+                continue
+            response = request.future.result()
+            if response.status_code == 200:
+                results[folder_path] = self._collect_pages(response.json(), folder_path)
+            else:
+                self.logger.error("File listing failed",
+                                folder_path=folder_path,
+                                status_code=response.status_code)
+                results[folder_path] = None
+        return results
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get Graph API call statistics"""
+        if not REQUESTS_AVAILABLE:
+            return {}
+        return {
+            "http": self.session.stats(),
+            "token": self.token_manager.stats(),
+            "folder_cache": self.folder_cache.stats(),
+            "drive_index": self.drive_index.stats(),
+            "upload_dedup": self.upload_index.stats()
+        }
+    
     def cleanup(self):
         """Cleanup resources"""
-        self.access_token = None
+        if REQUESTS_AVAILABLE:
+            self.delta_sync.stop()
+            self.token_manager.close()
         self.logger.info("OneDrive client cleaned up")
\ No newline at end of file
@@ -0,0 +1,461 @@
+"""
+Local SQLite index of the OneDrive upload tree, kept current with delta queries
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+from urllib.parse import unquote
+
+from config import config
+from modules.utils.logger import StructuredLogger, log_error_with_traceback
+from modules.utils.sqlite import connect_sqlite
+
+
+def parent_reference_path(item: Dict[str, Any]) -> Optional[str]:
+    """
+    Get the drive path of an item's parent from parentReference.path
+
+    Args:
+        item: driveItem JSON; e.g. parentReference.path '/drive/root:/LineBot_Uploads/u1'
+
+    Returns:
+        Parent path relative to the drive root ('' for the root), or None if not given
+    """
+    path = (item.get('parentReference') or {}).get('path')
+    if path is None or ':' not in path:
+        return None
+    return unquote(path.split(':', 1)[1]).strip('/')
+
+
+class DriveIndex:
+    """SQLite copy of driveItem metadata keyed by item ID and drive path"""
+
+    def __init__(self, db_path: Union[str, Path, None] = None):
+        """
+        Initialize the index
+
+        Args:
+            db_path: Database file (defaults to DRIVE_INDEX_DB_PATH)
+        """
+        self._lock = threading.RLock()
+        self._conn = connect_sqlite(db_path or config.DRIVE_INDEX_DB_PATH)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS drive_items ("
+            " id TEXT PRIMARY KEY,"
+            " parent_id TEXT,"
+            " name TEXT NOT NULL,"
+            " path TEXT NOT NULL,"
+            " is_folder INTEGER NOT NULL,"
+            " size INTEGER,"
+            " quick_xor_hash TEXT,"
+            " modified_at TEXT,"
+            " generation INTEGER NOT NULL DEFAULT 0,"
+            " data TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS drive_items_path ON drive_items (path);"
+            "CREATE INDEX IF NOT EXISTS drive_items_parent ON drive_items (parent_id, name);"
+            "CREATE INDEX IF NOT EXISTS drive_items_hash ON drive_items (quick_xor_hash);"
+            "CREATE INDEX IF NOT EXISTS drive_items_modified ON drive_items (modified_at);"
+            "CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT);"
+            "CREATE TABLE IF NOT EXISTS sync_lease ("
+            " name TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " expires_at REAL NOT NULL);"
+        )
+
+    # Sync state
+
+    def get_state(self, key: str) -> Optional[str]:
+        """Get a persisted sync value (delta link, root ID, ...)"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
+    def set_state(self, key: str, value: Optional[str]):
+        """Persist a sync value, or remove it when value is None"""
+        with self._lock:
+            if value is None:
+                self._conn.execute("DELETE FROM sync_state WHERE key = ?", (key,))
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value)
+                )
+
+    def acquire_lease(self, owner: str, seconds: float, name: str = 'delta') -> bool:
+        """
+        Take or renew a lease shared by every process using this index file
+
+        Args:
+            owner: Identifies the holder (unique per process)
+            seconds: Lease duration; a holder that stops renewing loses it after this
+            name: Lease name
+
+        Returns:
+            True if the lease is now held by owner
+        """
+        now = time.time()
+        with self._lock:
+            return self._conn.execute(
+                "INSERT INTO sync_lease (name, owner, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at"
+                " WHERE sync_lease.owner = excluded.owner OR sync_lease.expires_at <= ?",
+                (name, owner, now + seconds, now)
+            ).rowcount > 0
+
+    def release_lease(self, owner: str, name: str = 'delta'):
+        """Give up a lease so another process can take it without waiting for expiry"""
+        with self._lock:
+            self._conn.execute("DELETE FROM sync_lease WHERE name = ? AND owner = ?", (name, owner))
+
+    @property
+    def generation(self) -> int:
+        return int(self.get_state('generation') or 0)
+
+    def begin_full_sync(self) -> int:
+        """
+        Start a full enumeration; rows not seen again are dropped by finish_full_sync
+
+        Returns:
+            New generation number
+        """
+        generation = self.generation + 1
+        self.set_state('generation', str(generation))
+        self.set_state('delta_link', None)
+        return generation
+
+    def finish_full_sync(self) -> int:
+        """
+        Drop rows left over from before the last full enumeration
+
+        Returns:
+            Number of rows removed
+        """
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM drive_items WHERE generation < ?", (self.generation,)
+            ).rowcount
+
+    def last_sync(self) -> Optional[float]:
+        """Time of the last completed sync, or None if never synced"""
+        value = self.get_state('last_sync')
+        return float(value) if value else None
+
+    def is_fresh(self, max_age: float) -> bool:
+        """True if a sync completed within the last `max_age` seconds"""
+        last_sync = self.last_sync()
+        return last_sync is not None and time.time() - last_sync <= max_age
+
+    # Updates
+
+    def apply(self, items: Iterable[Dict[str, Any]], root_id: Optional[str] = None,
+              root_path: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Apply driveItems from a delta page or an API response
+
+        An item's path comes from parentReference.path when Graph includes it,
+        otherwise from its parent's row (delta responses omit the path).
+
+        Args:
+            items: driveItem JSON objects
+            root_id: ID of the folder the delta query is rooted at
+            root_path: Drive path of that folder
+
+        Returns:
+            Items whose parent is not indexed yet; pass them again later
+        """
+        unresolved = []
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                generation = self.generation
+                pending = list(items)
+                # Parents usually precede children, but retry until no progress is made
+                while pending:
+                    unresolved = [item for item in pending if not self._apply_item(item, generation, root_id, root_path)]
+                    if len(unresolved) == len(pending):
+                        break
+                    pending = unresolved
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return unresolved
+
+    def _apply_item(self, item: Dict[str, Any], generation: int,
+                    root_id: Optional[str], root_path: Optional[str]) -> bool:
+        """Upsert or delete one item; False if its path cannot be determined yet"""
+        item_id = item['id']
+        if 'deleted' in item:
+            self._delete(item_id)
+            return True
+
+        parent_id = (item.get('parentReference') or {}).get('id')
+        if item_id == root_id and root_path is not None:
+            path = root_path
+        elif 'root' in item:
+            path = ''
+        else:
+            parent_path = parent_reference_path(item)
+            if parent_path is None and parent_id:
+                row = self._conn.execute("SELECT path FROM drive_items WHERE id = ?", (parent_id,)).fetchone()
+                parent_path = row['path'] if row else None
+            if parent_path is None:
+                return False
+            path = f"{parent_path}/{item['name']}" if parent_path else item['name']
+
+        previous = self._conn.execute("SELECT path FROM drive_items WHERE id = ?", (item_id,)).fetchone()
+        if previous and previous['path'] != path:
+            # Renamed or moved folder: carry its descendants along
+            old_prefix = previous['path'] + '/'
+            self._conn.execute(
+                "UPDATE drive_items SET path = ? || substr(path, ?)"
+                " WHERE substr(path, 1, ?) = ?",
+                (path + '/', len(old_prefix) + 1, len(old_prefix), old_prefix)
+            )
+
+        data = {key: value for key, value in item.items() if not key.startswith('@')}
+        self._conn.execute(
+            "INSERT OR REPLACE INTO drive_items"
+            " (id, parent_id, name, path, is_folder, size, quick_xor_hash, modified_at, generation, data)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                item_id,
+                parent_id,
+                item.get('name', ''),
+                path,
+                1 if 'folder' in item or 'root' in item else 0,
+                item.get('size'),
+                ((item.get('file') or {}).get('hashes') or {}).get('quickXorHash'),
+                item.get('lastModifiedDateTime'),
+                generation,
+                json.dumps(data, ensure_ascii=False)
+            )
+        )
+        return True
+
+    def _delete(self, item_id: str):
+        """Remove an item and everything below it"""
+        row = self._conn.execute("SELECT path FROM drive_items WHERE id = ?", (item_id,)).fetchone()
+        self._conn.execute("DELETE FROM drive_items WHERE id = ?", (item_id,))
+        if row:
+            prefix = row['path'] + '/'
+            self._conn.execute(
+                "DELETE FROM drive_items WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)
+            )
+
+    def clear(self):
+        """Drop all items and sync state"""
+        with self._lock:
+            self._conn.execute("DELETE FROM drive_items")
+            self._conn.execute("DELETE FROM sync_state")
+
+    # Queries
+
+    def _items(self, sql: str, params: tuple) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Get an item by drive path
+
+        Args:
+            path: Path relative to the drive root, e.g. 'LineBot_Uploads/u1/a.jpg'
+
+        Returns:
+            driveItem JSON or None if not indexed
+        """
+        items = self._items("SELECT data FROM drive_items WHERE path = ?", (path.strip('/'),))
+        return items[0] if items else None
+
+    def list_children(self, path: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        List a folder's children
+
+        Args:
+            path: Folder path relative to the drive root
+
+        Returns:
+            driveItems ordered by name, or None if the folder is not indexed
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM drive_items WHERE path = ? AND is_folder = 1", (path.strip('/'),)
+            ).fetchone()
+        if row is None:
+            return None
+        return self._items(
+            "SELECT data FROM drive_items WHERE parent_id = ? ORDER BY name", (row['id'],)
+        )
+
+    def find_by_hash(self, quick_xor_hash: str, parent_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Find files with the given quickXorHash (duplicate checks), optionally in one folder"""
+        if parent_id is None:
+            return self._items(
+                "SELECT data FROM drive_items WHERE quick_xor_hash = ?", (quick_xor_hash,)
+            )
+        return self._items(
+            "SELECT data FROM drive_items WHERE quick_xor_hash = ? AND parent_id = ?",
+            (quick_xor_hash, parent_id)
+        )
+
+    def recent_files(self, path: str = '', limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Get the most recently modified files under a folder
+
+        Args:
+            path: Folder path relative to the drive root ('' for everything)
+            limit: Maximum number of files
+
+        Returns:
+            driveItems, newest first
+        """
+        prefix = path.strip('/') + '/' if path.strip('/') else ''
+        return self._items(
+            "SELECT data FROM drive_items WHERE is_folder = 0 AND substr(path, 1, ?) = ?"
+            " ORDER BY modified_at DESC LIMIT ?",
+            (len(prefix), prefix, limit)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Get item counts and sync status"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS items, COALESCE(SUM(is_folder), 0) AS folders FROM drive_items"
+            ).fetchone()
+        last_sync = self.last_sync()
+        return {
+            "items": row['items'],
+            "folders": row['folders'],
+            "files": row['items'] - row['folders'],
+            "last_sync": last_sync,
+            "sync_age_seconds": round(time.time() - last_sync, 1) if last_sync else None,
+        }
+
+
+class DeltaSync:
+    """
+    Pulls changes under ONEDRIVE_ROOT_FOLDER into a DriveIndex with delta queries
+
+    Every worker process starts the background sync, but only the one holding
+    the index's lease (renewed each round, DRIVE_INDEX_SYNC_LEASE seconds)
+    runs it; the others read the shared index and take over if it lapses.
+    """
+
+    # Seconds to wait after a failed sync before trying again
+    RETRY_INTERVAL = 60
+
+    def __init__(self, client, index: DriveIndex, interval: Optional[float] = None,
+                 lease_seconds: Optional[float] = None):
+        """
+        Initialize the sync
+
+        Args:
+            client: OneDriveClient used for the delta requests
+            index: Index to update
+            interval: Seconds between background syncs (defaults to DRIVE_INDEX_SYNC_INTERVAL)
+            lease_seconds: Background sync lease duration (defaults to DRIVE_INDEX_SYNC_LEASE)
+        """
+        self.logger = StructuredLogger(__name__)
+        self.client = client
+        self.index = index
+        self.interval = config.DRIVE_INDEX_SYNC_INTERVAL if interval is None else interval
+        self.lease_seconds = config.DRIVE_INDEX_SYNC_LEASE if lease_seconds is None else lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sync(self) -> Optional[Dict[str, int]]:
+        """
+        Apply all changes since the saved delta link (a full enumeration the first time)
+
+        Returns:
+            Counts of pages and items applied, or None if the sync failed
+        """
+        with self._sync_lock:
+            root_path = self.client._drive_path()
+            root_id = self.client.ensure_folder()
+            if root_id is None:
+                return None
+            if self.index.get_state('root_id') != root_id:
+                # The upload folder was replaced; its old contents are no longer valid
+                self.index.clear()
+                self.index.set_state('root_id', root_id)
+
+            url = self.index.get_state('delta_link')
+            full = url is None
+            if full:
+                self.index.begin_full_sync()
+                url = f"{self.client.base_url}/me/drive/items/{root_id}/delta"
+
+            pages = 0
+            applied = 0
+            unresolved: List[Dict[str, Any]] = []
+            while url:
+                response = self.client._graph_request('GET', url)
+                if response is None:
+                    return None
+                if response.status_code == 410 and not full:
+                    # Delta token expired: enumerate everything again
+                    self.logger.warning("Delta token expired, resyncing drive index")
+                    full = True
+                    self.index.begin_full_sync()
+                    url = f"{self.client.base_url}/me/drive/items/{root_id}/delta"
+                    continue
+                if response.status_code != 200:
+                    self.logger.error("Delta query failed",
+                                    status_code=response.status_code,
+                                    response=response.text)
+                    return None
+
+                data = response.json()
+                items = data.get('value', [])
+                unresolved = self.index.apply(unresolved + items, root_id=root_id, root_path=root_path)
+                pages += 1
+                applied += len(items)
+                url = data.get('@odata.nextLink')
+                if not url:
+                    self.index.set_state('delta_link', data.get('@odata.deltaLink'))
+
+            if unresolved:
+                self.logger.warning("Delta items without an indexed parent were skipped", count=len(unresolved))
+            removed = self.index.finish_full_sync() if full else 0
+            self.index.set_state('last_sync', str(time.time()))
+            self.logger.debug("Drive index synced", pages=pages, items=applied, full=full)
+            return {"pages": pages, "items": applied, "removed": removed, "full": int(full)}
+
+    def start(self):
+        """Start syncing in the background every `interval` seconds"""
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sync_loop, name="drive-index-sync", daemon=True)
+        self._thread.start()
+
+    def _sync_loop(self):
+        while not self._stop.is_set():
+            try:
+                if not self.index.acquire_lease(self.owner, self.lease_seconds):
+                    # Another worker process keeps the shared index current
+                    self._stop.wait(self.interval)
+                    continue
+                result = self.sync()
+            except Exception as e:
+                log_error_with_traceback(logging.getLogger(__name__), "Drive index sync error", e)
+                result = None
+            self._stop.wait(self.interval if result is not None else min(self.interval, self.RETRY_INTERVAL))
+
+    def stop(self):
+        """Stop the background sync"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+            self.index.release_lease(self.owner)
@@ -0,0 +1,97 @@
+"""
+Folder path to driveItem ID cache
+"""
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+class FolderCache:
+    """Thread-safe TTL cache mapping folder paths to driveItem IDs"""
+
+    def __init__(self, ttl_seconds: float = 3600):
+        """
+        Initialize the cache
+
+        Args:
+            ttl_seconds: How long a resolved folder ID is trusted
+        """
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def normalize(path: str) -> str:
+        """Strip surrounding and duplicate slashes"""
+        return '/'.join(part for part in path.split('/') if part)
+
+    def get(self, path: str) -> Optional[str]:
+        """
+        Get the cached item ID for a path
+
+        Args:
+            path: Folder path
+
+        Returns:
+            Item ID, or None if unknown or expired
+        """
+        path = self.normalize(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry[1] > time.monotonic():
+                self._hits += 1
+                return entry[0]
+            if entry:
+                del self._entries[path]
+            self._misses += 1
+            return None
+
+    def deepest_ancestor(self, path: str) -> Tuple[str, Optional[str]]:
+        """
+        Find the longest cached prefix of a path (including the path itself)
+
+        Args:
+            path: Folder path
+
+        Returns:
+            (prefix, item ID), or ('', None) if no prefix is cached
+        """
+        parts = self.normalize(path).split('/')
+        now = time.monotonic()
+        with self._lock:
+            for depth in range(len(parts), 0, -1):
+                prefix = '/'.join(parts[:depth])
+                entry = self._entries.get(prefix)
+                if entry and entry[1] > now:
+                    return prefix, entry[0]
+        return '', None
+
+    def set(self, path: str, item_id: str):
+        """Cache the item ID of a folder path"""
+        with self._lock:
+            self._entries[self.normalize(path)] = (item_id, time.monotonic() + self.ttl_seconds)
+
+    def invalidate(self, path: str):
+        """
+        Drop a path and everything below it (e.g. after a 404)
+
+        Args:
+            path: Folder path
+        """
+        path = self.normalize(path)
+        prefix = path + '/'
+        with self._lock:
+            for key in [key for key in self._entries if key == path or key.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Get hit/miss counters"""
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self._hits, "misses": self._misses}
@@ -0,0 +1,138 @@
+"""
+Content hashes used to recognize files that were already uploaded
+"""
+import base64
+import hashlib
+from typing import BinaryIO, Dict, Optional, Union
+
+from config import config
+
+
+class QuickXorHash:
+    """
+    OneDrive's quickXorHash, with a hashlib-style interface
+
+    Byte n of the input is XORed into a 160-bit ring at bit offset
+    (11 * n) % 160, and the input length is XORed into the last 8 bytes.
+    Because the offset only depends on n % 160, each chunk is first folded
+    into a single 160-byte block with big-integer XORs (done in C), and the
+    per-byte placement runs once, in digest().
+    """
+
+    WIDTH_IN_BITS = 160
+    SHIFT = 11
+    BLOCK_SIZE = WIDTH_IN_BITS  # bytes that share one set of bit offsets
+
+    _RING_MASK = (1 << WIDTH_IN_BITS) - 1
+    _BLOCK_BITS = BLOCK_SIZE * 8
+    _BLOCK_MASK = (1 << _BLOCK_BITS) - 1
+
+    name = "quickxorhash"
+    digest_size = WIDTH_IN_BITS // 8
+
+    def __init__(self, data: bytes = b""):
+        self._folded = 0
+        self._length = 0
+        if data:
+            self.update(data)
+
+    def update(self, data: bytes):
+        """Add bytes to the hash"""
+        if not data:
+            return
+        # Shift the chunk so every byte sits at its global position modulo 160
+        value = int.from_bytes(data, "little") << (8 * (self._length % self.BLOCK_SIZE))
+        blocks = (len(data) + self._length % self.BLOCK_SIZE + self.BLOCK_SIZE - 1) // self.BLOCK_SIZE
+        while blocks > 1:
+            half = (blocks + 1) // 2
+            bits = half * self._BLOCK_BITS
+            value = (value & ((1 << bits) - 1)) ^ (value >> bits)
+            blocks = half
+        self._folded ^= value
+        self._length += len(data)
+
+    def digest(self) -> bytes:
+        """Get the 20-byte hash"""
+        ring = 0
+        folded = self._folded
+        for index in range(self.BLOCK_SIZE):
+            byte = folded & 0xFF
+            folded >>= 8
+            if byte:
+                offset = (index * self.SHIFT) % self.WIDTH_IN_BITS
+                shifted = byte << offset
+                ring ^= (shifted | (shifted >> self.WIDTH_IN_BITS)) & self._RING_MASK
+        result = bytearray(ring.to_bytes(self.digest_size, "little"))
+        for index, byte in enumerate(self._length.to_bytes(8, "little")):
+            result[self.digest_size - 8 + index] ^= byte
+        return bytes(result)
+
+    def hexdigest(self) -> str:
+        return self.digest().hex()
+
+    def b64digest(self) -> str:
+        """Get the hash in the base64 form Graph reports as file.hashes.quickXorHash"""
+        return base64.b64encode(self.digest()).decode("ascii")
+
+    def copy(self) -> "QuickXorHash":
+        other = QuickXorHash()
+        other._folded = self._folded
+        other._length = self._length
+        return other
+
+
+class ContentHasher:
+    """Computes SHA-1, SHA-256 and quickXorHash in a single pass"""
+
+    def __init__(self):
+        self._sha1 = hashlib.sha1()
+        self._sha256 = hashlib.sha256()
+        self._quick_xor = QuickXorHash()
+        self.size = 0
+
+    def update(self, data: bytes):
+        self._sha1.update(data)
+        self._sha256.update(data)
+        self._quick_xor.update(data)
+        self.size += len(data)
+
+    def hashes(self) -> Dict[str, Union[str, int]]:
+        """
+        Get the hashes in Graph's file.hashes naming
+
+        Returns:
+            sha1Hash and sha256Hash (upper-case hex), quickXorHash (base64) and size
+        """
+        return {
+            "sha1Hash": self._sha1.hexdigest().upper(),
+            "sha256Hash": self._sha256.hexdigest().upper(),
+            "quickXorHash": self._quick_xor.b64digest(),
+            "size": self.size,
+        }
+
+
+def hash_content(file_content: Union[bytes, BinaryIO], chunk_size: Optional[int] = None) -> Dict[str, Union[str, int]]:
+    """
+    Hash bytes or a seekable stream (the stream is rewound afterwards)
+
+    Args:
+        file_content: Bytes or seekable binary file object
+        chunk_size: Bytes to read at a time (defaults to STREAM_CHUNK_SIZE)
+
+    Returns:
+        Hashes as returned by ContentHasher.hashes
+    """
+    hasher = ContentHasher()
+    if isinstance(file_content, (bytes, bytearray, memoryview)):
+        hasher.update(bytes(file_content))
+        return hasher.hashes()
+
+    chunk_size = chunk_size or config.STREAM_CHUNK_SIZE
+    file_content.seek(0)
+    while True:
+        chunk = file_content.read(chunk_size)
+        if not chunk:
+            break
+        hasher.update(chunk)
+    file_content.seek(0)
+    return hasher.hashes()
@@ -0,0 +1,287 @@
+"""
+Pooled HTTP session with timeouts and retry/backoff for Microsoft Graph
+"""
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.exceptions import ConnectionError as RequestsConnectionError, ConnectTimeout, Timeout
+    REQUESTS_AVAILABLE = True
+except ImportError:
+    REQUESTS_AVAILABLE = False
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.onedrive.rate_limiter import ERROR, SUCCESS, THROTTLED, AdaptiveConcurrencyLimiter
+
+
+# Methods that can be resent safely when the outcome of a request is unknown
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+
+# Status codes that mean the request was not processed and may be retried
+THROTTLE_STATUS_CODES = frozenset([429, 503])
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header
+
+    Args:
+        value: Header value, either delay seconds or an HTTP date
+
+    Returns:
+        Delay in seconds, or None if the header is missing or invalid
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class GraphSession:
+    """Thread-safe keep-alive session shared by all Graph API calls"""
+
+    def __init__(self,
+                 pool_connections: Optional[int] = None,
+                 pool_maxsize: Optional[int] = None,
+                 connect_timeout: Optional[float] = None,
+                 read_timeout: Optional[float] = None,
+                 max_retries: Optional[int] = None,
+                 backoff_base: Optional[float] = None,
+                 backoff_max: Optional[float] = None,
+                 session=None,
+                 sleep: Callable[[float], None] = time.sleep,
+                 limiter: Optional[AdaptiveConcurrencyLimiter] = None):
+        """
+        Initialize the session and its connection pool
+
+        Args:
+            pool_connections: Number of host pools to cache
+            pool_maxsize: Maximum keep-alive connections per host
+            connect_timeout: Default connect timeout in seconds
+            read_timeout: Default read timeout in seconds
+            max_retries: Maximum retries per call
+            backoff_base: First backoff delay in seconds
+            backoff_max: Upper bound for backoff and Retry-After delays
+            session: Preconfigured requests.Session (mainly for tests)
+            sleep: Sleep function (mainly for tests)
+            limiter: Adaptive concurrency limit shared by all calls (defaults to a new one)
+        """
+        self.logger = StructuredLogger(__name__)
+        self.timeout = (
+            config.GRAPH_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout,
+            config.GRAPH_READ_TIMEOUT if read_timeout is None else read_timeout
+        )
+        self.max_retries = config.GRAPH_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = config.GRAPH_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = config.GRAPH_BACKOFF_MAX if backoff_max is None else backoff_max
+        self._sleep = sleep
+        self.limiter = limiter or AdaptiveConcurrencyLimiter()
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=config.GRAPH_POOL_CONNECTIONS if pool_connections is None else pool_connections,
+                pool_maxsize=config.GRAPH_POOL_MAXSIZE if pool_maxsize is None else pool_maxsize,
+                max_retries=0
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+
+        self._stats_lock = threading.Lock()
+        self._calls = 0
+        self._retries = 0
+        self._failures = 0
+        self._total_latency = 0.0
+
+    def backoff_delay(self, attempt: int) -> float:
+        """
+        Exponential backoff with full jitter
+
+        Args:
+            attempt: Zero-based retry attempt
+
+        Returns:
+            Delay in seconds
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method: str, url: str, **kwargs) -> "requests.Response":
+        """
+        Send a request, retrying transient failures
+
+        Throttling responses (429/503) are retried for every method after the
+        Retry-After delay. Other 5xx responses and read errors are retried only
+        for idempotent methods. Bodies that cannot be rewound are never resent.
+        Each attempt waits for a slot from the adaptive concurrency limiter, and
+        for any pause a throttled call requested.
+
+        Args:
+            method: HTTP method
+            url: Request URL
+            **kwargs: Arguments passed to requests.Session.request
+
+        Returns:
+            Final response
+
+        Raises:
+            requests.RequestException: If the last attempt fails with a network error
+        """
+        method = method.upper()
+        kwargs.setdefault("timeout", self.timeout)
+
+        body = kwargs.get("data")
+        body_position = None
+        if hasattr(body, "read"):
+            try:
+                body_position = body.tell()
+            except (AttributeError, OSError):
+                body_position = None
+        rewindable = not hasattr(body, "read") or body_position is not None
+
+        retries = 0
+        delay = 0.0
+        started_at = time.monotonic()
+        path = urlsplit(url).path
+
+        while True:
+            # Throttling seen by any call holds back every new attempt
+            wait = max(delay, self.limiter.pause_remaining())
+            if wait > 0:
+                self._sleep(wait)
+
+            if retries and body_position is not None:
+                body.seek(body_position)
+
+            can_retry = retries < self.max_retries and rewindable
+            attempt_started = self.limiter.acquire()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except Exception as e:
+                self.limiter.release(attempt_started, ERROR)
+                retryable = REQUESTS_AVAILABLE and (
+                    isinstance(e, ConnectTimeout)
+                    or (method in IDEMPOTENT_METHODS and isinstance(e, (RequestsConnectionError, Timeout)))
+                )
+                if not (can_retry and retryable):
+                    self._record(started_at, retries, failed=True)
+                    self.logger.warning("Graph API call failed",
+                                        method=method, path=path, retries=retries, error=str(e))
+                    raise
+                delay = self.backoff_delay(retries)
+                self.logger.warning("Graph API network error, retrying",
+                                    method=method, path=path, attempt=retries + 1,
+                                    delay=round(delay, 3), error=str(e))
+            else:
+                status = response.status_code
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if status in THROTTLE_STATUS_CODES:
+                    self.limiter.release(attempt_started, THROTTLED, min(retry_after or 0.0, self.backoff_max))
+                else:
+                    self.limiter.release(attempt_started, ERROR if status >= 500 else SUCCESS)
+                retryable = status in THROTTLE_STATUS_CODES or (
+                    status in RETRY_STATUS_CODES and method in IDEMPOTENT_METHODS
+                )
+                if not (can_retry and retryable):
+                    latency = self._record(started_at, retries, failed=status >= 400)
+                    self.logger.debug("Graph API call",
+                                      method=method, path=path, status_code=status,
+                                      latency_ms=round(latency * 1000, 1), retries=retries)
+                    return response
+
+                delay = retry_after if status in THROTTLE_STATUS_CODES else None
+                if delay is None:
+                    delay = self.backoff_delay(retries)
+                delay = min(delay, self.backoff_max)
+                self.logger.warning("Graph API transient error, retrying",
+                                    method=method, path=path, status_code=status,
+                                    attempt=retries + 1, delay=round(delay, 3))
+                response.close()
+
+            retries += 1
+
+    def _record(self, started_at: float, retries: int, failed: bool) -> float:
+        """Update call counters and return the call latency"""
+        latency = time.monotonic() - started_at
+        with self._stats_lock:
+            self._calls += 1
+            self._retries += retries
+            self._total_latency += latency
+            if failed:
+                self._failures += 1
+        return latency
+
+    def get(self, url: str, **kwargs) -> "requests.Response":
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> "requests.Response":
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> "requests.Response":
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> "requests.Response":
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> "requests.Response":
+        return self.request("DELETE", url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get call, retry and latency counters
+
+        Returns:
+            Dictionary of session statistics
+        """
+        with self._stats_lock:
+            return {
+                "calls": self._calls,
+                "retries": self._retries,
+                "failures": self._failures,
+                "avg_latency_ms": round(self._total_latency / self._calls * 1000, 1) if self._calls else 0.0,
+                "concurrency": self.limiter.stats(),
+            }
+
+    def close(self):
+        """Close pooled connections"""
+        self.session.close()
+
+
+_shared_session: Optional[GraphSession] = None
+_shared_session_lock = threading.Lock()
+
+
+def get_graph_session() -> GraphSession:
+    """
+    Get the process-wide Graph session, creating it on first use
+
+    Returns:
+        Shared GraphSession instance
+    """
+    global _shared_session
+    if _shared_session is None:
+        with _shared_session_lock:
+            if _shared_session is None:
+                _shared_session = GraphSession()
+    return _shared_session
@@ -0,0 +1,400 @@
+"""
+Naming rules: templates compiled once into callables that choose an upload's folder and file name
+"""
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import config
+from modules.utils.logger import StructuredLogger
+
+
+# Placeholders a template may use, e.g. '{date:%Y-%m}' or '{seq:3}'
+FIELDS = ("date", "user_id", "user_name", "category", "kind", "original", "message_id", "seq")
+PLACEHOLDER_RE = re.compile(r"\{(\w+)(?::([^{}]*))?\}")
+
+# Characters OneDrive does not allow in names, plus control characters
+INVALID_CHARS_RE = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+DEFAULT_DATE_FORMAT = "%Y%m%d"
+MAX_SEQUENCE_WIDTH = 10
+
+# Categories for the {category} placeholder, by extension
+CATEGORIES = {
+    "jpg": "画像", "jpeg": "画像", "png": "画像", "gif": "画像", "heic": "画像", "webp": "画像",
+    "pdf": "PDF",
+    "doc": "文書", "docx": "文書",
+    "xls": "表計算", "xlsx": "表計算", "csv": "表計算",
+    "txt": "テキスト",
+}
+
+# Used after the admins' rules; the last one renders for any upload
+DEFAULT_RULES = (
+    {"name": "default", "priority": 1000000, "folder_template": "{user_id}/{date:%Y-%m}",
+     "file_template": "{original}"},
+    {"name": "fallback", "priority": 1000001, "folder_template": "{date:%Y-%m}",
+     "file_template": "{date:%Y%m%d_%H%M%S}"},
+)
+
+
+class MissingValue(Exception):
+    """A template field has no value for this upload"""
+
+
+def clean_value(value: Any) -> str:
+    """
+    Make a field value safe inside a OneDrive name
+
+    Args:
+        value: Field value
+
+    Returns:
+        Value with invalid characters replaced, or '' if nothing usable is left
+    """
+    return INVALID_CHARS_RE.sub("_", str(value)).strip(" .")
+
+
+def category_for(extension: Optional[str]) -> str:
+    """Get the {category} value for a file extension"""
+    return CATEGORIES.get((extension or "").lower(), "その他")
+
+
+def _sequence_format(spec: Optional[str]) -> str:
+    if spec and not (spec.isdigit() and 1 <= int(spec) <= MAX_SEQUENCE_WIDTH):
+        raise ValueError(f"Sequence width must be 1 to {MAX_SEQUENCE_WIDTH}, got '{spec}'")
+    return "{:0%dd}" % int(spec or 1)
+
+
+def _field_getter(name: str, spec: Optional[str]) -> Callable[[Dict[str, Any]], str]:
+    if name == "date":
+        date_format = spec or DEFAULT_DATE_FORMAT
+        try:
+            sample = datetime(2000, 1, 2, 3, 4, 5).strftime(date_format)
+        except ValueError:
+            raise ValueError(f"Invalid date format '{date_format}'")
+        if INVALID_CHARS_RE.search(sample):
+            raise ValueError(f"Date format '{date_format}' produces characters not allowed in names")
+        return lambda context: context["date"].strftime(date_format)
+
+    if name == "seq":
+        number_format = _sequence_format(spec)
+        return lambda context: number_format.format(context["seq"])
+
+    if spec:
+        raise ValueError(f"'{{{name}}}' does not take a format")
+
+    def get(context: Dict[str, Any]) -> str:
+        value = context.get(name)
+        if callable(value):
+            # Expensive values (e.g. the LINE display name) are only looked up when a rule uses them
+            value = context[name] = value()
+        value = clean_value(value) if value is not None else ""
+        if not value:
+            raise MissingValue(name)
+        return value
+
+    return get
+
+
+class CompiledTemplate:
+    """
+    A template parsed once into a format string and one getter per placeholder
+
+    render() is then a single str.format call, with no parsing per upload.
+    """
+
+    __slots__ = ("source", "fields", "is_folder", "_format", "_getters", "_sequence_formats")
+
+    def __init__(self, source: str, is_folder: bool = False):
+        """
+        Compile a template
+
+        Args:
+            source: Template text, e.g. '{date:%Y%m%d}_{user_name}_{seq:3}'
+            is_folder: Allow '/' between folder levels
+
+        Raises:
+            ValueError: If the template uses an unknown field, a bad format
+                        or characters not allowed in names
+        """
+        self.source = source
+        self.is_folder = is_folder
+        literals, getters, fields = [], [], []
+        sequence_formats = {}
+        position = 0
+        for match in PLACEHOLDER_RE.finditer(source):
+            literals.append(source[position:match.start()])
+            name, spec = match.group(1), match.group(2)
+            if name not in FIELDS:
+                raise ValueError(f"Unknown field '{{{name}}}' (available: {', '.join(FIELDS)})")
+            if name == "seq":
+                sequence_formats[len(getters)] = _sequence_format(spec)
+            getters.append(_field_getter(name, spec))
+            fields.append(name)
+            position = match.end()
+        literals.append(source[position:])
+
+        for literal in literals:
+            if "{" in literal or "}" in literal:
+                raise ValueError(f"Unbalanced brace in template '{source}'")
+            text = literal.replace("/", "") if is_folder else literal
+            if INVALID_CHARS_RE.search(text):
+                raise ValueError(f"Template '{source}' contains characters not allowed in names")
+        if is_folder and any(part in (".", "..") for part in "".join(literals).split("/")):
+            raise ValueError(f"Template '{source}' must not contain '.' or '..' folders")
+
+        self.fields = frozenset(fields)
+        self._format = "{}".join(literals)
+        self._getters = tuple(getters)
+        self._sequence_formats = sequence_formats
+
+    def render(self, context: Dict[str, Any]) -> Optional[str]:
+        """
+        Fill the template
+
+        Args:
+            context: Field values; 'date' must be a datetime
+
+        Returns:
+            Rendered text, or None if a field it uses has no value
+        """
+        try:
+            text = self._format.format(*[get(context) for get in self._getters])
+        except MissingValue:
+            return None
+        if self.is_folder:
+            text = "/".join(part for part in text.split("/") if part.strip(" ."))
+        return text or None
+
+    def render_parts(self, context: Dict[str, Any]) -> Optional[List[Optional[str]]]:
+        """
+        Render every field except {seq}, whose slots are left as None
+
+        Args:
+            context: Field values
+
+        Returns:
+            Rendered values in template order, or None if a field has no value
+        """
+        try:
+            return [None if i in self._sequence_formats else get(context) for i, get in enumerate(self._getters)]
+        except MissingValue:
+            return None
+
+    def fill(self, parts: List[Optional[str]], seq: Optional[int] = None) -> str:
+        """
+        Join parts from render_parts with a sequence number
+
+        Args:
+            parts: Rendered values
+            seq: Number for the {seq} slots ('#' when None, e.g. to name the sequence)
+
+        Returns:
+            Rendered text
+        """
+        return self._format.format(*[
+            part if part is not None else "#" if seq is None else self._sequence_formats[i].format(seq)
+            for i, part in enumerate(parts)
+        ])
+
+
+class CompiledRule:
+    """A naming rule with its conditions and compiled templates"""
+
+    __slots__ = ("name", "priority", "kind", "extensions", "folder", "file", "numbered")
+
+    def __init__(self, rule: Dict[str, Any]):
+        """
+        Compile a rule
+
+        Args:
+            rule: Dict with name, folder_template, file_template and optional
+                  priority, kind ('image'/'file') and extensions (comma-separated)
+
+        Raises:
+            ValueError: If the rule is incomplete or a template is invalid
+        """
+        if not rule.get("name"):
+            raise ValueError("Naming rule needs a name")
+        if not rule.get("folder_template") or not rule.get("file_template"):
+            raise ValueError("Naming rule needs a folder and a file name template")
+        if rule.get("kind") not in (None, "", "image", "file"):
+            raise ValueError(f"Unknown kind '{rule['kind']}' (expected 'image' or 'file')")
+        self.name = rule["name"]
+        self.priority = int(rule.get("priority", 100))
+        self.kind = rule.get("kind") or None
+        extensions = [e.strip().lstrip(".").lower() for e in (rule.get("extensions") or "").split(",")]
+        self.extensions = frozenset(e for e in extensions if e)
+        self.folder = CompiledTemplate(rule["folder_template"], is_folder=True)
+        self.file = CompiledTemplate(rule["file_template"])
+        if "seq" in self.folder.fields:
+            raise ValueError("{seq} can only be used in the file name")
+        self.numbered = "seq" in self.file.fields
+
+    def matches(self, kind: Optional[str], extension: str) -> bool:
+        """Check whether the rule applies to an upload"""
+        return (self.kind is None or self.kind == kind) and (not self.extensions or extension in self.extensions)
+
+
+def compile_rule(rule: Dict[str, Any]) -> CompiledRule:
+    """
+    Compile a rule, e.g. to validate it before saving
+
+    Raises:
+        ValueError: If the rule is invalid
+    """
+    return CompiledRule(rule)
+
+
+class NamingRuleEngine:
+    """
+    Chooses the OneDrive folder (under ONEDRIVE_ROOT_FOLDER) and file name of uploads
+
+    Rules are compiled when loaded. At most every check_interval seconds the
+    repository's version stamp is compared, and the rules are reloaded only
+    when an admin changed them, so edits reach every worker without a
+    restart while a naming decision stays a few microseconds. Only rules
+    numbering their files ({seq}) touch the database per upload.
+    """
+
+    def __init__(self, repository=None, check_interval: Optional[float] = None):
+        """
+        Initialize the engine
+
+        Args:
+            repository: NamingRuleRepository with the admins' rules (None uses only the defaults,
+                        with sequence numbers unique to this process)
+            check_interval: Seconds between version checks (defaults to NAMING_RULES_CHECK_INTERVAL)
+        """
+        self.logger = StructuredLogger(__name__)
+        self.repository = repository
+        self.check_interval = config.NAMING_RULES_CHECK_INTERVAL if check_interval is None else check_interval
+        self.defaults = tuple(CompiledRule(rule) for rule in DEFAULT_RULES)
+        self._lock = threading.Lock()
+        self._rules: Tuple[CompiledRule, ...] = self.defaults
+        self._version: Optional[int] = None
+        self._checked_at = float("-inf")
+        self._invalid: List[str] = []
+        self._reloads = 0
+        self._local_sequences: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    def rules(self) -> Tuple[CompiledRule, ...]:
+        """Get the compiled rules in the order they are tried, reloading them if they changed"""
+        if self.repository is not None and time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload(force=False)
+        return self._rules
+
+    def reload(self, force: bool = True):
+        """
+        Reload the rules if their version changed
+
+        Args:
+            force: Check the version now even if the check interval has not passed
+        """
+        if self.repository is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            try:
+                if self.repository.version() == self._version:
+                    return
+                version, rows = self.repository.load()
+            except Exception as e:
+                self.logger.warning("Could not check naming rules, keeping the loaded ones", error=str(e))
+                return
+
+            rules, invalid = [], []
+            for row in rows:
+                if not row.get("enabled", 1):
+                    continue
+                try:
+                    rules.append(CompiledRule(row))
+                except ValueError as e:
+                    invalid.append(row.get("name"))
+                    self.logger.error("Skipping invalid naming rule", rule=row.get("name"), error=str(e))
+            rules.sort(key=lambda rule: (rule.priority, rule.name))
+            self._rules = tuple(rules) + self.defaults
+            self._version = version
+            self._invalid = invalid
+            self._reloads += 1
+            self.logger.info("Naming rules loaded", version=version, rules=len(rules), invalid=len(invalid))
+
+    def decide(self, context: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Choose the folder and file name for an upload
+
+        Args:
+            context: Upload fields: user_id, kind ('image'/'file'), original
+                     (received or generated file name with extension) and
+                     optionally message_id, user_name, category and date
+                     (defaults to now). A value may be a callable, which is
+                     only called if the chosen rule uses the field.
+
+        Returns:
+            Dict with folder_path (relative to ONEDRIVE_ROOT_FOLDER), file_name and rule
+        """
+        original = str(context.get("original") or "")
+        stem, dot, extension = original.rpartition(".")
+        if not dot:
+            stem, extension = original, ""
+        extension = extension.lower()
+
+        fields = dict(context)
+        fields["original"] = stem
+        fields.setdefault("date", datetime.now())
+        fields.setdefault("category", category_for(extension))
+
+        for rule in self.rules():
+            if not rule.matches(context.get("kind"), extension):
+                continue
+            folder_path = rule.folder.render(fields)
+            if folder_path is None:
+                continue
+            if rule.numbered:
+                # A number is only taken once the rest of the name is known, so none are skipped;
+                # numbers count up per folder and name around the number
+                parts = rule.file.render_parts(fields)
+                if parts is None:
+                    continue
+                seq = self.next_sequence(rule.name, f"{folder_path}/{rule.file.fill(parts)}")
+                name = rule.file.fill(parts, seq)
+            else:
+                name = rule.file.render(fields)
+                if name is None:
+                    continue
+            return {
+                "folder_path": folder_path,
+                "file_name": f"{name}.{extension}" if extension else name,
+                "rule": rule.name,
+            }
+
+        # The fallback rule only uses the date, so this is not reached
+        raise RuntimeError("No naming rule produced a name")
+
+    def next_sequence(self, rule: str, scope: str) -> int:
+        """Take the next sequence number of a rule and scope"""
+        if self.repository is not None:
+            return self.repository.next_sequence(rule, scope)
+        with self._lock:
+            self._local_sequences[(rule, scope)] += 1
+            return self._local_sequences[(rule, scope)]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the loaded rules' state
+
+        Returns:
+            Dictionary with version, rule count, invalid rules and reloads
+        """
+        return {
+            "version": self._version,
+            "rules": len(self._rules) - len(self.defaults),
+            "invalid": list(self._invalid),
+            "reloads": self._reloads,
+        }
@@ -0,0 +1,372 @@
+"""
+Durable outbox of received files waiting to be uploaded to OneDrive
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional, Union
+
+from config import config
+from modules.utils.file_stream import write_chunks
+from modules.utils.logger import StructuredLogger, log_error_with_traceback
+from modules.utils.sqlite import connect_sqlite
+
+
+# Entry states; completed entries are deleted together with their spool file
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+FAILED = "failed"
+
+
+class UploadOutbox:
+    """
+    Spool directory plus SQLite journal of files waiting for upload
+
+    enqueue() writes the content to disk and records it, so nothing is lost if
+    the upload fails or the process restarts. Drainer threads upload entries
+    with exponential backoff. Only the `per_user` oldest unfinished entries of
+    each user are eligible. The default of 1 uploads each user's files
+    strictly in the order they were received; a larger value (opt-in) uploads
+    that many concurrently, so they may finish out of order. Either way one
+    user cannot take every drainer while a failing file is retried.
+    """
+
+    def __init__(self,
+                 upload: Callable[[Dict[str, Any], BinaryIO], Optional[Dict[str, Any]]],
+                 db_path: Union[str, Path, None] = None,
+                 spool_dir: Union[str, Path, None] = None,
+                 workers: Optional[int] = None,
+                 max_attempts: Optional[int] = None,
+                 backoff_base: Optional[float] = None,
+                 backoff_max: Optional[float] = None,
+                 lease_seconds: Optional[float] = None,
+                 per_user: Optional[int] = None,
+                 on_complete: Optional[Callable[[Dict[str, Any], Dict[str, Any]], None]] = None,
+                 on_failure: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        Initialize the outbox
+
+        Args:
+            upload: Uploads an entry from its spooled file; returns the driveItem or None on failure
+            db_path: Journal database (defaults to OUTBOX_DB_PATH)
+            spool_dir: Directory for waiting files (defaults to OUTBOX_DIR)
+            workers: Number of drainer threads (defaults to OUTBOX_WORKERS)
+            max_attempts: Attempts before an entry is parked as failed (defaults to OUTBOX_MAX_ATTEMPTS)
+            backoff_base: First retry delay in seconds (defaults to OUTBOX_BACKOFF_BASE)
+            backoff_max: Longest retry delay in seconds (defaults to OUTBOX_BACKOFF_MAX)
+            lease_seconds: Time after which an unfinished claim (e.g. from a crashed
+                           process) is retried (defaults to OUTBOX_LEASE_SECONDS)
+            per_user: Unfinished entries per user that may be uploaded at once
+                      (defaults to OUTBOX_PER_USER; above 1 relaxes the per-user order)
+            on_complete: Called with the entry and driveItem after a successful upload, before
+                         the entry is removed (at least once if the process stops in between)
+            on_failure: Called with the entry when it is parked as failed
+        """
+        self.logger = StructuredLogger(__name__)
+        self.upload = upload
+        self.on_complete = on_complete
+        self.on_failure = on_failure
+        self.spool_dir = Path(spool_dir or config.OUTBOX_DIR)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.workers = config.OUTBOX_WORKERS if workers is None else workers
+        self.max_attempts = config.OUTBOX_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self.backoff_base = config.OUTBOX_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = config.OUTBOX_BACKOFF_MAX if backoff_max is None else backoff_max
+        self.lease_seconds = config.OUTBOX_LEASE_SECONDS if lease_seconds is None else lease_seconds
+        self.per_user = max(1, config.OUTBOX_PER_USER if per_user is None else per_user)
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._completed = 0
+        self._retries = 0
+
+        self._conn = connect_sqlite(db_path or config.OUTBOX_DB_PATH)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS upload_outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " user_id TEXT NOT NULL,"
+            " file_name TEXT NOT NULL,"
+            " folder_path TEXT,"
+            " spool_name TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " metadata TEXT,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL,"
+            " claimed_at REAL,"
+            " last_error TEXT,"
+            " created_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS upload_outbox_user ON upload_outbox (user_id, status, id);"
+            "CREATE INDEX IF NOT EXISTS upload_outbox_due ON upload_outbox (status, next_attempt_at);"
+        )
+        self._remove_partial_files()
+
+    def _remove_partial_files(self):
+        """Delete spool files whose enqueue never completed"""
+        for path in self.spool_dir.glob("*.part"):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    # Producing
+
+    def enqueue(self, user_id: str, chunks: Iterable[bytes], file_name: str,
+                folder_path: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None,
+                max_size: Optional[int] = None) -> int:
+        """
+        Write content to the spool directory and journal it for upload
+
+        Args:
+            user_id: Owner of the file; uploads of one user keep their order
+            chunks: Content as an iterator of byte chunks
+            file_name: Name of the file in OneDrive
+            folder_path: Folder under the root folder
+            metadata: JSON-serializable data handed back in the entry
+            max_size: Maximum content size (defaults to MAX_FILE_SIZE)
+
+        Returns:
+            Outbox entry ID
+
+        Raises:
+            FileTooLargeError: As soon as the content exceeds max_size
+        """
+        spool_name = f"{uuid.uuid4().hex}.bin"
+        partial = self.spool_dir / (spool_name + ".part")
+
+        try:
+            with open(partial, "wb") as spool:
+                size = write_chunks(chunks, spool, max_size)
+                spool.flush()
+                os.fsync(spool.fileno())
+            os.replace(partial, self.spool_dir / spool_name)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+
+        now = time.time()
+        with self._lock:
+            entry_id = self._conn.execute(
+                "INSERT INTO upload_outbox"
+                " (user_id, file_name, folder_path, spool_name, size, metadata, status, next_attempt_at, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, file_name, folder_path, spool_name, size,
+                 json.dumps(metadata, ensure_ascii=False) if metadata else None, PENDING, now, now)
+            ).lastrowid
+
+        self.logger.info("File added to upload outbox", entry_id=entry_id, file_name=file_name, size=size)
+        with self._wakeup:
+            self._wakeup.notify()
+        return entry_id
+
+    # Draining
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Take the next due entry among the first `per_user` in its user's queue"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM upload_outbox o"
+                    " WHERE ((o.status = ? AND o.next_attempt_at <= ?) OR (o.status = ? AND o.claimed_at <= ?))"
+                    " AND (SELECT COUNT(*) FROM upload_outbox p WHERE p.user_id = o.user_id"
+                    "  AND p.id < o.id AND p.status IN (?, ?)) < ?"
+                    " ORDER BY o.id LIMIT 1",
+                    (PENDING, now, IN_PROGRESS, now - self.lease_seconds, PENDING, IN_PROGRESS, self.per_user)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE upload_outbox SET status = ?, claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                        (IN_PROGRESS, now, row["id"])
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        entry = self._entry(row)
+        entry["attempts"] += 1
+        return entry
+
+    @staticmethod
+    def _entry(row) -> Dict[str, Any]:
+        entry = dict(row)
+        entry["metadata"] = json.loads(entry["metadata"]) if entry["metadata"] else {}
+        return entry
+
+    def drain_once(self) -> bool:
+        """
+        Upload one due entry, if any
+
+        Returns:
+            True if an entry was processed (successfully or not)
+        """
+        entry = self._claim()
+        if entry is None:
+            return False
+
+        path = self.spool_dir / entry["spool_name"]
+        result = None
+        error = None
+        try:
+            with open(path, "rb") as spool:
+                result = self.upload(entry, spool)
+        except FileNotFoundError:
+            error = "spool file missing"
+            self.logger.error("Outbox spool file missing", entry_id=entry["id"], path=str(path))
+        except Exception as e:
+            error = str(e)
+            log_error_with_traceback(logging.getLogger(__name__), f"Outbox upload error for entry {entry['id']}", e)
+
+        if result:
+            self._complete(entry, path, result)
+        else:
+            self._reschedule(entry, error or "upload failed", give_up=error == "spool file missing")
+        return True
+
+    def _complete(self, entry: Dict[str, Any], path: Path, result: Dict[str, Any]):
+        self.logger.info("Outbox entry uploaded", entry_id=entry["id"], attempts=entry["attempts"])
+        # The entry stays journaled until its follow-up ran, so a crash in between
+        # repeats the (deduplicated) upload and the callback rather than losing them
+        if self.on_complete:
+            try:
+                self.on_complete(entry, result)
+            except Exception as e:
+                log_error_with_traceback(logging.getLogger(__name__), "Outbox completion callback error", e)
+        with self._lock:
+            self._conn.execute("DELETE FROM upload_outbox WHERE id = ?", (entry["id"],))
+            self._completed += 1
+        path.unlink(missing_ok=True)
+
+    def _reschedule(self, entry: Dict[str, Any], error: str, give_up: bool = False):
+        if give_up or (self.max_attempts and entry["attempts"] >= self.max_attempts):
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE upload_outbox SET status = ?, last_error = ? WHERE id = ?",
+                    (FAILED, error, entry["id"])
+                )
+            self.logger.error("Outbox entry failed permanently",
+                            entry_id=entry["id"], attempts=entry["attempts"], error=error)
+            if self.on_failure:
+                try:
+                    self.on_failure(entry)
+                except Exception as e:
+                    log_error_with_traceback(logging.getLogger(__name__), "Outbox failure callback error", e)
+            return
+
+        delay = self.backoff_delay(entry["attempts"])
+        with self._lock:
+            self._conn.execute(
+                "UPDATE upload_outbox SET status = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (PENDING, time.time() + delay, error, entry["id"])
+            )
+            self._retries += 1
+        self.logger.warning("Outbox upload failed, will retry",
+                            entry_id=entry["id"], attempts=entry["attempts"], delay=round(delay, 1))
+
+    def backoff_delay(self, attempts: int) -> float:
+        """
+        Delay before the next attempt: exponential, with jitter so entries do not retry in lockstep
+
+        Args:
+            attempts: Attempts made so far (1 after the first failure)
+
+        Returns:
+            Delay in seconds
+        """
+        delay = min(self.backoff_max, self.backoff_base * (2 ** max(0, attempts - 1)))
+        return random.uniform(delay / 2, delay)
+
+    def _seconds_until_due(self) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM upload_outbox WHERE status = ?", (PENDING,)
+            ).fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def _drain_loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.drain_once():
+                    continue
+                due = self._seconds_until_due()
+            except Exception as e:
+                log_error_with_traceback(logging.getLogger(__name__), "Outbox drainer error", e)
+                due = None
+            # Other processes may add entries too, so poll at least every few seconds
+            with self._wakeup:
+                self._wakeup.wait(min(5.0, due) if due is not None else 5.0)
+
+    def start(self):
+        """Start the drainer threads"""
+        if self._threads:
+            return
+        self._stop.clear()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._drain_loop, name=f"upload-outbox-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.logger.info("Upload outbox started", workers=self.workers, pending=self.pending_count())
+
+    def stop(self, timeout: float = 30):
+        """Stop the drainer threads; unfinished entries stay journaled"""
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    # Inspection
+
+    def retry_failed(self) -> int:
+        """
+        Put parked entries back in the queue
+
+        Returns:
+            Number of entries requeued
+        """
+        with self._lock:
+            count = self._conn.execute(
+                "UPDATE upload_outbox SET status = ?, attempts = 0, next_attempt_at = ? WHERE status = ?",
+                (PENDING, time.time(), FAILED)
+            ).rowcount
+        with self._wakeup:
+            self._wakeup.notify_all()
+        return count
+
+    def pending_count(self) -> int:
+        """Number of entries waiting for upload (including ones being uploaded)"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM upload_outbox WHERE status IN (?, ?)", (PENDING, IN_PROGRESS)
+            ).fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """Get queue sizes and counters"""
+        with self._lock:
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM upload_outbox GROUP BY status"
+            ).fetchall())
+            oldest = self._conn.execute(
+                "SELECT MIN(created_at) FROM upload_outbox WHERE status IN (?, ?)", (PENDING, IN_PROGRESS)
+            ).fetchone()[0]
+            return {
+                "pending": counts.get(PENDING, 0),
+                "in_progress": counts.get(IN_PROGRESS, 0),
+                "failed": counts.get(FAILED, 0),
+                "completed": self._completed,
+                "retries": self._retries,
+                "oldest_pending_seconds": round(time.time() - oldest, 1) if oldest else None,
+                "workers": len(self._threads),
+            }
@@ -0,0 +1,191 @@
+"""
+Adaptive (AIMD) concurrency limit for Microsoft Graph calls
+"""
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from config import config
+from modules.utils.logger import StructuredLogger
+
+
+# Outcomes reported to AdaptiveConcurrencyLimiter.release
+SUCCESS = "success"
+THROTTLED = "throttled"
+ERROR = "error"
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Caps in-flight requests and adapts the cap additive-increase/multiplicative-decrease
+
+    While calls succeed within the latency target and the error rate is low,
+    the limit grows by one after each `limit` calls that completed while the
+    limit was fully used (about +1 per round of requests). A throttled call (429/503) halves the limit and
+    pauses new calls for its Retry-After; other failures cut it gently once
+    the error rate is unhealthy. Calls that started before the last cut do not
+    cut it again, so one burst of 429s counts as one event.
+    """
+
+    # Weight of the newest sample in the latency and error-rate averages
+    SMOOTHING = 0.2
+
+    # Multiplicative decrease for errors that are not throttling
+    ERROR_DECREASE_FACTOR = 0.8
+
+    def __init__(self,
+                 initial_limit: Optional[int] = None,
+                 min_limit: Optional[int] = None,
+                 max_limit: Optional[int] = None,
+                 latency_target_ms: Optional[float] = None,
+                 decrease_factor: float = 0.5,
+                 error_threshold: float = 0.1):
+        """
+        Initialize the limiter
+
+        Args:
+            initial_limit: Starting concurrency (defaults to GRAPH_CONCURRENCY_INITIAL)
+            min_limit: Lowest concurrency (defaults to GRAPH_CONCURRENCY_MIN)
+            max_limit: Highest concurrency (defaults to GRAPH_CONCURRENCY_MAX)
+            latency_target_ms: Calls slower than this do not raise the limit
+                               (defaults to GRAPH_LATENCY_TARGET_MS)
+            decrease_factor: Limit multiplier on throttling
+            error_threshold: Smoothed error rate above which the limit stops growing
+        """
+        self.logger = StructuredLogger(__name__)
+        self.min_limit = max(1, config.GRAPH_CONCURRENCY_MIN if min_limit is None else min_limit)
+        self.max_limit = max(self.min_limit, config.GRAPH_CONCURRENCY_MAX if max_limit is None else max_limit)
+        initial = config.GRAPH_CONCURRENCY_INITIAL if initial_limit is None else initial_limit
+        self.latency_target = (config.GRAPH_LATENCY_TARGET_MS if latency_target_ms is None else latency_target_ms) / 1000
+        self.decrease_factor = decrease_factor
+        self.error_threshold = error_threshold
+
+        self._condition = threading.Condition()
+        self._limit = min(self.max_limit, max(self.min_limit, initial))
+        self._in_flight = 0
+        self._last_saturated = -1.0
+        self._successes = 0
+        self._waiting = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._latency = None
+        self._error_rate = 0.0
+        self._throttle_events = 0
+        self._increases = 0
+        self._decreases = 0
+        self._peak_in_flight = 0
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    def acquire(self) -> float:
+        """
+        Wait for a free slot
+
+        Returns:
+            Start time to pass to release()
+        """
+        with self._condition:
+            self._waiting += 1
+            try:
+                while self._in_flight >= self._limit:
+                    self._condition.wait()
+            finally:
+                self._waiting -= 1
+            started_at = time.monotonic()
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+            if self._in_flight >= self._limit:
+                self._last_saturated = started_at
+        return started_at
+
+    def release(self, started_at: float, outcome: str, retry_after: Optional[float] = None):
+        """
+        Free a slot and adapt the limit to the call's outcome
+
+        Args:
+            started_at: Value returned by acquire()
+            outcome: SUCCESS, THROTTLED or ERROR
+            retry_after: Server-requested delay for throttled calls
+        """
+        now = time.monotonic()
+        latency = now - started_at
+        with self._condition:
+            # The limit was fully used at some point while this call ran
+            saturated = self._last_saturated >= started_at
+            self._in_flight -= 1
+            self._error_rate += self.SMOOTHING * ((outcome != SUCCESS) - self._error_rate)
+            # Calls already in flight when the limit was cut reflect the old limit
+            fresh = started_at >= self._last_decrease
+
+            if outcome == THROTTLED:
+                self._throttle(now, started_at, retry_after)
+            elif outcome == ERROR:
+                if fresh and self._error_rate > self.error_threshold:
+                    self._decrease(self.ERROR_DECREASE_FACTOR, now)
+            else:
+                self._latency = latency if self._latency is None else (
+                    self._latency + self.SMOOTHING * (latency - self._latency)
+                )
+                healthy = latency <= self.latency_target and self._error_rate <= self.error_threshold
+                if healthy and saturated and self._limit < self.max_limit:
+                    self._successes += 1
+                    if self._successes >= self._limit:
+                        self._limit += 1
+                        self._successes = 0
+                        self._increases += 1
+            self._condition.notify_all()
+
+    def record_throttle(self, started_at: float, retry_after: Optional[float] = None):
+        """
+        Report throttling seen outside a slot, e.g. a 429 sub-response in a $batch
+
+        Args:
+            started_at: When the throttled call was sent (time.monotonic())
+            retry_after: Server-requested delay in seconds
+        """
+        with self._condition:
+            self._throttle(time.monotonic(), started_at, retry_after)
+            self._condition.notify_all()
+
+    def _throttle(self, now: float, started_at: float, retry_after: Optional[float]):
+        """Pause new calls and halve the limit (caller holds the condition)"""
+        self._throttle_events += 1
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+        if started_at >= self._last_decrease:
+            self._decrease(self.decrease_factor, now)
+
+    def _decrease(self, factor: float, now: float):
+        """Cut the limit (caller holds the condition)"""
+        previous = self._limit
+        self._limit = max(self.min_limit, int(self._limit * factor))
+        self._successes = 0
+        self._last_decrease = now
+        self._decreases += 1
+        self.logger.warning("Graph concurrency limit reduced",
+                            previous_limit=previous, limit=self._limit,
+                            error_rate=round(self._error_rate, 3))
+
+    def pause_remaining(self) -> float:
+        """Seconds until throttled calls asked new requests to wait"""
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the current limit and throttling counters"""
+        with self._condition:
+            return {
+                "limit": self._limit,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "in_flight": self._in_flight,
+                "peak_in_flight": self._peak_in_flight,
+                "waiting": self._waiting,
+                "throttle_events": self._throttle_events,
+                "increases": self._increases,
+                "decreases": self._decreases,
+                "error_rate": round(self._error_rate, 4),
+                "avg_latency_ms": round(self._latency * 1000, 1) if self._latency is not None else None,
+                "paused_seconds": round(self.pause_remaining(), 3),
+            }
@@ -0,0 +1,369 @@
+"""
+Expiry-aware Microsoft Graph access token management shared across workers
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Union
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+try:
+    import msal
+    MSAL_AVAILABLE = True
+except ImportError:
+    MSAL_AVAILABLE = False
+
+from config import config
+from modules.utils.logger import log_error_with_traceback, StructuredLogger
+from modules.utils.sqlite import connect_sqlite
+
+
+GRAPH_SCOPES = ["https://graph.microsoft.com/.default"]
+
+
+class TokenCache:
+    """In-process token cache; base class for the shared caches"""
+
+    def __init__(self):
+        self._token: Optional[Dict[str, Any]] = None
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Hold an exclusive lock while checking and refreshing the token"""
+        yield
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Load the cached token ({'access_token', 'expires_at'}) or None"""
+        return self._token
+
+    def save(self, token: Dict[str, Any]):
+        """Store a token"""
+        self._token = token
+
+    def clear(self):
+        """Remove the cached token"""
+        self._token = None
+
+
+class FileTokenCache(TokenCache):
+    """JSON file cache guarded by an flock, shared by workers on the same host"""
+
+    def __init__(self, path: Union[str, Path]):
+        super().__init__()
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.path.with_suffix(self.path.suffix + ".lock")
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        if not FCNTL_AVAILABLE:
+            yield
+            return
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, token: Dict[str, Any]):
+        # Write then rename so readers never see a partial file
+        tmp_path = self.path.with_suffix(self.path.suffix + f".{os.getpid()}.tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(token, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SQLiteTokenCache(TokenCache):
+    """SQLite cache; an IMMEDIATE transaction serializes refreshes across workers"""
+
+    def __init__(self, path: Union[str, Path], key: str = "graph"):
+        super().__init__()
+        self.key = key
+        self._lock = threading.RLock()
+        self._conn = connect_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS access_tokens ("
+            " cache_key TEXT PRIMARY KEY,"
+            " access_token TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            else:
+                self._conn.execute("COMMIT")
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT access_token, expires_at FROM access_tokens WHERE cache_key = ?",
+                (self.key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"access_token": row["access_token"], "expires_at": row["expires_at"]}
+
+    def save(self, token: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO access_tokens (cache_key, access_token, expires_at) VALUES (?, ?, ?)",
+                (self.key, token["access_token"], token["expires_at"])
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM access_tokens WHERE cache_key = ?", (self.key,))
+
+
+def create_token_cache(backend: Optional[str] = None) -> TokenCache:
+    """
+    Create the token cache selected in the configuration
+
+    Args:
+        backend: 'file', 'sqlite' or 'memory' (defaults to config.GRAPH_TOKEN_CACHE)
+
+    Returns:
+        Token cache instance
+    """
+    backend = (backend or config.GRAPH_TOKEN_CACHE).lower()
+    if backend == "sqlite":
+        return SQLiteTokenCache(config.GRAPH_TOKEN_CACHE_PATH)
+    if backend == "file":
+        return FileTokenCache(config.GRAPH_TOKEN_CACHE_PATH)
+    return TokenCache()
+
+
+class TokenManager:
+    """Keeps a valid Graph access token, refreshing it ahead of expiry"""
+
+    # Seconds before the refresh margin at which the background thread refreshes
+    BACKGROUND_LEAD = 60
+
+    # Seconds between background attempts after a failed refresh
+    RETRY_INTERVAL = 30
+
+    def __init__(self,
+                 cache: Optional[TokenCache] = None,
+                 fetch_token: Optional[Callable[[], Optional[Dict[str, Any]]]] = None,
+                 refresh_margin: Optional[float] = None,
+                 background_refresh: bool = True):
+        """
+        Initialize the token manager
+
+        Args:
+            cache: Shared token cache (defaults to the configured backend)
+            fetch_token: Function returning {'access_token', 'expires_in'} or None
+            refresh_margin: Seconds before expiry at which the token is refreshed
+            background_refresh: Refresh in a background thread before callers need to
+        """
+        self.logger = StructuredLogger(__name__)
+        self.cache = cache if cache is not None else create_token_cache()
+        self.refresh_margin = config.GRAPH_TOKEN_REFRESH_MARGIN if refresh_margin is None else refresh_margin
+        self._fetch_token = fetch_token or self._fetch_token_from_graph
+        self._token: Optional[Dict[str, Any]] = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresh_count = 0
+        self._msal_app = None
+
+        self._refresh_thread = None
+        if background_refresh:
+            self._refresh_thread = threading.Thread(
+                target=self._refresh_loop,
+                name="graph-token-refresh",
+                daemon=True
+            )
+            self._refresh_thread.start()
+
+    def _is_fresh(self, token: Optional[Dict[str, Any]], margin: Optional[float] = None) -> bool:
+        """True if the token is valid for at least `margin` more seconds"""
+        margin = self.refresh_margin if margin is None else margin
+        return bool(token) and token.get("expires_at", 0) - margin > time.time()
+
+    def get_token(self) -> Optional[str]:
+        """
+        Get a valid access token, refreshing it if needed
+
+        Returns:
+            Access token or None if it could not be obtained
+        """
+        token = self._token
+        if self._is_fresh(token):
+            return token["access_token"]
+
+        token = self._refresh()
+        return token["access_token"] if token else None
+
+    def invalidate(self, access_token: Optional[str] = None):
+        """
+        Drop a token that Graph rejected
+
+        Args:
+            access_token: The rejected token; the shared cache is only cleared if it
+                still holds this token, so one 401 does not cause a refresh storm
+        """
+        with self._refresh_lock:
+            with self.cache.locked():
+                cached = self.cache.load()
+                if cached and (access_token is None or cached.get("access_token") == access_token):
+                    self.cache.clear()
+            if self._token and (access_token is None or self._token.get("access_token") == access_token):
+                self._token = None
+
+    def _refresh(self, margin: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Refresh the token; concurrent callers share a single refresh
+
+        Args:
+            margin: Tokens valid for longer than this are reused (defaults to refresh_margin)
+
+        Returns:
+            Token dictionary or None if the refresh failed
+        """
+        with self._refresh_lock:
+            # Another thread may have refreshed while we waited for the lock
+            if self._is_fresh(self._token, margin):
+                return self._token
+
+            with self.cache.locked():
+                # Another worker process may have refreshed the shared cache
+                cached = self.cache.load()
+                if self._is_fresh(cached, margin):
+                    self._token = cached
+                    return cached
+
+                try:
+                    fetched = self._fetch_token()
+                except Exception as e:
+                    log_error_with_traceback(
+                        logging.getLogger(__name__),
+                        "Access token refresh error",
+                        e
+                    )
+                    fetched = None
+
+                if not fetched or not fetched.get("access_token"):
+                    self.logger.error("Failed to obtain access token")
+                    # Keep using a cached token that has not actually expired yet
+                    if cached and cached.get("expires_at", 0) > time.time():
+                        self._token = cached
+                        return cached
+                    return None
+
+                token = {
+                    "access_token": fetched["access_token"],
+                    "expires_at": time.time() + float(fetched.get("expires_in", 3600))
+                }
+                self.cache.save(token)
+                self._token = token
+                self._refresh_count += 1
+                self.logger.info("Access token refreshed",
+                               expires_in=int(token["expires_at"] - time.time()))
+                return token
+
+    def _refresh_loop(self):
+        """Refresh the token shortly before foreground callers would have to"""
+        margin = self.refresh_margin + self.BACKGROUND_LEAD
+        while not self._stop.is_set():
+            token = self._token
+            if token is None:
+                # Nothing to keep warm until the first foreground request
+                self._stop.wait(self.RETRY_INTERVAL)
+                continue
+
+            delay = token["expires_at"] - margin - time.time()
+            if delay > 0:
+                self._stop.wait(min(delay, 300))
+                continue
+
+            if not self._is_fresh(self._refresh(margin), margin):
+                self._stop.wait(self.RETRY_INTERVAL)
+
+    def _fetch_token_from_graph(self) -> Optional[Dict[str, Any]]:
+        """Request a token with the client credentials flow (MSAL when available)"""
+        if not all([config.MICROSOFT_CLIENT_ID, config.MICROSOFT_CLIENT_SECRET, config.MICROSOFT_TENANT_ID]):
+            self.logger.warning("Cannot fetch access token: Microsoft Graph configuration is incomplete")
+            return None
+
+        authority = f"https://login.microsoftonline.com/{config.MICROSOFT_TENANT_ID}"
+
+        if MSAL_AVAILABLE:
+            if self._msal_app is None:
+                self._msal_app = msal.ConfidentialClientApplication(
+                    config.MICROSOFT_CLIENT_ID,
+                    authority=authority,
+                    client_credential=config.MICROSOFT_CLIENT_SECRET
+                )
+            # This manager decides when to refresh; MSAL's own cache would hand back
+            # the token that was just rejected or is about to expire
+            msal_cache = self._msal_app.token_cache
+            for cached_token in msal_cache.find(msal.TokenCache.CredentialType.ACCESS_TOKEN):
+                msal_cache.remove_at(cached_token)
+            result = self._msal_app.acquire_token_for_client(scopes=GRAPH_SCOPES)
+            if "access_token" not in result:
+                self.logger.error("Authentication failed",
+                                error=result.get("error"),
+                                description=result.get("error_description"))
+                return None
+            return result
+
+        from modules.onedrive.http_session import get_graph_session
+
+        response = get_graph_session().post(
+            f"{authority}/oauth2/v2.0/token",
+            data={
+                'client_id': config.MICROSOFT_CLIENT_ID,
+                'client_secret': config.MICROSOFT_CLIENT_SECRET,
+                'scope': GRAPH_SCOPES[0],
+                'grant_type': 'client_credentials'
+            }
+        )
+        if response.status_code != 200:
+            self.logger.error("Authentication failed",
+                            status_code=response.status_code,
+                            response=response.text)
+            return None
+        return response.json()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get token state for metrics"""
+        token = self._token
+        return {
+            "refreshes": self._refresh_count,
+            "expires_in": int(token["expires_at"] - time.time()) if token else None,
+        }
+
+    def close(self):
+        """Stop the background refresh thread"""
+        self._stop.set()
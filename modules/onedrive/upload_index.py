@@ -0,0 +1,169 @@
+"""
+Index of uploaded content hashes, used to skip re-uploading identical files
+"""
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+from config import config
+from modules.utils.sqlite import connect_sqlite
+
+
+class UploadHashIndex:
+    """
+    SQLite map of content SHA-256 to the driveItems it was uploaded as
+
+    uploaded_hashes keeps the latest item and the cached analysis per content;
+    uploaded_locations keeps one item per content and parent folder, so a
+    duplicate is only skipped when it would land in the same folder.
+    """
+
+    def __init__(self, db_path: Union[str, Path, None] = None):
+        """
+        Initialize the index
+
+        Args:
+            db_path: Database file (defaults to UPLOAD_HASH_DB_PATH)
+        """
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(db_path or config.UPLOAD_HASH_DB_PATH)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS uploaded_hashes ("
+            " sha256 TEXT PRIMARY KEY,"
+            " sha1 TEXT,"
+            " quick_xor_hash TEXT,"
+            " size INTEGER NOT NULL,"
+            " item_id TEXT NOT NULL,"
+            " item TEXT NOT NULL,"
+            " analysis TEXT,"
+            " uploaded_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS uploaded_locations ("
+            " sha256 TEXT NOT NULL,"
+            " parent_id TEXT NOT NULL,"
+            " item_id TEXT NOT NULL,"
+            " item TEXT NOT NULL,"
+            " uploaded_at REAL NOT NULL,"
+            " PRIMARY KEY (sha256, parent_id))"
+        )
+        self._hits = 0
+        self._misses = 0
+        self._bytes_saved = 0
+
+    def get(self, sha256: str, parent_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Look up a previous upload by content hash
+
+        Args:
+            sha256: Upper-case hex SHA-256 of the content
+            parent_id: Only return an upload into this folder
+
+        Returns:
+            Dict with item_id, item (driveItem JSON) and analysis, or None
+        """
+        with self._lock:
+            if parent_id is None:
+                row = self._conn.execute(
+                    "SELECT * FROM uploaded_hashes WHERE sha256 = ?", (sha256,)
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT l.item_id, l.item, h.size, h.analysis FROM uploaded_locations l"
+                    " JOIN uploaded_hashes h ON h.sha256 = l.sha256"
+                    " WHERE l.sha256 = ? AND l.parent_id = ?", (sha256, parent_id)
+                ).fetchone()
+        if row is None:
+            return None
+        return {
+            "item_id": row["item_id"],
+            "size": row["size"],
+            "item": json.loads(row["item"]),
+            "analysis": json.loads(row["analysis"]) if row["analysis"] else None,
+        }
+
+    def add(self, hashes: Dict[str, Any], item: Dict[str, Any]):
+        """
+        Record an uploaded file
+
+        Args:
+            hashes: Result of hash_content for the uploaded bytes
+            item: driveItem returned by the upload
+        """
+        parent_id = (item.get("parentReference") or {}).get("id")
+        item_json = json.dumps(item, ensure_ascii=False)
+        with self._lock:
+            # Keep an analysis recorded for the same content under an earlier item
+            self._conn.execute(
+                "INSERT INTO uploaded_hashes"
+                " (sha256, sha1, quick_xor_hash, size, item_id, item, uploaded_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(sha256) DO UPDATE SET item_id = excluded.item_id,"
+                " item = excluded.item, uploaded_at = excluded.uploaded_at",
+                (
+                    hashes["sha256Hash"],
+                    hashes.get("sha1Hash"),
+                    hashes.get("quickXorHash"),
+                    hashes["size"],
+                    item["id"],
+                    item_json,
+                    time.time(),
+                )
+            )
+            if parent_id:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO uploaded_locations (sha256, parent_id, item_id, item, uploaded_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (hashes["sha256Hash"], parent_id, item["id"], item_json, time.time())
+                )
+
+    def set_analysis(self, sha256: str, analysis: Dict[str, Any]) -> bool:
+        """
+        Attach an AI analysis result to uploaded content
+
+        Args:
+            sha256: Content hash
+            analysis: Analysis result to return for later duplicates
+
+        Returns:
+            True if the hash was known
+        """
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE uploaded_hashes SET analysis = ? WHERE sha256 = ?",
+                (json.dumps(analysis, ensure_ascii=False), sha256)
+            ).rowcount > 0
+
+    def forget(self, sha256: str, item_id: str):
+        """Remove the entries of an item that no longer exists"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM uploaded_hashes WHERE sha256 = ? AND item_id = ?", (sha256, item_id)
+            )
+            self._conn.execute(
+                "DELETE FROM uploaded_locations WHERE sha256 = ? AND item_id = ?", (sha256, item_id)
+            )
+
+    def record_hit(self, size: int):
+        with self._lock:
+            self._hits += 1
+            self._bytes_saved += size
+
+    def record_miss(self):
+        with self._lock:
+            self._misses += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Get dedup hit rate and bytes saved since startup"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            entries = self._conn.execute("SELECT COUNT(*) FROM uploaded_hashes").fetchone()[0]
+            return {
+                "entries": entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "bytes_saved": self._bytes_saved,
+            }
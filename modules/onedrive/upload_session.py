@@ -0,0 +1,296 @@
+"""
+Resumable chunked uploads through Graph upload sessions
+"""
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Optional, Union
+
+from config import config
+from modules.utils.logger import StructuredLogger
+from modules.utils.sqlite import connect_sqlite
+
+
+# Graph requires upload session chunks to be multiples of 320 KiB
+CHUNK_ALIGNMENT = 320 * 1024
+
+# Seconds of clock difference tolerated when matching a finished upload's lastModifiedDateTime
+CLOCK_SKEW = 300
+
+
+def align_chunk_size(chunk_size: int) -> int:
+    """
+    Round a chunk size down to a multiple of 320 KiB
+
+    Args:
+        chunk_size: Requested chunk size in bytes
+
+    Returns:
+        Aligned chunk size (at least 320 KiB)
+    """
+    return max(CHUNK_ALIGNMENT, chunk_size - chunk_size % CHUNK_ALIGNMENT)
+
+
+def parse_next_offset(next_expected_ranges) -> Optional[int]:
+    """
+    Get the first missing byte from a nextExpectedRanges list
+
+    Args:
+        next_expected_ranges: e.g. ["26-"] or ["0-99", "200-"]
+
+    Returns:
+        Byte offset to send next, or None if the list is empty
+    """
+    if not next_expected_ranges:
+        return None
+    return int(str(next_expected_ranges[0]).split("-", 1)[0])
+
+
+class UploadSessionStore:
+    """SQLite journal of open upload sessions, so uploads survive restarts"""
+
+    def __init__(self, db_path: Union[str, Path, None] = None):
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(db_path or config.UPLOAD_SESSION_DB_PATH)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS upload_sessions ("
+            " resume_key TEXT PRIMARY KEY,"
+            " upload_url TEXT NOT NULL,"
+            " total_size INTEGER NOT NULL,"
+            " next_offset INTEGER NOT NULL DEFAULT 0,"
+            " expires_at REAL,"
+            " updated_at REAL NOT NULL)"
+        )
+
+    def get(self, resume_key: str) -> Optional[Dict[str, Any]]:
+        """Get the saved session for a key"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM upload_sessions WHERE resume_key = ?", (resume_key,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def save(self, resume_key: str, upload_url: str, total_size: int, expires_at: Optional[float]):
+        """Record a newly created session"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO upload_sessions"
+                " (resume_key, upload_url, total_size, next_offset, expires_at, updated_at)"
+                " VALUES (?, ?, ?, 0, ?, ?)",
+                (resume_key, upload_url, total_size, expires_at, time.time())
+            )
+
+    def update_offset(self, resume_key: str, next_offset: int):
+        """Record the last acknowledged byte range"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE upload_sessions SET next_offset = ?, updated_at = ? WHERE resume_key = ?",
+                (next_offset, time.time(), resume_key)
+            )
+
+    def delete(self, resume_key: str):
+        """Forget a finished or abandoned session"""
+        with self._lock:
+            self._conn.execute("DELETE FROM upload_sessions WHERE resume_key = ?", (resume_key,))
+
+
+class ResumableUploader:
+    """Uploads a seekable stream in chunks, resuming from the last acknowledged range"""
+
+    def __init__(self,
+                 graph_request: Callable[..., Any],
+                 session,
+                 store: Optional[UploadSessionStore] = None,
+                 chunk_size: Optional[int] = None):
+        """
+        Initialize the uploader
+
+        Args:
+            graph_request: Authenticated request function (OneDriveClient._graph_request)
+            session: GraphSession for the pre-authenticated upload URL
+            store: Session journal (defaults to the configured SQLite file)
+            chunk_size: Bytes per chunk, rounded down to a multiple of 320 KiB
+        """
+        self.logger = StructuredLogger(__name__)
+        self.graph_request = graph_request
+        self.session = session
+        self.store = store or UploadSessionStore()
+        self.chunk_size = align_chunk_size(chunk_size or config.UPLOAD_CHUNK_SIZE)
+
+    def upload(self, stream: BinaryIO, total_size: int, create_session_url: str,
+               resume_key: str, cancel_event: Optional[threading.Event] = None) -> Optional[Dict[str, Any]]:
+        """
+        Upload a stream through an upload session
+
+        Args:
+            stream: Seekable file object holding the content
+            total_size: Content size in bytes
+            create_session_url: .../createUploadSession URL of the target item
+            resume_key: Stable key identifying this upload across restarts
+            cancel_event: Stops the upload before the next chunk when set
+
+        Returns:
+            Created driveItem, or None if the upload failed (it can be resumed later)
+        """
+        for _ in range(2):
+            upload_url, offset, completed = self._open_session(total_size, create_session_url, resume_key)
+            if completed is not None:
+                return completed
+            if upload_url is None:
+                return None
+
+            result = self._send_chunks(stream, total_size, upload_url, offset, resume_key, cancel_event)
+            if result != "expired":
+                return result
+
+            # The session is gone; it may have finished with the final response lost
+            completed = self._find_completed(create_session_url, total_size, self.store.get(resume_key))
+            self.store.delete(resume_key)
+            if completed is not None:
+                return completed
+            # Otherwise it expired or was cancelled server-side; start over once
+        return None
+
+    def _open_session(self, total_size: int, create_session_url: str, resume_key: str):
+        """Resume a saved session or create a new one; returns (upload_url, offset, finished item)"""
+        saved = self.store.get(resume_key)
+        if saved and saved["total_size"] == total_size and (
+                not saved["expires_at"] or saved["expires_at"] > time.time()):
+            offset = self._query_offset(saved["upload_url"])
+            if offset is not None:
+                self.logger.info("Resuming upload session",
+                               resume_key=resume_key, offset=offset, total_size=total_size)
+                return saved["upload_url"], offset, None
+        if saved:
+            # Graph drops a session once it completes, so a lost final response
+            # looks like an expired session; sending again would create "name 1.ext"
+            completed = self._find_completed(create_session_url, total_size, saved)
+            self.store.delete(resume_key)
+            if completed is not None:
+                return None, 0, completed
+
+        response = self.graph_request(
+            'POST', create_session_url,
+            json={'item': {'@microsoft.graph.conflictBehavior': 'rename'}}
+        )
+        if response is None:
+            return None, 0, None
+        if response.status_code != 200:
+            self.logger.error("Upload session creation failed",
+                            status_code=response.status_code,
+                            response=response.text)
+            return None, 0, None
+
+        data = response.json()
+        upload_url = data['uploadUrl']
+        self.store.save(resume_key, upload_url, total_size, self._parse_timestamp(data.get('expirationDateTime')))
+        return upload_url, 0, None
+
+    def _find_completed(self, create_session_url: str, total_size: int,
+                        saved: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Look up the target item of a session whose completion response was lost
+
+        Args:
+            create_session_url: .../createUploadSession URL of the target item
+            total_size: Content size in bytes
+            saved: Journaled session (None if there was none)
+
+        Returns:
+            The driveItem if a file of this size was written at the target path
+            after the session's last acknowledged chunk, otherwise None
+        """
+        if saved is None:
+            return None
+        item_url = create_session_url.rsplit(':/createUploadSession', 1)[0]
+        response = self.graph_request('GET', item_url)
+        if response is None or response.status_code != 200:
+            return None
+
+        item = response.json()
+        modified_at = self._parse_timestamp(item.get('lastModifiedDateTime'))
+        if 'file' not in item or item.get('size') != total_size or (
+                modified_at is None or modified_at < saved["updated_at"] - CLOCK_SKEW):
+            return None
+        self.logger.info("Upload session had already completed",
+                       resume_key=saved["resume_key"], item_id=item.get('id'))
+        return item
+
+    def _query_offset(self, upload_url: str) -> Optional[int]:
+        """Ask Graph which bytes it still expects; None if the session is gone"""
+        try:
+            response = self.session.get(upload_url)
+        except Exception as e:
+            self.logger.warning("Upload session status check failed", error=str(e))
+            return None
+        if response.status_code != 200:
+            return None
+        offset = parse_next_offset(response.json().get('nextExpectedRanges'))
+        return 0 if offset is None else offset
+
+    def _send_chunks(self, stream: BinaryIO, total_size: int, upload_url: str,
+                     offset: int, resume_key: str, cancel_event: Optional[threading.Event] = None):
+        """Send chunks from offset; returns the driveItem, None on failure, or 'expired'"""
+        while offset < total_size:
+            if cancel_event is not None and cancel_event.is_set():
+                # The journaled session stays open, so the upload can be resumed later
+                self.logger.info("Upload session cancelled", resume_key=resume_key, offset=offset)
+                return None
+
+            end = min(offset + self.chunk_size, total_size) - 1
+            stream.seek(offset)
+            chunk = stream.read(end - offset + 1)
+
+            # The upload URL is pre-authenticated and must not get an Authorization header
+            response = self.session.put(
+                upload_url,
+                data=chunk,
+                headers={
+                    'Content-Length': str(len(chunk)),
+                    'Content-Range': f'bytes {offset}-{end}/{total_size}'
+                }
+            )
+
+            if response.status_code in (200, 201):
+                self.store.delete(resume_key)
+                self.logger.info("Upload session completed",
+                               resume_key=resume_key, total_size=total_size)
+                return response.json()
+
+            if response.status_code == 202:
+                next_offset = parse_next_offset(response.json().get('nextExpectedRanges'))
+                offset = end + 1 if next_offset is None else next_offset
+                self.store.update_offset(resume_key, offset)
+                continue
+
+            if response.status_code == 404:
+                return "expired"
+
+            if response.status_code == 416:
+                # Graph already has (part of) this range; resync with its view
+                server_offset = self._query_offset(upload_url)
+                if server_offset is None:
+                    return "expired"
+                offset = server_offset
+                continue
+
+            self.logger.error("Upload chunk failed",
+                            resume_key=resume_key,
+                            offset=offset,
+                            status_code=response.status_code,
+                            response=response.text)
+            return None
+
+        # Every byte was acknowledged but the final response was lost
+        return "expired"
+
+    @staticmethod
+    def _parse_timestamp(value: Optional[str]) -> Optional[float]:
+        """Parse an ISO 8601 Graph timestamp (expirationDateTime, lastModifiedDateTime)"""
+        if not value:
+            return None
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            return None
@@ -0,0 +1,107 @@
+"""
+Streaming helpers for moving uploaded media without holding it in memory
+"""
+from pathlib import Path
+from typing import BinaryIO, Iterable, Optional
+
+from config import config
+
+
+# Extensions for the content types LINE returns for image/video/audio messages
+CONTENT_TYPE_EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "application/pdf": "pdf",
+    "text/plain": "txt",
+}
+
+
+class FileTooLargeError(ValueError):
+    """Raised when a stream exceeds the configured maximum file size"""
+
+    def __init__(self, max_size: int):
+        super().__init__(f"File exceeds maximum size of {max_size} bytes")
+        self.max_size = max_size
+
+
+class UnsupportedFileTypeError(ValueError):
+    """Raised when a file extension is not in the allowed list"""
+
+    def __init__(self, extension: str):
+        super().__init__(f"File type '{extension}' is not allowed")
+        self.extension = extension
+
+
+def get_file_extension(file_name: str) -> str:
+    """
+    Get the lower-case extension of a file name without the dot
+
+    Args:
+        file_name: File name
+
+    Returns:
+        Extension, or an empty string if there is none
+    """
+    return Path(file_name).suffix.lstrip(".").lower()
+
+
+def extension_for_content_type(content_type: Optional[str]) -> str:
+    """
+    Map a MIME type to a file extension
+
+    Args:
+        content_type: Content-Type header value
+
+    Returns:
+        Extension, or an empty string if the type is unknown
+    """
+    if not content_type:
+        return ""
+    return CONTENT_TYPE_EXTENSIONS.get(content_type.split(";")[0].strip().lower(), "")
+
+
+def validate_file_extension(extension: str):
+    """
+    Check an extension against ALLOWED_EXTENSIONS
+
+    Args:
+        extension: Extension without the dot
+
+    Raises:
+        UnsupportedFileTypeError: If the extension is not allowed
+    """
+    allowed = {ext.strip().lower() for ext in config.ALLOWED_EXTENSIONS}
+    if extension.lower() not in allowed:
+        raise UnsupportedFileTypeError(extension)
+
+
+def write_chunks(chunks: Iterable[bytes], destination: BinaryIO, max_size: Optional[int] = None) -> int:
+    """
+    Copy a chunk iterator into a file, enforcing the size limit
+
+    Only one chunk is held in memory at a time, so peak memory per transfer
+    stays constant.
+
+    Args:
+        chunks: Iterator of byte chunks (e.g. a streamed HTTP response)
+        destination: File opened for binary writing
+        max_size: Maximum total size in bytes (defaults to config.MAX_FILE_SIZE)
+
+    Returns:
+        Bytes written
+
+    Raises:
+        FileTooLargeError: As soon as the stream exceeds max_size
+    """
+    max_size = config.MAX_FILE_SIZE if max_size is None else max_size
+    total = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        total += len(chunk)
+        if total > max_size:
+            raise FileTooLargeError(max_size)
+        destination.write(chunk)
+    return total
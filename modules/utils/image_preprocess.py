@@ -0,0 +1,236 @@
+"""
+Receipt image preprocessing (EXIF rotation, resize, grayscale, re-encode)
+"""
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
+try:
+    from PIL import Image, ImageOps, ImageStat
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+from config import config
+from modules.utils.logger import StructuredLogger
+
+
+# Grayscale modes
+GRAYSCALE_AUTO = "auto"
+GRAYSCALE_ALWAYS = "always"
+GRAYSCALE_NEVER = "never"
+
+# Formats that are re-encoded; anything else (e.g. animated GIF) is kept as is
+PROCESSABLE_FORMATS = frozenset(["JPEG", "PNG", "WEBP", "BMP", "MPO"])
+
+# Mean HSV saturation (0-255) below which an image counts as monochrome
+GRAYSCALE_SATURATION_THRESHOLD = 24
+
+
+def is_mostly_gray(image: "Image.Image") -> bool:
+    """
+    Check whether an image carries little colour information (e.g. a paper receipt)
+
+    Args:
+        image: RGB image
+
+    Returns:
+        True if the image can be converted to grayscale without losing content
+    """
+    sample = image.copy()
+    sample.thumbnail((128, 128))
+    saturation = ImageStat.Stat(sample.convert("HSV")).mean[1]
+    return saturation < GRAYSCALE_SATURATION_THRESHOLD
+
+
+def preprocess_image(data: bytes, max_long_edge: int, quality: int,
+                     grayscale: str = GRAYSCALE_AUTO) -> Dict[str, Any]:
+    """
+    Rotate, shrink and re-encode an image as JPEG
+
+    Runs in worker processes, so it only takes and returns picklable values.
+    When the re-encoded image is not smaller than the input, the input is
+    returned unchanged.
+
+    Args:
+        data: Encoded image
+        max_long_edge: Longest side in pixels after resizing (0 keeps the size)
+        quality: JPEG quality (1-95)
+        grayscale: GRAYSCALE_AUTO, GRAYSCALE_ALWAYS or GRAYSCALE_NEVER
+
+    Returns:
+        Dictionary with content, content_type, extension, width, height,
+        grayscale, original_size, size and changed
+    """
+    result = {
+        "content": data,
+        "content_type": None,
+        "extension": None,
+        "width": None,
+        "height": None,
+        "grayscale": False,
+        "original_size": len(data),
+        "size": len(data),
+        "changed": False,
+    }
+
+    with Image.open(io.BytesIO(data)) as source:
+        if source.format not in PROCESSABLE_FORMATS or getattr(source, "is_animated", False):
+            result["width"], result["height"] = source.size
+            return result
+
+        # Phones store the camera orientation in EXIF instead of rotating the pixels
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ("RGB", "L"):
+            background = Image.new("RGB", image.size, "white")
+            converted = image.convert("RGBA")
+            background.paste(converted, mask=converted.getchannel("A"))
+            image = background
+
+        if max_long_edge and max(image.size) > max_long_edge:
+            image.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+
+        if image.mode == "L":
+            gray = True
+        elif grayscale == GRAYSCALE_ALWAYS:
+            gray = True
+        elif grayscale == GRAYSCALE_AUTO:
+            gray = is_mostly_gray(image)
+        else:
+            gray = False
+        if gray and image.mode != "L":
+            image = image.convert("L")
+
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        encoded = output.getvalue()
+
+    result["width"], result["height"] = image.size
+    if len(encoded) < len(data):
+        result.update(
+            content=encoded,
+            content_type="image/jpeg",
+            extension="jpg",
+            grayscale=gray,
+            size=len(encoded),
+            changed=True,
+        )
+    return result
+
+
+class ImagePreprocessor:
+    """
+    Shrinks received images before they are uploaded and analyzed
+
+    Decoding and resizing are CPU bound, so they run in a process pool where
+    they do not hold the GIL of the webhook and upload threads. With zero
+    workers images are processed inline.
+    """
+
+    def __init__(self,
+                 max_long_edge: Optional[int] = None,
+                 quality: Optional[int] = None,
+                 grayscale: Optional[str] = None,
+                 workers: Optional[int] = None):
+        """
+        Initialize the preprocessor
+
+        Args:
+            max_long_edge: Longest side in pixels (defaults to IMAGE_MAX_LONG_EDGE)
+            quality: JPEG quality (defaults to IMAGE_JPEG_QUALITY)
+            grayscale: 'auto', 'always' or 'never' (defaults to IMAGE_GRAYSCALE)
+            workers: Worker processes (defaults to IMAGE_PREPROCESS_WORKERS, 0 runs inline)
+        """
+        self.logger = StructuredLogger(__name__)
+        self.max_long_edge = config.IMAGE_MAX_LONG_EDGE if max_long_edge is None else max_long_edge
+        self.quality = config.IMAGE_JPEG_QUALITY if quality is None else quality
+        self.grayscale = (config.IMAGE_GRAYSCALE if grayscale is None else grayscale).lower()
+        self.workers = config.IMAGE_PREPROCESS_WORKERS if workers is None else workers
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._images = 0
+        self._skipped = 0
+        self._failures = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Start the process pool on first use"""
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process that runs threads can copy held locks
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def process(self, data: bytes) -> Dict[str, Any]:
+        """
+        Preprocess an encoded image
+
+        Images that cannot be decoded are returned unchanged, so a
+        preprocessing problem never loses a received file.
+
+        Args:
+            data: Encoded image
+
+        Returns:
+            Result of preprocess_image, plus bytes_saved
+        """
+        if not PIL_AVAILABLE:
+            result = {"content": data, "original_size": len(data), "size": len(data), "changed": False}
+        else:
+            args = (data, self.max_long_edge, self.quality, self.grayscale)
+            try:
+                if self.workers > 0:
+                    result = self._get_executor().submit(preprocess_image, *args).result()
+                else:
+                    result = preprocess_image(*args)
+            except Exception as e:
+                self.logger.warning("Image preprocessing failed, keeping original",
+                                    size=len(data), error=str(e))
+                with self._lock:
+                    self._failures += 1
+                return {"content": data, "original_size": len(data), "size": len(data),
+                        "changed": False, "bytes_saved": 0}
+
+        result["bytes_saved"] = result["original_size"] - result["size"]
+        with self._lock:
+            self._images += 1
+            self._skipped += not result["changed"]
+            self._bytes_in += result["original_size"]
+            self._bytes_out += result["size"]
+
+        self.logger.info("Image preprocessed",
+                         original_size=result["original_size"], size=result["size"],
+                         bytes_saved=result["bytes_saved"], width=result.get("width"),
+                         height=result.get("height"), grayscale=result.get("grayscale"))
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get preprocessing counters
+
+        Returns:
+            Dictionary with images, unchanged, failures, bytes_in, bytes_out and bytes_saved
+        """
+        with self._lock:
+            return {
+                "images": self._images,
+                "unchanged": self._skipped,
+                "failures": self._failures,
+                "bytes_in": self._bytes_in,
+                "bytes_out": self._bytes_out,
+                "bytes_saved": self._bytes_in - self._bytes_out,
+            }
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,32 @@
+"""
+SQLite helpers shared by the local stores
+"""
+import sqlite3
+from pathlib import Path
+from typing import Union
+
+
+def connect_sqlite(path: Union[str, Path], timeout: float = 30.0,
+                   cached_statements: int = 128) -> sqlite3.Connection:
+    """
+    Open a SQLite connection tuned for concurrent access from several workers
+
+    Args:
+        path: Database file path, or ':memory:'
+        timeout: Seconds to wait for a lock held by another connection
+        cached_statements: Prepared statements kept per connection
+
+    Returns:
+        SQLite connection in autocommit mode with WAL journaling
+    """
+    if str(path) != ":memory:":
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+    # isolation_level=None lets callers control transactions explicitly
+    conn = sqlite3.connect(str(path), timeout=timeout, isolation_level=None, check_same_thread=False,
+                           cached_statements=cached_statements)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(timeout * 1000)}")
+    return conn
@@ -0,0 +1,361 @@
+"""
+In-process fake of the Microsoft Graph drive endpoints for offline tests
+"""
+import json
+import re
+import threading
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from modules.onedrive.hashing import QuickXorHash
+
+
+ITEM_PATH_RE = re.compile(r'^/v1\.0/me/drive/root:/(?P<path>.+?)(?::/(?P<action>content|createUploadSession|children))?$')
+ITEM_ID_RE = re.compile(r'^/v1\.0/me/drive/items/(?P<item_id>[0-9a-f]+)(?P<rest>.*)$')
+UPLOAD_RE = re.compile(r'^/upload/(?P<session_id>[0-9a-f]+)$')
+MONITOR_RE = re.compile(r'^/monitor/(?P<item_id>[0-9a-f]+)$')
+CONTENT_RANGE_RE = re.compile(r'^bytes (?P<start>\d+)-(?P<end>\d+)/(?P<total>\d+)$')
+
+
+class FakeGraphServer:
+    """Serves a small in-memory drive over HTTP on localhost"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = {}
+        self.sessions = {}
+        self.requests = []
+        self.chunk_bytes_received = 0
+        self.chunks_received = 0
+        # Set to N to fail the chunk PUT that follows the Nth accepted chunk
+        self.fail_after_chunks = None
+        # Set to True to drop the connection instead of answering the completing chunk
+        self.lose_final_response = False
+        self.batch_calls = 0
+        # Change sequence for delta queries; deleted item IDs are kept as tombstones
+        self.seq = 0
+        self.tombstones = []
+        # Items per page for children listings and delta responses
+        self.page_size = 200
+        # Set to True to answer the next delta-link request with 410 Gone
+        self.expire_delta_token = False
+        # Sub-request URLs answered with 429 once each
+        self.throttle_batch_urls = set()
+        # Authorization headers sent to copy monitor URLs
+        self.monitor_authorization = []
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self, 'GET')
+
+            def do_PUT(self):
+                server.handle(self, 'PUT')
+
+            def do_POST(self):
+                server.handle(self, 'POST')
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def root_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.root_url}/v1.0"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    # Helpers
+
+    def _make_item(self, path, content=None, folder=False):
+        name = path.rsplit('/', 1)[-1]
+        self.seq += 1
+        previous = self.items.get(path)
+        item = {
+            'id': previous['id'] if previous else uuid.uuid4().hex,
+            'name': name,
+            'path': path,
+            'seq': self.seq,
+            'lastModifiedDateTime': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+        }
+        if folder:
+            item['folder'] = {'childCount': 0}
+        else:
+            item['file'] = {'hashes': {'quickXorHash': QuickXorHash(content).b64digest()}}
+            item['size'] = len(content)
+            item['content'] = content
+        return item
+
+    def _ensure_parents(self, path):
+        parts = path.split('/')[:-1]
+        for i in range(1, len(parts) + 1):
+            parent = '/'.join(parts[:i])
+            if parent not in self.items:
+                self.items[parent] = self._make_item(parent, folder=True)
+
+    def _unique_path(self, path):
+        if path not in self.items:
+            return path
+        base, dot, ext = path.rpartition('.')
+        if not dot or '/' in ext:
+            base, ext = path, ''
+        counter = 1
+        while True:
+            candidate = f"{base} {counter}" + (f".{ext}" if ext else '')
+            if candidate not in self.items:
+                return candidate
+            counter += 1
+
+    def delete_tree(self, path):
+        """Remove an item and everything below it"""
+        with self.lock:
+            for key in [key for key in self.items if key == path or key.startswith(path + '/')]:
+                self.seq += 1
+                self.tombstones.append((self.seq, self.items.pop(key)['id']))
+
+    def rename(self, path, new_name):
+        """Rename an item, moving everything below it"""
+        with self.lock:
+            new_path = path.rsplit('/', 1)[0] + '/' + new_name if '/' in path else new_name
+            for key in sorted(key for key in self.items if key == path or key.startswith(path + '/')):
+                item = self.items.pop(key)
+                item['path'] = new_path + key[len(path):]
+                if key == path:
+                    item['name'] = new_name
+                    self.seq += 1
+                    item['seq'] = self.seq
+                self.items[item['path']] = item
+
+    def public(self, item, with_path=True):
+        data = {key: value for key, value in item.items() if key not in ('content', 'seq', 'path')}
+        parent = item['path'].rsplit('/', 1)[0] if '/' in item['path'] else ''
+        data['parentReference'] = {'id': self.items[parent]['id'] if parent else 'root'}
+        if with_path:
+            data['parentReference']['path'] = '/drive/root:' + (f"/{quote(parent)}" if parent else '')
+        return data
+
+    def page(self, values, url, skip):
+        """Cut a collection response to page_size, adding @odata.nextLink"""
+        data = {'value': values[skip:skip + self.page_size]}
+        if skip + self.page_size < len(values):
+            separator = '&' if '?' in url else '?'
+            data['@odata.nextLink'] = f"{self.root_url}{url}{separator}skip={skip + self.page_size}"
+        return data
+
+    # Request handling
+
+    def handle(self, handler, method):
+        url = urlsplit(handler.path)
+        path = unquote(url.path)
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+
+        with self.lock:
+            self.requests.append((method, path))
+            status, payload, *extra = self.route(method, path, handler.headers, body, url.query)
+
+        if status is None:
+            # Simulate a response lost on the way back
+            handler.close_connection = True
+            return
+        data = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        handler.send_response(status)
+        for name, value in (extra[0] if extra else {}).items():
+            handler.send_header(name, value)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def route(self, method, path, headers, body, query=''):
+        match = UPLOAD_RE.match(path)
+        if match:
+            return self.handle_upload_session(method, match.group('session_id'), headers, body)
+
+        match = MONITOR_RE.match(path)
+        if match:
+            # Copies finish immediately; the monitor reports the new item
+            self.monitor_authorization.append(headers.get('Authorization'))
+            return 200, {'status': 'completed', 'resourceId': match.group('item_id')}
+
+        if path == '/v1.0/$batch' and method == 'POST':
+            return self.handle_batch(json.loads(body))
+
+        if path == '/v1.0/me/drive/root/children':
+            item_path, action = '', 'children'
+        elif ITEM_ID_RE.match(path):
+            match = ITEM_ID_RE.match(path)
+            item_path = next(
+                (key for key, item in self.items.items() if item['id'] == match.group('item_id')), None
+            )
+            if item_path is None:
+                return 404, {'error': {'code': 'itemNotFound'}}
+            rest = match.group('rest')
+            if rest == '/delta' and method == 'GET':
+                return self.handle_delta(item_path, match.group('item_id'), parse_qs(query))
+            if rest == '/copy' and method == 'POST':
+                return self.handle_copy(item_path, json.loads(body or b'{}'), parse_qs(query))
+            if rest.startswith(':/'):
+                # items/{id}:/name addresses a path relative to the item
+                return self.route(method, f"/v1.0/me/drive/root:/{item_path}/{rest[2:]}", headers, body, query)
+            if rest not in ('', '/children'):
+                return 404, {'error': {'code': 'itemNotFound'}}
+            action = 'children' if rest else None
+        else:
+            match = ITEM_PATH_RE.match(path)
+            if not match:
+                return 404, {'error': {'code': 'itemNotFound'}}
+            item_path, action = match.group('path'), match.group('action')
+
+        if action is None and method == 'GET':
+            item = self.items.get(item_path)
+            if item is None:
+                return 404, {'error': {'code': 'itemNotFound'}}
+            return 200, self.public(item)
+
+        if action == 'content' and method == 'PUT':
+            self._ensure_parents(item_path)
+            created = item_path not in self.items
+            self.items[item_path] = self._make_item(item_path, content=body)
+            return (201 if created else 200), self.public(self.items[item_path])
+
+        if action == 'createUploadSession' and method == 'POST':
+            session_id = uuid.uuid4().hex
+            self.sessions[session_id] = {'path': item_path, 'data': bytearray(), 'total': None}
+            return 200, {
+                'uploadUrl': f"{self.root_url}/upload/{session_id}",
+                'expirationDateTime': '2099-01-01T00:00:00.000Z',
+                'nextExpectedRanges': ['0-']
+            }
+
+        if action == 'children' and method == 'GET':
+            prefix = item_path + '/' if item_path else ''
+            children = [
+                self.public(item) for key, item in sorted(self.items.items())
+                if key.startswith(prefix) and '/' not in key[len(prefix):]
+            ]
+            skip = int(parse_qs(query).get('skip', ['0'])[0])
+            return 200, self.page(children, path, skip)
+
+        if action == 'children' and method == 'POST':
+            request = json.loads(body or b'{}')
+            child_path = f"{item_path}/{request['name']}" if item_path else request['name']
+            self._ensure_parents(child_path)
+            if child_path in self.items:
+                behavior = request.get('@microsoft.graph.conflictBehavior', 'fail')
+                if behavior == 'fail':
+                    return 409, {'error': {'code': 'nameAlreadyExists'}}
+                child_path = self._unique_path(child_path)
+            self.items[child_path] = self._make_item(child_path, folder=True)
+            return 201, self.public(self.items[child_path])
+
+        return 405, {'error': {'code': 'invalidRequest'}}
+
+    def handle_batch(self, batch):
+        self.batch_calls += 1
+        requests = batch['requests']
+        if len(requests) > 20:
+            return 400, {'error': {'code': 'invalidRequest', 'message': 'Too many requests'}}
+
+        ids = {request['id'] for request in requests}
+        statuses = {}
+        responses = []
+        for request in requests:
+            depends_on = request.get('dependsOn', [])
+            if any(dependency not in ids for dependency in depends_on):
+                return 400, {'error': {'code': 'invalidRequest', 'message': 'Unknown dependsOn'}}
+
+            url = request['url']
+            if url in self.throttle_batch_urls:
+                self.throttle_batch_urls.discard(url)
+                status, payload, headers = 429, {'error': {'code': 'tooManyRequests'}}, {'Retry-After': '0'}
+            elif any(statuses.get(dependency, 500) >= 400 for dependency in depends_on):
+                status, payload, headers = 424, {'error': {'code': 'failedDependency'}}, {}
+            else:
+                body = json.dumps(request['body']).encode('utf-8') if 'body' in request else b''
+                status, payload = self.route(request['method'], '/v1.0' + unquote(url), {}, body)[:2]
+                headers = {}
+            statuses[request['id']] = status
+            responses.append({'id': request['id'], 'status': status, 'headers': headers, 'body': payload})
+        return 200, {'responses': responses}
+
+    def handle_copy(self, item_path, request, query):
+        parent_id = request['parentReference']['id']
+        parent_path = next((key for key, item in self.items.items() if item['id'] == parent_id), None)
+        if parent_path is None:
+            return 404, {'error': {'code': 'itemNotFound'}}
+        copy_path = f"{parent_path}/{request.get('name') or self.items[item_path]['name']}"
+        if copy_path in self.items:
+            if query.get('@microsoft.graph.conflictBehavior', ['fail'])[0] == 'fail':
+                return 409, {'error': {'code': 'nameAlreadyExists'}}
+            copy_path = self._unique_path(copy_path)
+        self.items[copy_path] = self._make_item(copy_path, content=self.items[item_path]['content'])
+        return 202, None, {'Location': f"{self.root_url}/monitor/{self.items[copy_path]['id']}"}
+
+    def handle_delta(self, folder_path, folder_id, query):
+        token = int(query.get('token', ['0'])[0])
+        skip = int(query.get('skip', ['0'])[0])
+        if token and self.expire_delta_token:
+            self.expire_delta_token = False
+            return 410, {'error': {'code': 'resyncRequired'}}
+
+        changed = sorted(
+            (item for key, item in self.items.items()
+             if (key == folder_path or key.startswith(folder_path + '/')) and item['seq'] > token),
+            key=lambda item: item['path'].count('/')
+        )
+        values = [self.public(item, with_path=False) for item in changed]
+        values += [{'id': item_id, 'deleted': {'state': 'deleted'}} for seq, item_id in self.tombstones if seq > token]
+
+        data = self.page(values, f"/v1.0/me/drive/items/{folder_id}/delta?token={token}", skip)
+        if '@odata.nextLink' not in data:
+            data['@odata.deltaLink'] = f"{self.base_url}/me/drive/items/{folder_id}/delta?token={self.seq}"
+        return 200, data
+
+    def handle_upload_session(self, method, session_id, headers, body):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return 404, {'error': {'code': 'itemNotFound'}}
+
+        received = len(session['data'])
+        if method == 'GET':
+            return 200, {'nextExpectedRanges': [f"{received}-"]}
+
+        if self.fail_after_chunks is not None and self.chunks_received >= self.fail_after_chunks:
+            self.fail_after_chunks = None
+            return 500, {'error': {'code': 'generalException'}}
+
+        match = CONTENT_RANGE_RE.match(headers.get('Content-Range', ''))
+        if not match:
+            return 400, {'error': {'code': 'invalidRange'}}
+        start, end, total = (int(match.group(name)) for name in ('start', 'end', 'total'))
+        if start != received or end - start + 1 != len(body):
+            return 416, {'error': {'code': 'invalidRange'}}
+
+        session['data'].extend(body)
+        self.chunk_bytes_received += len(body)
+        self.chunks_received += 1
+
+        if len(session['data']) < total:
+            return 202, {'nextExpectedRanges': [f"{len(session['data'])}-"]}
+
+        del self.sessions[session_id]
+        item_path = self._unique_path(session['path'])
+        self._ensure_parents(item_path)
+        self.items[item_path] = self._make_item(item_path, content=bytes(session['data']))
+        if self.lose_final_response:
+            self.lose_final_response = False
+            return None, None
+        return 201, self.public(self.items[item_path])
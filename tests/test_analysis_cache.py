@@ -0,0 +1,150 @@
+"""
+Tests for the receipt analysis cache
+"""
+import unittest
+import sys
+import os
+import io
+import tempfile
+import time
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.ai import analysis_cache
+from modules.ai.analysis_cache import AnalysisCache, hamming_distance, perceptual_hash
+
+if analysis_cache.PIL_AVAILABLE:
+    from PIL import Image
+
+
+EXTRACTED = {"total_amount": 1280.0, "date": "2024-05-01", "store_name": "テスト商店", "items": [], "tax": 116.0}
+
+
+def make_image(seed=0, size=(600, 800), quality=90):
+    image = Image.new("L", size, 240)
+    for i in range(12):
+        y = 40 + i * 60
+        image.paste(20, (60 + (seed * 37 + i * 53) % 200, y, 540 - (seed * 11 + i * 29) % 200, y + 25))
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+
+class TestAnalysisCache(unittest.TestCase):
+    """Test exact lookups, versions and eviction"""
+
+    def create_cache(self, **kwargs):
+        options = dict(db_path=":memory:", ttl_seconds=0, max_entries=100,
+                       memory_entries=10, perceptual_distance=-1)
+        options.update(kwargs)
+        return AnalysisCache("model:1", **options)
+
+    def test_hit_after_put(self):
+        """Test that stored results are returned for the same bytes"""
+        cache = self.create_cache()
+        self.assertIsNone(cache.get(b"image-a"))
+
+        cache.put(b"image-a", EXTRACTED, 0.93)
+        result = cache.get(b"image-a")
+
+        self.assertEqual(result["extracted_data"], EXTRACTED)
+        self.assertEqual(result["confidence"], 0.93)
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(result["cache"], "exact")
+        self.assertIsNone(cache.get(b"image-b"))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_results_are_copies(self):
+        """Test that modifying a returned result does not change the cache"""
+        cache = self.create_cache()
+        cache.put(b"image-a", EXTRACTED, 0.9)
+        cache.get(b"image-a")["extracted_data"]["total_amount"] = 0
+
+        self.assertEqual(cache.get(b"image-a")["extracted_data"]["total_amount"], 1280.0)
+
+    def test_version_change_invalidates(self):
+        """Test that a new model/prompt version does not reuse old results"""
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        path = os.path.join(temp_dir.name, "cache.sqlite3")
+
+        AnalysisCache("model:1", db_path=path, perceptual_distance=-1).put(b"image-a", EXTRACTED, 0.9)
+        self.assertIsNotNone(AnalysisCache("model:1", db_path=path).get(b"image-a"))
+
+        newer = AnalysisCache("model:2", db_path=path, perceptual_distance=-1)
+        self.assertIsNone(newer.get(b"image-a"))
+        newer.prune()
+        self.assertEqual(len(AnalysisCache("model:1", db_path=path)), 0)
+
+    def test_ttl_expiry(self):
+        """Test that expired results are misses"""
+        cache = self.create_cache(ttl_seconds=0.05, memory_entries=0)
+        cache.put(b"image-a", EXTRACTED, 0.9)
+        self.assertIsNotNone(cache.get(b"image-a"))
+
+        time.sleep(0.1)
+        self.assertIsNone(cache.get(b"image-a"))
+
+    def test_size_bound_evicts_least_recently_used(self):
+        """Test that pruning keeps the most recently used entries"""
+        cache = self.create_cache(max_entries=2, memory_entries=0)
+        cache.put(b"a", EXTRACTED, 0.9)
+        time.sleep(0.01)
+        cache.put(b"b", EXTRACTED, 0.9)
+        time.sleep(0.01)
+        cache.get(b"a")
+        time.sleep(0.01)
+        cache.put(b"c", EXTRACTED, 0.9)
+
+        cache.prune()
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNotNone(cache.get(b"a"))
+        self.assertIsNone(cache.get(b"b"))
+
+    def test_memory_hits_are_fast(self):
+        """Test that repeated lookups stay well under a millisecond"""
+        cache = self.create_cache()
+        image = os.urandom(500000)
+        sha256 = analysis_cache.content_hash(image)
+        cache.put(image, EXTRACTED, 0.9, sha256=sha256)
+
+        started = time.perf_counter()
+        for _ in range(1000):
+            cache.get(image, sha256=sha256)
+        self.assertLess((time.perf_counter() - started) / 1000, 0.001)
+
+
+@unittest.skipUnless(analysis_cache.PIL_AVAILABLE, "Pillow not installed")
+class TestPerceptualMatching(unittest.TestCase):
+    """Test near-duplicate lookups"""
+
+    def test_reencoded_copy_hits(self):
+        """Test that a recompressed and resized copy finds the original's result"""
+        cache = AnalysisCache("model:1", db_path=":memory:", perceptual_distance=2)
+        original = make_image(quality=95)
+        cache.put(original, EXTRACTED, 0.9)
+
+        with Image.open(io.BytesIO(original)) as image:
+            output = io.BytesIO()
+            image.resize((300, 400)).save(output, format="JPEG", quality=40)
+        copy = output.getvalue()
+
+        self.assertLessEqual(hamming_distance(perceptual_hash(original), perceptual_hash(copy)), 2)
+        result = cache.get(copy)
+        self.assertEqual(result["cache"], "perceptual")
+        self.assertEqual(result["extracted_data"], EXTRACTED)
+        self.assertEqual(cache.stats()["perceptual_hits"], 1)
+
+    def test_disabled_by_negative_distance(self):
+        """Test that perceptual matching can be turned off"""
+        cache = AnalysisCache("model:1", db_path=":memory:", perceptual_distance=-1)
+        cache.put(make_image(quality=95), EXTRACTED, 0.9)
+
+        self.assertIsNone(cache.get(make_image(quality=60)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+"""
+Tests for the asyncio OneDrive client
+"""
+import unittest
+import sys
+import os
+import asyncio
+import threading
+import time
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+from modules.onedrive import client as client_module
+from modules.onedrive.async_client import AsyncOneDriveClient
+from modules.onedrive.delta_index import DriveIndex
+from modules.onedrive.upload_index import UploadHashIndex
+
+
+class SlowClient:
+    """Stands in for OneDriveClient and records how many uploads overlap"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.started = []
+        self.cancel_events = []
+
+    def ensure_folder(self, folder_path=None):
+        return "folder-id"
+
+    def upload_file(self, file_content, file_name, folder_path=None, resume_key=None,
+                    deduplicate=True, cancel_event=None):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.started.append(file_name)
+            self.cancel_events.append(cancel_event)
+        try:
+            # Stop early like a chunked upload would
+            cancel_event.wait(self.delay)
+            return None if cancel_event.is_set() else {"name": file_name}
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class TestAsyncOneDriveClient(unittest.TestCase):
+    """Test bounded concurrency and cancellation"""
+
+    def test_concurrency_is_bounded(self):
+        """Test that uploads overlap but never exceed the limit"""
+        slow = SlowClient()
+        async_client = AsyncOneDriveClient(client=slow, max_concurrency=3)
+
+        async def run():
+            async with async_client:
+                return await async_client.upload_many([(b"x", f"{n}.jpg") for n in range(10)], folder_path="u1")
+
+        results = asyncio.run(run())
+        self.assertEqual([result["name"] for result in results], [f"{n}.jpg" for n in range(10)])
+        self.assertEqual(slow.peak, 3)
+        self.assertEqual(async_client.stats()["completed"], 11)
+
+    def test_cancellation_stops_running_and_queued_uploads(self):
+        """Test that queued uploads never start and running ones are told to stop"""
+        slow = SlowClient(delay=5)
+        async_client = AsyncOneDriveClient(client=slow, max_concurrency=2)
+
+        async def run():
+            task = asyncio.ensure_future(
+                async_client.upload_many([(b"x", f"{n}.jpg") for n in range(6)])
+            )
+            while len(slow.started) < 2:
+                await asyncio.sleep(0.01)
+            started = time.monotonic()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await async_client.aclose()
+            return time.monotonic() - started
+
+        elapsed = asyncio.run(run())
+        self.assertLess(elapsed, 2)
+        self.assertEqual(len(slow.started), 2)
+        self.assertTrue(all(event.is_set() for event in slow.cancel_events))
+        self.assertEqual(async_client.stats()["cancelled"], 2)
+
+
+@unittest.skipUnless(client_module.REQUESTS_AVAILABLE, "requests not installed")
+class TestAsyncUploads(unittest.TestCase):
+    """Test parallel uploads against a fake Graph endpoint"""
+
+    def setUp(self):
+        from modules.onedrive.http_session import GraphSession
+        from modules.onedrive.token_manager import TokenCache, TokenManager
+        from tests.fake_graph import FakeGraphServer
+
+        self.server = FakeGraphServer()
+        self.addCleanup(self.server.close)
+        self.original_base_url = config.GRAPH_BASE_URL
+        config.GRAPH_BASE_URL = self.server.base_url
+
+        self.client = client_module.OneDriveClient(
+            token_manager=TokenManager(
+                cache=TokenCache(),
+                fetch_token=lambda: {"access_token": "fake", "expires_in": 3600},
+                background_refresh=False
+            ),
+            session=GraphSession(max_retries=0),
+            drive_index=DriveIndex(":memory:")
+        )
+        self.client.upload_index = UploadHashIndex(":memory:")
+
+    def tearDown(self):
+        config.GRAPH_BASE_URL = self.original_base_url
+
+    def test_upload_image_set(self):
+        """Test that an image set lands in one folder without duplicate folders"""
+        async def run():
+            async with AsyncOneDriveClient(client=self.client, max_concurrency=4) as async_client:
+                results = await async_client.upload_many(
+                    [(f"photo {n}".encode(), f"{n}.jpg") for n in range(8)], folder_path="u1/2024-01"
+                )
+                listing = await async_client.list_files("u1/2024-01", use_index=False)
+            return results, listing
+
+        results, listing = asyncio.run(run())
+        self.assertTrue(all(results))
+        self.assertEqual(sorted(item["name"] for item in listing), [f"{n}.jpg" for n in range(8)])
+        self.assertEqual([key for key in self.server.items if key.endswith("u1 1")], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+"""
+Tests for the LINE Bot handler's upload and receipt analysis flow
+"""
+import unittest
+import sys
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+from modules.ai.analysis_cache import content_hash
+from modules.line_bot import bot_handler
+from modules.line_bot.bot_handler import LineBotHandler
+
+
+def receipt_result(amount, store="セブンイレブン", date="2024-05-01"):
+    return {"status": "success", "confidence": 0.95,
+            "extracted_data": {"store_name": store, "date": date, "total_amount": amount, "items": []}}
+
+
+class FakeContent:
+    """LINE message content"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.data), chunk_size):
+            yield self.data[start:start + chunk_size]
+
+
+class FakeOneDrive:
+    """Stores uploads in memory"""
+
+    def __init__(self):
+        self.uploads = []
+        self.lock = threading.Lock()
+
+    def upload_file(self, content, file_name, folder_path=None, resume_key=None):
+        data = content if isinstance(content, bytes) else content.read()
+        with self.lock:
+            self.uploads.append((folder_path, file_name, data))
+            return {"id": f"item-{len(self.uploads)}", "name": file_name, "size": len(data)}
+
+
+class FakeAssistant:
+    """Reads the receipt total from the image bytes ('receipt-<amount>')"""
+
+    image_preprocessor = None
+
+    def __init__(self):
+        self.analyzed = []
+        self.bulk_runs = []
+        self.placements = []
+
+    def analyze_receipt_image(self, image, preprocessed=False):
+        self.analyzed.append(image)
+        return receipt_result(int(image.split(b"-")[1]))
+
+    def analyze_receipts_bulk(self, images, on_progress=None, preprocessed=False):
+        self.bulk_runs.append(list(images))
+        for index, image in enumerate(images):
+            yield index, receipt_result(int(image.split(b"-")[1]))
+            if on_progress:
+                on_progress(index + 1, len(images))
+
+    def translate_search_query(self, question):
+        return None
+
+    def suggest_file_placement(self, fields):
+        if "taxi" in fields["file_name"]:
+            return {"folder": "交通費", "file_name": fields["file_name"], "confidence": 0.9, "source": "index"}
+        return None
+
+    def record_file_placement(self, fields, folder, file_name):
+        self.placements.append((fields, folder, file_name))
+
+
+class FakeLineApi:
+    """Records pushed messages"""
+
+    def __init__(self):
+        self.pushed = []
+
+    def push_message(self, user_id, message):
+        self.pushed.append((user_id, message.text))
+
+    def get_profile(self, user_id):
+        return SimpleNamespace(display_name="田中")
+
+
+@unittest.skipUnless(bot_handler.DEPENDENCIES_AVAILABLE, "line-bot-sdk or Flask not installed")
+class TestReceiptAnalysisAfterUpload(unittest.TestCase):
+    """Test that stored images are analyzed and the results stored"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        temp = Path(self.temp_dir.name)
+        patcher = mock.patch.multiple(
+            config,
+            LINE_CHANNEL_ACCESS_TOKEN="token",
+            LINE_CHANNEL_SECRET="secret",
+            DEDUP_BACKEND="memory",
+            DATABASE_URL=f"sqlite:///{temp}/app.sqlite3",
+            OUTBOX_DB_PATH=str(temp / "outbox.sqlite3"),
+            OUTBOX_DIR=temp / "outbox",
+            IMAGE_PREPROCESS_ENABLED=False,
+            EXPORT_API_TOKEN="",
+            RECEIPT_BATCH_WINDOW=0.2,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.onedrive = FakeOneDrive()
+        self.assistant = FakeAssistant()
+        self.handler = LineBotHandler(onedrive_client=self.onedrive, ai_assistant=self.assistant)
+        self.handler.line_bot_api = FakeLineApi()
+
+    def tearDown(self):
+        self.handler.cleanup()
+        self.temp_dir.cleanup()
+
+    def wait_for(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            value = condition()
+            if value:
+                return value
+            time.sleep(0.02)
+        self.fail("Timed out waiting for the background work")
+
+    def send_image(self, user_id, data, message_id="m1"):
+        file_name = self.handler.build_file_name(message_id, "jpg")
+        return self.handler.store_message_content(user_id, FakeContent(data), file_name, kind="image",
+                                                  message_id=message_id)
+
+    def test_completed_image_entry_is_analyzed_and_stored(self):
+        """Test the path from a completed outbox entry to a stored analysis"""
+        image = b"receipt-1280-" + b"x" * 100
+        self.assertIsNotNone(self.send_image("U1", image))
+
+        stored = self.wait_for(lambda: self.handler.receipt_results.get("U1", content_hash(image)))
+        self.assertEqual(stored["total_amount"], 1280)
+        self.assertEqual(stored["store_name"], "セブンイレブン")
+        self.assertEqual(len(self.onedrive.uploads), 1)
+        self.assertEqual(self.handler.receipt_images, {})
+        self.wait_for(lambda: any("¥1,280" in text for _, text in self.handler.line_bot_api.pushed))
+
+        found = self.handler.search_index.search("U1", {"keywords": ["セブン"]})
+        self.assertEqual([doc["kind"] for doc in found], ["receipt"])
+
+    def test_receipt_without_total_is_reported_as_unknown(self):
+        """Test that a missing total is not pushed as ¥0"""
+        image = b"receipt-0-" + b"x" * 100
+        with mock.patch.object(self.assistant, "analyze_receipt_image",
+                               return_value=receipt_result(None)):
+            self.send_image("U1", image)
+            text = self.wait_for(lambda: next((text for _, text in self.handler.line_bot_api.pushed
+                                               if "レシートを読み取りました" in text), None))
+        self.assertIn("金額不明", text)
+        self.assertNotIn("¥0", text)
+
+    def test_photo_set_is_analyzed_in_one_bulk_run(self):
+        """Test that receipts uploaded together reach analyze_receipts_for_user"""
+        images = [b"receipt-%d-" % amount + b"x" * 100 for amount in (100, 200, 300)]
+        for number, image in enumerate(images):
+            self.send_image("U1", image, message_id=f"m{number}")
+
+        for image in images:
+            self.wait_for(lambda: self.handler.receipt_results.get("U1", content_hash(image)))
+        self.assertEqual(len(self.assistant.bulk_runs), 1)
+        self.assertEqual(sorted(self.assistant.bulk_runs[0]), sorted(images))
+        self.assertEqual(self.assistant.analyzed, [])
+        self.assertEqual(self.handler.receipt_batches, {})
+        self.wait_for(lambda: any("3件のレシートの解析が完了しました" in text
+                                  for _, text in self.handler.line_bot_api.pushed))
+
+    def test_full_photo_set_is_analyzed_without_waiting(self):
+        """Test that RECEIPT_BATCH_MAX receipts are flushed right away"""
+        with mock.patch.object(config, "RECEIPT_BATCH_WINDOW", 60.0), \
+                mock.patch.object(config, "RECEIPT_BATCH_MAX", 2):
+            for number in range(2):
+                self.send_image("U1", b"receipt-%d-" % (number + 1) + b"x" * 10, message_id=f"m{number}")
+            self.wait_for(lambda: self.assistant.bulk_runs)
+        self.assertEqual(len(self.assistant.bulk_runs[0]), 2)
+
+    def test_sales_commands_show_uploaded_receipts(self):
+        """Test that 'ステータス' and '週報' count receipts analyzed after upload"""
+        image = b"receipt-1280-" + b"x" * 100
+        # An unreadable date falls back to the day the photo was sent, i.e. this week
+        with mock.patch.object(self.assistant, "analyze_receipt_image",
+                               return_value=receipt_result(1280, date=None)):
+            self.send_image("U1", image)
+            self.wait_for(lambda: self.handler.receipt_results.get("U1", content_hash(image)))
+
+        status = self.handler.process_text_message("U1", "ステータス")
+        self.assertIn("本日: ¥1,280（1件）", status)
+        self.assertIn("累計: ¥1,280（1件）", status)
+        self.assertIn("売上合計: ¥1,280", self.handler.process_text_message("U1", "週報"))
+
+    def test_suggested_category_places_the_file_and_is_learned(self):
+        """Test that {category} comes from the classifier and the decision is recorded"""
+        self.handler.naming_rules.save({"name": "by-category", "priority": 1,
+                                        "folder_template": "{user_id}/{category}", "file_template": "{original}"})
+        self.handler.naming.reload()
+
+        self.handler.store_message_content("U1", FakeContent(b"fare"), "taxi.pdf", kind="file")
+        self.handler.store_message_content("U1", FakeContent(b"memo"), "memo.txt", kind="file")
+        self.wait_for(lambda: len(self.assistant.placements) == 2)
+
+        self.assertEqual(sorted(self.onedrive.uploads)[0][:2], ("U1/テキスト", "memo.txt"))
+        self.assertEqual(sorted(self.onedrive.uploads)[1][:2], ("U1/交通費", "taxi.pdf"))
+        self.assertIn(({"file_name": "taxi.pdf"}, "交通費", "taxi.pdf"), self.assistant.placements)
+
+    def test_files_are_not_analyzed(self):
+        """Test that only image entries go to receipt analysis"""
+        entry_id = self.handler.store_message_content("U1", FakeContent(b"receipt-5-pdf"), "a.pdf", kind="file")
+        self.assertIsNotNone(entry_id)
+        self.wait_for(lambda: self.handler.upload_history.recent("U1"))
+        time.sleep(0.1)
+        self.assertEqual(self.assistant.analyzed, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+"""
+Tests for vision requests and bulk receipt analysis
+"""
+import unittest
+import sys
+import os
+import base64
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.ai import receipt_vision
+from modules.ai.analysis_cache import AnalysisCache
+from modules.ai.bulk_analysis import ReceiptBulkAnalyzer
+from modules.ai.receipt_vision import ReceiptParseError, ReceiptVisionClient, parse_receipt_response
+from modules.onedrive.rate_limiter import AdaptiveConcurrencyLimiter
+
+
+def receipt_image(amount, size=100):
+    """Fake image bytes whose 'content' is the receipt total"""
+    return f"receipt-{amount}-".encode() + b"x" * size
+
+
+def amount_of(part):
+    data = base64.b64decode(part["image_url"]["url"].split(",", 1)[1])
+    return int(data.split(b"-")[1])
+
+
+class FakeCompletions:
+    """Answers receipt requests from the amounts encoded in the images"""
+
+    def __init__(self, delay=0.0, drop_packed=False, throttle=0):
+        self.delay = delay
+        self.drop_packed = drop_packed
+        self.throttle = throttle
+        self.requests = []
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def create(self, **body):
+        with self.lock:
+            self.requests.append(body)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            throttled = self.throttle > 0
+            self.throttle -= throttled
+        try:
+            if throttled:
+                import httpx
+                response = httpx.Response(429, headers={"retry-after": "0.01"},
+                                          request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+                raise receipt_vision.openai.RateLimitError("rate limited", response=response, body=None)
+            time.sleep(self.delay)
+            images = [part for part in body["messages"][1]["content"] if part["type"] == "image_url"]
+            receipts = [{"total_amount": amount_of(part), "date": "2024-05-01", "store_name": "店",
+                         "items": [], "tax": 0, "confidence": 0.9} for part in images]
+            if self.drop_packed and len(receipts) > 1:
+                receipts = receipts[:-1]
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps({"receipts": receipts})))],
+                usage=SimpleNamespace(prompt_tokens=100 * len(images), completion_tokens=50 * len(images))
+            )
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def fake_openai(completions):
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+
+def create_vision(completions, **kwargs):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=kwargs.pop("limit", 4), min_limit=1,
+                                         max_limit=8, latency_target_ms=10000)
+    return ReceiptVisionClient(client=fake_openai(completions), limiter=limiter, model="test-model",
+                               max_retries=kwargs.pop("max_retries", 2), sleep=lambda _: None)
+
+
+class TestParseReceiptResponse(unittest.TestCase):
+    """Test parsing of model answers"""
+
+    def test_normalizes_amounts(self):
+        """Test that amounts written as strings become numbers"""
+        text = json.dumps({"receipts": [{"total_amount": "¥1,280", "date": "2024-05-01", "tax": "116",
+                                         "items": [{"name": "弁当", "price": "1,280"}], "confidence": 1.5}]})
+        result = parse_receipt_response(text, 1)[0]
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(result["extracted_data"]["total_amount"], 1280.0)
+        self.assertEqual(result["extracted_data"]["items"][0], {"name": "弁当", "price": 1280.0, "quantity": 1.0})
+        self.assertEqual(result["confidence"], 1.0)
+
+    def test_wrong_count_is_rejected(self):
+        """Test that an answer with a missing receipt is an error"""
+        with self.assertRaises(ReceiptParseError):
+            parse_receipt_response(json.dumps({"receipts": [{}]}), 2)
+        with self.assertRaises(ReceiptParseError):
+            parse_receipt_response("not json", 1)
+
+
+@unittest.skipUnless(receipt_vision.OPENAI_AVAILABLE, "openai not installed")
+class TestReceiptVisionClient(unittest.TestCase):
+    """Test requests, retries and statistics"""
+
+    def test_throttled_request_is_retried(self):
+        """Test that a 429 is retried and reported to the limiter"""
+        completions = FakeCompletions(throttle=1)
+        vision = create_vision(completions)
+
+        results = vision.analyze([receipt_image(500)])
+
+        self.assertEqual(results[0]["extracted_data"]["total_amount"], 500.0)
+        self.assertEqual(len(completions.requests), 2)
+        stats = vision.stats()
+        self.assertEqual(stats["retries"], 1)
+        self.assertEqual(stats["concurrency"]["throttle_events"], 1)
+        self.assertEqual(stats["prompt_tokens"], 100)
+
+
+@unittest.skipUnless(receipt_vision.OPENAI_AVAILABLE, "openai not installed")
+class TestReceiptBulkAnalyzer(unittest.TestCase):
+    """Test packing, concurrency, fallbacks and streaming"""
+
+    def test_packs_small_images_and_streams_all_results(self):
+        """Test that small receipts share requests and every index gets its result"""
+        completions = FakeCompletions(delay=0.02)
+        analyzer = ReceiptBulkAnalyzer(create_vision(completions), images_per_request=4,
+                                       pack_max_bytes=1000, workers=4)
+        images = [receipt_image(100 + i) for i in range(10)] + [receipt_image(999, size=5000)]
+        progress = []
+
+        results = dict(analyzer.analyze(images, on_progress=lambda done, total: progress.append((done, total))))
+
+        self.assertEqual(sorted(results), list(range(11)))
+        for index in range(10):
+            self.assertEqual(results[index]["extracted_data"]["total_amount"], 100 + index)
+        self.assertEqual(results[10]["extracted_data"]["total_amount"], 999)
+        # 10 small images in 3 requests, the large one alone
+        self.assertEqual(sorted(len(r["messages"][1]["content"]) - 1 for r in completions.requests), [1, 2, 4, 4])
+        self.assertGreater(completions.peak, 1)
+        self.assertEqual(progress[-1], (11, 11))
+
+    def test_mismatched_packed_answer_falls_back_to_single_requests(self):
+        """Test that a packed answer missing a receipt is redone one image at a time"""
+        completions = FakeCompletions(drop_packed=True)
+        analyzer = ReceiptBulkAnalyzer(create_vision(completions), images_per_request=3, pack_max_bytes=1000)
+
+        results = dict(analyzer.analyze([receipt_image(i) for i in range(3)]))
+
+        self.assertEqual([results[i]["extracted_data"]["total_amount"] for i in range(3)], [0, 1, 2])
+        self.assertEqual(len(completions.requests), 4)
+
+    def test_images_are_preprocessed_once(self):
+        """Test that requests carry the preprocessed image, shrunk once even when a packed answer is redone"""
+        completions = FakeCompletions(drop_packed=True)
+        cache = AnalysisCache("test", db_path=":memory:", perceptual_distance=-1)
+        prepared = []
+
+        def shrink(data):
+            prepared.append(data)
+            return receipt_image(int(data.split(b"-")[1]), size=10)
+
+        analyzer = ReceiptBulkAnalyzer(create_vision(completions), cache=cache, images_per_request=2,
+                                       pack_max_bytes=1000, preprocess=shrink)
+        images = [receipt_image(500, size=5000), receipt_image(700, size=5000)]
+        results = dict(analyzer.analyze(images))
+
+        self.assertEqual([results[i]["extracted_data"]["total_amount"] for i in range(2)], [500.0, 700.0])
+        self.assertEqual(prepared, images)
+        # One packed request, then one per image after the mismatched answer
+        self.assertEqual(len(completions.requests), 3)
+        sent = [part["image_url"]["url"] for request in completions.requests
+                for part in request["messages"][1]["content"] if part["type"] == "image_url"]
+        self.assertTrue(all(len(base64.b64decode(url.split(",", 1)[1])) < 100 for url in sent))
+        # Cached under the original image
+        self.assertEqual(dict(analyzer.analyze(images))[0]["cache"], "exact")
+
+    def test_preprocessed_images_are_sent_as_given(self):
+        """Test that images already shrunk when stored are not preprocessed again"""
+        completions = FakeCompletions()
+        prepared = []
+        analyzer = ReceiptBulkAnalyzer(create_vision(completions), pack_max_bytes=1000,
+                                       preprocess=lambda data: prepared.append(data) or data)
+
+        list(analyzer.analyze([receipt_image(1)], preprocessed=True))
+
+        self.assertEqual(prepared, [])
+        self.assertEqual(len(completions.requests), 1)
+
+    def test_cached_results_skip_requests(self):
+        """Test that cached receipts are yielded first without calling the API"""
+        cache = AnalysisCache("test", db_path=":memory:", perceptual_distance=-1)
+        completions = FakeCompletions()
+        analyzer = ReceiptBulkAnalyzer(create_vision(completions), cache=cache, pack_max_bytes=1000)
+        images = [receipt_image(1), receipt_image(2)]
+        list(analyzer.analyze(images[:1]))
+
+        streamed = list(analyzer.analyze(images))
+
+        self.assertEqual(streamed[0][0], 0)
+        self.assertEqual(streamed[0][1]["cache"], "exact")
+        self.assertEqual(len(completions.requests), 2)
+
+    def test_batch_job_round_trip(self):
+        """Test submitting an offline batch and collecting its output"""
+        vision = create_vision(FakeCompletions())
+        uploaded = {}
+        state = {"status": "in_progress"}
+
+        def create_file(file, purpose):
+            uploaded["lines"] = [json.loads(line) for line in file[1].decode().splitlines()]
+            uploaded["purpose"] = purpose
+            return SimpleNamespace(id="file-in")
+
+        def output_text():
+            lines = []
+            for request in uploaded["lines"]:
+                images = [p for p in request["body"]["messages"][1]["content"] if p["type"] == "image_url"]
+                content = json.dumps({"receipts": [{"total_amount": amount_of(p), "confidence": 0.8} for p in images]})
+                lines.append(json.dumps({"custom_id": request["custom_id"], "response": {
+                    "status_code": 200, "body": {"choices": [{"message": {"content": content}}]}}}))
+            return "\n".join(lines)
+
+        vision._client = SimpleNamespace(
+            files=SimpleNamespace(create=create_file,
+                                  content=lambda file_id: SimpleNamespace(text=output_text())),
+            post=lambda path, cast_to, body: {"id": "batch-1", "input_file_id": body["input_file_id"]},
+            get=lambda path, cast_to: dict(state, output_file_id="file-out"),
+        )
+        analyzer = ReceiptBulkAnalyzer(vision, images_per_request=2, pack_max_bytes=1000)
+        images = [receipt_image(i * 10) for i in range(3)]
+
+        batch_id = analyzer.submit_batch(images)
+        self.assertEqual(batch_id, "batch-1")
+        self.assertEqual(uploaded["purpose"], "batch")
+        self.assertEqual(len(uploaded["lines"]), 2)
+        self.assertIsNone(analyzer.collect_batch(batch_id))
+
+        state["status"] = "completed"
+        results = analyzer.collect_batch(batch_id, images)
+        self.assertEqual({i: r["extracted_data"]["total_amount"] for i, r in results.items()},
+                         {0: 0, 1: 10, 2: 20})
+
+
+if __name__ == '__main__':
+    unittest.main()
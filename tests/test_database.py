@@ -0,0 +1,198 @@
+"""
+Tests for the pooled SQLite persistence layer
+"""
+import unittest
+import sys
+import os
+import sqlite3
+import tempfile
+import threading
+from decimal import Decimal
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.database.batcher import WriteBehindBatcher
+from modules.database.pool import ConnectionPool, PoolTimeoutError, parse_database_url
+from modules.database.repositories import (
+    CommissionRateRepository, ReceiptResultRepository, UploadHistoryRepository, UserStateRepository
+)
+
+
+class TestParseDatabaseUrl(unittest.TestCase):
+    """Test DATABASE_URL parsing"""
+
+    def test_sqlite_urls(self):
+        """Test relative, absolute and in-memory paths with pool options"""
+        self.assertEqual(parse_database_url("sqlite:///data/app.sqlite3")["path"], "data/app.sqlite3")
+        settings = parse_database_url("sqlite:////var/lib/bot.db?pool_size=3&timeout=5")
+        self.assertEqual((settings["path"], settings["pool_size"], settings["timeout"]), ("/var/lib/bot.db", 3, 5.0))
+        self.assertEqual(parse_database_url("sqlite:///:memory:")["path"], ":memory:")
+        self.assertTrue(parse_database_url("")["path"].endswith("app.sqlite3"))
+
+    def test_other_databases_are_rejected(self):
+        """Test that non-SQLite URLs raise"""
+        with self.assertRaises(ValueError):
+            parse_database_url("postgresql://user@host/db")
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.pool = ConnectionPool(f"sqlite:///{self.temp_dir.name}/app.sqlite3?timeout=2", pool_size=2)
+        self.batcher = WriteBehindBatcher(self.pool, max_batch=100, flush_interval=0.01)
+
+    def tearDown(self):
+        self.batcher.stop()
+        self.pool.close()
+        self.temp_dir.cleanup()
+
+
+class TestConnectionPool(DatabaseTestCase):
+    """Test connection reuse, limits and transactions"""
+
+    def test_connections_are_reused_and_bounded(self):
+        """Test that the pool hands out at most pool_size connections"""
+        with self.pool.connection() as first:
+            with self.pool.connection() as second:
+                self.assertIsNot(first, second)
+                self.pool.timeout = 0.05
+                with self.assertRaises(PoolTimeoutError):
+                    with self.pool.connection():
+                        pass
+        with self.pool.connection() as again:
+            self.assertIn(again, (first, second))
+        self.assertEqual(self.pool.stats()["open"], 2)
+
+    def test_transaction_rolls_back_on_error(self):
+        """Test that a failed transaction leaves no rows"""
+        with self.pool.connection() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER)")
+        with self.assertRaises(RuntimeError):
+            with self.pool.transaction() as conn:
+                conn.execute("INSERT INTO t VALUES (1)")
+                raise RuntimeError("boom")
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 0)
+
+
+class TestWriteBehindBatcher(DatabaseTestCase):
+    """Test batched writes"""
+
+    def test_inserts_are_grouped(self):
+        """Test that concurrent inserts are committed in few transactions"""
+        with self.pool.connection() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER UNIQUE)")
+
+        def insert(start):
+            for x in range(start, start + 250):
+                self.batcher.submit("INSERT INTO t VALUES (?)", (x,))
+
+        threads = [threading.Thread(target=insert, args=(i * 250,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(self.batcher.flush(5))
+
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 1000)
+        stats = self.batcher.stats()
+        self.assertEqual(stats["written"], 1000)
+        self.assertLess(stats["batches"], 100)
+
+    def test_bad_statement_does_not_lose_batch(self):
+        """Test that one failing insert is dropped and the rest are written"""
+        with self.pool.connection() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER UNIQUE)")
+        for x in (1, 2, 2, 3):
+            self.batcher.submit("INSERT INTO t VALUES (?)", (x,))
+        self.batcher.flush(5)
+
+        with self.pool.connection() as conn:
+            self.assertEqual([row[0] for row in conn.execute("SELECT x FROM t ORDER BY x")], [1, 2, 3])
+        self.assertEqual(self.batcher.stats()["failed"], 1)
+
+    def test_locked_database_requeues_writes(self):
+        """Test that writes hitting a held lock are retried in order instead of dropped"""
+        path = f"{self.temp_dir.name}/locked.sqlite3"
+        pool = ConnectionPool(f"sqlite:///{path}?timeout=0.05")
+        batcher = WriteBehindBatcher(pool, flush_interval=0.01)
+        self.addCleanup(pool.close)
+        self.addCleanup(batcher.stop)
+        with pool.connection() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER)")
+
+        holder = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        holder.execute("BEGIN IMMEDIATE")
+        for x in (1, 2, 3):
+            batcher.submit("INSERT INTO t VALUES (?)", (x,))
+        self.assertFalse(batcher.flush(0.3))
+        holder.execute("COMMIT")
+        holder.close()
+        self.assertTrue(batcher.flush(5))
+
+        with pool.connection() as conn:
+            self.assertEqual([row[0] for row in conn.execute("SELECT x FROM t ORDER BY rowid")], [1, 2, 3])
+        stats = batcher.stats()
+        self.assertEqual((stats["written"], stats["failed"]), (3, 0))
+        self.assertGreater(stats["requeued"], 0)
+
+
+class TestRepositories(DatabaseTestCase):
+    """Test the repositories through the batcher"""
+
+    def test_upload_history(self):
+        """Test that queued uploads are visible to the next read"""
+        history = UploadHistoryRepository(self.pool, self.batcher)
+        history.add("u1", "a.jpg", folder_path="u1/2024-05", item_id="1", size=10, kind="image")
+        history.add("u1", "b.pdf", kind="file", deduplicated=True)
+        history.add("u2", "c.jpg")
+
+        recent = history.recent("u1")
+
+        self.assertEqual([row["file_name"] for row in recent], ["b.pdf", "a.jpg"])
+        self.assertEqual(recent[0]["deduplicated"], 1)
+
+    def test_receipt_results(self):
+        """Test that a result is stored once per image with whole-yen totals"""
+        receipts = ReceiptResultRepository(self.pool, self.batcher)
+        result = {"status": "success", "confidence": 0.9, "tier": "fast",
+                  "extracted_data": {"store_name": "店", "date": "2024-05-02", "total_amount": 1080.5}}
+        receipts.add("u1", "hash1", result)
+        receipts.add("u1", "hash1", dict(result, tier="accurate"))
+        receipts.add("u1", "hash2", dict(result, extracted_data={"date": "2024-06-01", "total_amount": 10}))
+
+        stored = receipts.get("u1", "hash1")
+
+        self.assertEqual((stored["total_amount"], stored["tier"]), (1081, "accurate"))
+        self.assertEqual(stored["data"]["store_name"], "店")
+        self.assertEqual([row["sha256"] for row in receipts.between("u1", "2024-05-01", "2024-05-31")], ["hash1"])
+
+    def test_commission_rates(self):
+        """Test exact decimal rates and validation"""
+        rates = CommissionRateRepository(self.pool)
+        rates.set("A社", 0.3)
+        rates.set("B社", "0.125")
+
+        self.assertEqual(rates.get("A社"), Decimal("0.3"))
+        self.assertEqual(rates.all(), {"A社": Decimal("0.3"), "B社": Decimal("0.125")})
+        self.assertIsNone(rates.get("C社"))
+        with self.assertRaises(ValueError):
+            rates.set("A社", 1.5)
+
+    def test_user_state(self):
+        """Test set, overwrite and delete keep their order through the batcher"""
+        state = UserStateRepository(self.pool, self.batcher)
+        state.set("u1", "mode", "receipt")
+        state.set("u1", "mode", {"step": 2})
+        state.set("u1", "lang", "ja")
+        state.delete("u1", "lang")
+
+        self.assertEqual(state.get("u1", "mode"), {"step": 2})
+        self.assertEqual(state.all_for("u1"), {"mode": {"step": 2}})
+        self.assertEqual(state.get("u2", "mode", "none"), "none")
+
+
+if __name__ == '__main__':
+    unittest.main()
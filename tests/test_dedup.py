@@ -0,0 +1,86 @@
+"""
+Tests for webhook event deduplication
+"""
+import unittest
+import sys
+import os
+import tempfile
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.line_bot.dedup import MemoryDedupStore, SQLiteDedupStore
+
+
+class DedupStoreTests:
+    """Behaviour shared by every dedup backend"""
+
+    def create_store(self, ttl_seconds=60, max_entries=100):
+        raise NotImplementedError
+
+    def test_second_delivery_is_duplicate(self):
+        """Test that the same event ID is reported once as new"""
+        store = self.create_store()
+        self.assertFalse(store.is_duplicate("event-1"))
+        self.assertTrue(store.is_duplicate("event-1"))
+        self.assertFalse(store.is_duplicate("event-2"))
+
+        stats = store.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_expired_event_is_new_again(self):
+        """Test that an event ID is forgotten after the TTL"""
+        store = self.create_store(ttl_seconds=-1)
+        self.assertFalse(store.is_duplicate("event-1"))
+        self.assertFalse(store.is_duplicate("event-1"))
+
+    def test_forget(self):
+        """Test that forgotten event IDs are processed again"""
+        store = self.create_store()
+        store.is_duplicate("event-1")
+        store.forget("event-1")
+        self.assertFalse(store.is_duplicate("event-1"))
+
+
+class TestMemoryDedupStore(DedupStoreTests, unittest.TestCase):
+    """Test the in-process store"""
+
+    def create_store(self, ttl_seconds=60, max_entries=100):
+        return MemoryDedupStore(ttl_seconds=ttl_seconds, max_entries=max_entries)
+
+    def test_lru_eviction(self):
+        """Test that the least recently seen ID is evicted first"""
+        store = self.create_store(max_entries=2)
+        store.is_duplicate("a")
+        store.is_duplicate("b")
+        store.is_duplicate("a")
+        store.is_duplicate("c")
+        self.assertEqual(len(store), 2)
+        self.assertTrue(store.is_duplicate("a"))
+        self.assertFalse(store.is_duplicate("b"))
+
+
+class TestSQLiteDedupStore(DedupStoreTests, unittest.TestCase):
+    """Test the store shared across worker processes"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "events.sqlite3")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_store(self, ttl_seconds=60, max_entries=100):
+        return SQLiteDedupStore(self.db_path, ttl_seconds=ttl_seconds, max_entries=max_entries)
+
+    def test_shared_between_instances(self):
+        """Test that a second store on the same file sees the first store's IDs"""
+        first = self.create_store()
+        second = self.create_store()
+        self.assertFalse(first.is_duplicate("event-1"))
+        self.assertTrue(second.is_duplicate("event-1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+"""
+Tests for the delta-query backed drive index
+"""
+import unittest
+import sys
+import os
+import tempfile
+import time
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+from modules.onedrive import client as client_module
+from modules.onedrive.delta_index import DeltaSync, DriveIndex, parent_reference_path
+from modules.onedrive.upload_index import UploadHashIndex
+
+
+class TestDriveIndex(unittest.TestCase):
+    """Test applying driveItems to the index"""
+
+    def setUp(self):
+        self.index = DriveIndex(":memory:")
+        self.index.apply([{'id': 'r', 'name': 'Root', 'folder': {}}], root_id='r', root_path='Root')
+
+    def test_parent_reference_path(self):
+        """Test that parentReference.path is decoded relative to the drive root"""
+        self.assertEqual(parent_reference_path({'parentReference': {'path': '/drive/root:/A%20B/c'}}), 'A B/c')
+        self.assertEqual(parent_reference_path({'parentReference': {'path': '/drive/root:'}}), '')
+        self.assertIsNone(parent_reference_path({'parentReference': {'id': 'x'}}))
+
+    def test_children_before_parents(self):
+        """Test that items arriving before their parent are still placed"""
+        unresolved = self.index.apply([
+            {'id': 'f', 'name': 'a.jpg', 'file': {}, 'size': 3, 'parentReference': {'id': 'd'}},
+            {'id': 'd', 'name': 'u1', 'folder': {}, 'parentReference': {'id': 'r'}},
+        ])
+        self.assertEqual(unresolved, [])
+        self.assertEqual(self.index.get('Root/u1/a.jpg')['size'], 3)
+
+    def test_folder_rename_moves_descendants(self):
+        """Test that renaming a folder rewrites the paths below it"""
+        self.index.apply([
+            {'id': 'd', 'name': 'u1', 'folder': {}, 'parentReference': {'id': 'r'}},
+            {'id': 'f', 'name': 'a.jpg', 'file': {}, 'parentReference': {'id': 'd'}},
+        ])
+        self.index.apply([{'id': 'd', 'name': 'u2', 'folder': {}, 'parentReference': {'id': 'r'}}])
+        self.assertIsNone(self.index.get('Root/u1/a.jpg'))
+        self.assertEqual(self.index.get('Root/u2/a.jpg')['id'], 'f')
+
+    def test_deleted_folder_removes_descendants(self):
+        """Test that a deleted folder takes its children with it"""
+        self.index.apply([
+            {'id': 'd', 'name': 'u1', 'folder': {}, 'parentReference': {'id': 'r'}},
+            {'id': 'f', 'name': 'a.jpg', 'file': {}, 'parentReference': {'id': 'd'}},
+        ])
+        self.index.apply([{'id': 'd', 'deleted': {}}])
+        self.assertEqual(self.index.list_children('Root'), [])
+        self.assertEqual(self.index.stats()['items'], 1)
+
+
+class TestSyncLease(unittest.TestCase):
+    """Test that worker processes sharing an index file sync one at a time"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = os.path.join(self.temp_dir.name, "drive_index.sqlite3")
+
+    def test_lease_is_exclusive_until_released(self):
+        """Test that a held lease is renewed by its owner and refused to others"""
+        first, second = DriveIndex(self.path), DriveIndex(self.path)
+        self.assertTrue(first.acquire_lease("a", 60))
+        self.assertTrue(first.acquire_lease("a", 60))
+        self.assertFalse(second.acquire_lease("b", 60))
+
+        first.release_lease("a")
+        self.assertTrue(second.acquire_lease("b", 60))
+
+    def test_expired_lease_is_taken_over(self):
+        """Test that a crashed holder's lease lapses"""
+        first, second = DriveIndex(self.path), DriveIndex(self.path)
+        self.assertTrue(first.acquire_lease("a", -1))
+        self.assertTrue(second.acquire_lease("b", 60))
+        self.assertFalse(first.acquire_lease("a", 60))
+
+    def test_only_the_lease_holder_syncs(self):
+        """Test that background syncs on several workers run in one of them"""
+        synced = []
+        workers = [DeltaSync(None, DriveIndex(self.path), interval=0.02, lease_seconds=60) for _ in range(3)]
+        for worker in workers:
+            worker.sync = lambda owner=worker.owner: synced.append(owner) or {}
+            worker.start()
+        time.sleep(0.3)
+        for worker in workers:
+            worker.stop()
+
+        self.assertGreater(len(synced), 1)
+        self.assertEqual(len(set(synced)), 1)
+
+
+@unittest.skipUnless(client_module.REQUESTS_AVAILABLE, "requests not installed")
+class TestDeltaSync(unittest.TestCase):
+    """Test delta sync against a fake Graph endpoint"""
+
+    def setUp(self):
+        from modules.onedrive.http_session import GraphSession
+        from modules.onedrive.token_manager import TokenCache, TokenManager
+        from tests.fake_graph import FakeGraphServer
+
+        self.server = FakeGraphServer()
+        self.server.page_size = 2
+        self.addCleanup(self.server.close)
+        self.original_base_url = config.GRAPH_BASE_URL
+        config.GRAPH_BASE_URL = self.server.base_url
+
+        self.client = client_module.OneDriveClient(
+            token_manager=TokenManager(
+                cache=TokenCache(),
+                fetch_token=lambda: {"access_token": "fake", "expires_in": 3600},
+                background_refresh=False
+            ),
+            session=GraphSession(max_retries=0),
+            drive_index=DriveIndex(":memory:")
+        )
+        self.client.upload_index = UploadHashIndex(":memory:")
+
+    def tearDown(self):
+        config.GRAPH_BASE_URL = self.original_base_url
+
+    def path(self, folder_path):
+        return f"{config.ONEDRIVE_ROOT_FOLDER}/{folder_path}"
+
+    def names(self, items):
+        return sorted(item['name'] for item in items)
+
+    def test_list_files_follows_next_link(self):
+        """Test that listings larger than one page are not cut off"""
+        for number in range(5):
+            self.client.upload_file(str(number).encode(), f"{number}.txt", folder_path="u1")
+        files = self.client.list_files("u1", use_index=False)
+        self.assertEqual(self.names(files), [f"{number}.txt" for number in range(5)])
+
+    def test_incremental_sync(self):
+        """Test that later syncs apply only changes since the delta link"""
+        self.client.upload_file(b"one", "a.txt", folder_path="u1/2024-01")
+        self.client.upload_file(b"two", "b.txt", folder_path="u1/2024-01")
+        first = self.client.delta_sync.sync()
+        self.assertEqual(first['full'], 1)
+        self.assertGreater(first['pages'], 1)
+
+        self.server.delete_tree(self.path("u1/2024-01/a.txt"))
+        self.server.rename(self.path("u1"), "u9")
+        second = self.client.delta_sync.sync()
+        self.assertEqual(second['full'], 0)
+        self.assertEqual(second['items'], 2)
+
+        requests_before = len(self.server.requests)
+        files = self.client.list_files("u9/2024-01")
+        self.assertEqual(self.names(files), ["b.txt"])
+        self.assertEqual(len(self.server.requests), requests_before)
+        self.assertIsNone(self.client.drive_index.get(self.path("u1/2024-01/b.txt")))
+
+    def test_expired_token_resyncs(self):
+        """Test that a 410 response rebuilds the index from scratch"""
+        self.client.upload_file(b"one", "a.txt", folder_path="u1")
+        self.client.delta_sync.sync()
+        self.client.drive_index.apply([{'id': 'ghost', 'name': 'ghost.txt', 'file': {},
+                                        'parentReference': {'path': f"/drive/root:/{config.ONEDRIVE_ROOT_FOLDER}"}}])
+
+        self.server.expire_delta_token = True
+        result = self.client.delta_sync.sync()
+        self.assertEqual(result['full'], 1)
+        self.assertEqual(result['removed'], 1)
+        self.assertEqual(self.names(self.client.list_files()), ["u1"])
+
+    def test_uploads_are_written_through(self):
+        """Test that uploads appear in the index before the next sync"""
+        self.client.delta_sync.sync()
+        self.client.upload_file(b"abc", "new.txt", folder_path="u2")
+        self.assertEqual(self.client.drive_index.get(self.path("u2/new.txt"))['size'], 3)
+        self.assertEqual([item['name'] for item in self.client.recent_files("u2")], ["new.txt"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+Tests for the webhook event worker pool
+"""
+import unittest
+import sys
+import os
+import threading
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.line_bot.event_queue import EventWorkerPool
+
+
+class TestEventWorkerPool(unittest.TestCase):
+    """Test background event processing"""
+
+    def test_jobs_run_on_workers(self):
+        """Test that submitted jobs are executed and counted"""
+        pool = EventWorkerPool(num_workers=2, max_queue_size=10)
+        results = []
+        lock = threading.Lock()
+
+        def job(value):
+            with lock:
+                results.append(value)
+
+        for i in range(5):
+            self.assertTrue(pool.submit(job, i))
+        pool.shutdown()
+
+        self.assertEqual(sorted(results), [0, 1, 2, 3, 4])
+        stats = pool.stats()
+        self.assertEqual(stats['processed'], 5)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_full_queue_rejects_jobs(self):
+        """Test that a full queue rejects instead of blocking"""
+        pool = EventWorkerPool(num_workers=1, max_queue_size=1)
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocking_job():
+            started.set()
+            release.wait(5)
+
+        self.assertTrue(pool.submit(blocking_job))
+        started.wait(5)
+        self.assertTrue(pool.submit(blocking_job))
+        self.assertFalse(pool.submit(blocking_job))
+        self.assertEqual(pool.stats()['rejected'], 1)
+        self.assertEqual(pool.stats()['busy_workers'], 1)
+
+        release.set()
+        pool.shutdown()
+        self.assertEqual(pool.stats()['processed'], 2)
+
+    def test_failed_job_is_counted(self):
+        """Test that an exception in a job does not kill the worker"""
+        pool = EventWorkerPool(num_workers=1, max_queue_size=5)
+
+        def failing_job():
+            raise ValueError("boom")
+
+        pool.submit(failing_job)
+        pool.submit(lambda: None)
+        pool.shutdown()
+
+        stats = pool.stats()
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['processed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+Tests for the local file classifier
+"""
+import unittest
+import sys
+import os
+import tempfile
+import time
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.ai.file_classifier import FileClassifier, embed, fill_template, name_template
+
+
+def receipt_fields(store, date="2024-05-01", amount=1100.0, file_name="IMG_0001.jpg"):
+    return {"file_name": file_name, "store_name": store, "date": date, "amount": amount}
+
+
+class FakeFallback:
+    def __init__(self, answer=None):
+        self.answer = answer
+        self.calls = []
+
+    def __call__(self, fields, neighbours):
+        self.calls.append((fields, neighbours))
+        return self.answer
+
+
+class TestNaming(unittest.TestCase):
+    """Test name templates learned from past file names"""
+
+    def test_template_round_trip(self):
+        """Test that a chosen name is generalized and refilled for another file"""
+        template = name_template("2024-05-01_セブンイレブン_1100.jpg", receipt_fields("セブンイレブン"))
+        self.assertEqual(template, "{date}_{store_name}_{amount}")
+        self.assertEqual(fill_template(template, receipt_fields("ローソン", "2024-06-02", 540)),
+                         "2024-06-02_ローソン_540")
+        self.assertIsNone(fill_template(template, receipt_fields("ローソン", date=None)))
+
+    def test_embedding_is_normalized_and_ignores_digits(self):
+        """Test unit length and that only numbers differing gives the same vector"""
+        vector = embed({"file_name": "請求書_2024-05.pdf"}, 256)
+        self.assertAlmostEqual(sum(v * v for v in vector.values()), 1.0, places=5)
+        self.assertEqual(vector, embed({"file_name": "請求書_2023-11.pdf"}, 256))
+        self.assertEqual(embed({}, 256), {})
+
+
+class TestFileClassifier(unittest.TestCase):
+    """Test suggestions, fallback and persistence"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "decisions.sqlite3")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_classifier(self, fallback=None):
+        return FileClassifier(fallback=fallback, db_path=self.db_path, dimensions=256, top_k=5, min_confidence=0.6)
+
+    def teach(self, classifier):
+        for day, store in enumerate(["セブンイレブン 新宿店", "セブンイレブン 渋谷店", "セブンイレブン 池袋店"], 1):
+            fields = receipt_fields(store, f"2024-05-0{day}")
+            classifier.learn(fields, "経費/コンビニ", f"2024-05-0{day}_{store}_1100.jpg")
+        for day in range(1, 4):
+            fields = receipt_fields("ENEOS 高井戸SS", f"2024-05-0{day}", 5000)
+            classifier.learn(fields, "経費/燃料", f"燃料_2024-05-0{day}.jpg")
+
+    def test_suggests_folder_and_name_locally(self):
+        """Test that similar files are answered from the index without the fallback"""
+        fallback = FakeFallback()
+        classifier = self.create_classifier(fallback)
+        self.teach(classifier)
+
+        suggestion = classifier.suggest(receipt_fields("セブンイレブン 品川店", "2024-06-10", 432, "IMG_9.jpeg"))
+
+        self.assertEqual(suggestion["source"], "index")
+        self.assertEqual(suggestion["folder"], "経費/コンビニ")
+        self.assertEqual(suggestion["file_name"], "2024-06-10_セブンイレブン 品川店_432.jpeg")
+        self.assertGreaterEqual(suggestion["confidence"], 0.6)
+        self.assertEqual(fallback.calls, [])
+
+        fuel = classifier.suggest(receipt_fields("ENEOS 高井戸SS", "2024-06-11", 4800))
+        self.assertEqual((fuel["folder"], fuel["file_name"]), ("経費/燃料", "燃料_2024-06-11.jpg"))
+
+    def test_low_confidence_asks_fallback(self):
+        """Test that an unfamiliar file goes to the fallback with its neighbours"""
+        fallback = FakeFallback({"folder": "書類/契約", "file_name": "契約書_山田"})
+        classifier = self.create_classifier(fallback)
+        self.teach(classifier)
+
+        suggestion = classifier.suggest({"file_name": "業務委託契約書.pdf", "text": "契約期間 甲 乙"})
+
+        self.assertEqual(suggestion["source"], "fallback")
+        self.assertEqual((suggestion["folder"], suggestion["file_name"]), ("書類/契約", "契約書_山田.pdf"))
+        self.assertEqual(len(fallback.calls), 1)
+        self.assertEqual(classifier.stats()["fallback"], 1)
+
+    def test_empty_index_without_fallback(self):
+        """Test that there is no suggestion before anything was learned"""
+        self.assertIsNone(self.create_classifier().suggest(receipt_fields("ローソン")))
+
+    def test_decisions_survive_restart(self):
+        """Test that learned decisions are reloaded from the database"""
+        self.teach(self.create_classifier())
+
+        restarted = self.create_classifier()
+
+        self.assertEqual(len(restarted), 6)
+        self.assertEqual(restarted.suggest(receipt_fields("セブンイレブン 新宿店"))["folder"], "経費/コンビニ")
+
+    def test_suggestion_is_fast(self):
+        """Test that a suggestion over a few thousand decisions takes milliseconds"""
+        classifier = self.create_classifier()
+        for i in range(2000):
+            classifier._append(f"folder{i % 40}", f"file{i}.jpg", receipt_fields(f"店舗{i % 300} 支店{i}"))
+
+        started = time.perf_counter()
+        classifier.suggest(receipt_fields("店舗12 支店99"))
+        self.assertLess(time.perf_counter() - started, 0.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
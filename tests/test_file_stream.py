@@ -0,0 +1,51 @@
+"""
+Tests for streaming file helpers
+"""
+import unittest
+import sys
+import os
+import io
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.utils.file_stream import (
+    FileTooLargeError, UnsupportedFileTypeError,
+    extension_for_content_type, get_file_extension, validate_file_extension, write_chunks
+)
+
+
+class TestFileStream(unittest.TestCase):
+    """Test size and type enforcement while streaming"""
+
+    def test_write_chunks_roundtrip(self):
+        """Test that written content matches the input chunks"""
+        destination = io.BytesIO()
+        self.assertEqual(write_chunks(iter([b"a" * 10, b"", b"b" * 5]), destination, max_size=100), 15)
+        self.assertEqual(destination.getvalue(), b"a" * 10 + b"b" * 5)
+
+    def test_write_chunks_stops_at_limit(self):
+        """Test that reading stops as soon as the limit is exceeded"""
+        consumed = []
+
+        def chunks():
+            for i in range(10):
+                consumed.append(i)
+                yield b"x" * 10
+
+        with self.assertRaises(FileTooLargeError):
+            write_chunks(chunks(), io.BytesIO(), max_size=25)
+        self.assertEqual(consumed, [0, 1, 2])
+
+    def test_extension_helpers(self):
+        """Test extension detection and validation"""
+        self.assertEqual(get_file_extension("Receipt.JPG"), "jpg")
+        self.assertEqual(extension_for_content_type("image/png; charset=binary"), "png")
+        self.assertEqual(extension_for_content_type(None), "")
+        validate_file_extension("pdf")
+        with self.assertRaises(UnsupportedFileTypeError):
+            validate_file_extension("exe")
+
+
+if __name__ == '__main__':
+    unittest.main()
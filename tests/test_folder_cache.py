@@ -0,0 +1,138 @@
+"""
+Tests for folder path resolution and the folder ID cache
+"""
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+from modules.onedrive import client as client_module
+from modules.onedrive.folder_cache import FolderCache
+from modules.onedrive.upload_index import UploadHashIndex
+
+
+class TestFolderCache(unittest.TestCase):
+    """Test the path -> item ID cache"""
+
+    def test_deepest_ancestor(self):
+        """Test that the longest cached prefix is returned"""
+        cache = FolderCache()
+        cache.set("root/a", "id-a")
+        cache.set("root/a/b", "id-b")
+        self.assertEqual(cache.deepest_ancestor("/root/a/b/c/"), ("root/a/b", "id-b"))
+        self.assertEqual(cache.deepest_ancestor("other/x"), ("", None))
+
+    def test_invalidate_drops_descendants(self):
+        """Test that invalidating a folder drops the folders below it"""
+        cache = FolderCache()
+        cache.set("root/a", "id-a")
+        cache.set("root/a/b", "id-b")
+        cache.set("root/ab", "id-ab")
+        cache.invalidate("root/a")
+        self.assertIsNone(cache.get("root/a/b"))
+        self.assertEqual(cache.get("root/ab"), "id-ab")
+
+    def test_entries_expire(self):
+        """Test that entries are not returned after the TTL"""
+        cache = FolderCache(ttl_seconds=0)
+        cache.set("root/a", "id-a")
+        self.assertIsNone(cache.get("root/a"))
+
+
+@unittest.skipUnless(client_module.REQUESTS_AVAILABLE, "requests not installed")
+class TestEnsureFolder(unittest.TestCase):
+    """Test ensure-path semantics against a fake Graph endpoint"""
+
+    def setUp(self):
+        from modules.onedrive.http_session import GraphSession
+        from modules.onedrive.token_manager import TokenCache, TokenManager
+        from tests.fake_graph import FakeGraphServer
+
+        self.server = FakeGraphServer()
+        self.addCleanup(self.server.close)
+        self.original_base_url = config.GRAPH_BASE_URL
+        config.GRAPH_BASE_URL = self.server.base_url
+
+        self.client = client_module.OneDriveClient(
+            token_manager=TokenManager(
+                cache=TokenCache(),
+                fetch_token=lambda: {"access_token": "fake", "expires_in": 3600},
+                background_refresh=False
+            ),
+            session=GraphSession(max_retries=0)
+        )
+        self.client.upload_index = UploadHashIndex(":memory:")
+
+    def tearDown(self):
+        config.GRAPH_BASE_URL = self.original_base_url
+
+    def path(self, folder_path):
+        return f"{config.ONEDRIVE_ROOT_FOLDER}/{folder_path}"
+
+    def test_creates_only_missing_segments(self):
+        """Test that existing ancestors are reused and not duplicated"""
+        first = self.client.ensure_folder("u1/2024-01")
+        self.assertEqual(first, self.server.items[self.path("u1/2024-01")]['id'])
+
+        before = len(self.server.requests)
+        second = self.client.ensure_folder("u1/2024-02")
+        self.assertEqual(second, self.server.items[self.path("u1/2024-02")]['id'])
+        posts = [request for request in self.server.requests[before:] if request[0] == 'POST']
+        self.assertEqual(len(posts), 1)
+
+        # Without cached ancestors, existing folders are looked up, not renamed
+        self.client.folder_cache.clear()
+        self.client.ensure_folder("u1/2024-03")
+        self.assertNotIn(self.path("u1 1"), self.server.items)
+        self.assertEqual(len([key for key in self.server.items if key.count('/') == 1]), 1)
+
+    def test_missing_segments_are_created_in_one_batch(self):
+        """Test that a new folder tree costs a lookup, one $batch of lookups and one of creates"""
+        folder_id = self.client.ensure_folder("u1/2024-01/receipts")
+        self.assertEqual(folder_id, self.server.items[self.path("u1/2024-01/receipts")]['id'])
+        self.assertEqual([method for method, path in self.server.requests], ['GET', 'POST', 'POST'])
+        self.assertEqual(self.server.batch_calls, 2)
+
+        # Every created segment is cached
+        count = len(self.server.requests)
+        self.client.ensure_folder("u1/2024-01")
+        self.client.ensure_folder("u1")
+        self.assertEqual(len(self.server.requests), count)
+
+    def test_cache_hit_makes_no_requests(self):
+        """Test that a resolved folder is served from the cache"""
+        folder_id = self.client.ensure_folder("u1/2024-01")
+        count = len(self.server.requests)
+        self.assertEqual(self.client.ensure_folder("u1/2024-01/"), folder_id)
+        self.assertEqual(len(self.server.requests), count)
+
+    def test_stale_cache_is_invalidated(self):
+        """Test that a deleted folder is re-created after a 404"""
+        self.client.ensure_folder("u1/2024-01")
+        self.server.delete_tree(self.path("u1"))
+
+        result = self.client.upload_file(b"data", "a.txt", folder_path="u1/2024-01")
+        self.assertEqual(result['size'], 4)
+        self.assertIn(self.path("u1/2024-01/a.txt"), self.server.items)
+
+        folder_id = self.client.ensure_folder("u1/2024-02")
+        self.assertEqual(folder_id, self.server.items[self.path("u1/2024-02")]['id'])
+
+    def test_upload_addresses_folder_by_id(self):
+        """Test that uploads go through the parent folder ID"""
+        self.client.upload_file(b"one", "a.txt", folder_path="u1")
+        self.client.upload_file(b"two", "b.txt", folder_path="u1")
+        folder_id = self.server.items[self.path("u1")]['id']
+        puts = [path for method, path in self.server.requests if method == 'PUT']
+        self.assertEqual(puts, [
+            f"/v1.0/me/drive/items/{folder_id}:/a.txt:/content",
+            f"/v1.0/me/drive/items/{folder_id}:/b.txt:/content",
+        ])
+        self.assertEqual(self.server.items[self.path("u1/b.txt")]['content'], b"two")
+
+
+if __name__ == '__main__':
+    unittest.main()
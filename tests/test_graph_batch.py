@@ -0,0 +1,102 @@
+"""
+Tests for Graph $batch support against a fake Graph endpoint
+"""
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+from modules.onedrive import client as client_module
+from modules.onedrive.batch import GraphBatch, MAX_BATCH_SIZE
+
+
+@unittest.skipUnless(client_module.REQUESTS_AVAILABLE, "requests not installed")
+class TestGraphBatch(unittest.TestCase):
+    """Test bulk folder operations through $batch"""
+
+    def setUp(self):
+        from modules.onedrive.http_session import GraphSession
+        from modules.onedrive.token_manager import TokenCache, TokenManager
+        from tests.fake_graph import FakeGraphServer
+
+        self.server = FakeGraphServer()
+        self.addCleanup(self.server.close)
+
+        self.original_base_url = config.GRAPH_BASE_URL
+        config.GRAPH_BASE_URL = self.server.base_url
+        self.addCleanup(setattr, config, 'GRAPH_BASE_URL', self.original_base_url)
+
+        self.client = client_module.OneDriveClient(
+            token_manager=TokenManager(
+                cache=TokenCache(),
+                fetch_token=lambda: {"access_token": "fake", "expires_in": 3600},
+                background_refresh=False
+            ),
+            session=GraphSession(max_retries=0)
+        )
+        self.root = config.ONEDRIVE_ROOT_FOLDER
+
+    def test_folder_tree_in_one_call(self):
+        """Test that a folder tree is created with a single $batch call"""
+        results = self.client.create_folder_tree(['2024-05/a', '2024-05/b', '2024-06/a'])
+        self.assertEqual(self.server.batch_calls, 1)
+        self.assertEqual(set(results), {'2024-05', '2024-05/a', '2024-05/b', '2024-06', '2024-06/a'})
+        self.assertTrue(all(results.values()))
+        self.assertIn(f'{self.root}/2024-06/a', self.server.items)
+
+    def test_existing_folders_are_not_duplicated(self):
+        """Test that existing parents are reused instead of renamed"""
+        self.client.create_folder_tree(['2024-05'])
+        results = self.client.create_folder_tree(['2024-05/c'])
+        self.assertEqual(results['2024-05']['name'], '2024-05')
+        self.assertEqual(results['2024-05/c']['name'], 'c')
+        self.assertNotIn(f'{self.root}/2024-05 1', self.server.items)
+
+    def test_many_listings_are_split_into_batches_of_20(self):
+        """Test that 25 folder listings need two $batch calls"""
+        paths = [f'folder{i}' for i in range(25)]
+        self.client.create_folder_tree(paths)
+        self.server.batch_calls = 0
+
+        listings = self.client.list_files_many(paths)
+        self.assertEqual(self.server.batch_calls, 2)
+        self.assertEqual(len(listings), 25)
+        self.assertTrue(all(listing == [] for listing in listings.values()))
+
+    def test_throttled_sub_requests_are_resent(self):
+        """Test that a 429 sub-response is retried"""
+        self.client.create_folder_tree(['x'])
+        self.server.throttle_batch_urls.add(f'/me/drive/root:/{self.root}/x:/children')
+        listings = self.client.list_files_many(['x'])
+        self.assertEqual(listings['x'], [])
+        self.assertEqual(self.server.batch_calls, 3)
+
+
+class TestBatchPacking(unittest.TestCase):
+    """Test how sub-requests are grouped"""
+
+    def test_long_chain_is_split_in_dependency_order(self):
+        """Test that a dependency chain longer than 20 is cut in order"""
+        batch = GraphBatch(client=None)
+        previous = None
+        chain = []
+        for i in range(MAX_BATCH_SIZE + 5):
+            previous = batch.add('GET', f'/item/{i}', depends_on=[previous] if previous else None)
+            chain.append(previous)
+
+        groups = GraphBatch._pack(chain)
+        self.assertEqual([len(group) for group in groups], [MAX_BATCH_SIZE, 5])
+        self.assertEqual(groups[0] + groups[1], chain)
+
+    def test_independent_requests_share_groups(self):
+        """Test that unrelated requests are packed together"""
+        batch = GraphBatch(client=None)
+        requests = [batch.add('GET', f'/item/{i}') for i in range(30)]
+        self.assertEqual([len(group) for group in GraphBatch._pack(requests)], [20, 10])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+"""
+Tests for content hashing and upload deduplication
+"""
+import unittest
+import sys
+import os
+import base64
+import hashlib
+import io
+import random
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+from modules.onedrive import client as client_module
+from modules.onedrive.delta_index import DriveIndex
+from modules.onedrive.hashing import QuickXorHash, hash_content
+from modules.onedrive.upload_index import UploadHashIndex
+
+
+def reference_quick_xor_hash(data):
+    """Byte-at-a-time port of the published quickXorHash algorithm"""
+    cells = [0, 0, 0]
+    shift = 0
+    for byte in data:
+        index, offset = shift // 64, shift % 64
+        last = index == 2
+        bits = 32 if last else 64
+        cells[index] ^= (byte << offset) & 0xFFFFFFFFFFFFFFFF
+        if offset > bits - 8:
+            cells[0 if last else index + 1] ^= byte >> (bits - offset)
+        shift = (shift + 11) % 160
+    result = bytearray(cells[0].to_bytes(8, 'little') + cells[1].to_bytes(8, 'little') + cells[2].to_bytes(8, 'little')[:4])
+    for index, byte in enumerate(len(data).to_bytes(8, 'little')):
+        result[12 + index] ^= byte
+    return base64.b64encode(bytes(result)).decode('ascii')
+
+
+class TestQuickXorHash(unittest.TestCase):
+    """Test the folded quickXorHash against the reference algorithm"""
+
+    def test_empty(self):
+        """Test the hash of no data"""
+        self.assertEqual(QuickXorHash().b64digest(), "AAAAAAAAAAAAAAAAAAAAAAAAAAA=")
+
+    def test_matches_reference(self):
+        """Test lengths around the 160-byte block size"""
+        rng = random.Random(1)
+        for length in (1, 7, 159, 160, 161, 320, 1000, 4099):
+            data = bytes(rng.getrandbits(8) for _ in range(length))
+            self.assertEqual(QuickXorHash(data).b64digest(), reference_quick_xor_hash(data), length)
+
+    def test_chunking_does_not_matter(self):
+        """Test that arbitrary update() splits give the same hash"""
+        rng = random.Random(2)
+        data = bytes(rng.getrandbits(8) for _ in range(5000))
+        hasher = QuickXorHash()
+        position = 0
+        while position < len(data):
+            step = rng.randint(1, 400)
+            hasher.update(data[position:position + step])
+            position += step
+        self.assertEqual(hasher.b64digest(), QuickXorHash(data).b64digest())
+
+    def test_hash_content_rewinds_stream(self):
+        """Test that hashing a stream leaves it ready to upload"""
+        data = os.urandom(10000)
+        stream = io.BytesIO(data)
+        hashes = hash_content(stream, chunk_size=999)
+        self.assertEqual(stream.tell(), 0)
+        self.assertEqual(hashes['sha256Hash'], hashlib.sha256(data).hexdigest().upper())
+        self.assertEqual(hashes['sha1Hash'], hashlib.sha1(data).hexdigest().upper())
+        self.assertEqual(hashes['quickXorHash'], reference_quick_xor_hash(data))
+        self.assertEqual(hashes['size'], len(data))
+
+
+@unittest.skipUnless(client_module.REQUESTS_AVAILABLE, "requests not installed")
+class TestUploadDeduplication(unittest.TestCase):
+    """Test skipping uploads of content that is already stored"""
+
+    def setUp(self):
+        from modules.onedrive.http_session import GraphSession
+        from modules.onedrive.token_manager import TokenCache, TokenManager
+        from tests.fake_graph import FakeGraphServer
+
+        self.server = FakeGraphServer()
+        self.addCleanup(self.server.close)
+        self.original_settings = (config.GRAPH_BASE_URL, config.UPLOAD_DEDUP_ENABLED)
+        config.GRAPH_BASE_URL = self.server.base_url
+        config.UPLOAD_DEDUP_ENABLED = True
+
+        self.client = client_module.OneDriveClient(
+            token_manager=TokenManager(
+                cache=TokenCache(),
+                fetch_token=lambda: {"access_token": "fake", "expires_in": 3600},
+                background_refresh=False
+            ),
+            session=GraphSession(max_retries=0),
+            drive_index=DriveIndex(":memory:")
+        )
+        self.client.upload_index = UploadHashIndex(":memory:")
+
+    def tearDown(self):
+        config.GRAPH_BASE_URL, config.UPLOAD_DEDUP_ENABLED = self.original_settings
+
+    def puts(self):
+        return [path for method, path in self.server.requests if method == 'PUT']
+
+    def test_resend_skips_upload(self):
+        """Test that identical content is not uploaded twice"""
+        first = self.client.upload_file(b"receipt", "a.jpg", folder_path="u1")
+        self.client.record_analysis(first['contentHashes'], {"amount": 1200})
+
+        second = self.client.upload_file(io.BytesIO(b"receipt"), "b.jpg", folder_path="u1")
+        self.assertTrue(second['deduplicated'])
+        self.assertEqual(second['id'], first['id'])
+        self.assertEqual(second['analysis'], {"amount": 1200})
+        self.assertEqual(len(self.puts()), 1)
+
+        stats = self.client.stats()['upload_dedup']
+        self.assertEqual((stats['hits'], stats['misses'], stats['bytes_saved']), (1, 1, 7))
+
+    def test_deleted_item_is_uploaded_again(self):
+        """Test that a stale hash entry does not hide a deleted file"""
+        self.client.upload_file(b"receipt", "a.jpg", folder_path="u1")
+        self.server.delete_tree(f"{config.ONEDRIVE_ROOT_FOLDER}/u1/a.jpg")
+
+        result = self.client.upload_file(b"receipt", "a.jpg", folder_path="u1")
+        self.assertNotIn('deduplicated', result)
+        self.assertEqual(len(self.puts()), 2)
+
+    def test_matches_files_known_from_the_drive_index(self):
+        """Test that files seen through delta sync are matched by quickXorHash"""
+        self.client.upload_file(b"uploaded elsewhere", "x.jpg", folder_path="u1", deduplicate=False)
+        self.client.delta_sync.sync()
+
+        result = self.client.upload_file(b"uploaded elsewhere", "y.jpg", folder_path="u1")
+        self.assertTrue(result['deduplicated'])
+        self.assertEqual(result['name'], "x.jpg")
+        self.assertEqual(len(self.puts()), 1)
+
+    def test_other_folder_gets_a_copy(self):
+        """Test that a duplicate from another folder is copied, not resolved to that folder's item"""
+        first = self.client.upload_file(b"receipt", "a.jpg", folder_path="u1")
+        self.client.record_analysis(first['contentHashes'], {"amount": 1200})
+
+        second = self.client.upload_file(b"receipt", "b.jpg", folder_path="u2")
+        self.assertFalse(second.get('deduplicated'))
+        self.assertNotEqual(second['id'], first['id'])
+        self.assertEqual(second['name'], "b.jpg")
+        self.assertEqual(second['analysis'], {"amount": 1200})
+        self.assertIn(f"{config.ONEDRIVE_ROOT_FOLDER}/u2/b.jpg", self.server.items)
+        self.assertEqual(len(self.puts()), 1)
+        self.assertEqual(self.server.monitor_authorization, [None])
+
+        # The copy is now the folder's own duplicate
+        third = self.client.upload_file(b"receipt", "c.jpg", folder_path="u2")
+        self.assertTrue(third['deduplicated'])
+        self.assertEqual(third['id'], second['id'])
+        self.assertEqual(len(self.puts()), 1)
+
+    def test_drive_index_match_in_another_folder_is_copied(self):
+        """Test that files seen through delta sync elsewhere are copied into the folder"""
+        self.client.upload_file(b"uploaded elsewhere", "x.jpg", folder_path="u1", deduplicate=False)
+        self.client.delta_sync.sync()
+
+        result = self.client.upload_file(b"uploaded elsewhere", "y.jpg", folder_path="u2")
+        self.assertFalse(result.get('deduplicated'))
+        self.assertEqual(result['name'], "y.jpg")
+        self.assertIn(f"{config.ONEDRIVE_ROOT_FOLDER}/u2/y.jpg", self.server.items)
+        self.assertEqual(len(self.puts()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
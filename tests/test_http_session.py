@@ -0,0 +1,97 @@
+"""
+Tests for the Graph HTTP session retry logic
+"""
+import unittest
+import sys
+import os
+import io
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.onedrive.http_session import GraphSession, parse_retry_after
+
+
+class FakeResponse:
+    """Minimal response object"""
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    """Returns queued responses and records calls"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        body = kwargs.get('data')
+        self.calls.append((method, body.read() if hasattr(body, 'read') else body))
+        return self.responses.pop(0)
+
+
+class TestGraphSession(unittest.TestCase):
+    """Test retries, backoff and Retry-After handling"""
+
+    def create_session(self, responses, max_retries=3):
+        self.sleeps = []
+        fake = FakeSession(responses)
+        session = GraphSession(
+            max_retries=max_retries,
+            backoff_base=0.5,
+            backoff_max=10,
+            session=fake,
+            sleep=self.sleeps.append
+        )
+        return session, fake
+
+    def test_retry_after_is_honored(self):
+        """Test that throttled calls wait for Retry-After and are resent"""
+        session, fake = self.create_session([
+            FakeResponse(429, {'Retry-After': '3'}),
+            FakeResponse(200)
+        ])
+        response = session.post('https://graph.example/v1.0/me/drive')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.sleeps, [3.0])
+        self.assertEqual(session.stats()['retries'], 1)
+
+    def test_post_not_retried_on_server_error(self):
+        """Test that non-idempotent calls are not resent after a 500"""
+        session, fake = self.create_session([FakeResponse(500), FakeResponse(200)])
+        response = session.post('https://graph.example/v1.0/me/drive')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(fake.calls), 1)
+
+    def test_file_body_is_rewound(self):
+        """Test that a file body is resent from its original position"""
+        session, fake = self.create_session([FakeResponse(503), FakeResponse(201)])
+        body = io.BytesIO(b"content")
+        response = session.put('https://graph.example/v1.0/content', data=body)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([call[1] for call in fake.calls], [b"content", b"content"])
+        self.assertTrue(0 <= self.sleeps[0] <= 0.5)
+
+    def test_gives_up_after_max_retries(self):
+        """Test that the last response is returned when retries run out"""
+        session, fake = self.create_session([FakeResponse(503)] * 3, max_retries=2)
+        response = session.get('https://graph.example/v1.0/me/drive')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(fake.calls), 3)
+
+    def test_parse_retry_after(self):
+        """Test Retry-After parsing"""
+        self.assertEqual(parse_retry_after('12'), 12.0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
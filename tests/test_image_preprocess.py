@@ -0,0 +1,122 @@
+"""
+Tests for receipt image preprocessing
+"""
+import unittest
+import sys
+import os
+import io
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.utils import image_preprocess
+from modules.utils.image_preprocess import ImagePreprocessor, preprocess_image
+
+if image_preprocess.PIL_AVAILABLE:
+    from PIL import Image
+
+
+def encode(image, fmt="JPEG", **kwargs):
+    output = io.BytesIO()
+    image.save(output, format=fmt, **kwargs)
+    return output.getvalue()
+
+
+def receipt(width=3000, height=4000, color=(250, 250, 250)):
+    """Large, mostly white image with dark 'text' lines"""
+    image = Image.new("RGB", (width, height), color)
+    for y in range(100, height - 100, 80):
+        image.paste((20, 20, 20), (200, y, width - 200, y + 20))
+    return image
+
+
+@unittest.skipUnless(image_preprocess.PIL_AVAILABLE, "Pillow not installed")
+class TestPreprocessImage(unittest.TestCase):
+    """Test the worker function"""
+
+    def test_resizes_long_edge_and_saves_bytes(self):
+        """Test that large images are shrunk to the configured long edge"""
+        data = encode(receipt(), quality=95)
+        result = preprocess_image(data, max_long_edge=1000, quality=80)
+
+        self.assertTrue(result["changed"])
+        self.assertEqual(max(result["width"], result["height"]), 1000)
+        self.assertLess(result["size"], result["original_size"])
+        self.assertEqual(result["content_type"], "image/jpeg")
+        with Image.open(io.BytesIO(result["content"])) as image:
+            self.assertEqual(image.size, (750, 1000))
+
+    def test_applies_exif_orientation(self):
+        """Test that EXIF-rotated photos come out upright"""
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotate 90 CW to display
+        data = encode(receipt(4000, 3000), quality=95, exif=exif)
+        result = preprocess_image(data, max_long_edge=1000, quality=80)
+
+        self.assertEqual((result["width"], result["height"]), (750, 1000))
+
+    def test_grayscale_auto_detects_monochrome(self):
+        """Test that receipts become grayscale and colour photos do not"""
+        gray = preprocess_image(encode(receipt(), quality=95), max_long_edge=800, quality=80)
+        self.assertTrue(gray["grayscale"])
+        with Image.open(io.BytesIO(gray["content"])) as image:
+            self.assertEqual(image.mode, "L")
+
+        photo = receipt(color=(200, 40, 40))
+        color = preprocess_image(encode(photo, quality=95), max_long_edge=800, quality=80)
+        self.assertFalse(color["grayscale"])
+
+        forced = preprocess_image(encode(photo, quality=95), max_long_edge=800, quality=80,
+                                  grayscale=image_preprocess.GRAYSCALE_ALWAYS)
+        self.assertTrue(forced["grayscale"])
+
+    def test_keeps_original_when_not_smaller(self):
+        """Test that re-encoding never makes a file bigger"""
+        noise = Image.frombytes("RGB", (64, 64), os.urandom(64 * 64 * 3))
+        data = encode(noise, quality=10)
+        result = preprocess_image(data, max_long_edge=2048, quality=95,
+                                  grayscale=image_preprocess.GRAYSCALE_NEVER)
+
+        self.assertFalse(result["changed"])
+        self.assertEqual(result["content"], data)
+
+    def test_png_with_alpha_is_flattened(self):
+        """Test that transparent PNGs are converted to JPEG on white"""
+        image = receipt(2000, 2000).convert("RGBA")
+        result = preprocess_image(encode(image, "PNG"), max_long_edge=500, quality=80)
+
+        self.assertTrue(result["changed"])
+        self.assertEqual(result["extension"], "jpg")
+
+
+@unittest.skipUnless(image_preprocess.PIL_AVAILABLE, "Pillow not installed")
+class TestImagePreprocessor(unittest.TestCase):
+    """Test the process pool wrapper"""
+
+    def test_process_pool_and_stats(self):
+        """Test that worker processes return results and bytes saved are counted"""
+        preprocessor = ImagePreprocessor(max_long_edge=800, quality=80, grayscale="auto", workers=1)
+        self.addCleanup(preprocessor.shutdown)
+        data = encode(receipt(), quality=95)
+
+        result = preprocessor.process(data)
+
+        self.assertTrue(result["changed"])
+        self.assertEqual(result["bytes_saved"], len(data) - result["size"])
+        stats = preprocessor.stats()
+        self.assertEqual(stats["images"], 1)
+        self.assertEqual(stats["bytes_saved"], result["bytes_saved"])
+
+    def test_undecodable_content_is_kept(self):
+        """Test that a broken image is passed through unchanged"""
+        preprocessor = ImagePreprocessor(workers=0)
+
+        result = preprocessor.process(b"not an image")
+
+        self.assertEqual(result["content"], b"not an image")
+        self.assertFalse(result["changed"])
+        self.assertEqual(preprocessor.stats()["failures"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+Tests for cached invoice templates
+"""
+import unittest
+import sys
+import os
+import time
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.ai.invoice_templates import CompiledTemplate, InvoiceEngine, InvoiceTemplateStore
+
+
+CONTRACTOR = {"name": "山田太郎", "address": "東京都", "contact": "090-0000-0000"}
+SALES = {"period": "2024年5月", "total_sales": 1234567, "commission_rate": 0.3, "commission_amount": 370370}
+
+LLM_TEMPLATE = """請求書 ({name})
+期間: {{period}}
+売上: ¥{{ total_sales }} / 歩合 {{commission_rate}}
+ご請求額: ¥{{commission_amount}}"""
+
+
+class FakeGenerator:
+    def __init__(self, template=LLM_TEMPLATE):
+        self.template = template
+        self.calls = []
+
+    def __call__(self, contractor_info, layout):
+        self.calls.append((contractor_info["name"], layout))
+        if isinstance(self.template, Exception):
+            raise self.template
+        return self.template.replace("{name}", contractor_info["name"])
+
+
+class TestInvoiceEngine(unittest.TestCase):
+    """Test template generation, reuse and regeneration"""
+
+    def create_engine(self, generator, version="1", store=None):
+        if store is None:
+            store = InvoiceTemplateStore(":memory:")
+        return InvoiceEngine(generator, store=store, version=version)
+
+    def test_renders_amounts_locally(self):
+        """Test that amounts are formatted into the generated template"""
+        engine = self.create_engine(FakeGenerator())
+
+        text = engine.render(SALES, CONTRACTOR)
+
+        self.assertEqual(text, "請求書 (山田太郎)\n期間: 2024年5月\n売上: ¥1,234,567 / 歩合 30%\nご請求額: ¥370,370")
+
+    def test_template_is_generated_once(self):
+        """Test that later invoices reuse the template, also after a restart"""
+        generator = FakeGenerator()
+        store = InvoiceTemplateStore(":memory:")
+        engine = self.create_engine(generator, store=store)
+        for month in range(1, 13):
+            engine.render(dict(SALES, period=f"2024年{month}月"), CONTRACTOR)
+        self.assertEqual(len(generator.calls), 1)
+
+        restarted = self.create_engine(generator, store=store)
+        self.assertIn("2024年6月", restarted.render(dict(SALES, period="2024年6月"), CONTRACTOR))
+        self.assertEqual(len(generator.calls), 1)
+        self.assertEqual(restarted.stats()["generated"], 0)
+
+    def test_regenerates_on_contractor_or_version_change(self):
+        """Test that new contractor details or a version bump produce a new template"""
+        generator = FakeGenerator()
+        store = InvoiceTemplateStore(":memory:")
+        engine = self.create_engine(generator, store=store)
+        engine.render(SALES, CONTRACTOR)
+
+        engine.render(SALES, dict(CONTRACTOR, address="大阪府"))
+        self.assertEqual(len(generator.calls), 2)
+
+        self.create_engine(generator, version="2", store=store).render(SALES, dict(CONTRACTOR, address="大阪府"))
+        self.assertEqual(len(generator.calls), 3)
+        self.assertEqual(len(store), 1)
+
+        engine.render(SALES, CONTRACTOR, layout="detailed")
+        self.assertEqual(generator.calls[-1], ("山田太郎", "detailed"))
+
+    def test_invalid_template_falls_back_to_default(self):
+        """Test that a template without the placeholders is not used"""
+        engine = self.create_engine(FakeGenerator("請求書 合計 1,000円"))
+
+        text = engine.render(SALES, CONTRACTOR)
+
+        self.assertIn("請求先: 山田太郎", text)
+        self.assertIn("¥370,370", text)
+        self.assertEqual(engine.stats()["fallbacks"], 1)
+
+    def test_failed_generation_is_not_stored_and_is_retried(self):
+        """Test that the default template stays in memory and generation is retried later"""
+        generator = FakeGenerator(TimeoutError("LLM unavailable"))
+        store = InvoiceTemplateStore(":memory:")
+        engine = InvoiceEngine(generator, store=store, version="1", retry_seconds=0.05)
+
+        self.assertIn("請求先: 山田太郎", engine.render(SALES, CONTRACTOR))
+        self.assertIn("請求先: 山田太郎", engine.render(SALES, CONTRACTOR))
+        self.assertEqual(len(generator.calls), 1)
+        self.assertEqual(len(store), 0)
+
+        generator.template = LLM_TEMPLATE
+        time.sleep(0.06)
+        self.assertIn("ご請求額: ¥370,370", engine.render(SALES, CONTRACTOR))
+        self.assertEqual(len(generator.calls), 2)
+        self.assertEqual(store.get("山田太郎", "default")["source"], "llm")
+        self.assertEqual(engine.stats()["generated"], 1)
+        self.assertEqual(engine.stats()["fallbacks"], 1)
+
+    def test_render_is_fast(self):
+        """Test that rendering a cached template takes microseconds"""
+        engine = self.create_engine(FakeGenerator())
+        engine.render(SALES, CONTRACTOR)
+
+        started = time.perf_counter()
+        for _ in range(1000):
+            engine.render(SALES, CONTRACTOR)
+        self.assertLess((time.perf_counter() - started) / 1000, 0.0005)
+
+
+class TestCompiledTemplate(unittest.TestCase):
+    """Test template validation"""
+
+    def test_unknown_placeholder_is_rejected(self):
+        """Test that placeholders other than the invoice fields are errors"""
+        with self.assertRaises(ValueError):
+            CompiledTemplate("{{period}} {{total_sales}} {{commission_rate}} {{commission_amount}} {{bank}}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+"""
+Tests for the streaming CSV export
+"""
+import unittest
+import sys
+import os
+import csv
+import gzip
+import io
+import tempfile
+from datetime import date, datetime
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.database.pool import ConnectionPool, PoolTimeoutError
+from modules.database.repositories import ReceiptResultRepository, UploadHistoryRepository
+from modules.liff import export
+from modules.liff.export import build_export_query, create_export_blueprint, gzip_chunks, iter_csv, stream_rows
+
+
+def read_csv(data: bytes):
+    return list(csv.reader(io.StringIO(data.decode("utf-8-sig"))))
+
+
+class TestCsvEncoding(unittest.TestCase):
+    """Test chunked CSV encoding"""
+
+    def test_bom_and_formula_escaping(self):
+        """Test that the BOM is written once and formula-like text is neutralized"""
+        data = b"".join(iter_csv([("=SUM(A1)", -5, None), ("店", 1.5, "x")], ["a", "b", "c"]))
+
+        self.assertTrue(data.startswith(b"\xef\xbb\xbf"))
+        self.assertEqual(data.count(b"\xef\xbb\xbf"), 1)
+        self.assertEqual(read_csv(data), [["a", "b", "c"], ["'=SUM(A1)", "-5", ""], ["店", "1.5", "x"]])
+
+    def test_rows_are_streamed_in_bounded_chunks(self):
+        """Test that a large export is produced lazily in chunks of about chunk_size"""
+        consumed = []
+
+        def rows():
+            for i in range(50000):
+                consumed.append(i)
+                yield (i, "ファイル名", "フォルダ/サブフォルダ")
+
+        chunks = iter_csv(rows(), ["id", "name", "folder"], chunk_size=4096)
+        first = next(chunks)
+        self.assertLess(len(consumed), 1000)
+
+        sizes = [len(first)] + [len(chunk) for chunk in chunks]
+        self.assertGreater(len(sizes), 100)
+        self.assertLess(max(sizes), 4096 * 3 + 200)
+
+    def test_gzip_round_trip(self):
+        """Test that compressed output decompresses to the same CSV"""
+        plain = list(iter_csv([(i, "x" * 20) for i in range(5000)], ["id", "x"], chunk_size=1024))
+        compressed = b"".join(gzip_chunks(iter(plain)))
+        self.assertEqual(gzip.decompress(compressed), b"".join(plain))
+        self.assertLess(len(compressed), len(b"".join(plain)) / 5)
+
+
+class TestExportQuery(unittest.TestCase):
+    """Test filters"""
+
+    def test_filters(self):
+        """Test user, date range and folder conditions"""
+        sql, params = build_export_query("uploads", user_id="u1", start=date(2024, 5, 1),
+                                         end=date(2024, 5, 31), folder="/u1/2024_05/")
+        self.assertIn("user_id = ?", sql)
+        self.assertEqual(params[0], "u1")
+        self.assertEqual(params[1:3], [datetime(2024, 5, 1).timestamp(), datetime(2024, 6, 1).timestamp()])
+        self.assertEqual(params[3:], ["u1/2024_05", "u1/2024\\_05/%"])
+
+        sql, params = build_export_query("receipts", start=date(2024, 5, 1))
+        self.assertEqual(params, ["2024-05-01"])
+
+    def test_unsupported_filters(self):
+        """Test unknown exports and folder filters on receipts"""
+        with self.assertRaises(ValueError):
+            build_export_query("invoices")
+        with self.assertRaises(ValueError):
+            build_export_query("receipts", folder="u1")
+
+
+class TestStreamRows(unittest.TestCase):
+    """Test the export cursor"""
+
+    def test_export_does_not_hold_a_pooled_connection(self):
+        """Test that a download in progress leaves the pool's connections to other requests"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pool = ConnectionPool(f"sqlite:///{temp_dir}/app.sqlite3", pool_size=1)
+            uploads = UploadHistoryRepository(pool)
+            for i in range(5):
+                uploads.add("u1", f"file{i}.jpg")
+            pool.timeout = 0.05
+
+            rows = stream_rows(pool, "SELECT file_name FROM upload_history ORDER BY id", (), fetch_size=2)
+            self.assertEqual(next(rows)[0], "file0.jpg")
+            try:
+                with pool.connection() as conn:
+                    conn.execute("SELECT 1")
+            except PoolTimeoutError:
+                self.fail("The export holds the only pooled connection")
+            self.assertEqual([row[0] for row in rows], [f"file{i}.jpg" for i in range(1, 5)])
+            pool.close()
+
+
+@unittest.skipUnless(export.FLASK_AVAILABLE, "Flask is not installed")
+class TestExportEndpoint(unittest.TestCase):
+    """Test the Flask endpoint"""
+
+    def setUp(self):
+        from flask import Flask
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.pool = ConnectionPool(f"sqlite:///{self.temp_dir.name}/app.sqlite3")
+        uploads = UploadHistoryRepository(self.pool)
+        for i in range(30):
+            uploads.add("u1" if i % 3 else "u2", f"file{i}.jpg", folder_path=f"u1/2024-0{i % 2 + 5}")
+        receipts = ReceiptResultRepository(self.pool)
+        receipts.add("u1", "h1", {"status": "success",
+                                  "extracted_data": {"store_name": "=cmd", "date": "2024-05-02", "total_amount": 980}})
+
+        app = Flask(__name__)
+        app.register_blueprint(create_export_blueprint(self.pool, token="secret"))
+        self.client = app.test_client()
+        self.auth = {"Authorization": "Bearer secret"}
+
+    def tearDown(self):
+        self.pool.close()
+        self.temp_dir.cleanup()
+
+    def test_requires_token(self):
+        """Test that requests without the bearer token are refused"""
+        self.assertEqual(self.client.get("/liff/export/uploads.csv").status_code, 403)
+        self.assertEqual(self.client.get("/liff/export/uploads.csv",
+                                         headers={"Authorization": "Bearer wrong"}).status_code, 403)
+
+    def test_filtered_uploads(self):
+        """Test a filtered upload export"""
+        response = self.client.get("/liff/export/uploads.csv?user_id=u1&folder=u1/2024-05", headers=self.auth)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("attachment", response.headers["Content-Disposition"])
+        rows = read_csv(response.data)
+        self.assertEqual(rows[0][:4], ["日時", "ユーザーID", "フォルダ", "ファイル名"])
+        self.assertEqual(len(rows) - 1, 10)
+        self.assertTrue(all(row[1] == "u1" and row[2] == "u1/2024-05" for row in rows[1:]))
+
+    def test_gzip_receipts(self):
+        """Test a compressed receipt export"""
+        response = self.client.get("/liff/export/receipts.csv?gzip=1&start=2024-05-01&end=2024-05-31",
+                                   headers=self.auth)
+
+        self.assertEqual(response.mimetype, "application/gzip")
+        rows = read_csv(gzip.decompress(response.data))
+        self.assertEqual(rows[1][:4], ["2024-05-02", "u1", "'=cmd", "980"])
+
+    def test_bad_requests(self):
+        """Test invalid dates, folder filters on receipts and unknown exports"""
+        self.assertEqual(self.client.get("/liff/export/uploads.csv?start=May", headers=self.auth).status_code, 400)
+        self.assertEqual(self.client.get("/liff/export/receipts.csv?folder=x", headers=self.auth).status_code, 400)
+        self.assertEqual(self.client.get("/liff/export/invoices.csv", headers=self.auth).status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+"""
+Tests for compiled naming rules
+"""
+import unittest
+import sys
+import os
+import tempfile
+import threading
+import unittest.mock
+from datetime import datetime
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.database.pool import ConnectionPool
+from modules.database.repositories import NamingRuleRepository
+from modules.liff import naming_rules
+from modules.onedrive.naming import CompiledTemplate, NamingRuleEngine, compile_rule
+
+WHEN = datetime(2024, 5, 1, 9, 30, 15)
+
+
+class TestCompiledTemplate(unittest.TestCase):
+    """Test template compilation and rendering"""
+
+    def test_render(self):
+        """Test dates, fields, sequence width and value cleaning"""
+        template = CompiledTemplate("{date:%Y年%m月}_{user_name}_{category}_{seq:3}")
+        context = {"date": WHEN, "user_name": "田中/太郎:", "category": "画像", "seq": 7}
+        self.assertEqual(template.render(context), "2024年05月_田中_太郎__画像_007")
+        self.assertEqual(CompiledTemplate("{date}").render(context), "20240501")
+
+    def test_missing_values_and_folders(self):
+        """Test that missing values skip the template and folders are normalized"""
+        self.assertIsNone(CompiledTemplate("{user_name}").render({"user_name": None}))
+        folder = CompiledTemplate("{user_id}//{category}/", is_folder=True)
+        self.assertEqual(folder.render({"user_id": "U1", "category": "画像"}), "U1/画像")
+        self.assertIsNone(folder.render({"user_id": "U1", "category": ".."}))
+
+    def test_invalid_templates(self):
+        """Test that invalid templates are rejected when compiled"""
+        for source in ("{unknown}", "{user_id:%Y}", "{seq:0}", "a{b", "a:b", "{date:%Y/%m}"):
+            with self.assertRaises(ValueError, msg=source):
+                CompiledTemplate(source)
+        with self.assertRaises(ValueError):
+            CompiledTemplate("../{user_id}", is_folder=True)
+        with self.assertRaises(ValueError):
+            compile_rule({"name": "r", "folder_template": "{seq}", "file_template": "x"})
+
+
+class TestNamingRuleEngine(unittest.TestCase):
+    """Test rule selection, hot reloading and sequence numbers"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.url = f"sqlite:///{self.temp_dir.name}/app.sqlite3"
+        self.pool = ConnectionPool(self.url)
+        self.repository = NamingRuleRepository(self.pool)
+        self.engine = NamingRuleEngine(self.repository, check_interval=3600)
+
+    def tearDown(self):
+        self.pool.close()
+        self.temp_dir.cleanup()
+
+    def decide(self, engine=None, **context):
+        context = {"user_id": "U1", "kind": "image", "original": "photo.JPG", "date": WHEN, **context}
+        return (engine or self.engine).decide(context)
+
+    def test_default_rule_keeps_user_month_folder(self):
+        """Test that without rules files go to the user's month folder unchanged"""
+        self.assertEqual(self.decide(), {"folder_path": "U1/2024-05", "file_name": "photo.jpg", "rule": "default"})
+        self.assertEqual(self.decide(original="")["rule"], "fallback")
+
+    def test_rules_are_reloaded_when_version_changes(self):
+        """Test that edits are picked up by version without restarting"""
+        self.assertEqual(self.decide()["rule"], "default")
+        self.repository.save({"name": "receipts", "kind": "image", "priority": 10,
+                              "folder_template": "レシート/{date:%Y}/{user_id}",
+                              "file_template": "{date:%Y%m%d}_{category}"})
+        # Not checked again until the interval passes
+        self.assertEqual(self.decide()["rule"], "default")
+
+        self.engine.reload()
+        decision = self.decide()
+        self.assertEqual(decision, {"folder_path": "レシート/2024/U1", "file_name": "20240501_画像.jpg",
+                                    "rule": "receipts"})
+        self.assertEqual(self.decide(kind="file", original="a.pdf")["rule"], "default")
+
+        self.repository.save({"name": "receipts", "kind": "image", "folder_template": "x",
+                              "file_template": "y", "enabled": False})
+        self.engine.reload()
+        self.assertEqual(self.decide()["rule"], "default")
+        self.assertEqual(self.engine.stats()["reloads"], 3)
+
+    def test_lazy_values_and_fallthrough(self):
+        """Test that a rule whose value is missing falls through to the next"""
+        self.repository.save({"name": "named", "extensions": "pdf, .xlsx",
+                              "folder_template": "{user_name}", "file_template": "{original}"})
+        self.engine.reload()
+        calls = []
+
+        def user_name():
+            calls.append(1)
+            return "田中"
+
+        self.assertEqual(self.decide(original="a.jpg", user_name=user_name)["rule"], "default")
+        self.assertEqual(calls, [])
+        self.assertEqual(self.decide(original="a.pdf", user_name=user_name)["folder_path"], "田中")
+        self.assertEqual(self.decide(original="a.xlsx", user_name=lambda: None)["rule"], "default")
+
+    def test_invalid_stored_rule_is_skipped(self):
+        """Test that a bad row does not stop the other rules"""
+        self.repository.save({"name": "bad", "priority": 1, "folder_template": "{nope}", "file_template": "x"})
+        self.repository.save({"name": "good", "priority": 2, "folder_template": "f", "file_template": "g"})
+        self.engine.reload()
+        self.assertEqual(self.decide()["rule"], "good")
+        self.assertEqual(self.engine.stats()["invalid"], ["bad"])
+
+    def test_sequence_numbers_are_unique_across_processes(self):
+        """Test that engines on separate connections never hand out the same number"""
+        self.repository.save({"name": "numbered", "folder_template": "{user_id}",
+                              "file_template": "{date}_{seq:4}"})
+        engines = []
+        for _ in range(4):
+            pool = ConnectionPool(self.url)
+            self.addCleanup(pool.close)
+            engines.append(NamingRuleEngine(NamingRuleRepository(pool)))
+        names = []
+        lock = threading.Lock()
+
+        def upload(engine):
+            for _ in range(25):
+                name = self.decide(engine)["file_name"]
+                with lock:
+                    names.append(name)
+
+        threads = [threading.Thread(target=upload, args=(engine,)) for engine in engines]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(names)), 100)
+        self.assertEqual(max(names), "20240501_0100.jpg")
+        # A rule whose other fields are missing does not take a number
+        self.repository.save({"name": "named_numbered", "priority": 1, "folder_template": "{user_id}",
+                              "file_template": "{user_name}_{seq}"})
+        engines[0].reload()
+        self.assertEqual(self.decide(engines[0], user_name=None)["rule"], "numbered")
+        self.assertEqual(self.decide(engines[0], user_name="田中")["file_name"], "田中_1.jpg")
+        # A different user numbers separately
+        self.assertEqual(self.decide(engines[0], user_id="U2")["file_name"], "20240501_0001.jpg")
+
+
+@unittest.skipUnless(naming_rules.FLASK_AVAILABLE, "Flask is not installed")
+class TestNamingRulesEndpoint(unittest.TestCase):
+    """Test the admin endpoints"""
+
+    def setUp(self):
+        from flask import Flask
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.pool = ConnectionPool(f"sqlite:///{self.temp_dir.name}/app.sqlite3")
+        self.repository = NamingRuleRepository(self.pool)
+        app = Flask(__name__)
+        app.register_blueprint(naming_rules.create_naming_rules_blueprint(self.repository, token="secret"))
+        self.client = app.test_client()
+        self.auth = {"Authorization": "Bearer secret"}
+
+    def tearDown(self):
+        self.pool.close()
+        self.temp_dir.cleanup()
+
+    def test_save_list_delete(self):
+        """Test that valid rules are saved and each change bumps the version"""
+        rule = {"folder_template": "{user_id}/{date:%Y}", "file_template": "{date}_{seq:3}", "kind": "image"}
+        response = self.client.put("/liff/naming-rules/receipts", json=rule, headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["version"], 1)
+
+        listed = self.client.get("/liff/naming-rules", headers=self.auth).get_json()
+        self.assertEqual(listed["version"], 1)
+        self.assertEqual(listed["rules"][0]["name"], "receipts")
+
+        self.assertEqual(self.client.delete("/liff/naming-rules/receipts", headers=self.auth).get_json(),
+                         {"version": 2})
+        self.assertEqual(self.repository.load(), (2, []))
+
+    def test_rejects_invalid_rules_and_missing_token(self):
+        """Test validation and authorization"""
+        response = self.client.put("/liff/naming-rules/bad", json={"folder_template": "{nope}", "file_template": "x"},
+                                   headers=self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.repository.version(), 0)
+        self.assertEqual(self.client.get("/liff/naming-rules").status_code, 403)
+
+    def test_export_token_is_not_accepted(self):
+        """Test that the rules default to their own admin token"""
+        from flask import Flask
+        from config import config
+        app = Flask(__name__)
+        with unittest.mock.patch.object(config, "EXPORT_API_TOKEN", "export"), \
+                unittest.mock.patch.object(config, "NAMING_RULES_ADMIN_TOKEN", "admin"):
+            app.register_blueprint(naming_rules.create_naming_rules_blueprint(self.repository))
+        client = app.test_client()
+        rule = {"folder_template": "x", "file_template": "y"}
+        self.assertEqual(client.put("/liff/naming-rules/r", json=rule,
+                                    headers={"Authorization": "Bearer export"}).status_code, 403)
+        self.assertEqual(client.put("/liff/naming-rules/r", json=rule,
+                                    headers={"Authorization": "Bearer admin"}).status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
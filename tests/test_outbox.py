@@ -0,0 +1,176 @@
+"""
+Tests for the durable upload outbox
+"""
+import unittest
+import sys
+import os
+import tempfile
+import time
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.onedrive.outbox import UploadOutbox
+from modules.utils.file_stream import FileTooLargeError
+
+
+class TestUploadOutbox(unittest.TestCase):
+    """Test journaling, retries and per-user ordering"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.uploaded = []
+        self.completed = []
+        self.failed = []
+        self.failures = {}
+
+    def upload(self, entry, spool):
+        if self.failures.get(entry['file_name'], 0) > 0:
+            self.failures[entry['file_name']] -= 1
+            return None
+        self.uploaded.append((entry['file_name'], spool.read()))
+        return {"id": f"item-{entry['id']}", "name": entry['file_name']}
+
+    def create_outbox(self, **kwargs):
+        options = dict(
+            db_path=os.path.join(self.temp_dir.name, "outbox.sqlite3"),
+            spool_dir=os.path.join(self.temp_dir.name, "spool"),
+            workers=1,
+            max_attempts=3,
+            backoff_base=0,
+            backoff_max=0,
+            on_complete=lambda entry, result: self.completed.append(result['name']),
+            on_failure=lambda entry: self.failed.append(entry['file_name'])
+        )
+        options.update(kwargs)
+        return UploadOutbox(self.upload, **options)
+
+    def spool_files(self):
+        return os.listdir(os.path.join(self.temp_dir.name, "spool"))
+
+    def test_entry_is_uploaded_and_removed(self):
+        """Test that a drained entry leaves no journal row or spool file"""
+        outbox = self.create_outbox()
+        outbox.enqueue("u1", [b"ab", b"cd"], "a.jpg", folder_path="u1/2024-01", metadata={"kind": "image"})
+        self.assertEqual(outbox.pending_count(), 1)
+        self.assertEqual(len(self.spool_files()), 1)
+
+        self.assertTrue(outbox.drain_once())
+        self.assertEqual(self.uploaded, [("a.jpg", b"abcd")])
+        self.assertEqual(self.completed, ["a.jpg"])
+        self.assertEqual(outbox.pending_count(), 0)
+        self.assertEqual(self.spool_files(), [])
+        self.assertFalse(outbox.drain_once())
+
+    def test_failed_upload_is_retried(self):
+        """Test that failures are retried until the upload succeeds"""
+        outbox = self.create_outbox()
+        self.failures["a.jpg"] = 2
+        outbox.enqueue("u1", [b"data"], "a.jpg")
+        for _ in range(3):
+            outbox.drain_once()
+        self.assertEqual(self.completed, ["a.jpg"])
+        self.assertEqual(outbox.stats()['retries'], 2)
+
+    def test_user_order_is_preserved(self):
+        """Test that by default a user's later file waits for the earlier one"""
+        outbox = self.create_outbox(backoff_base=60, backoff_max=60)
+        self.failures["a1.jpg"] = 1
+        outbox.enqueue("a", [b"1"], "a1.jpg")
+        outbox.enqueue("a", [b"2"], "a2.jpg")
+        outbox.enqueue("b", [b"3"], "b1.jpg")
+
+        outbox.drain_once()  # a1 fails and backs off for a minute
+        outbox.drain_once()
+        self.assertFalse(outbox.drain_once())
+        self.assertEqual([name for name, _ in self.uploaded], ["b1.jpg"])
+        self.assertEqual(outbox.pending_count(), 2)
+
+    def test_user_entries_are_uploaded_concurrently(self):
+        """Test that up to per_user of one user's entries are in flight at once"""
+        outbox = self.create_outbox(per_user=2)
+        for number in range(4):
+            outbox.enqueue("a", [b"x"], f"a{number}.jpg")
+
+        first, second = outbox._claim(), outbox._claim()
+        self.assertEqual([first['file_name'], second['file_name']], ["a0.jpg", "a1.jpg"])
+        self.assertIsNone(outbox._claim())
+
+    def test_failing_entry_holds_one_slot(self):
+        """Test that a backed-off entry does not stop the user's other uploads"""
+        outbox = self.create_outbox(backoff_base=60, backoff_max=60, per_user=2)
+        self.failures["a0.jpg"] = 1
+        for number in range(3):
+            outbox.enqueue("a", [b"x"], f"a{number}.jpg")
+
+        while outbox.drain_once():
+            pass
+        self.assertEqual([name for name, _ in self.uploaded], ["a1.jpg", "a2.jpg"])
+        self.assertEqual(outbox.pending_count(), 1)
+
+    def test_entry_is_parked_after_max_attempts(self):
+        """Test that an entry that keeps failing is parked and can be requeued"""
+        outbox = self.create_outbox()
+        self.failures["a.jpg"] = 3
+        outbox.enqueue("u1", [b"data"], "a.jpg")
+        for _ in range(3):
+            outbox.drain_once()
+        self.assertEqual(self.failed, ["a.jpg"])
+        self.assertEqual(outbox.stats()['failed'], 1)
+        self.assertEqual(len(self.spool_files()), 1)
+
+        self.assertEqual(outbox.retry_failed(), 1)
+        outbox.drain_once()
+        self.assertEqual(self.completed, ["a.jpg"])
+
+    def test_entries_survive_restart(self):
+        """Test that a new outbox resumes journaled and abandoned entries"""
+        outbox = self.create_outbox()
+        outbox.enqueue("u1", [b"1"], "a.jpg")
+        outbox.enqueue("u2", [b"2"], "b.jpg")
+        outbox._claim()  # claimed by a process that then died
+
+        restarted = self.create_outbox(lease_seconds=0)
+        while restarted.drain_once():
+            pass
+        self.assertEqual(sorted(self.completed), ["a.jpg", "b.jpg"])
+
+    def test_entry_is_kept_until_completion_callback_ran(self):
+        """Test that an entry whose follow-up did not finish is still journaled"""
+        seen = []
+        outbox = self.create_outbox(on_complete=lambda entry, result: seen.append(outbox.pending_count()))
+        outbox.enqueue("u1", [b"1"], "a.jpg")
+
+        outbox.drain_once()
+
+        self.assertEqual(seen, [1])
+        self.assertEqual(outbox.pending_count(), 0)
+
+    def test_too_large_content_leaves_nothing(self):
+        """Test that oversized content is rejected without a journal entry"""
+        outbox = self.create_outbox()
+        with self.assertRaises(FileTooLargeError):
+            outbox.enqueue("u1", [b"x" * 10] * 3, "big.bin", max_size=25)
+        self.assertEqual(outbox.pending_count(), 0)
+        self.assertEqual(self.spool_files(), [])
+
+    def test_drainer_threads(self):
+        """Test that background drainers upload new entries"""
+        outbox = self.create_outbox(workers=2, per_user=1)
+        outbox.start()
+        self.addCleanup(outbox.stop)
+        for number in range(5):
+            outbox.enqueue(f"u{number % 2}", [b"x"], f"{number}.jpg")
+
+        # Entries leave the journal only after their completion callback
+        deadline = time.monotonic() + 5
+        while outbox.pending_count() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sorted(self.completed), [f"{number}.jpg" for number in range(5)])
+        self.assertEqual([name for name, _ in self.uploaded if name in ("0.jpg", "2.jpg", "4.jpg")],
+                         ["0.jpg", "2.jpg", "4.jpg"])
+
+
+if __name__ == '__main__':
+    unittest.main()
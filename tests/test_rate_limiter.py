@@ -0,0 +1,112 @@
+"""
+Tests for the adaptive Graph concurrency limiter
+"""
+import unittest
+import sys
+import os
+import threading
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.onedrive.http_session import GraphSession
+from modules.onedrive.rate_limiter import ERROR, SUCCESS, THROTTLED, AdaptiveConcurrencyLimiter
+from tests.test_http_session import FakeResponse, FakeSession
+
+
+class TestAdaptiveConcurrencyLimiter(unittest.TestCase):
+    """Test additive increase and multiplicative decrease"""
+
+    def create_limiter(self, initial=4):
+        return AdaptiveConcurrencyLimiter(initial_limit=initial, min_limit=1, max_limit=8,
+                                          latency_target_ms=1000)
+
+    def run_round(self, limiter, outcome=SUCCESS):
+        """Fill every slot, then complete all calls"""
+        started = [limiter.acquire() for _ in range(limiter.limit)]
+        for started_at in started:
+            limiter.release(started_at, outcome)
+
+    def test_limit_grows_while_saturated_and_healthy(self):
+        """Test roughly +1 per full round of successful calls"""
+        limiter = self.create_limiter()
+        for _ in range(3):
+            self.run_round(limiter)
+        self.assertEqual(limiter.limit, 7)
+        for _ in range(10):
+            self.run_round(limiter)
+        self.assertEqual(limiter.limit, 8)
+
+    def test_limit_holds_when_not_saturated(self):
+        """Test that sequential calls do not raise the limit"""
+        limiter = self.create_limiter()
+        for _ in range(20):
+            limiter.release(limiter.acquire(), SUCCESS)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_throttle_burst_halves_once(self):
+        """Test that 429s from calls started before the cut count as one decrease"""
+        limiter = self.create_limiter(initial=8)
+        self.run_round(limiter, THROTTLED)
+        stats = limiter.stats()
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual((stats['throttle_events'], stats['decreases']), (8, 1))
+
+        self.run_round(limiter, THROTTLED)
+        self.run_round(limiter, THROTTLED)
+        self.run_round(limiter, THROTTLED)
+        self.assertEqual(limiter.limit, 1)
+
+    def test_errors_cut_only_when_unhealthy(self):
+        """Test that an occasional error is tolerated but an error storm is not"""
+        limiter = self.create_limiter()
+        limiter.release(limiter.acquire(), ERROR)
+        self.assertEqual(limiter.limit, 3)  # error rate 0.2 > 0.1 after one sample
+        for _ in range(30):
+            limiter.release(limiter.acquire(), SUCCESS)
+        limiter.release(limiter.acquire(), SUCCESS)
+        self.assertLess(limiter.stats()['error_rate'], 0.1)
+
+    def test_acquire_blocks_at_limit(self):
+        """Test that callers wait for a free slot"""
+        limiter = self.create_limiter(initial=1)
+        started_at = limiter.acquire()
+        acquired = threading.Event()
+
+        def worker():
+            limiter.release(limiter.acquire(), SUCCESS)
+            acquired.set()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        self.assertEqual(limiter.stats()['waiting'], 1)
+        limiter.release(started_at, SUCCESS)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+
+
+class TestGraphSessionLimiter(unittest.TestCase):
+    """Test that Graph calls feed the limiter"""
+
+    def test_throttle_pauses_other_calls(self):
+        """Test that Retry-After from one call holds back the next call"""
+        sleeps = []
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=4, min_limit=1, max_limit=8)
+        session = GraphSession(
+            max_retries=0,
+            session=FakeSession([FakeResponse(429, {'Retry-After': '5'}), FakeResponse(200)]),
+            sleep=sleeps.append,
+            limiter=limiter
+        )
+        self.assertEqual(session.get('https://graph.example/v1.0/me').status_code, 429)
+        self.assertEqual(session.get('https://graph.example/v1.0/me').status_code, 200)
+
+        self.assertEqual(len(sleeps), 1)
+        self.assertTrue(4 < sleeps[0] <= 5)
+        concurrency = session.stats()['concurrency']
+        self.assertEqual((concurrency['limit'], concurrency['throttle_events']), (2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+Tests for columnar sales aggregation
+"""
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.ai import sales_aggregation
+from modules.ai.assistant import AIAssistant
+from modules.ai.sales_aggregation import SalesColumns, aggregate_sales, apply_rate, to_yen
+
+
+def receipt(total, date="2024-05-01", items=1):
+    return {"status": "success",
+            "extracted_data": {"total_amount": total, "date": date, "items": [{"name": "a"}] * items}}
+
+
+RECEIPTS = [
+    ("yamada", receipt(1000.0, "2024-05-03", 2)),
+    ("yamada", receipt(2001.0, "2024-05-20")),
+    ("yamada", {"status": "error", "extracted_data": {"total_amount": 9999.0}}),
+    ("yamada", receipt(500.0, "2024-06-01")),
+    ("sato", receipt(333.0, "2024-05-10", 3)),
+    ("sato", receipt(0.1, None)),
+]
+
+
+class TestYenArithmetic(unittest.TestCase):
+    """Test exact rounding to whole yen"""
+
+    def test_to_yen(self):
+        """Test that amounts are rounded half up from their decimal value"""
+        self.assertEqual(to_yen(1234.5), 1235)
+        self.assertEqual(to_yen(0.1 + 0.2), 0)
+        self.assertEqual(to_yen("99.49"), 99)
+        self.assertEqual(to_yen(None), 0)
+        self.assertEqual(to_yen("N/A"), 0)
+
+    def test_apply_rate(self):
+        """Test that commissions avoid float error and honour the rounding mode"""
+        # 0.3 * 2001 is 600.3 exactly, but 600.2999... as a float
+        self.assertEqual(apply_rate(2001, 0.3, "down"), 600)
+        self.assertEqual(apply_rate(1005, 0.3, "down"), 301)
+        self.assertEqual(apply_rate(1005, 0.3, "half_up"), 302)
+        self.assertEqual(apply_rate(10, 0.7, "down"), 7)
+
+
+class TestAggregateSales(unittest.TestCase):
+    """Test per-contractor, per-period summaries"""
+
+    def check(self, use_numpy):
+        summaries = aggregate_sales(SalesColumns.from_receipts(RECEIPTS),
+                                    {"yamada": 0.3, "sato": "0.25"}, rounding="down", use_numpy=use_numpy)
+
+        self.assertEqual(sorted(summaries), [("sato", "2024-05"), ("sato", "unknown"),
+                                             ("yamada", "2024-05"), ("yamada", "2024-06"), ("yamada", "unknown")])
+        may = summaries[("yamada", "2024-05")]
+        self.assertEqual(may["total_receipts"], 2)
+        self.assertEqual(may["total_amount"], 3001)
+        self.assertEqual(may["total_items"], 3)
+        self.assertEqual(may["date_range"], {"start": "2024-05-03", "end": "2024-05-20"})
+        self.assertEqual(may["average_amount"], 1501)
+        self.assertEqual(may["commission_amount"], 900)
+        self.assertEqual(may["remaining_amount"], 2101)
+
+        # Failed analyses count as receipts without an amount
+        failed = summaries[("yamada", "unknown")]
+        self.assertEqual((failed["total_receipts"], failed["total_amount"]), (1, 0))
+        self.assertEqual(failed["date_range"], {"start": None, "end": None})
+        self.assertEqual(summaries[("sato", "2024-05")]["commission_amount"], 83)
+
+    def test_array_fallback(self):
+        """Test aggregation without NumPy"""
+        self.check(use_numpy=False)
+
+    @unittest.skipUnless(sales_aggregation.NUMPY_AVAILABLE, "NumPy is not installed")
+    def test_numpy(self):
+        """Test aggregation with NumPy"""
+        self.check(use_numpy=True)
+
+    def test_matches_summarize_sales_data_for_whole_yen(self):
+        """Test that totals agree with the per-list summary for one contractor and month"""
+        # summarize_sales_data only needs a logger
+        assistant = AIAssistant.__new__(AIAssistant)
+        assistant.logger = type("Logger", (), {"info": lambda *args, **kwargs: None})()
+        group = [r for c, r in RECEIPTS[:2]]
+
+        legacy = assistant.summarize_sales_data(group)
+        summary = aggregate_sales(SalesColumns.from_receipts(RECEIPTS[:2]))[("yamada", "2024-05")]
+
+        for key in ("total_receipts", "total_amount", "total_items", "date_range"):
+            self.assertEqual(summary[key], legacy[key])
+
+    def test_empty(self):
+        """Test that no receipts give no summaries"""
+        self.assertEqual(aggregate_sales(SalesColumns()), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+Tests for the sales ledger and its running aggregates
+"""
+import unittest
+import sys
+import os
+from datetime import date, datetime
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.database.pool import ConnectionPool
+from modules.database.repositories import SalesLedgerRepository, period_keys
+
+
+def receipt(total, date_text="2024-05-01", items=1):
+    return {"status": "success",
+            "extracted_data": {"total_amount": total, "date": date_text, "items": [{"name": "a"}] * items}}
+
+
+class TestSalesLedger(unittest.TestCase):
+    """Test recording, reads and rebuilding"""
+
+    def setUp(self):
+        self.pool = ConnectionPool("sqlite:///:memory:")
+        self.ledger = SalesLedgerRepository(self.pool)
+        self.keys = iter(range(1000))
+
+    def tearDown(self):
+        self.pool.close()
+
+    def record(self, user_id, result, **kwargs):
+        return self.ledger.record(user_id, f"hash{next(self.keys)}", result, **kwargs)
+
+    def aggregates(self):
+        with self.pool.connection() as conn:
+            return [tuple(row) for row in conn.execute("SELECT * FROM sales_aggregates ORDER BY 1, 2, 3, 4")]
+
+    def test_period_keys(self):
+        """Test day, ISO week and month labels"""
+        self.assertEqual(period_keys(date(2024, 12, 30)),
+                         {"day": "2024-12-30", "week": "2025-W01", "month": "2024-12", "total": "all"})
+
+    def test_record_updates_every_grain(self):
+        """Test that each receipt is added to its day, week, month and total"""
+        self.record("u1", receipt(1000.4, "2024-05-06", 2))
+        self.record("u1", receipt(2000.0, "2024-05-08"))
+        self.record("u1", receipt(500.0, "2024-06-01"))
+        self.record("u2", receipt(9999.0, "2024-05-06"))
+
+        status = self.ledger.status("u1", today=date(2024, 5, 8))
+
+        self.assertEqual(status["day"]["total_amount"], 2000)
+        self.assertEqual(status["week"]["period"], "2024-W19")
+        self.assertEqual((status["week"]["receipts"], status["week"]["total_amount"]), (2, 3000))
+        self.assertEqual(status["week"]["total_items"], 3)
+        self.assertEqual((status["week"]["first_date"], status["week"]["last_date"]), ("2024-05-06", "2024-05-08"))
+        self.assertEqual(status["month"]["total_amount"], 3000)
+        self.assertEqual(status["total"]["total_amount"], 3500)
+
+    def test_empty_period(self):
+        """Test that a period without receipts reads as zero"""
+        summary = self.ledger.summary("u1", "month", "2024-01")
+        self.assertEqual((summary["receipts"], summary["total_amount"], summary["first_date"]), (0, 0, None))
+
+    def test_receipt_is_counted_once(self):
+        """Test that failures are skipped and a repeated image is ignored"""
+        self.assertTrue(self.ledger.record("u1", "abc", receipt(1000.0)))
+        self.assertFalse(self.ledger.record("u1", "abc", receipt(1000.0)))
+        self.assertFalse(self.record("u1", {"status": "error"}))
+        self.assertEqual(self.ledger.summary("u1", "total")["receipts"], 1)
+
+    def test_receipt_is_stored_in_receipt_results(self):
+        """Test that the counted receipt is the receipt_results row, with its contractor and sale date"""
+        self.ledger.record("u1", "abc", receipt(1280.0, "2024-05-02", 3), contractor="A社")
+
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT * FROM receipt_results WHERE user_id = 'u1' AND sha256 = 'abc'").fetchone()
+        self.assertEqual((row["status"], row["total_amount"], row["items"]), ("success", 1280, 3))
+        self.assertEqual((row["contractor"], row["sale_date"]), ("A社", "2024-05-02"))
+
+    def test_unreadable_date_uses_received_date(self):
+        """Test that receipts without a date are filed under the day they arrived"""
+        self.record("u1", receipt(800.0, None), received_at=datetime(2024, 7, 3, 12, 0))
+        self.assertEqual(self.ledger.summary("u1", "day", "2024-07-03")["total_amount"], 800)
+
+    def test_contractor_summaries(self):
+        """Test per-contractor totals next to the user's total"""
+        self.record("u1", receipt(1000.0), contractor="A社")
+        self.record("u1", receipt(3000.0), contractor="B社")
+        self.record("u1", receipt(500.0))
+
+        rows = self.ledger.contractor_summaries("u1", "week", "2024-W18")
+
+        self.assertEqual([(row["contractor"], row["total_amount"]) for row in rows], [("B社", 3000), ("A社", 1000)])
+        self.assertEqual(self.ledger.summary("u1", "week", "2024-W18")["total_amount"], 4500)
+
+    def test_rebuild_matches_incremental_totals(self):
+        """Test that recomputing from receipts reproduces the running aggregates"""
+        for day in range(1, 29):
+            self.record("u1", receipt(day * 111.5, f"2024-02-{day:02d}", day % 3),
+                        contractor="A社" if day % 2 else None)
+        before = self.aggregates()
+
+        with self.pool.connection() as conn:
+            conn.execute("UPDATE sales_aggregates SET total_amount = 0")
+        rows = self.ledger.rebuild()
+
+        self.assertEqual(rows, len(before))
+        self.assertEqual(self.aggregates(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
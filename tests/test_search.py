@@ -0,0 +1,147 @@
+"""
+Tests for the full-text search index and cached query translation
+"""
+import unittest
+import sys
+import os
+import tempfile
+from datetime import date
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.ai.search_query import QueryTranslator, normalize_question, validate_query
+from modules.database.batcher import WriteBehindBatcher
+from modules.database.pool import ConnectionPool
+from modules.database.search_index import SearchIndex, match_expression, ngram_tokens, resolve_period
+
+
+def receipt(store, day, total, items=()):
+    return {"status": "success", "extracted_data": {
+        "store_name": store, "date": day, "total_amount": total, "items": [{"name": name} for name in items]}}
+
+
+class TestTokenization(unittest.TestCase):
+    """Test bigram tokenization and periods"""
+
+    def test_ngram_tokens(self):
+        """Test that CJK runs become bigrams and other text words"""
+        self.assertEqual(ngram_tokens("ｾﾌﾞﾝ新宿店 Receipt_01.JPG"),
+                         ["セブ", "ブン", "ン新", "新宿", "宿店", "receipt_01", "jpg"])
+        self.assertEqual(ngram_tokens("水"), ["水"])
+        self.assertEqual(ngram_tokens("緑茶", run_ends=True), ["緑茶", "茶"])
+        self.assertEqual(match_expression(["新宿店", "jpg", "!!"]), '"新宿 宿店" AND "jpg"')
+        self.assertEqual(match_expression(["ローソン100"]), '"ロー ーソ ソン" AND "100"')
+
+    def test_resolve_period(self):
+        """Test relative periods around month and year boundaries"""
+        today = date(2024, 3, 6)
+        self.assertEqual(resolve_period("last_month", today), (date(2024, 2, 1), date(2024, 2, 29)))
+        self.assertEqual(resolve_period("this_week", today), (date(2024, 3, 4), date(2024, 3, 10)))
+        self.assertEqual(resolve_period("last_week", today), (date(2024, 2, 26), date(2024, 3, 3)))
+        self.assertEqual(resolve_period("last_month", date(2024, 1, 15)), (date(2023, 12, 1), date(2023, 12, 31)))
+        self.assertEqual(resolve_period(None, today), (None, None))
+
+
+class TestSearchIndex(unittest.TestCase):
+    """Test indexing and searching"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.pool = ConnectionPool(f"sqlite:///{self.temp_dir.name}/app.sqlite3")
+        self.batcher = WriteBehindBatcher(self.pool, flush_interval=0.01)
+        self.index = SearchIndex(self.pool, self.batcher)
+        self.index.index_receipt("u1", "h1", receipt("セブンイレブン新宿店", "2024-02-10", 1080, ["おにぎり", "緑茶"]))
+        self.index.index_receipt("u1", "h2", receipt("ローソン渋谷店", "2024-02-20", 540, ["コーヒー"]))
+        self.index.index_receipt("u1", "h3", receipt("セブンイレブン池袋店", "2024-03-02", 300))
+        self.index.index_receipt("u2", "h4", receipt("セブンイレブン新宿店", "2024-02-11", 999))
+        self.index.index_file("u1", "item1", "見積書_新宿.pdf", folder_path="u1/2024-02", uploaded_at=1707523200)
+
+    def tearDown(self):
+        self.batcher.stop()
+        self.pool.close()
+        self.temp_dir.cleanup()
+
+    def refs(self, user_id, query, **kwargs):
+        return [doc["ref"] for doc in self.index.search(user_id, query, today=date(2024, 3, 6), **kwargs)]
+
+    def test_keyword_and_period(self):
+        """Test 'last month's receipts from store X'"""
+        self.assertEqual(self.refs("u1", {"kind": "receipt", "keywords": ["セブン"], "period": "last_month"}), ["h1"])
+
+    def test_short_terms_items_and_folders(self):
+        """Test two-character terms, line items and folder paths"""
+        self.assertEqual(sorted(self.refs("u1", {"keywords": ["新宿"]})), ["h1", "item1"])
+        self.assertEqual(self.refs("u1", {"keywords": ["緑茶"]}), ["h1"])
+        self.assertEqual(self.refs("u1", {"keywords": ["茶"]}), ["h1"])
+        self.assertEqual(self.refs("u1", {"keywords": ["緑"]}), ["h1"])
+        self.assertEqual(sorted(self.refs("u1", {"keywords": ["宿"]})), ["h1", "item1"])
+        self.assertEqual(self.refs("u1", {"kind": "file", "keywords": ["2024"]}), ["item1"])
+        self.assertEqual(self.refs("u1", {"keywords": ["新宿池袋"]}), [])
+
+    def test_mixed_and_spaced_keywords(self):
+        """Test keywords that cross CJK/non-CJK boundaries or contain spaces, e.g. an extracted store name"""
+        self.index.index_receipt("u1", "h5", receipt("ファミマ 新宿店", "2024-02-12", 200, ["お茶 500ml"]))
+        self.index.index_receipt("u1", "h6", receipt("ローソン100", "2024-02-13", 100, ["水2L"]))
+
+        self.assertEqual(self.refs("u1", {"keywords": ["ファミマ 新宿"]}), ["h5"])
+        self.assertEqual(self.refs("u1", {"keywords": ["ファミマ 新宿店"]}), ["h5"])
+        self.assertEqual(self.refs("u1", {"keywords": ["お茶 500ml"]}), ["h5"])
+        self.assertEqual(self.refs("u1", {"keywords": ["ローソン100"]}), ["h6"])
+        self.assertEqual(self.refs("u1", {"keywords": ["水2l"]}), ["h6"])
+        self.assertEqual(self.refs("u1", {"keywords": ["ローソン200"]}), [])
+
+    def test_filters_without_keywords(self):
+        """Test amount and user filters, newest first"""
+        self.assertEqual(self.refs("u1", {"kind": "receipt", "amount_min": 500}), ["h2", "h1"])
+        self.assertEqual(self.refs(None, {"keywords": ["新宿店"], "kind": "receipt"}, limit=5).count("h4"), 1)
+
+    def test_reindexing_replaces_document(self):
+        """Test that indexing the same receipt again updates it in place"""
+        self.index.index_receipt("u1", "h2", receipt("ファミリーマート", "2024-02-20", 540))
+        self.assertEqual(self.refs("u1", {"keywords": ["ローソン"]}), [])
+        self.assertEqual(self.refs("u1", {"keywords": ["ファミマ"]}), [])
+        self.assertEqual(self.refs("u1", {"keywords": ["ファミリー"]}), ["h2"])
+
+
+class TestQueryTranslator(unittest.TestCase):
+    """Test the translation cache"""
+
+    def setUp(self):
+        self.calls = []
+
+        def translate(question):
+            self.calls.append(question)
+            return {"kind": "receipt", "keywords": ["セブンイレブン"], "period": "last_month",
+                    "date_from": "last month", "amount_min": None, "extra": 1}
+
+        self.translator = QueryTranslator(translate, db_path=":memory:", version="1")
+
+    def test_repeated_phrasings_are_translated_once(self):
+        """Test that width, spacing, punctuation and politeness variants share a translation"""
+        first = self.translator("先月のセブンイレブンのレシートを教えてください。")
+        again = self.translator("先月の セブンイレブン の レシート を教えて")
+        width = self.translator("先月のｾﾌﾞﾝｲﾚﾌﾞﾝのレシート")
+
+        self.assertEqual(first, {"kind": "receipt", "keywords": ["セブンイレブン"], "period": "last_month"})
+        self.assertEqual(again, first)
+        self.assertEqual(width, first)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.translator.stats()["hits"], 2)
+
+    def test_failed_translation_is_not_cached(self):
+        """Test that an error falls back to the question's words and is retried next time"""
+        translator = QueryTranslator(lambda question: 1 / 0, db_path=":memory:")
+        self.assertEqual(translator("新宿 見積書"), {"keywords": ["新宿", "見積書"]})
+        self.assertEqual(translator.stats()["cached"], 0)
+
+    def test_normalize_and_validate(self):
+        """Test question normalization and query validation"""
+        self.assertEqual(normalize_question("ＡＢＣ　の領収書を見せて！"), "abcの領収書")
+        self.assertEqual(validate_query({"keywords": "水道", "kind": "invoice", "period": "someday"}),
+                         {"keywords": ["水道"]})
+        self.assertEqual(validate_query(None), {"keywords": []})
+
+
+if __name__ == '__main__':
+    unittest.main()
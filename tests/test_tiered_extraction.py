@@ -0,0 +1,131 @@
+"""
+Tests for confidence-tiered receipt extraction
+"""
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.ai.receipt_vision import ReceiptParseError
+from modules.ai.tiered_extraction import TieredReceiptExtractor, receipt_issues
+
+
+TIERS = [
+    {"name": "fast", "model": "small", "cost": [0.15, 0.60]},
+    {"name": "accurate", "model": "large", "cost": [2.50, 10.00]},
+]
+
+
+def result(total=1100.0, date="2024-05-01", items=None, tax=100.0, confidence=0.95):
+    return {
+        "status": "success",
+        "extracted_data": {"total_amount": total, "date": date, "store_name": "店",
+                           "items": items or [], "tax": tax},
+        "confidence": confidence,
+    }
+
+
+class FakeVision:
+    """Returns canned results per model, keyed by image bytes"""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+
+    def analyze_with_usage(self, images, model=None):
+        self.calls.append((model, list(images)))
+        answer = self.answers[model]
+        if isinstance(answer, Exception):
+            raise answer
+        usage = {"prompt_tokens": 1000 * len(images), "completion_tokens": 100 * len(images)}
+        return [answer[image]() for image in images], usage
+
+
+class TestReceiptIssues(unittest.TestCase):
+    """Test the consistency checks"""
+
+    def test_consistent_receipt_has_no_issues(self):
+        """Test that items matching the total with or without tax pass"""
+        items = [{"name": "a", "price": 500.0, "quantity": 2}]
+        self.assertEqual(receipt_issues(result(items=items), 0.8, 1), [])
+        self.assertEqual(receipt_issues(result(total=1000.0, items=items, tax=90.0), 0.8, 1), [])
+
+    def test_detects_each_issue(self):
+        """Test low confidence, missing date, missing total and item mismatches"""
+        self.assertEqual(receipt_issues(result(confidence=0.5), 0.8, 1), ["low_confidence"])
+        self.assertEqual(receipt_issues(result(date=None), 0.8, 1), ["missing_date"])
+        self.assertEqual(receipt_issues(result(date="05/01"), 0.8, 1), ["missing_date"])
+        self.assertIn("missing_total", receipt_issues(result(total=0.0, tax=0.0), 0.8, 1))
+        items = [{"name": "a", "price": 300.0, "quantity": 1}]
+        self.assertEqual(receipt_issues(result(items=items), 0.8, 1), ["items_mismatch"])
+        self.assertEqual(receipt_issues(result(tax=500.0), 0.8, 1), ["tax_out_of_range"])
+        self.assertEqual(receipt_issues(None, 0.8, 1), ["failed"])
+
+
+class TestTieredReceiptExtractor(unittest.TestCase):
+    """Test escalation and per-tier statistics"""
+
+    def test_only_doubtful_receipts_are_escalated(self):
+        """Test that good fast results are kept and bad ones go to the large model"""
+        vision = FakeVision({
+            "small": {b"easy": lambda: result(), b"hard": lambda: result(date=None, confidence=0.4)},
+            "large": {b"hard": lambda: result(total=2200.0, tax=200.0)},
+        })
+        extractor = TieredReceiptExtractor(vision, tiers=TIERS, confidence_threshold=0.8, tolerance=1)
+
+        easy, hard = extractor.analyze([b"easy", b"hard"])
+
+        self.assertEqual(vision.calls, [("small", [b"easy", b"hard"]), ("large", [b"hard"])])
+        self.assertEqual(easy["tier"], "fast")
+        self.assertNotIn("escalation_reasons", easy)
+        self.assertEqual(hard["tier"], "accurate")
+        self.assertEqual(hard["extracted_data"]["total_amount"], 2200.0)
+        self.assertEqual(hard["escalation_reasons"], ["low_confidence", "missing_date"])
+
+        stats = extractor.stats()
+        self.assertEqual(stats["fast"]["hit_rate"], 0.5)
+        self.assertEqual(stats["fast"]["escalated"], 1)
+        self.assertEqual(stats["accurate"]["accepted"], 1)
+        self.assertAlmostEqual(stats["fast"]["cost_usd"], (2000 * 0.15 + 200 * 0.60) / 1e6)
+        self.assertAlmostEqual(stats["accurate"]["cost_usd"], (1000 * 2.50 + 100 * 10.00) / 1e6)
+
+    def test_last_tier_result_is_flagged_for_review(self):
+        """Test that a result still failing checks after escalation is kept with needs_review"""
+        vision = FakeVision({
+            "small": {b"r": lambda: result(confidence=0.3)},
+            "large": {b"r": lambda: result(confidence=0.5)},
+        })
+        extractor = TieredReceiptExtractor(vision, tiers=TIERS, confidence_threshold=0.8, tolerance=1)
+
+        analysis = extractor.analyze([b"r"])[0]
+
+        self.assertEqual(analysis["tier"], "accurate")
+        self.assertEqual(analysis["needs_review"], ["low_confidence"])
+
+    def test_failed_escalation_keeps_fast_result(self):
+        """Test that an error from the large model does not lose the cheap answer"""
+        vision = FakeVision({
+            "small": {b"r": lambda: result(date=None)},
+            "large": RuntimeError("unavailable"),
+        })
+        extractor = TieredReceiptExtractor(vision, tiers=TIERS, confidence_threshold=0.8, tolerance=1)
+
+        analysis = extractor.analyze([b"r"])[0]
+
+        self.assertEqual(analysis["tier"], "fast")
+        self.assertEqual(analysis["needs_review"], ["missing_date"])
+        self.assertEqual(extractor.stats()["accurate"]["failures"], 1)
+
+    def test_packed_parse_error_is_raised(self):
+        """Test that a mismatched packed answer is left to the caller to split"""
+        vision = FakeVision({"small": ReceiptParseError("Expected 2 receipts, got 1"), "large": {}})
+        extractor = TieredReceiptExtractor(vision, tiers=TIERS)
+
+        with self.assertRaises(ReceiptParseError):
+            extractor.analyze([b"a", b"b"])
+
+
+if __name__ == '__main__':
+    unittest.main()
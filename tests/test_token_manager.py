@@ -0,0 +1,141 @@
+"""
+Tests for the Graph access token manager
+"""
+import unittest
+import sys
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+from modules.onedrive import token_manager as token_manager_module
+from modules.onedrive.token_manager import TokenManager, TokenCache, FileTokenCache, SQLiteTokenCache
+
+
+class TokenFetcher:
+    """Counts token requests and hands out numbered tokens"""
+
+    def __init__(self, expires_in=3600, delay=0.0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        time.sleep(self.delay)
+        with self.lock:
+            self.count += 1
+            return {"access_token": f"token-{self.count}", "expires_in": self.expires_in}
+
+
+class TestTokenManager(unittest.TestCase):
+    """Test token refresh and sharing"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_manager(self, cache, fetcher, refresh_margin=300):
+        manager = TokenManager(cache=cache, fetch_token=fetcher,
+                               refresh_margin=refresh_margin, background_refresh=False)
+        self.addCleanup(manager.close)
+        return manager
+
+    def test_concurrent_refreshes_collapse(self):
+        """Test that simultaneous callers trigger a single token request"""
+        fetcher = TokenFetcher(delay=0.05)
+        manager = self.create_manager(FileTokenCache(os.path.join(self.temp_dir.name, "token.json")), fetcher)
+
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(manager.get_token())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(fetcher.count, 1)
+        self.assertEqual(set(tokens), {"token-1"})
+
+    def test_expiring_token_is_refreshed(self):
+        """Test that a token inside the refresh margin is replaced"""
+        fetcher = TokenFetcher(expires_in=100)
+        manager = self.create_manager(SQLiteTokenCache(os.path.join(self.temp_dir.name, "token.db")),
+                                      fetcher, refresh_margin=300)
+        self.assertEqual(manager.get_token(), "token-1")
+        self.assertEqual(manager.get_token(), "token-2")
+
+    def test_cache_is_shared_between_managers(self):
+        """Test that a second worker reuses the cached token"""
+        for cache_class, name in ((FileTokenCache, "token.json"), (SQLiteTokenCache, "token.db")):
+            path = os.path.join(self.temp_dir.name, name)
+            fetcher = TokenFetcher()
+            first = self.create_manager(cache_class(path), fetcher)
+            second = self.create_manager(cache_class(path), fetcher)
+
+            self.assertEqual(first.get_token(), "token-1")
+            self.assertEqual(second.get_token(), "token-1")
+            self.assertEqual(fetcher.count, 1)
+
+    def test_invalidate_only_rejected_token(self):
+        """Test that invalidating an old token keeps a newer cached one"""
+        fetcher = TokenFetcher()
+        manager = self.create_manager(FileTokenCache(os.path.join(self.temp_dir.name, "token.json")), fetcher)
+        manager.get_token()
+
+        manager.invalidate("some-older-token")
+        self.assertEqual(manager.get_token(), "token-1")
+
+        manager.invalidate("token-1")
+        self.assertEqual(manager.get_token(), "token-2")
+
+
+
+class CachingMsalApp:
+    """Client credentials app that, like MSAL, answers from its token cache first"""
+
+    def __init__(self):
+        import msal
+        self.token_cache = msal.TokenCache()
+        self.issued = 0
+
+    def acquire_token_for_client(self, scopes):
+        cached = self.token_cache.find(self.token_cache.CredentialType.ACCESS_TOKEN)
+        if cached:
+            return {"access_token": cached[0]["secret"], "expires_in": 3600}
+        self.issued += 1
+        response = {"access_token": f"msal-{self.issued}", "expires_in": 3600, "token_type": "Bearer"}
+        self.token_cache.add({
+            "client_id": "client",
+            "scope": scopes,
+            "token_endpoint": "https://login.microsoftonline.com/tenant/oauth2/v2.0/token",
+            "response": dict(response),
+        })
+        return response
+
+
+@unittest.skipUnless(token_manager_module.MSAL_AVAILABLE, "msal not installed")
+class TestMsalTokenFetch(unittest.TestCase):
+    """Test that refreshes through MSAL get a new token"""
+
+    def test_invalidated_token_is_not_returned_from_msal_cache(self):
+        """Test that a 401 refresh bypasses MSAL's in-memory cache"""
+        with mock.patch.multiple(config, MICROSOFT_CLIENT_ID="client",
+                                 MICROSOFT_CLIENT_SECRET="secret", MICROSOFT_TENANT_ID="tenant"):
+            manager = TokenManager(cache=TokenCache(), background_refresh=False)
+            self.addCleanup(manager.close)
+            manager._msal_app = CachingMsalApp()
+            self.assertEqual(manager.get_token(), "msal-1")
+
+            manager.invalidate("msal-1")
+            self.assertEqual(manager.get_token(), "msal-2")
+
+
+if __name__ == '__main__':
+    unittest.main()
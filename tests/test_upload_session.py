@@ -0,0 +1,110 @@
+"""
+Tests for resumable OneDrive uploads against a fake Graph endpoint
+"""
+import unittest
+import sys
+import os
+import io
+import tempfile
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+from modules.onedrive import client as client_module
+from modules.onedrive.upload_index import UploadHashIndex
+from modules.onedrive.upload_session import CHUNK_ALIGNMENT, ResumableUploader, UploadSessionStore
+
+
+@unittest.skipUnless(client_module.REQUESTS_AVAILABLE, "requests not installed")
+class TestResumableUpload(unittest.TestCase):
+    """Test chunked upload sessions"""
+
+    def setUp(self):
+        from modules.onedrive.http_session import GraphSession
+        from modules.onedrive.token_manager import TokenCache, TokenManager
+        from tests.fake_graph import FakeGraphServer
+
+        self.server = FakeGraphServer()
+        self.addCleanup(self.server.close)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+        self.original_settings = (config.GRAPH_BASE_URL, config.UPLOAD_SESSION_THRESHOLD)
+        config.GRAPH_BASE_URL = self.server.base_url
+        config.UPLOAD_SESSION_THRESHOLD = CHUNK_ALIGNMENT
+
+        self.session = GraphSession(max_retries=0)
+        self.token_manager = TokenManager(
+            cache=TokenCache(),
+            fetch_token=lambda: {"access_token": "fake", "expires_in": 3600},
+            background_refresh=False
+        )
+        self.store_path = os.path.join(self.temp_dir.name, "sessions.sqlite3")
+
+    def tearDown(self):
+        config.GRAPH_BASE_URL, config.UPLOAD_SESSION_THRESHOLD = self.original_settings
+
+    def create_client(self):
+        client = client_module.OneDriveClient(token_manager=self.token_manager, session=self.session)
+        client.resumable_uploader = ResumableUploader(
+            client._graph_request,
+            self.session,
+            store=UploadSessionStore(self.store_path),
+            chunk_size=CHUNK_ALIGNMENT
+        )
+        client.upload_index = UploadHashIndex(":memory:")
+        return client
+
+    def stored_content(self, file_name):
+        return self.server.items[f"{config.ONEDRIVE_ROOT_FOLDER}/u1/{file_name}"]['content']
+
+    def test_small_file_uses_simple_upload(self):
+        """Test that files under the threshold use a single PUT"""
+        client = self.create_client()
+        result = client.upload_file(b"small", "small.txt", folder_path="u1")
+        self.assertEqual(result['size'], 5)
+        self.assertEqual(self.stored_content("small.txt"), b"small")
+        self.assertEqual(self.server.chunk_bytes_received, 0)
+
+    def test_large_file_uses_chunks(self):
+        """Test that files over the threshold are sent in 320 KiB chunks"""
+        content = os.urandom(CHUNK_ALIGNMENT * 3 + 100)
+        client = self.create_client()
+        result = client.upload_file(io.BytesIO(content), "large.bin", folder_path="u1")
+        self.assertEqual(result['size'], len(content))
+        self.assertEqual(self.stored_content("large.bin"), content)
+
+    def test_interrupted_upload_resumes(self):
+        """Test that a new client continues from the last acknowledged range"""
+        content = os.urandom(CHUNK_ALIGNMENT * 4)
+
+        client = self.create_client()
+        self.server.fail_after_chunks = 2
+        self.assertIsNone(client.upload_file(io.BytesIO(content), "resume.bin", folder_path="u1", resume_key="msg-1"))
+        self.assertEqual(self.server.chunk_bytes_received, CHUNK_ALIGNMENT * 2)
+
+        # A fresh client (e.g. after a restart) resumes the journaled session
+        result = self.create_client().upload_file(io.BytesIO(content), "resume.bin", folder_path="u1", resume_key="msg-1")
+        self.assertEqual(result['size'], len(content))
+        self.assertEqual(self.stored_content("resume.bin"), content)
+        self.assertEqual(self.server.chunk_bytes_received, len(content))
+
+    def test_lost_final_response_is_not_uploaded_again(self):
+        """Test that a session that completed unseen resolves to its item, not a renamed copy"""
+        content = os.urandom(CHUNK_ALIGNMENT * 2)
+
+        client = self.create_client()
+        self.server.lose_final_response = True
+        self.assertIsNone(client.upload_file(io.BytesIO(content), "lost.bin", folder_path="u1", resume_key="msg-2"))
+
+        result = self.create_client().upload_file(io.BytesIO(content), "lost.bin", folder_path="u1", resume_key="msg-2")
+        self.assertEqual(result['name'], "lost.bin")
+        self.assertEqual(self.stored_content("lost.bin"), content)
+        self.assertNotIn(f"{config.ONEDRIVE_ROOT_FOLDER}/u1/lost 1.bin", self.server.items)
+        self.assertEqual(self.server.chunk_bytes_received, len(content))
+        self.assertIsNone(client.resumable_uploader.store.get("msg-2"))
+
+
+if __name__ == '__main__':
+    unittest.main()